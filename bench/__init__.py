@@ -0,0 +1 @@
+"""Benchmarking and load-testing tools (not imported by the app)."""
@@ -0,0 +1,156 @@
+"""Replay past drops through the anomaly detector (``polygreen.anomaly``).
+
+Feeds ``earn`` transactions in ``created_at`` order through one
+``Detector`` (as if a single worker had seen all of them, in hold mode)
+and reports how many drops each rule flags or holds, the machines and
+users caught most often and the time per check:
+
+    python -m bench.anomalyreplay --database-url postgresql://localhost/polygreen \
+        --since 2024-06-01 --machine-max-per-min 40
+
+``--archive`` reads archived partitions (``python -m polygreen.partitions
+archive`` output, ``.csv.gz``) instead of the database. With
+``--bad-users`` (one user id per line, e.g. accounts closed for fraud) it
+also prints how many of those users were caught and how many others were.
+The threshold flags override the ``ANOMALY_*`` settings.
+"""
+
+import argparse
+import collections
+import csv
+import datetime as dt
+import gzip
+import json
+import os
+import sys
+import time
+
+from polygreen import anomaly
+
+REPLAY_SQL = """
+    SELECT machine_id, user_id, bottles, created_at
+    FROM transactions
+    WHERE type = 'earn' AND machine_id IS NOT NULL
+      AND created_at >= %(since)s AND (%(until)s IS NULL OR created_at < %(until)s)
+    ORDER BY created_at, id;
+"""
+
+
+def from_database(url, since, until):
+    import psycopg2
+
+    conn = psycopg2.connect(url)
+    try:
+        with conn.cursor("anomaly_replay") as cur:
+            cur.itersize = 10000
+            cur.execute(REPLAY_SQL, {"since": since, "until": until})
+            for machine_id, user_id, bottles, created_at in cur:
+                yield machine_id, user_id, bottles, created_at.timestamp()
+    finally:
+        conn.close()
+
+
+def from_archives(paths):
+    rows = []
+    for path in paths:
+        with gzip.open(path, "rt", newline="") as f:
+            for r in csv.DictReader(f):
+                if r["type"] == "earn" and r["machine_id"]:
+                    rows.append((r["created_at"], r["machine_id"], r["user_id"], int(r["bottles"])))
+    rows.sort()
+    for created_at, machine_id, user_id, bottles in rows:
+        yield machine_id, user_id, bottles, dt.datetime.fromisoformat(created_at).timestamp()
+
+
+def replay(drops, detector):
+    stats = {"drops": 0, "actions": collections.Counter(), "rules": collections.Counter(),
+             "machines": collections.Counter(), "users": collections.Counter(), "check_ns": []}
+    for machine_id, user_id, bottles, at in drops:
+        t = time.perf_counter_ns()
+        verdict = detector.check(machine_id, user_id, bottles, now=at)
+        stats["check_ns"].append(time.perf_counter_ns() - t)
+        stats["drops"] += 1
+        stats["actions"][verdict.action] += 1
+        if verdict.action != "ok":
+            for reason in verdict.reasons:
+                stats["rules"][f"{reason} ({verdict.action})"] += 1
+            stats["machines"][machine_id] += 1
+            stats["users"][user_id] += 1
+    return stats
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    ap.add_argument("--archive", nargs="+", help="archived partition files instead of the database")
+    ap.add_argument("--since", default="-infinity")
+    ap.add_argument("--until")
+    ap.add_argument("--mode", choices=["hold", "flag"], default="hold")
+    ap.add_argument("--window", type=float, default=anomaly.WINDOW)
+    ap.add_argument("--max-per-insert", type=int, default=anomaly.MAX_PER_INSERT)
+    ap.add_argument("--machine-max-per-min", type=float, default=anomaly.MACHINE_MAX_PER_MIN)
+    ap.add_argument("--user-max-per-min", type=float, default=anomaly.USER_MAX_PER_MIN)
+    ap.add_argument("--hop-seconds", type=float, default=anomaly.HOP_SECONDS)
+    ap.add_argument("--z", type=float, default=anomaly.Z)
+    ap.add_argument("--bad-users", help="file of known bad user ids, one per line")
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    if args.archive:
+        drops = from_archives(args.archive)
+    elif args.database_url:
+        drops = from_database(args.database_url, args.since, args.until)
+    else:
+        ap.error("--database-url, DATABASE_URL or --archive is required")
+
+    detector = anomaly.Detector(
+        mode=args.mode, window=args.window, max_per_insert=args.max_per_insert,
+        machine_max_per_min=args.machine_max_per_min, user_max_per_min=args.user_max_per_min,
+        hop_seconds=args.hop_seconds, z=args.z, max_tracks=sys.maxsize,
+    )
+    started = time.perf_counter()
+    stats = replay(drops, detector)
+    elapsed = time.perf_counter() - started
+
+    ns = sorted(stats["check_ns"]) or [0]
+    result = {
+        "drops": stats["drops"],
+        "actions": dict(stats["actions"]),
+        "rules": dict(stats["rules"]),
+        "top_machines": stats["machines"].most_common(args.top),
+        "top_users": stats["users"].most_common(args.top),
+        "check_us": {"p50": round(ns[len(ns) // 2] / 1000, 2),
+                     "p99": round(ns[int(len(ns) * 0.99)] / 1000, 2),
+                     "max": round(ns[-1] / 1000, 2)},
+        "elapsed_s": round(elapsed, 2),
+    }
+    print(f"{result['drops']:,} drops in {result['elapsed_s']}s: {result['actions']}")
+    for rule, n in sorted(result["rules"].items(), key=lambda kv: -kv[1]):
+        print(f"  {rule:28} {n:>8,}")
+    print(f"check p50 {result['check_us']['p50']}us  p99 {result['check_us']['p99']}us  "
+          f"max {result['check_us']['max']}us")
+    print(f"top machines {result['top_machines']}")
+    print(f"top users {result['top_users']}")
+
+    if args.bad_users:
+        with open(args.bad_users) as f:
+            bad = {line.strip() for line in f if line.strip()}
+        caught = set(stats["users"])
+        result["bad_users"] = {
+            "known": len(bad),
+            "caught": len(bad & caught),
+            "other_users_caught": len(caught - bad),
+        }
+        print(f"known bad users caught {len(bad & caught)}/{len(bad)}, "
+              f"other users caught {len(caught - bad)}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Cold-start benchmark: how long a fresh process takes to import the app.
+
+Each sample runs ``import application`` in a brand new interpreter (what a
+gunicorn worker or test process pays at boot) and records the wall time,
+plus the slowest imports reported by ``-X importtime`` for the last run:
+
+    python -m bench.coldstart --runs 15 --out results/coldstart.json --max-ms 600
+
+``--max-ms`` makes the command exit non-zero when the median exceeds the
+budget, so it can gate CI. ``--forbid`` lists modules that must *not* be
+imported at boot (defaults to the lazily loaded ReportLab and Vonage).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import sys, time, json
+t = time.perf_counter()
+import application
+elapsed = time.perf_counter() - t
+print(json.dumps({"ms": elapsed * 1000, "modules": sorted(sys.modules)}))
+"""
+
+
+def sample(importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", PROBE]
+    # no background warm-up: it would import ReportLab mid-measurement
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="0", WARMUP="0")
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result, proc.stderr
+
+
+def slowest_imports(stderr, limit):
+    """Parse ``-X importtime`` output into (cumulative_us, package) pairs,
+    keeping the most expensive import of each top-level package."""
+    best = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        package = parts[2].strip().split(".")[0]
+        if package == "application":
+            continue
+        best[package] = max(best.get(package, 0), int(parts[1]))
+    return sorted(((us, name) for name, us in best.items()), reverse=True)[:limit]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    ap.add_argument("--max-ms", type=float, help="fail if the median exceeds this")
+    ap.add_argument("--forbid", nargs="*", default=["reportlab", "vonage"],
+                    help="modules that must not be loaded at import time")
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    sample()  # warm the bytecode cache so every run measures the same thing
+    times = []
+    for _ in range(args.runs):
+        result, _ = sample()
+        times.append(result["ms"])
+    result, stderr = sample(importtime=True)
+
+    loaded = set(result["modules"])
+    leaked = sorted(m for m in args.forbid if m in loaded)
+    top = slowest_imports(stderr, args.top)
+
+    summary = {
+        "runs": args.runs,
+        "median_ms": round(statistics.median(times), 1),
+        "min_ms": round(min(times), 1),
+        "max_ms": round(max(times), 1),
+        "modules_loaded": len(loaded),
+        "forbidden_loaded": leaked,
+        "slowest_imports_ms": {name: round(us / 1000, 1) for us, name in top},
+    }
+
+    print(f"import application: median {summary['median_ms']}ms "
+          f"(min {summary['min_ms']}, max {summary['max_ms']}) over {args.runs} runs, "
+          f"{summary['modules_loaded']} modules")
+    for name, ms in summary["slowest_imports_ms"].items():
+        print(f"  {ms:8.1f}ms  {name}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    failed = False
+    if leaked:
+        print(f"FAIL: loaded at boot but should be lazy: {', '.join(leaked)}")
+        failed = True
+    if args.max_ms is not None and summary["median_ms"] > args.max_ms:
+        print(f"FAIL: median {summary['median_ms']}ms exceeds budget {args.max_ms}ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Compression middleware benchmark (``polygreen.compression``).
+
+Renders the admin ``transactions.html`` and ``users.html`` tables with
+``--rows`` synthetic rows and builds an ``/api/machines`` body of
+``--machines`` machines (no database needed), then sends each body
+through ``Compressor`` for every coding and level in ``--settings``, both
+as one piece (a rendered template) and as ``--chunk``-byte pieces without
+a ``Content-Length`` (a stream). Reports bytes on the wire and CPU time
+per response:
+
+    python -m bench.compressbench --rows 5000 --machines 3000 \
+        --settings identity,gzip:1,gzip:6,gzip:9,br:1,br:4,br:6
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import random
+import sys
+import time
+
+from polygreen import compression
+
+
+def bodies(rows, machines, seed=1):
+    os.environ.setdefault("DATABASE_URL", "postgresql://unused/unused")
+    from flask import render_template
+
+    from polygreen import create_app
+
+    rnd = random.Random(seed)
+    app = create_app({"WARMUP": False})
+    start = dt.datetime(2024, 6, 1)
+    transactions = [{
+        "id": i, "user_id": f"U{rnd.randrange(5000):05d}", "type": rnd.choice(["earn", "redeem"]),
+        "points": rnd.randrange(10, 500), "bottles": rnd.randrange(0, 20),
+        "machine_id": f"M{rnd.randrange(800):04d}",
+        "created_at": start + dt.timedelta(seconds=rnd.randrange(30 * 86400)),
+    } for i in range(rows)]
+    users = [{
+        "user_id": f"U{i:05d}", "name": f"User {i}", "mobile": f"010{rnd.randrange(10**8):08d}",
+        "points": rnd.randrange(5000), "bottles": rnd.randrange(2000),
+    } for i in range(rows)]
+    items = [{
+        "id": i, "machine_id": f"M{i:04d}", "name": f"Machine {i}",
+        "city": rnd.choice(["Seoul", "Busan", "Jeju"]),
+        "lat": round(33 + rnd.random() * 5, 6), "lng": round(125 + rnd.random() * 4, 6),
+        "current_bottles": rnd.randrange(300), "max_capacity": 300,
+        "available_space": rnd.randrange(300), "is_full": False,
+        "last_emptied": (start + dt.timedelta(hours=rnd.randrange(720))).isoformat(),
+    } for i in range(machines)]
+
+    with app.test_request_context("/admin"):
+        out = {
+            "transactions.html": (render_template("admin/transactions.html",
+                                                  transactions=transactions), "text/html"),
+            "users.html": (render_template("admin/users.html", users=users), "text/html"),
+        }
+    out["api_machines.json"] = (json.dumps({"items": items}, separators=(",", ":")),
+                                "application/json")
+    return {name: (body.encode(), mimetype) for name, (body, mimetype) in out.items()}
+
+
+def run(body, mimetype, coding, level, chunk, reps):
+    def app(environ, start_response):
+        headers = [("Content-Type", f"{mimetype}; charset=utf-8")]
+        if not chunk:
+            headers.append(("Content-Length", str(len(body))))
+            start_response("200 OK", headers)
+            return [body]
+        start_response("200 OK", headers)
+        return (body[i:i + chunk] for i in range(0, len(body), chunk))
+
+    middleware = compression.Compressor(
+        app, gzip_levels={"default": level or 6}, br_quality={"default": level or 4})
+    environ = {"REQUEST_METHOD": "GET", "HTTP_ACCEPT_ENCODING": coding or ""}
+    wire = 0
+    cpu = time.process_time()
+    for _ in range(reps):
+        wire = sum(len(p) for p in middleware(environ, lambda status, headers, exc_info=None: None))
+    return wire, (time.process_time() - cpu) / reps
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--machines", type=int, default=3000)
+    ap.add_argument("--settings", default="identity,gzip:1,gzip:6,gzip:9,br:1,br:4,br:6,br:11")
+    ap.add_argument("--chunk", type=int, default=8192, help="stream piece size")
+    ap.add_argument("--reps", type=int, default=5)
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    settings = []
+    for item in args.settings.split(","):
+        coding, _, level = item.partition(":")
+        if coding == "br" and compression.brotli is None:
+            print(f"skipping {item}: Brotli is not installed")
+            continue
+        settings.append((item, None if coding == "identity" else coding, int(level or 0)))
+
+    results = []
+    for name, (body, mimetype) in bodies(args.rows, args.machines).items():
+        print(f"\n{name}: {len(body):,} bytes")
+        print(f"  {'setting':10} {'whole':>12} {'ratio':>7} {'cpu ms':>8}   "
+              f"{'streamed':>12} {'ratio':>7} {'cpu ms':>8}")
+        for label, coding, level in settings:
+            row = {"body": name, "bytes": len(body), "setting": label}
+            for mode, chunk in (("whole", 0), ("streamed", args.chunk)):
+                wire, cpu = run(body, mimetype, coding, level, chunk, args.reps)
+                row[f"{mode}_bytes"] = wire
+                row[f"{mode}_ratio"] = round(len(body) / wire, 2)
+                row[f"{mode}_cpu_ms"] = round(cpu * 1000, 2)
+            results.append(row)
+            print(f"  {label:10} {row['whole_bytes']:>12,} {row['whole_ratio']:>7} "
+                  f"{row['whole_cpu_ms']:>8}   {row['streamed_bytes']:>12,} "
+                  f"{row['streamed_ratio']:>7} {row['streamed_cpu_ms']:>8}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+"""Synthetic large-scale data set for profiling.
+
+Bulk-loads users, machines and transactions through COPY so admin pages,
+reports and kiosk paths can be profiled at production volume:
+
+    python -m bench.datagen --database-url postgresql://localhost/polygreen_bench \
+        --users 2000000 --machines 5000 --transactions 200000000 --jobs 8
+
+Output is fully deterministic for a given ``--seed`` and size arguments:
+every chunk of rows draws from its own RNG seeded from (seed, table, chunk),
+so the result does not depend on ``--jobs``. Users follow the same id scheme
+as ``bench.loadtest`` (and ``generate_user_id``), so a generated database
+can be load-tested with ``bench.loadtest --no-seed``.
+"""
+
+import argparse
+import bisect
+import datetime as dt
+import io
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import psycopg2
+from passlib.hash import bcrypt
+
+from bench.loadtest import (
+    PASSWORD, bench_machine_id, bench_mobile, bench_name, bench_user_id, migrate,
+)
+
+# (name, lat, lng, relative population weight)
+CITIES = [
+    ("Seoul", 37.5665, 126.9780, 9.7),
+    ("Busan", 35.1796, 129.0756, 3.4),
+    ("Incheon", 37.4563, 126.7052, 2.9),
+    ("Daegu", 35.8714, 128.6014, 2.4),
+    ("Daejeon", 36.3504, 127.3845, 1.5),
+    ("Gwangju", 35.1595, 126.8526, 1.5),
+    ("Suwon", 37.2636, 127.0286, 1.2),
+    ("Ulsan", 35.5384, 129.3114, 1.1),
+    ("Changwon", 35.2280, 128.6811, 1.0),
+    ("Goyang", 37.6584, 126.8320, 1.0),
+    ("Yongin", 37.2411, 127.1776, 1.0),
+    ("Seongnam", 37.4200, 127.1265, 0.9),
+    ("Cheongju", 36.6424, 127.4890, 0.8),
+    ("Jeonju", 35.8242, 127.1480, 0.6),
+    ("Cheonan", 36.8151, 127.1139, 0.6),
+    ("Jeju", 33.4996, 126.5312, 0.5),
+]
+
+# share of transactions per hour of day (kiosks are busiest after work)
+HOURLY = [1, 0.5, 0.3, 0.2, 0.2, 0.4, 1, 2, 3, 3.5, 4, 4.5,
+          5, 4.5, 4, 4, 4.5, 5.5, 6.5, 7, 6, 4.5, 3, 2]
+
+CHUNK_ROWS = 200_000
+EPOCH = dt.datetime(1970, 1, 1)
+
+
+def _rng(seed, table, chunk):
+    return random.Random(f"{seed}:{table}:{chunk}")
+
+
+def _ts(seconds):
+    return (EPOCH + dt.timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Plan:
+    """Everything a worker needs to generate any chunk on its own."""
+
+    def __init__(self, args):
+        self.seed = args.seed
+        self.users = args.users
+        self.machines = args.machines
+        self.transactions = args.transactions
+        self.days = args.days
+        self.max_capacity = args.max_capacity
+        self.redeem_ratio = args.redeem_ratio
+        self.user_skew = args.user_skew
+        self.recency_skew = args.recency_skew
+        self.end = int((dt.datetime.fromisoformat(args.end_date) - EPOCH).total_seconds())
+        self.start = self.end - self.days * 86400
+        self.password_hash = bcrypt.hash(PASSWORD)
+
+        hours = sum(HOURLY)
+        acc, self.hour_cdf = 0.0, []
+        for h in HOURLY:
+            acc += h / hours
+            self.hour_cdf.append(acc)
+
+    # ---------------- time helpers ----------------
+
+    def skewed_day(self, rnd):
+        """Day offset back from ``end``; recent days are busier (growth)."""
+        return int(self.days * rnd.random() ** self.recency_skew)
+
+    def timestamp(self, rnd):
+        day = self.skewed_day(rnd)
+        hour = min(23, bisect.bisect_left(self.hour_cdf, rnd.random()))
+        midnight = self.end - (day + 1) * 86400
+        return midnight + hour * 3600 + rnd.randrange(3600)
+
+    def pick(self, rnd, n):
+        """Heavy-tailed pick: a few users/machines get most of the traffic."""
+        return min(n - 1, int(n * rnd.random() ** self.user_skew))
+
+
+# ---------------------- CHUNK GENERATORS ------------------------------
+
+def gen_users(plan, chunk):
+    rnd = _rng(plan.seed, "users", chunk)
+    buf = io.StringIO()
+    lo = chunk * CHUNK_ROWS
+    hi = min(plan.users, lo + CHUNK_ROWS)
+    for i in range(lo, hi):
+        created = plan.start + int((plan.end - plan.start) * (1 - rnd.random() ** 0.7))
+        buf.write(f"{bench_user_id(i)}\t{bench_name(i)}\t{bench_mobile(i)}\t"
+                  f"{plan.password_hash}\t0\t0\t{_ts(created)}\n")
+    return buf
+
+
+def gen_machines(plan, chunk):
+    rnd = _rng(plan.seed, "machines", chunk)
+    weights = [c[3] for c in CITIES]
+    buf = io.StringIO()
+    lo = chunk * CHUNK_ROWS
+    hi = min(plan.machines, lo + CHUNK_ROWS)
+    for i in range(lo, hi):
+        city, lat, lng, _ = rnd.choices(CITIES, weights)[0]
+        # ~5km spread around the city centre
+        lat += rnd.gauss(0, 0.045)
+        lng += rnd.gauss(0, 0.055)
+        current = rnd.randrange(plan.max_capacity)
+        created = plan.start + rnd.randrange(max(1, (plan.end - plan.start) // 2))
+        emptied = plan.end - rnd.randrange(7 * 86400)
+        buf.write(f"{bench_machine_id(i)}\tMachine {i}\t{city}\t{lat:.6f}\t{lng:.6f}\t"
+                  f"{current}\t{plan.max_capacity}\t0\t"
+                  f"{'t' if current >= plan.max_capacity else 'f'}\t"
+                  f"{_ts(emptied)}\t{_ts(created)}\n")
+    return buf
+
+
+def gen_transactions(plan, chunk):
+    rnd = _rng(plan.seed, "transactions", chunk)
+    buf = io.StringIO()
+    lo = chunk * CHUNK_ROWS
+    hi = min(plan.transactions, lo + CHUNK_ROWS)
+    write = buf.write
+    for _ in range(lo, hi):
+        uid = bench_user_id(plan.pick(rnd, plan.users))
+        ts = _ts(plan.timestamp(rnd))
+        if rnd.random() < plan.redeem_ratio:
+            points = rnd.choice((500, 1000, 2000, 5000))
+            write(f"{uid}\tredeem\t{points}\t0\t\\N\t{rnd.randint(1, 5)}\t{ts}\n")
+        else:
+            bottles = min(20, 1 + int(rnd.expovariate(0.35)))
+            mid = bench_machine_id(plan.pick(rnd, plan.machines))
+            write(f"{uid}\tearn\t{bottles * 10}\t{bottles}\t{mid}\t\\N\t{ts}\n")
+    return buf
+
+
+TABLES = {
+    "users": (gen_users,
+              "users (user_id, name, mobile, password_hash, points, bottles, created_at)"),
+    "machines": (gen_machines,
+                 "machines (machine_id, name, city, lat, lng, current_bottles, "
+                 "max_capacity, total_bottles, is_full, last_emptied, created_at)"),
+    "transactions": (gen_transactions,
+                     "transactions (user_id, type, points, bottles, machine_id, "
+                     "brand_id, created_at)"),
+}
+
+
+# ---------------------- LOADING ------------------------------
+
+_worker_conn = None
+
+
+def _init_worker(database_url):
+    global _worker_conn
+    _worker_conn = psycopg2.connect(database_url)
+
+
+def _load_chunk(job):
+    plan, table, chunk = job
+    gen, target = TABLES[table]
+    buf = gen(plan, chunk)
+    buf.seek(0)
+    with _worker_conn.cursor() as cur:
+        cur.copy_expert(f"COPY {target} FROM STDIN", buf)
+    _worker_conn.commit()
+    return table, chunk
+
+
+def load_table(pool, plan, table, total):
+    chunks = math.ceil(total / CHUNK_ROWS)
+    started = time.time()
+    done = 0
+    for _ in pool.imap_unordered(_load_chunk, [(plan, table, c) for c in range(chunks)]):
+        done += 1
+        rows = min(total, done * CHUNK_ROWS)
+        rate = rows / max(1e-6, time.time() - started)
+        print(f"\r  {table}: {rows:,}/{total:,} rows ({rate:,.0f}/s)", end="", flush=True)
+    print()
+
+
+def rollup(database_url):
+    """Bring users/machines counters in line with the generated ledger."""
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE users u
+                SET points = GREATEST(0, t.earned - t.spent), bottles = t.bottles
+                FROM (
+                    SELECT user_id,
+                           SUM(CASE WHEN type = 'earn' THEN points ELSE 0 END) AS earned,
+                           SUM(CASE WHEN type = 'redeem' THEN points ELSE 0 END) AS spent,
+                           SUM(bottles) AS bottles
+                    FROM transactions
+                    GROUP BY user_id
+                ) t
+                WHERE u.user_id = t.user_id;
+            """)
+            cur.execute("""
+                UPDATE machines m
+                SET total_bottles = t.bottles
+                FROM (
+                    SELECT machine_id, SUM(bottles) AS bottles
+                    FROM transactions
+                    WHERE machine_id IS NOT NULL
+                    GROUP BY machine_id
+                ) t
+                WHERE m.machine_id = t.machine_id;
+            """)
+        conn.commit()
+    conn.close()
+
+
+def prepare(database_url, reset):
+    # Only the baseline tables: secondary indexes are built after the load,
+    # which is far cheaper than maintaining them row by row during COPY.
+    migrate(database_url, reset, target=1)
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM reward_brand;")
+            if cur.fetchone()[0] == 0:
+                cur.executemany(
+                    "INSERT INTO reward_brand (name, min_points, active) VALUES (%s, %s, TRUE);",
+                    [("Starbucks", 500), ("CU", 1000), ("GS25", 1000),
+                     ("Olive Young", 2000), ("Lotte Mart", 5000)])
+        conn.commit()
+    conn.close()
+
+
+def ensure_partitions(database_url, plan):
+    """With --append on a database that already has partitioned
+    transactions, create the months the generated history falls into."""
+    first = (EPOCH + dt.timedelta(seconds=plan.start)).date()
+    last = (EPOCH + dt.timedelta(seconds=plan.end)).date()
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regprocedure("
+                        "'polygreen_ensure_transaction_partitions(date, date)') IS NOT NULL;")
+            if cur.fetchone()[0]:
+                cur.execute("SELECT polygreen_ensure_transaction_partitions(%s, %s);",
+                            (first, last))
+        conn.commit()
+    conn.close()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--users", type=int, default=1_000_000)
+    ap.add_argument("--machines", type=int, default=2_000)
+    ap.add_argument("--transactions", type=int, default=20_000_000)
+    ap.add_argument("--days", type=int, default=730, help="history length")
+    ap.add_argument("--end-date", default="2026-01-01", help="newest timestamp (ISO date)")
+    ap.add_argument("--max-capacity", type=int, default=500)
+    ap.add_argument("--redeem-ratio", type=float, default=0.03)
+    ap.add_argument("--user-skew", type=float, default=2.5,
+                    help="popularity skew for users/machines (1 = uniform)")
+    ap.add_argument("--recency-skew", type=float, default=1.6,
+                    help="how strongly activity leans to recent days (1 = flat)")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--append", action="store_true", help="keep existing tables")
+    ap.add_argument("--skip-rollup", action="store_true",
+                    help="leave users.points / machines.total_bottles at 0")
+    args = ap.parse_args(argv)
+
+    if not args.database_url:
+        ap.error("--database-url or BENCH_DATABASE_URL is required")
+    if args.users > 26 ** 4 * 10000:
+        ap.error("--users exceeds the id space of generate_user_id-style ids")
+
+    plan = Plan(args)
+    prepare(args.database_url, reset=not args.append)
+    ensure_partitions(args.database_url, plan)
+
+    started = time.time()
+    with multiprocessing.Pool(args.jobs, _init_worker, (args.database_url,)) as pool:
+        load_table(pool, plan, "users", args.users)
+        load_table(pool, plan, "machines", args.machines)
+        load_table(pool, plan, "transactions", args.transactions)
+
+    if not args.skip_rollup:
+        print("  rolling up user / machine counters ...")
+        rollup(args.database_url)
+
+    print("  building indexes and partitions ...")
+    migrate(args.database_url, reset=False)
+
+    with psycopg2.connect(args.database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE;")
+    conn.close()
+    print(f"done in {time.time() - started:,.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Micro-benchmark for the fleet fill-rate forecast (``polygreen.forecast``).
+
+Generates ``--machines`` machines of synthetic hourly history (Poisson
+drops around a per-machine rate, a daily cycle and a slow trend) and times
+the vectorized fit and prediction against a plain-Python loop over the
+same model, in-process with no database:
+
+    python -m bench.forecastbench --machines 10000 --days 14
+
+The loop only runs on ``--loop-machines`` machines and is scaled up to the
+fleet. ``--db`` times ``forecast.compute`` (history query included) on
+``DATABASE_URL`` instead.
+"""
+
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from polygreen import forecast
+
+
+def synthetic(machines, hours, last_hour_of_day, seed=1):
+    """``(counts, rate, remaining)``: history with column 0 the last complete
+    hour, each machine's true mean rate and its space left."""
+    rng = np.random.default_rng(seed)
+    rate = rng.gamma(2.0, 1.5, machines)
+    trend = rng.normal(0, 0.002, machines)
+    peak = rng.integers(0, 24, machines)
+    hod = (last_hour_of_day - np.arange(hours)) % 24
+    daily = 1 + 0.8 * np.cos(2 * np.pi * (hod[None, :] - peak[:, None]) / 24)
+    growth = np.clip(1 - trend[:, None] * np.arange(hours)[None, :], 0, None)
+    counts = rng.poisson(rate[:, None] * daily * growth).astype(float)
+    capacity = rng.choice([200, 300, 500], machines)
+    remaining = np.floor(capacity * rng.random(machines))
+    return counts, rate, remaining
+
+
+def loop_forecast(counts, last_hour_of_day, remaining, horizon, half_life=forecast.HALF_LIFE):
+    """The same model one machine at a time, without NumPy."""
+    hours = len(counts[0])
+    w = [0.5 ** (a / half_life) for a in range(hours)]
+    x = [-a for a in range(hours)]
+    sw = sum(w)
+    sx = sum(wi * xi for wi, xi in zip(w, x))
+    sxx = sum(wi * xi * xi for wi, xi in zip(w, x))
+    hod = [(last_hour_of_day - a) % 24 for a in range(hours)]
+    weight_hod = [0.0] * 24
+    for a in range(hours):
+        weight_hod[hod[a]] += w[a]
+    out = []
+    for row, left in zip(counts, remaining):
+        sy = sum(wi * c for wi, c in zip(w, row))
+        sxy = sum(wi * xi * c for wi, xi, c in zip(w, x, row))
+        trend = (sw * sxy - sx * sy) / (sw * sxx - sx * sx)
+        level = (sy - trend * sx) / sw
+        per_hod = [0.0] * 24
+        for a in range(hours):
+            per_hod[hod[a]] += w[a] * row[a]
+        total = sum(per_hod)
+        trust = total / (total + forecast.PROFILE_PRIOR)
+        mean = total / sum(weight_hod)
+        profile = [trust * (p / wh / mean if total else 1) + (1 - trust)
+                   for p, wh in zip(per_hod, weight_hod)]
+        cum, found = 0.0, None
+        for k in range(horizon):
+            r = max(level + trend * min(k + 1, forecast.TREND_HOURS), 0) \
+                * profile[(last_hour_of_day + 1 + k) % 24]
+            if left <= 0:
+                found = 0.0
+                break
+            if cum + r >= left:
+                found = k + (left - cum) / r
+                break
+            cum += r
+        out.append(found)
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--machines", type=int, default=10000)
+    ap.add_argument("--days", type=int, default=forecast.DAYS)
+    ap.add_argument("--horizon", type=int, default=forecast.HORIZON)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--loop-machines", type=int, default=200)
+    ap.add_argument("--db", action="store_true", help="time forecast.compute on DATABASE_URL")
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    if args.db:
+        from polygreen import create_app
+        from polygreen.db import get_db
+
+        with create_app().app_context():
+            samples = []
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                with get_db() as conn:
+                    value = forecast.compute(conn, args.days, args.horizon)
+                samples.append((time.perf_counter() - t) * 1000)
+        result = {"machines": len(value["items"]), "fit_ms": value.get("fit_ms"),
+                  "compute_ms": round(min(samples), 1)}
+        print(f"{result['machines']} machines: compute {result['compute_ms']}ms "
+              f"(fit+predict {result['fit_ms']}ms)")
+    else:
+        hours = args.days * 24
+        last = 13
+        counts, rate, remaining = synthetic(args.machines, hours, last)
+
+        samples = []
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            level, trend, profile = forecast.fit(counts, last)
+            hours_to_full, next_24h = forecast.predict(level, trend, profile, remaining,
+                                                       (last + 1) % 24, args.horizon)
+            samples.append((time.perf_counter() - t) * 1000)
+
+        n = min(args.loop_machines, args.machines)
+        rows = counts[:n].tolist()
+        t = time.perf_counter()
+        looped = loop_forecast(rows, last, remaining[:n].tolist(), args.horizon)
+        loop_ms = (time.perf_counter() - t) * 1000 * args.machines / n
+
+        agree = [abs(a - b) < 1e-6 if a is not None else math.isnan(b)
+                 for a, b in zip(looped, hours_to_full[:n])]
+        result = {
+            "machines": args.machines,
+            "history_hours": hours,
+            "horizon_hours": args.horizon,
+            "numpy_ms": round(min(samples), 1),
+            "numpy_median_ms": round(statistics.median(samples), 1),
+            "loop_ms_estimated": round(loop_ms, 1),
+            "speedup": round(loop_ms / min(samples), 1),
+            "loop_agrees": sum(agree) / len(agree),
+            "rate_correlation": round(float(np.corrcoef(next_24h / 24, rate)[0, 1]), 3),
+            "within_horizon": int(np.count_nonzero(~np.isnan(hours_to_full))),
+        }
+        print(f"{args.machines} machines x {hours}h: fit+predict {result['numpy_ms']}ms "
+              f"(median {result['numpy_median_ms']}ms)")
+        print(f"plain Python ~{result['loop_ms_estimated']}ms ({result['speedup']}x slower), "
+              f"agrees on {result['loop_agrees']:.0%} of {n}")
+        print(f"rate correlation with truth {result['rate_correlation']}, "
+              f"{result['within_horizon']} full within {args.horizon}h")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""Concurrency benchmark: many kiosks' worth of drops against ONE machine.
+
+Runs the ``machine_insert`` transaction (user/machine check, capacity
+reservation, points, ledger row, commit) from many threads straight against
+Postgres, once per ``COUNTER_SLOTS`` setting, and reports committed drops per
+second and latency. ``--slots 1`` is the old single-row update path:
+
+    python -m bench.hotmachine --database-url postgresql://localhost/polygreen_bench \
+        --threads 32 --duration 15 --slots 1 8 16 --shared-user
+
+``--shared-user`` makes every thread credit the same account (a household
+sharing one login), which used to serialize on the ``users`` row as well.
+
+Each setting is followed by an exactness check: the machine is given a
+small capacity and the threads race to fill it; the run fails unless
+exactly that many bottles were accepted and recorded.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from bench.loadtest import bench_mobile, bench_name, bench_user_id, migrate, percentile
+from polygreen import counters
+
+MACHINE_ID = "HOT00001"
+
+
+def setup(database_url, users):
+    migrate(database_url, reset=False)
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.executemany("""
+                INSERT INTO users (user_id, name, mobile, password_hash)
+                VALUES (%s, %s, %s, 'x')
+                ON CONFLICT DO NOTHING;
+            """, [(bench_user_id(i), bench_name(i), bench_mobile(i)) for i in range(users)])
+            cur.execute("""
+                INSERT INTO machines (machine_id, name, city, max_capacity)
+                VALUES (%s, 'Hot machine', 'Bench', 0)
+                ON CONFLICT DO NOTHING;
+            """, (MACHINE_ID,))
+    conn.close()
+
+
+def reset_machine(database_url, capacity):
+    with psycopg2.connect(database_url, cursor_factory=RealDictCursor) as conn:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE machines SET max_capacity = %s WHERE machine_id = %s;",
+                        (capacity, MACHINE_ID))
+            counters.empty_machine(cur, MACHINE_ID)
+            cur.execute("DELETE FROM transactions WHERE machine_id = %s;", (MACHINE_ID,))
+    conn.close()
+
+
+def drop(conn, user_id):
+    """The DB work of POST /api/machine/insert for one bottle."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM users WHERE user_id=%s", (user_id,))
+        cur.fetchone()
+        cur.execute("SELECT 1 FROM machines WHERE machine_id=%s", (MACHINE_ID,))
+        cur.fetchone()
+        ok, _ = counters.reserve_bottles(cur, MACHINE_ID, 1)
+        if ok:
+            counters.add_points(cur, user_id, 10, 1)
+            cur.execute("""
+                INSERT INTO transactions (user_id, type, points, bottles, machine_id, created_at)
+                VALUES (%s, %s, %s, %s, %s, NOW())
+            """, (user_id, "earn", 10, 1, MACHINE_ID))
+    conn.commit()
+    return ok
+
+
+def hammer(database_url, threads, shared_user, deadline=None, async_commit=False):
+    """Run ``drop`` from ``threads`` threads until ``deadline`` (or until the
+    machine refuses a drop). Returns per-thread latency lists and counts."""
+    latencies = [[] for _ in range(threads)]
+    accepted = [0] * threads
+    errors = [0] * threads
+    start = threading.Barrier(threads)
+
+    def worker(i):
+        conn = psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+        if async_commit:
+            with conn.cursor() as cur:
+                cur.execute("SET synchronous_commit = off;")
+            conn.commit()
+        user_id = bench_user_id(0 if shared_user else i)
+        start.wait()
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                t = time.perf_counter()
+                try:
+                    ok = drop(conn, user_id)
+                except psycopg2.Error:
+                    conn.rollback()
+                    errors[i] += 1
+                    continue
+                latencies[i].append(time.perf_counter() - t)
+                if not ok:
+                    break
+                accepted[i] += 1
+        finally:
+            conn.close()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return [x for lat in latencies for x in lat], sum(accepted), sum(errors)
+
+
+def verify(database_url, threads, shared_user, capacity):
+    reset_machine(database_url, capacity)
+    _, accepted, errors = hammer(database_url, threads, shared_user)
+    with psycopg2.connect(database_url, cursor_factory=RealDictCursor) as conn:
+        counters.fold(conn)
+        with conn.cursor() as cur:
+            cur.execute("SELECT current_bottles FROM machines WHERE machine_id=%s;", (MACHINE_ID,))
+            level = cur.fetchone()["current_bottles"]
+            cur.execute("SELECT COALESCE(SUM(bottles), 0) AS n FROM transactions "
+                        "WHERE machine_id=%s;", (MACHINE_ID,))
+            recorded = cur.fetchone()["n"]
+    conn.close()
+    ok = accepted == level == recorded == capacity and errors == 0
+    return ok, {"capacity": capacity, "accepted": accepted, "level": level,
+                "recorded": recorded, "errors": errors}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--duration", type=float, default=15.0)
+    ap.add_argument("--slots", type=int, nargs="+", default=[1, 8, 16])
+    ap.add_argument("--shared-user", action="store_true")
+    ap.add_argument("--async-commit", action="store_true",
+                    help="synchronous_commit=off: measure lock waits, not fsync")
+    ap.add_argument("--verify-capacity", type=int, default=5000)
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    if not args.database_url:
+        ap.error("--database-url or BENCH_DATABASE_URL is required")
+
+    setup(args.database_url, args.threads)
+    results, failed = {}, False
+    for slots in args.slots:
+        counters.SLOTS = slots
+        reset_machine(args.database_url, 10 ** 9)
+        deadline = time.monotonic() + args.duration
+        latencies, accepted, errors = hammer(args.database_url, args.threads, args.shared_user,
+                                             deadline, args.async_commit)
+        latencies.sort()
+        exact, detail = verify(args.database_url, args.threads, args.shared_user,
+                               args.verify_capacity)
+        failed |= not exact
+        results[slots] = {
+            "drops_per_sec": round(accepted / args.duration, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+            "errors": errors,
+            "exact": exact,
+            "verify": detail,
+        }
+        r = results[slots]
+        print(f"slots={slots:<3} {r['drops_per_sec']:>9,.1f} drops/s  "
+              f"p50 {r['p50_ms']:.2f}ms  p99 {r['p99_ms']:.2f}ms  errors {errors}  "
+              f"capacity check {'ok' if exact else 'FAILED ' + json.dumps(detail)}")
+
+    counters.SLOTS = 1
+    reset_machine(args.database_url, 0)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump({"threads": args.threads, "shared_user": args.shared_user,
+                       "async_commit": args.async_commit, "results": results}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Bulk machine import benchmark (``polygreen.machine_import``).
+
+Generates a CSV of ``--rows`` machines (ids ``IMP…``, with every
+``--bad-every``-th row broken or repeated) and times parsing it on its
+own, then, with ``--database-url``, importing it through the staging table
+and ``COPY`` (twice: a fresh import, then the same file again as all
+conflicts). The form's old path, an existence ``SELECT`` and an ``INSERT``
+on a fresh connection per machine, runs on ``--baseline-rows`` rows for
+comparison:
+
+    python -m bench.importbench --database-url postgresql://localhost/polygreen_bench \
+        --rows 100000
+
+The ``IMP…`` machines are deleted afterwards.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+
+from polygreen import machine_import
+
+PREFIX = "IMP"
+
+
+def synthetic_csv(rows, bad_every, seed=1):
+    rnd = random.Random(seed)
+    out = [",".join(machine_import.COLUMNS)]
+    for i in range(rows):
+        lat, lng = 33 + rnd.random() * 5, 125 + rnd.random() * 4
+        row = [f"{PREFIX}{i:07d}", f"Machine {i}", rnd.choice(["Seoul", "Busan", "Jeju"]),
+               f"{lat:.6f}", f"{lng:.6f}", str(rnd.choice([200, 300, 500]))]
+        if bad_every and i % bad_every == bad_every - 1:
+            kind = rnd.randrange(3)
+            if kind == 0:
+                row[0] = f"{PREFIX}{i - 1:07d}"  # repeats the previous line
+            elif kind == 1:
+                row[3] = "north"
+            else:
+                row[5] = "-1"
+        out.append(",".join(row))
+    return "\n".join(out) + "\n"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    ap.add_argument("--rows", type=int, default=100000)
+    ap.add_argument("--bad-every", type=int, default=1000)
+    ap.add_argument("--baseline-rows", type=int, default=1000)
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    data = synthetic_csv(args.rows, args.bad_every)
+    t = time.perf_counter()
+    rows, errors = machine_import.parse(io.StringIO(data, newline=""))
+    result = {"rows": args.rows, "valid": len(rows), "invalid": len(errors),
+              "parse_s": round(time.perf_counter() - t, 3)}
+    print(f"parse {args.rows:,} rows: {result['parse_s']}s "
+          f"({result['valid']:,} valid, {result['invalid']:,} rejected)")
+
+    if args.database_url:
+        import psycopg2
+        from psycopg2.extras import RealDictCursor
+
+        from bench.loadtest import migrate
+
+        migrate(args.database_url, reset=False)
+        conn = psycopg2.connect(args.database_url, cursor_factory=RealDictCursor)
+
+        def cleanup():
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM machines WHERE machine_id LIKE %s;", (PREFIX + "%",))
+            conn.commit()
+
+        try:
+            cleanup()
+            for label in ("import", "reimport"):
+                report = machine_import.run(conn, io.StringIO(data, newline=""))
+                result[f"{label}_s"] = round(report["total_ms"] / 1000, 3)
+                result[f"{label}_inserted"] = report["inserted"]
+                result[f"{label}_errors"] = len(report["errors"])
+                print(f"{label:9}: {result[f'{label}_s']}s  inserted {report['inserted']:,}  "
+                      f"errors {len(report['errors']):,}")
+            cleanup()
+
+            n = min(args.baseline_rows, len(rows))
+            t = time.perf_counter()
+            for _, machine_id, name, city, lat, lng, capacity in rows[:n]:
+                c = psycopg2.connect(args.database_url)
+                try:
+                    with c.cursor() as cur:
+                        cur.execute("SELECT 1 FROM machines WHERE machine_id = %s;", (machine_id,))
+                        if not cur.fetchone():
+                            cur.execute("""
+                                INSERT INTO machines (
+                                    machine_id, name, city, lat, lng, max_capacity,
+                                    current_bottles, total_bottles, is_full, created_at
+                                ) VALUES (%s, %s, %s, %s, %s, %s, 0, 0, FALSE, NOW());
+                            """, (machine_id, name, city, lat, lng, capacity))
+                    c.commit()
+                finally:
+                    c.close()
+            per_row = (time.perf_counter() - t) / n
+            result["baseline_per_row_ms"] = round(per_row * 1000, 3)
+            result["baseline_estimated_s"] = round(per_row * len(rows), 1)
+            print(f"row by row: {result['baseline_per_row_ms']}ms/row, "
+                  f"~{result['baseline_estimated_s']}s for {len(rows):,}")
+        finally:
+            cleanup()
+            conn.close()
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""Simulated kiosks on the ``/ws/kiosk`` channel (``polygreen.kiosk``).
+
+Thousands of kiosks from one process (asyncio, a minimal WebSocket client
+from the standard library). Each kiosk holds one channel open, heartbeats,
+acknowledges commands and runs bottle sessions (``lookup`` then
+``insert``) at ``--sessions-per-min``; ``--drop-every`` makes kiosks cut
+their connection now and then and resume with ``since``:
+
+    python -m bench.kiosksim --database-url postgresql://localhost/polygreen_bench \
+        --kiosks 2000 --duration 60
+
+starts the app on gevent workers (like ``bench.loadtest``) and seeds one
+machine per kiosk. ``--target host:port`` drives a running deployment
+instead (its ``KIOSK_SECRET`` must be set here too, and the ``BM…``
+machines and bench users must exist). Compare the round trips with the
+``kiosk`` scenario of ``bench.loadtest``, which pays for a connection per
+request.
+"""
+
+import argparse
+import asyncio
+import base64
+import collections
+import json
+import os
+import random
+import struct
+import sys
+import time
+
+from bench.loadtest import bench_machine_id, bench_mobile, percentile, seed, start_app
+from polygreen.kiosk import token_for
+
+
+# ---------------------- WEBSOCKET CLIENT ------------------------------
+
+class Closed(Exception):
+    pass
+
+
+class WebSocket:
+    """Text frames only; enough for the kiosk protocol."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port, path):
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+                      f"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        head = await reader.readuntil(b"\r\n\r\n")
+        if not head.startswith(b"HTTP/1.1 101"):
+            writer.close()
+            raise Closed(head.split(b"\r\n", 1)[0].decode(errors="replace"))
+        return cls(reader, writer)
+
+    async def send(self, obj):
+        data = json.dumps(obj).encode()
+        mask = os.urandom(4)
+        n = len(data)
+        if n < 126:
+            header = struct.pack("!BB", 0x81, 0x80 | n)
+        elif n < 65536:
+            header = struct.pack("!BBH", 0x81, 0x80 | 126, n)
+        else:
+            header = struct.pack("!BBQ", 0x81, 0x80 | 127, n)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+        self.writer.write(header + mask + masked)
+        await self.writer.drain()
+
+    async def receive(self):
+        while True:
+            b0, b1 = await self.reader.readexactly(2)
+            n = b1 & 0x7F
+            if n == 126:
+                n = struct.unpack("!H", await self.reader.readexactly(2))[0]
+            elif n == 127:
+                n = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+            payload = await self.reader.readexactly(n)
+            opcode = b0 & 0x0F
+            if opcode == 0x8:
+                code = struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else 1005
+                raise Closed(f"{code} {payload[2:].decode(errors='replace')}")
+            if opcode == 0x9:  # ping -> pong (masked, same payload)
+                mask = os.urandom(4)
+                self.writer.write(struct.pack("!BB", 0x8A, 0x80 | len(payload)) + mask
+                                  + bytes(b ^ mask[i % 4] for i, b in enumerate(payload)))
+                continue
+            if opcode == 0x1:
+                return json.loads(payload)
+
+    def close(self):
+        self.writer.close()
+
+
+# ---------------------- KIOSK ------------------------------
+
+class Stats:
+    def __init__(self):
+        self.latency = collections.defaultdict(list)
+        self.status = collections.Counter()
+        self.commands = collections.Counter()
+        self.connects = 0
+        self.resumed = 0
+        self.errors = collections.Counter()
+
+
+async def kiosk(i, args, stats, stop_at, host, port):
+    rnd = random.Random(args.seed + i)
+    machine_id = bench_machine_id(i)
+    since = None
+    await asyncio.sleep(rnd.random() * args.ramp)
+
+    while time.monotonic() < stop_at:
+        try:
+            ws = await WebSocket.connect(host, port, "/ws/kiosk")
+        except (OSError, asyncio.IncompleteReadError, Closed) as e:
+            stats.errors[f"connect: {type(e).__name__}"] += 1
+            await asyncio.sleep(1 + rnd.random())
+            continue
+        stats.connects += 1
+        waiters = {}
+        next_id = [0]
+
+        async def reader():
+            nonlocal since
+            while True:
+                msg = await ws.receive()
+                kind = msg.get("type")
+                if kind == "command":
+                    stats.commands[msg["name"]] += 1
+                    if "seq" in msg:
+                        since = msg["seq"]
+                    await ws.send({"type": "ack", "n": msg["n"]})
+                elif kind in ("result", "pong"):
+                    fut = waiters.pop(msg.get("id"), None)
+                    if fut is not None and not fut.done():
+                        fut.set_result(msg)
+                elif kind == "welcome":
+                    stats.resumed += bool(msg.get("resumed"))
+
+        async def call(kind, **fields):
+            next_id[0] += 1
+            fut = asyncio.get_running_loop().create_future()
+            waiters[next_id[0]] = fut
+            t = time.perf_counter()
+            await ws.send(dict(fields, type=kind, id=next_id[0]))
+            msg = await asyncio.wait_for(fut, 30)
+            stats.latency[kind].append(time.perf_counter() - t)
+            stats.status[f"{kind} {msg.get('status', 200)}"] += 1
+            return msg
+
+        await ws.send({"type": "hello", "machine_id": machine_id,
+                       "token": token_for(machine_id), "since": since})
+        read_task = asyncio.ensure_future(reader())
+        try:
+            last_ping = time.monotonic()
+            drop_at = (time.monotonic() + rnd.expovariate(1 / args.drop_every)
+                       if args.drop_every else None)
+            while time.monotonic() < stop_at:
+                if drop_at and time.monotonic() > drop_at:
+                    break
+                await asyncio.sleep(rnd.expovariate(args.sessions_per_min / 60))
+                if read_task.done():
+                    read_task.result()
+                if time.monotonic() - last_ping > args.heartbeat:
+                    await call("ping")
+                    last_ping = time.monotonic()
+                user = rnd.randrange(args.users)
+                msg = await call("lookup", mobile=bench_mobile(user))
+                if msg.get("status") == 200:
+                    await call("insert", user_id=msg["body"]["user_id"],
+                               bottle_count=rnd.randint(1, 5))
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, Closed) as e:
+            stats.errors[type(e).__name__] += 1
+        finally:
+            read_task.cancel()
+            ws.close()
+
+
+async def simulate(args, host, port):
+    stats = Stats()
+    stop_at = time.monotonic() + args.ramp + args.duration
+    await asyncio.gather(*(kiosk(i, args, stats, stop_at, host, port)
+                           for i in range(args.kiosks)))
+    return stats
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    ap.add_argument("--target", help="host:port of a running server (skips seeding)")
+    ap.add_argument("--kiosks", type=int, default=1000)
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--port", type=int, default=8098)
+    ap.add_argument("--duration", type=float, default=60.0)
+    ap.add_argument("--ramp", type=float, default=10.0, help="seconds to spread connects over")
+    ap.add_argument("--sessions-per-min", type=float, default=6.0)
+    ap.add_argument("--heartbeat", type=float, default=15.0)
+    ap.add_argument("--drop-every", type=float, default=0.0,
+                    help="mean seconds between forced reconnects per kiosk (0 = never)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.kiosks + 100:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.kiosks + 100), hard))
+
+    proc = None
+    if args.target:
+        host, _, port = args.target.rpartition(":")
+        port = int(port)
+    else:
+        if not args.database_url:
+            ap.error("--database-url, BENCH_DATABASE_URL or --target is required")
+        seed(args.database_url, users=args.users, machines=args.kiosks)
+        host, port = "127.0.0.1", args.port
+        os.environ.setdefault("KIOSK_SECRET", "kiosksim")  # shared with the app below
+        proc = start_app(args.database_url, port, args.workers, extra_env={
+            "GUNICORN_WORKER_CLASS": "gevent",
+            "GUNICORN_WORKER_CONNECTIONS": str(args.kiosks + 100),
+        })
+    try:
+        stats = asyncio.run(simulate(args, host, port))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    result = {"kiosks": args.kiosks, "duration": args.duration, "connects": stats.connects,
+              "resumed": stats.resumed, "status": dict(stats.status),
+              "commands": dict(stats.commands), "errors": dict(stats.errors), "latency_ms": {}}
+    print(f"{args.kiosks} kiosks, {stats.connects} connects ({stats.resumed} resumed)")
+    for kind, values in sorted(stats.latency.items()):
+        values.sort()
+        row = {"n": len(values), "p50": round(percentile(values, 50) * 1000, 2),
+               "p99": round(percentile(values, 99) * 1000, 2)}
+        result["latency_ms"][kind] = row
+        print(f"  {kind:8} n={row['n']:>8}  p50 {row['p50']:>8}ms  p99 {row['p99']:>8}ms")
+    print(f"  status {dict(stats.status)}")
+    print(f"  commands {dict(stats.commands)}")
+    if stats.errors:
+        print(f"  errors {dict(stats.errors)}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0 if not stats.errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""Leaderboard benchmark at millions of users (``polygreen.leaderboard``).
+
+In-process: builds a rank ``Histogram`` over ``--users`` skewed scores and
+times "my rank" look-ups and score updates against it, with a sorted-list
+recount as the baseline:
+
+    python -m bench.leaderboardbench --users 2000000
+
+With ``--database-url`` it also loads that many rows into one bench-only
+board scope (``city`` / ``__bench__``) with COPY and times the queries the
+API runs (top-N, a user's points) against the naive rank query
+(``COUNT(*) WHERE points > mine``) for users at the top, middle and bottom,
+plus the aggregate a worker runs to load its histograms.
+"""
+
+import argparse
+import bisect
+import collections
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from polygreen import leaderboard
+
+SCOPE = ("city", "__bench__")
+
+
+def scores(n, seed=1):
+    rnd = random.Random(seed)
+    # a few heavy recyclers, a long tail of occasional ones
+    return [int(rnd.paretovariate(1.1) * 10) for _ in range(n)]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    samples.sort()
+    return {"p50_us": round(samples[len(samples) // 2] * 1e6, 2),
+            "p99_us": round(samples[int(len(samples) * 0.99)] * 1e6, 2),
+            "mean_us": round(statistics.fmean(samples) * 1e6, 2)}
+
+
+def in_memory(values, queries, updates):
+    rnd = random.Random(2)
+    result = {}
+
+    # a worker loads (score, users) pairs from a GROUP BY, not single rows
+    counts = collections.Counter(values)
+    t = time.perf_counter()
+    h = leaderboard.Histogram()
+    for v, n in counts.items():
+        h.add(v, n)
+    result["build_s"] = round(time.perf_counter() - t, 3)
+    result["distinct_scores"] = sum(len(c) for c in h.buckets.values())
+
+    probes = [rnd.choice(values) for _ in range(queries)]
+    it = iter(probes * 2)
+    result["rank"] = timed(lambda: h.above(next(it)), queries)
+
+    ordered = sorted(values)
+    for v in probes[:200]:
+        assert h.above(v) == len(ordered) - bisect.bisect_right(ordered, v)
+    it = iter(probes * 2)
+    result["rank_sorted_list"] = timed(
+        lambda: len(ordered) - bisect.bisect_right(ordered, next(it)), queries)
+
+    moves = [(rnd.choice(values), rnd.randint(1, 50)) for _ in range(updates)]
+    it = iter(moves)
+
+    def move():
+        old, gain = next(it)
+        h.add(old, -1)
+        h.add(old + gain)
+    result["update"] = timed(move, updates)
+
+    # keeping a sorted list of scores current costs O(n) per move
+    ordered_moves = iter(moves[:min(updates, 2000)])
+
+    def move_sorted():
+        old, gain = next(ordered_moves)
+        del ordered[bisect.bisect_left(ordered, old)]
+        bisect.insort(ordered, old + gain)
+    result["update_sorted_list"] = timed(move_sorted, min(updates, 2000))
+    return result
+
+
+def in_database(database_url, values, queries):
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    from bench.loadtest import migrate
+
+    migrate(database_url, reset=False)
+    conn = psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+    result = {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM leaderboard_scores WHERE board = %s AND scope = %s;", SCOPE)
+            buf = io.StringIO()
+            for i, v in enumerate(values):
+                buf.write(f"{SCOPE[0]}\t{SCOPE[1]}\tbench_{i:08d}\t{v}\n")
+            buf.seek(0)
+            t = time.perf_counter()
+            cur.copy_expert("COPY leaderboard_scores (board, scope, user_id, points) FROM STDIN", buf)
+            conn.commit()
+            result["copy_s"] = round(time.perf_counter() - t, 2)
+            cur.execute("ANALYZE leaderboard_scores;")
+            conn.commit()
+
+            def run(sql, params):
+                return lambda: (cur.execute(sql, params), cur.fetchall())
+
+            result["top_10"] = timed(run("""
+                SELECT user_id, points FROM leaderboard_scores
+                WHERE board = %s AND scope = %s
+                ORDER BY points DESC, user_id LIMIT 10;
+            """, SCOPE), queries)
+            result["my_points"] = timed(run("""
+                SELECT points FROM leaderboard_scores
+                WHERE board = %s AND scope = %s AND user_id = %s;
+            """, SCOPE + ("bench_00000042",)), queries)
+
+            ordered = sorted(values)
+            for label, pct in (("top", 0.999), ("middle", 0.5), ("bottom", 0.0)):
+                mine = ordered[int(pct * (len(ordered) - 1))]
+                result[f"naive_rank_{label}"] = timed(run("""
+                    SELECT COUNT(*) + 1 AS rank FROM leaderboard_scores
+                    WHERE board = %s AND scope = %s AND points > %s;
+                """, SCOPE + (mine,)), max(3, queries // 100))
+
+            t = time.perf_counter()
+            cur.execute("""
+                SELECT board, scope, points, COUNT(*) AS users
+                FROM leaderboard_scores
+                GROUP BY board, scope, points;
+            """)
+            cur.fetchall()
+            result["histogram_load_s"] = round(time.perf_counter() - t, 2)
+            conn.rollback()
+
+            cur.execute("DELETE FROM leaderboard_scores WHERE board = %s AND scope = %s;", SCOPE)
+            conn.commit()
+    finally:
+        conn.close()
+    return result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--users", type=int, default=2000000)
+    ap.add_argument("--queries", type=int, default=20000)
+    ap.add_argument("--updates", type=int, default=20000)
+    ap.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    values = scores(args.users)
+    results = {"users": args.users, "memory": in_memory(values, args.queries, args.updates)}
+    m = results["memory"]
+    print(f"{args.users:,} users, {m['distinct_scores']:,} distinct scores; "
+          f"histogram built in {m['build_s']}s")
+    for key in ("rank", "rank_sorted_list", "update", "update_sorted_list"):
+        print(f"  {key:20} p50 {m[key]['p50_us']:>9}us  p99 {m[key]['p99_us']:>9}us")
+
+    if args.database_url:
+        results["database"] = d = in_database(args.database_url, values, args.queries // 10)
+        print(f"database: COPY {d['copy_s']}s, histogram load query {d['histogram_load_s']}s")
+        for key, value in d.items():
+            if isinstance(value, dict):
+                print(f"  {key:20} p50 {value['p50_us']:>9}us  p99 {value['p99_us']:>9}us")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,430 @@
+"""HTTP load test for the PolyGreen backend.
+
+Stands up the app (gunicorn) against a local Postgres, seeds a small data
+set and drives a realistic traffic mix with closed-loop virtual users:
+
+  * kiosk  - POST /api/user/fetch -> POST /api/machine/insert
+  * app    - login -> /api/users/me -> /api/points/summary -> /api/machines
+  * admin  - dashboard, list pages, detail pages and PDF reports
+
+Latency percentiles and throughput are reported per route and written to a
+JSON file so runs can be compared between commits:
+
+    python -m bench.loadtest --database-url postgresql://localhost/polygreen_bench \
+        --duration 60 --users 32 --out results/head.json --compare results/main.json
+
+Only the standard library plus the app's own requirements are used.
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+import psycopg2
+from passlib.hash import bcrypt
+
+from polygreen.migrate import upgrade
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = "bench-password"
+ADMIN_USERNAME = "bench-admin"
+ADMIN_PASSWORD = "bench-admin-password"
+
+DEFAULT_MIX = {"kiosk": 6, "app": 3, "admin": 1}
+
+
+# ---------------------- SEEDING ------------------------------
+
+def bench_name(i):
+    """Four letter name prefix, unique per block of 10k mobiles."""
+    n = i // 10000
+    letters = []
+    for _ in range(4):
+        n, r = divmod(n, 26)
+        letters.append(chr(ord("a") + r))
+    return "".join(reversed(letters))
+
+
+def bench_mobile(i):
+    return f"010{i:08d}"
+
+
+def bench_user_id(i):
+    # same shape as application.generate_user_id(name, mobile)
+    return f"{bench_name(i)}_{bench_mobile(i)[-4:]}"
+
+
+def bench_machine_id(i):
+    return f"BM{i:05d}"
+
+
+def migrate(database_url, reset, target=None):
+    """(Re)create the schema through the app's own migrations."""
+    conn = psycopg2.connect(database_url)
+    try:
+        if reset:
+            with conn.cursor() as cur:
+                cur.execute("DROP TABLE IF EXISTS transactions, users, machines, "
+                            "user_otps, reward_brand, redemptions, leaderboard_scores, "
+                            "leaderboard_archived, machine_alerts, insert_anomalies, "
+                            "outbox_events, outbox_offsets, schema_migrations CASCADE;")
+            conn.commit()
+        upgrade(conn, target=target, log=lambda msg: print(f"  {msg}"))
+    finally:
+        conn.close()
+
+
+def seed(database_url, users, machines, reset=True):
+    """Create the schema and a small, predictable data set."""
+    migrate(database_url, reset)
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            pw_hash = bcrypt.hash(PASSWORD)
+            cur.executemany("""
+                INSERT INTO users (user_id, name, mobile, password_hash, points, bottles)
+                VALUES (%s, %s, %s, %s, 0, 0)
+                ON CONFLICT DO NOTHING;
+            """, [(bench_user_id(i), bench_name(i), bench_mobile(i), pw_hash)
+                  for i in range(users)])
+
+            # Practically unlimited capacity so kiosk sessions never hit "full"
+            cur.executemany("""
+                INSERT INTO machines (machine_id, name, city, lat, lng, max_capacity)
+                VALUES (%s, %s, %s, %s, %s, 1000000000)
+                ON CONFLICT DO NOTHING;
+            """, [(bench_machine_id(i), f"Bench {i}", "Seoul",
+                   37.5 + i * 0.001, 127.0 + i * 0.001) for i in range(machines)])
+        conn.commit()
+    conn.close()
+
+
+# ---------------------- APP PROCESS ------------------------------
+
+def start_app(database_url, port, workers, extra_env=None):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "ADMIN_USERNAME": ADMIN_USERNAME,
+        "ADMIN_PASSWORD": ADMIN_PASSWORD,
+    })
+    env.update(extra_env or {})
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "application:application",
+         "-b", f"127.0.0.1:{port}", "-w", str(workers), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("app exited during startup")
+        try:
+            c = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            c.request("GET", "/health/ready")
+            if c.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("app did not become ready within 30s")
+
+
+# ---------------------- CLIENT ------------------------------
+
+class Client:
+    """One keep-alive HTTP connection with cookie and bearer token state."""
+
+    def __init__(self, host, port, recorder):
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+        self.recorder = recorder
+        self.cookies = {}
+        self.token = None
+
+    def request(self, label, method, path, json_body=None, form=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body)
+            headers["Content-Type"] = "application/json"
+        elif form is not None:
+            body = urllib.parse.urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            resp = self.conn.getresponse()
+            data = resp.read()
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.recorder.record(label, time.perf_counter() - start, 0)
+            return 0, b""
+        self.recorder.record(label, time.perf_counter() - start, status)
+
+        for header in resp.headers.get_all("Set-Cookie") or []:
+            name, _, rest = header.partition("=")
+            self.cookies[name.strip()] = rest.split(";", 1)[0]
+        return status, data
+
+    def json(self, *args, **kwargs):
+        status, data = self.request(*args, **kwargs)
+        try:
+            return status, json.loads(data) if data else {}
+        except ValueError:
+            return status, {}
+
+
+# ---------------------- SCENARIOS ------------------------------
+
+def kiosk_session(client, rnd, cfg):
+    i = rnd.randrange(cfg.seed_users)
+    status, user = client.json("POST /api/user/fetch", "POST", "/api/user/fetch",
+                               json_body={"mobile": bench_mobile(i)})
+    if status != 200:
+        return
+    client.request("POST /api/machine/insert", "POST", "/api/machine/insert", json_body={
+        "machine_id": bench_machine_id(rnd.randrange(cfg.seed_machines)),
+        "user_id": user["user_id"],
+        "bottle_count": rnd.randint(1, 5),
+    })
+
+
+def app_session(client, rnd, cfg):
+    i = rnd.randrange(cfg.seed_users)
+    status, body = client.json("POST /api/auth/login", "POST", "/api/auth/login",
+                               json_body={"mobile": bench_mobile(i), "password": PASSWORD})
+    if status != 200:
+        return
+    client.token = body["access_token"]
+    client.request("GET /api/users/me", "GET", "/api/users/me")
+    client.request("GET /api/points/summary", "GET", "/api/points/summary")
+    client.request("GET /api/machines", "GET", "/api/machines")
+    client.token = None
+
+
+def admin_session(client, rnd, cfg):
+    if "session" not in client.cookies:
+        client.request("POST /admin/login", "POST", "/admin/login",
+                       form={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+
+    page = rnd.choice(("dashboard", "users", "machines", "transactions",
+                       "user_detail", "machine_detail", "users_report"))
+    if page == "dashboard":
+        client.request("GET /admin/dashboard", "GET", "/admin/dashboard")
+    elif page == "users":
+        client.request("GET /admin/users", "GET", "/admin/users")
+    elif page == "machines":
+        client.request("GET /admin/machines", "GET", "/admin/machines")
+    elif page == "transactions":
+        client.request("GET /admin/transactions", "GET", "/admin/transactions")
+    elif page == "user_detail":
+        uid = bench_user_id(rnd.randrange(cfg.seed_users))
+        client.request("GET /admin/users/<id>", "GET", f"/admin/users/{uid}")
+    elif page == "machine_detail":
+        mid = bench_machine_id(rnd.randrange(cfg.seed_machines))
+        client.request("GET /admin/machines/<id>", "GET", f"/admin/machines/{mid}")
+    else:
+        rows = [{"user_id": bench_user_id(i), "name": bench_name(i),
+                 "mobile": bench_mobile(i), "points": 0, "bottles": 0}
+                for i in range(min(50, cfg.seed_users))]
+        client.request("POST /admin/users/report", "POST", "/admin/users/report",
+                       json_body={"data": rows})
+
+
+SCENARIOS = {
+    "kiosk": kiosk_session,
+    "app": app_session,
+    "admin": admin_session,
+}
+
+
+# ---------------------- RECORDING ------------------------------
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, label, seconds, status):
+        with self.lock:
+            self.samples[label].append(seconds)
+            if not 200 <= status < 400:
+                self.errors[label] += 1
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    k = math.ceil(pct / 100.0 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, k))]
+
+
+def summarize(samples, errors, elapsed):
+    def stats(values, errs):
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "errors": errs,
+            "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(1000 * sum(values) / len(values), 2) if values else 0.0,
+            "p50_ms": round(1000 * percentile(values, 50), 2),
+            "p95_ms": round(1000 * percentile(values, 95), 2),
+            "p99_ms": round(1000 * percentile(values, 99), 2),
+            "max_ms": round(1000 * values[-1], 2) if values else 0.0,
+        }
+
+    routes = {label: stats(v, errors.get(label, 0)) for label, v in sorted(samples.items())}
+    everything = [s for v in samples.values() for s in v]
+    return routes, stats(everything, sum(errors.values()))
+
+
+# ---------------------- RUNNER ------------------------------
+
+def run(cfg):
+    recorder = Recorder()
+    names = list(cfg.mix)
+    weights = [cfg.mix[n] for n in names]
+    stop_at = time.time() + cfg.warmup + cfg.duration
+
+    def worker(n):
+        rnd = random.Random(cfg.seed + n)
+        client = Client("127.0.0.1", cfg.port, recorder)
+        while time.time() < stop_at:
+            SCENARIOS[rnd.choices(names, weights)[0]](client, rnd, cfg)
+            if cfg.think_ms:
+                time.sleep(rnd.expovariate(1000.0 / cfg.think_ms))
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(cfg.users)]
+    for t in threads:
+        t.start()
+
+    # throw away warm-up samples once the measurement window opens
+    time.sleep(cfg.warmup)
+    with recorder.lock:
+        recorder.samples.clear()
+        recorder.errors.clear()
+    started = time.time()
+    for t in threads:
+        t.join()
+    return recorder, time.time() - started
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(routes, total, baseline=None):
+    header = f"{'route':34} {'count':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}"
+    if baseline:
+        header += f" {'p95 Δ':>9}"
+    print(header)
+    print("-" * len(header))
+    rows = list(routes.items()) + [("TOTAL", total)]
+    for label, s in rows:
+        line = (f"{label:34} {s['count']:7d} {s['errors']:5d} {s['rps']:8.1f} "
+                f"{s['p50_ms']:8.1f} {s['p95_ms']:8.1f} {s['p99_ms']:8.1f}")
+        if baseline:
+            old = baseline["total"] if label == "TOTAL" else baseline["routes"].get(label)
+            if old and old["p95_ms"]:
+                line += f" {100.0 * (s['p95_ms'] - old['p95_ms']) / old['p95_ms']:+8.1f}%"
+        print(line)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                    help="throwaway Postgres database (default: $BENCH_DATABASE_URL)")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    ap.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    ap.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    ap.add_argument("--warmup", type=float, default=5.0, help="discarded seconds")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="mean think time per session")
+    ap.add_argument("--mix", type=parse_mix,
+                    default=DEFAULT_MIX, help="e.g. kiosk=6,app=3,admin=1")
+    ap.add_argument("--seed-users", type=int, default=2000)
+    ap.add_argument("--seed-machines", type=int, default=50)
+    ap.add_argument("--no-seed", action="store_true",
+                    help="reuse an already populated database")
+    ap.add_argument("--no-server", action="store_true",
+                    help="target an app already listening on --port")
+    ap.add_argument("--seed", type=int, default=1, help="random seed for the traffic mix")
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--compare", help="baseline results JSON to diff against")
+    cfg = ap.parse_args(argv)
+
+    if not cfg.database_url:
+        ap.error("--database-url or BENCH_DATABASE_URL is required")
+
+    if not cfg.no_seed:
+        seed(cfg.database_url, cfg.seed_users, cfg.seed_machines)
+
+    proc = None if cfg.no_server else start_app(cfg.database_url, cfg.port, cfg.workers)
+    try:
+        recorder, elapsed = run(cfg)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    routes, total = summarize(recorder.samples, recorder.errors, elapsed)
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "duration_s": round(elapsed, 2),
+            "users": cfg.users,
+            "workers": cfg.workers,
+            "mix": cfg.mix,
+            "seed_users": cfg.seed_users,
+            "seed_machines": cfg.seed_machines,
+        },
+        "routes": routes,
+        "total": total,
+    }
+
+    baseline = None
+    if cfg.compare:
+        with open(cfg.compare) as f:
+            baseline = json.load(f)
+    print_table(routes, total, baseline)
+
+    if cfg.out:
+        os.makedirs(os.path.dirname(os.path.abspath(cfg.out)), exist_ok=True)
+        with open(cfg.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nresults written to {cfg.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Outbox feed benchmark (``polygreen.outbox``).
+
+Loads ``--events`` synthetic ``ledger.earn`` events straight into
+``outbox_events`` (as if producers had emitted them), then times:
+
+* sequencing them (``outbox.sequence`` in ``--batch`` steps),
+* a ``Consumer`` catching up from position 0 in ``--consumer-batch`` pages,
+* the relay writing them to a ``file`` sink, and ``read_files`` reading
+  the segments back,
+* ``--emits`` single-event transactions through ``outbox.emit`` (the
+  cost a request pays), against the same transactions without the event.
+
+    python -m bench.outboxbench --database-url postgresql://localhost/polygreen_bench \
+        --events 1000000
+
+Run it on a scratch database: the outbox tables are emptied first.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from polygreen import outbox
+
+LOAD_SQL = """
+    INSERT INTO outbox_events (topic, key, payload, created_at)
+    SELECT 'ledger.earn', 'U' || (i %% 5000),
+           json_build_object('event_id', md5(i::TEXT), 'user_id', 'U' || (i %% 5000),
+                             'type', 'earn', 'points', 10, 'bottles', 1,
+                             'machine_id', 'M' || (i %% 800), 'brand_id', NULL,
+                             'created_at', NOW())::JSONB,
+           NOW()
+    FROM generate_series(1, %s) AS i;
+"""
+
+
+def timed(label, fn, n, result):
+    t = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - t
+    result[f"{label}_s"] = round(elapsed, 3)
+    result[f"{label}_per_s"] = round(n / elapsed) if elapsed else None
+    print(f"{label:12} {elapsed:8.2f}s  {n / elapsed if elapsed else 0:>12,.0f} events/s")
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    ap.add_argument("--events", type=int, default=1000000)
+    ap.add_argument("--batch", type=int, default=50000, help="sequencing / relay batch")
+    ap.add_argument("--consumer-batch", type=int, default=outbox.CONSUMER_BATCH)
+    ap.add_argument("--emits", type=int, default=2000)
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    if not args.database_url:
+        ap.error("--database-url or BENCH_DATABASE_URL is required")
+
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    from bench.loadtest import migrate
+
+    migrate(args.database_url, reset=False)
+    conn = psycopg2.connect(args.database_url, cursor_factory=RealDictCursor)
+    directory = tempfile.mkdtemp(prefix="outboxbench-")
+    result = {"events": args.events}
+    try:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE outbox_events, outbox_offsets RESTART IDENTITY;")
+            t = time.perf_counter()
+            cur.execute(LOAD_SQL, (args.events,))
+        conn.commit()
+        print(f"loaded {args.events:,} events in {time.perf_counter() - t:.2f}s")
+
+        def sequence_all():
+            while outbox.sequence(conn, args.batch):
+                pass
+        timed("sequence", sequence_all, args.events, result)
+
+        def catch_up():
+            consumer = outbox.Consumer(conn, "bench", batch=args.consumer_batch, start=0)
+            seen = 0
+            for events in consumer.batches():
+                seen += len(events)
+                consumer.commit()
+            return seen
+        seen = timed("consume", catch_up, args.events, result)
+        assert seen == args.events, (seen, args.events)
+
+        relay = outbox.Relay(outbox.build_sinks(f"file:{directory}"), batch=args.batch)
+        relay.purged_at = time.monotonic()  # keep the events for the rest of the run
+
+        def relay_all():
+            while relay.step(conn):
+                pass
+        timed("relay_file", relay_all, args.events, result)
+        seen = timed("read_files", lambda: sum(1 for _ in outbox.read_files(directory)),
+                     args.events, result)
+        assert seen == args.events, (seen, args.events)
+
+        for label, emit in (("tx_plain", False), ("tx_emit", True)):
+            t = time.perf_counter()
+            for i in range(args.emits):
+                with conn.cursor() as cur:
+                    cur.execute("SELECT LOCALTIMESTAMP AS now;")
+                    if emit:
+                        outbox.emit(cur, "bench.ping", i, {"i": i})
+                conn.commit()
+            result[f"{label}_ms"] = round((time.perf_counter() - t) / args.emits * 1000, 3)
+        print(f"transaction {result['tx_plain_ms']}ms, with an event "
+              f"{result['tx_emit_ms']}ms")
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE outbox_events, outbox_offsets RESTART IDENTITY;")
+        conn.commit()
+        conn.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,438 @@
+"""Query-plan regression checks for the SQL behind every hot handler.
+
+Runs ``EXPLAIN (FORMAT JSON)`` for each statement the handlers issue against
+a realistically sized, deterministic data set (``bench.datagen``) and fails
+when a plan loses its shape: a sequential scan where an index is expected,
+a sort over far more rows than the handler returns, an estimate or cost
+above its ceiling.
+
+    # throwaway cluster (needs initdb/pg_ctl on PATH), generated data
+    python -m bench.plancheck --local
+
+    # existing database; generate data first if it is empty
+    python -m bench.plancheck --database-url postgresql://localhost/polygreen_plans
+
+Cost ceilings are expressed as a fraction of a full scan of the table being
+read, so they hold at any data size. ``--save-baseline`` records every
+plan's cost; ``--baseline`` then also fails when a cost grows by more than
+``--tolerance`` times, which catches regressions that stay under a ceiling.
+
+Statements that are known to read a whole table (unpaginated admin lists,
+exact counts) are still explained and reported as KNOWN, so they are
+visible without failing the run. The SQL below mirrors the handlers
+verbatim: keep the two in step when a query changes.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+
+import psycopg2
+
+from bench import datagen
+from polygreen import leaderboard, machine_cache, rewards
+
+# Data set used by --local / --generate: big enough that the planner's
+# choices resemble production, small enough to build in a few minutes.
+DATA_ARGS = ["--users", "200000", "--machines", "2000", "--transactions", "3000000",
+             "--seed", "42"]
+
+
+class Check:
+    """One statement and what its plan must look like.
+
+    ``indexed`` tables must not be sequentially scanned, ``max_rows`` bounds
+    the row estimate of the top plan node, ``max_sort_rows`` bounds every
+    Sort node's input, and ``max_cost`` bounds total cost as a fraction of a
+    full scan of ``table``.
+    """
+
+    def __init__(self, name, handlers, sql, params=(), table=None, indexed=(),
+                 max_rows=None, max_sort_rows=1000, max_cost=None, known=None):
+        self.name = name
+        self.handlers = handlers
+        self.sql = sql
+        self.params = params
+        self.table = table
+        self.indexed = indexed
+        self.max_rows = max_rows
+        self.max_sort_rows = max_sort_rows
+        self.max_cost = max_cost
+        self.known = known
+
+
+def point(name, handlers, sql, params, table, rows=1):
+    """A single-row lookup/update through a unique key."""
+    return Check(name, handlers, sql, params, table=table, indexed=(table,),
+                 max_rows=rows, max_cost=0.01)
+
+
+def checks(p):
+    """The statement catalogue, with parameters taken from ``sample_params``."""
+    return [
+        # ---- kiosk ----
+        point("users_by_mobile", ["fetchuser"],
+              "SELECT user_id, name, mobile, bottles, points FROM users_live WHERE mobile=%s",
+              (p["mobile"],), "users"),
+        point("user_by_id_live", ["get_user_or_404", "export_individual_user_report"],
+              "SELECT * FROM users_live WHERE user_id=%s", (p["user_id"],), "users"),
+        point("machine_insert_user_exists", ["machine_insert"],
+              "SELECT 1 FROM users WHERE user_id=%s", (p["user_id"],), "users"),
+        point("machine_insert_machine_city", ["machine_insert"],
+              "SELECT city FROM machines WHERE machine_id=%s", (p["machine_id"],), "machines"),
+        # counters.reserve_bottles / add_points (sharded path)
+        Check("machine_insert_reserve_slot", ["machine_insert"], """
+            UPDATE machine_counter_slots SET used = used + %(n)s
+            WHERE (machine_id, slot) = (
+                SELECT machine_id, slot FROM machine_counter_slots
+                WHERE machine_id = %(machine_id)s AND used + %(n)s <= quota
+                ORDER BY (slot + %(start)s) %% %(slots)s
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING slot;
+        """, {"machine_id": p["machine_id"], "n": 1, "start": 3, "slots": 8},
+              max_rows=1, max_sort_rows=64),
+        Check("machine_insert_user_slot", ["machine_insert"], """
+            INSERT INTO user_counter_slots (user_id, slot, points, bottles)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (user_id, slot) DO UPDATE
+            SET points = user_counter_slots.points + EXCLUDED.points,
+                bottles = user_counter_slots.bottles + EXCLUDED.bottles;
+        """, (p["user_id"], 3, 10, 1), max_rows=1),
+        # ledger flush (a single-row batch here; flushes are multi-row VALUES)
+        Check("ledger_insert", ["machine_insert"], """
+            INSERT INTO transactions
+                (event_id, user_id, type, points, bottles, machine_id, brand_id, created_at)
+            VALUES (gen_random_uuid(), %s, %s, %s, %s, %s, NULL, LOCALTIMESTAMP)
+            ON CONFLICT (event_id, created_at) DO NOTHING
+            RETURNING user_id, type, points, machine_id, created_at
+        """, (p["user_id"], "earn", 10, 1, p["machine_id"]), max_rows=1),
+        # leaderboard.record, once per flushed batch (one row here)
+        Check("leaderboard_record", ["machine_insert"], leaderboard.RECORD_SQL,
+              ([p["user_id"]], [p["machine_id"]], [10], ["2024-01-01 12:00"]),
+              indexed=("machines", "leaderboard_scores"), max_sort_rows=64),
+        point("machine_insert_user_after", ["machine_insert"],
+              "SELECT user_id, points, bottles FROM users_live WHERE user_id=%s",
+              (p["user_id"],), "users"),
+        point("machine_insert_machine_after", ["machine_insert"],
+              "SELECT current_bottles, max_capacity, is_full FROM machines_live WHERE machine_id=%s",
+              (p["machine_id"],), "machines"),
+
+        # ---- app: auth ----
+        point("login", ["login"], "SELECT * FROM users_live WHERE mobile=%s",
+              (p["mobile"],), "users"),
+        point("check_user", ["check_user"], "SELECT user_id FROM users WHERE mobile=%s",
+              (p["mobile"],), "users"),
+        point("register_duplicate", ["register"],
+              "SELECT id FROM users WHERE mobile=%s OR user_id=%s",
+              (p["mobile"], p["user_id"]), "users", rows=2),
+        point("reset_password_lookup", ["reset_password_loggedin"],
+              "SELECT password_hash FROM users WHERE user_id=%s", (p["user_id"],), "users"),
+        point("set_new_password", ["set_new_password"],
+              "UPDATE users SET password_hash=%s WHERE mobile=%s", ("x", p["mobile"]), "users"),
+        # the generated data has no OTPs, so only the key lookup is checked
+        Check("otp_lookup", ["verify_otp_db"], """
+            SELECT otp, expires_at, verified
+            FROM user_otps
+            WHERE mobile=%s
+        """, (p["mobile"],), max_rows=1),
+
+        # ---- app: points ----
+        Check("points_summary", ["points_summary"], """
+            SELECT id, points, type, created_at
+            FROM transactions
+            WHERE user_id=%s
+            ORDER BY created_at DESC
+            LIMIT 5
+        """, (p["user_id"],), table="transactions", indexed=("transactions",),
+              max_rows=5, max_sort_rows=0, max_cost=0.001),
+        # rewards.redeem
+        Check("redeem_claim", ["redeem_request"], rewards.CLAIM_SQL,
+              (p["user_id"], "plancheck", 1, 500), indexed=("redemptions",), max_rows=1),
+        Check("redeem_replay", ["redeem_request"], """
+            SELECT id, brand_id, points, balance, coupon
+            FROM redemptions
+            WHERE user_id = %s AND idempotency_key = %s;
+        """, (p["user_id"], "plancheck"), indexed=("redemptions",), max_rows=1),
+        point("redeem_spend", ["redeem_request"], rewards.SPEND_SQL,
+              {"user_id": p["user_id"], "points": 500}, "users"),
+        # leaderboard.top / rank
+        Check("leaderboard_top", ["get_leaderboard"], """
+            SELECT s.user_id, u.name, s.points
+            FROM leaderboard_scores s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE s.board = %s AND s.scope = %s
+            ORDER BY s.points DESC, s.user_id
+            LIMIT %s;
+        """, ("global", "", 10), indexed=("leaderboard_scores", "users"),
+              max_rows=10, max_sort_rows=0),
+        Check("leaderboard_my_points", ["get_leaderboard"], """
+            SELECT points FROM leaderboard_scores
+            WHERE board = %s AND scope = %s AND user_id = %s;
+        """, ("global", "", p["user_id"]), indexed=("leaderboard_scores",), max_rows=1),
+        # one counter-slot probe per machine, so no ceiling relative to a scan
+        Check("machine_list", ["list_machines", "machine_cache"], machine_cache.LIST_SQL,
+              table="machines", indexed=("machine_counter_slots",), max_sort_rows=0),
+
+        # ---- admin ----
+        point("admin_user_detail_user", ["admin_user_detail"], """
+            SELECT user_id, name, mobile, points, bottles, created_at
+            FROM users_live
+            WHERE user_id=%s;
+        """, (p["user_id"],), "users"),
+        Check("admin_user_detail_transactions", ["admin_user_detail"], """
+            SELECT id, type, points, bottles, machine_id, brand_id, created_at
+            FROM transactions
+            WHERE user_id=%s
+            ORDER BY created_at DESC;
+        """, (p["user_id"],), table="transactions", indexed=("transactions",),
+              max_rows=p["user_rows_ceiling"], max_sort_rows=p["user_rows_ceiling"],
+              max_cost=0.05),
+        point("admin_machine_detail_machine", ["admin_machine_detail"], """
+            SELECT id, machine_id, name, city, lat, lng,
+                   current_bottles, max_capacity, total_bottles,
+                   is_full, last_emptied, created_at
+            FROM machines_live
+            WHERE machine_id=%s;
+        """, (p["machine_id"],), "machines"),
+        Check("admin_machine_detail_transactions", ["admin_machine_detail"], """
+            SELECT id, user_id, type, points, bottles,
+                   machine_id, brand_id, created_at
+            FROM transactions
+            WHERE machine_id=%s
+            ORDER BY created_at DESC;
+        """, (p["machine_id"],), table="transactions", indexed=("transactions",),
+              max_rows=p["machine_rows_ceiling"], max_sort_rows=p["machine_rows_ceiling"],
+              max_cost=0.25),
+        point("admin_empty_machine_lookup", ["admin_empty_machine"], """
+            SELECT name
+            FROM machines
+            WHERE machine_id = %s;
+        """, (p["machine_id"],), "machines"),
+        point("admin_add_machine_exists", ["admin_add_machine"],
+              "SELECT 1 FROM machines WHERE machine_id = %s;", (p["machine_id"],), "machines"),
+
+        Check("admin_users", ["admin_users"], """
+            SELECT user_id, name, mobile, points, bottles, created_at
+            FROM users
+            ORDER BY created_at DESC;
+        """, table="users", indexed=("users",), max_sort_rows=0,
+              known="unpaginated: returns every user"),
+        Check("admin_machines", ["admin_machines"], """
+            SELECT id, machine_id, name, city, lat, lng,
+                   current_bottles, max_capacity, total_bottles,
+                   is_full, last_emptied, created_at
+            FROM machines
+            ORDER BY id;
+        """, table="machines", max_sort_rows=0, max_cost=1.5),
+        Check("admin_transactions", ["admin_transactions"], """
+            SELECT id, user_id, type, points, bottles,
+                   machine_id, brand_id, created_at
+            FROM transactions
+            ORDER BY created_at DESC;
+        """, table="transactions", indexed=("transactions",), max_sort_rows=0,
+              known="unpaginated: returns every transaction"),
+        Check("admin_dashboard_users", ["admin_dashboard"],
+              "SELECT COUNT(*) AS total_users FROM users;", table="users",
+              known="exact COUNT(*) reads the whole table"),
+        Check("admin_dashboard_machines", ["admin_dashboard"],
+              "SELECT COUNT(*) AS total_machines FROM machines;", table="machines", max_cost=1.5),
+        Check("admin_dashboard_transactions", ["admin_dashboard"],
+              "SELECT COUNT(*) AS total_transactions FROM transactions;", table="transactions",
+              known="exact COUNT(*) reads the whole table"),
+    ]
+
+
+# ---------------- PLAN INSPECTION ----------------
+
+def explain(cur, sql, params=()):
+    cur.execute("EXPLAIN (FORMAT JSON) " + sql, params or None)
+    return cur.fetchone()[0][0]["Plan"]
+
+
+def nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from nodes(child)
+
+
+def _is_table(relation, table):
+    # monthly partitions and the like are named <table>_<suffix>
+    return relation == table or relation.startswith(table + "_")
+
+
+def full_scan_cost(cur, table, cache):
+    if table not in cache:
+        cur.execute("SET LOCAL enable_indexscan = off; SET LOCAL enable_bitmapscan = off; "
+                    "SET LOCAL enable_indexonlyscan = off;")
+        cache[table] = explain(cur, f"SELECT * FROM {table}")["Total Cost"]
+        cur.execute("RESET enable_indexscan; RESET enable_bitmapscan; RESET enable_indexonlyscan;")
+    return cache[table]
+
+
+def problems(check, plan, scan_cost):
+    found = []
+    for node in nodes(plan):
+        kind = node["Node Type"]
+        relation = node.get("Relation Name", "")
+        if kind == "Seq Scan" and any(_is_table(relation, t) for t in check.indexed):
+            found.append(f"sequential scan on {relation}")
+        if kind in ("Sort", "Incremental Sort") and node["Plan Rows"] > check.max_sort_rows:
+            found.append(f"sort over ~{node['Plan Rows']:,} rows (limit {check.max_sort_rows:,})")
+    if check.max_rows is not None and plan["Plan Rows"] > check.max_rows:
+        found.append(f"estimates {plan['Plan Rows']:,} rows (limit {check.max_rows:,})")
+    if check.max_cost is not None and scan_cost:
+        ratio = plan["Total Cost"] / scan_cost
+        if ratio > check.max_cost:
+            found.append(f"cost {ratio:.3f}x a full scan of {check.table} "
+                         f"(limit {check.max_cost}x)")
+    return found
+
+
+def shape(plan):
+    """Compact one-line rendering, e.g. ``Limit > Index Scan(transactions)``."""
+    parts = []
+    for node in nodes(plan):
+        label = node["Node Type"]
+        if node.get("Index Name"):
+            label += f"[{node['Index Name']}]"
+        elif node.get("Relation Name"):
+            label += f"({node['Relation Name']})"
+        parts.append(label)
+    return " > ".join(parts)
+
+
+# ---------------- DATA ----------------
+
+def sample_params(cur):
+    """Pick the busiest user and machine: the worst case for history queries."""
+    cur.execute("SELECT user_id, mobile, bottles FROM users ORDER BY bottles DESC LIMIT 1;")
+    user_id, mobile, user_bottles = cur.fetchone()
+    cur.execute("SELECT machine_id, total_bottles FROM machines "
+                "ORDER BY total_bottles DESC LIMIT 1;")
+    machine_id, machine_bottles = cur.fetchone()
+    cur.execute("SELECT COUNT(*) FROM transactions WHERE user_id=%s;", (user_id,))
+    user_rows = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM transactions WHERE machine_id=%s;", (machine_id,))
+    machine_rows = cur.fetchone()[0]
+    return {
+        "user_id": user_id,
+        "mobile": mobile,
+        "machine_id": machine_id,
+        # estimates may be off by a few x for skewed keys; an order of
+        # magnitude means the statistics or the query are wrong
+        "user_rows_ceiling": max(100, user_rows * 10),
+        "machine_rows_ceiling": max(1000, machine_rows * 10),
+    }
+
+
+def has_data(database_url):
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('transactions') IS NOT NULL "
+                        "AND EXISTS (SELECT 1 FROM transactions);")
+            result = cur.fetchone()[0]
+    conn.close()
+    return result
+
+
+@contextlib.contextmanager
+def local_cluster():
+    """A throwaway Postgres cluster in a temp directory, torn down on exit."""
+    for tool in ("initdb", "pg_ctl"):
+        if not shutil.which(tool):
+            raise SystemExit(f"--local needs {tool} on PATH")
+    root = tempfile.mkdtemp(prefix="polygreen-plans-")
+    data = os.path.join(root, "data")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    subprocess.run(["initdb", "-D", data, "-U", "postgres", "-A", "trust", "--no-sync"],
+                   check=True, capture_output=True)
+    subprocess.run(["pg_ctl", "-D", data, "-l", os.path.join(root, "log"), "-w",
+                    "-o", f"-p {port} -k {root} -c fsync=off -c full_page_writes=off",
+                    "start"], check=True, capture_output=True)
+    try:
+        yield f"postgresql://postgres@/postgres?host={root}&port={port}"
+    finally:
+        subprocess.run(["pg_ctl", "-D", data, "-m", "immediate", "stop"], capture_output=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# ---------------- RUN ----------------
+
+def run(database_url, baseline=None, tolerance=2.0):
+    results, failed = {}, False
+    scan_costs = {}
+    with psycopg2.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            params = sample_params(cur)
+            for check in checks(params):
+                plan = explain(cur, check.sql, check.params)
+                scan_cost = full_scan_cost(cur, check.table, scan_costs) if check.table else None
+                found = problems(check, plan, scan_cost)
+
+                cost = plan["Total Cost"]
+                previous = (baseline or {}).get(check.name)
+                if previous and cost > previous["cost"] * tolerance:
+                    found.append(f"cost {cost:,.0f} vs baseline {previous['cost']:,.0f}")
+
+                status = "ok" if not found else ("KNOWN" if check.known else "FAIL")
+                failed |= status == "FAIL"
+                results[check.name] = {"status": status, "cost": cost,
+                                       "rows": plan["Plan Rows"], "plan": shape(plan)}
+                print(f"{status:5} {check.name:36} {shape(plan)}")
+                for problem in found:
+                    print(f"        {problem}")
+                if check.known and found:
+                    print(f"        ({check.known}; used by {', '.join(check.handlers)})")
+        conn.rollback()
+    conn.close()
+    return results, failed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--database-url", default=os.getenv("PLANCHECK_DATABASE_URL"))
+    ap.add_argument("--local", action="store_true",
+                    help="run against a throwaway local cluster (initdb/pg_ctl)")
+    ap.add_argument("--generate", action="store_true",
+                    help="(re)generate the data set even if tables have rows")
+    ap.add_argument("--baseline", help="fail when a cost grows past --tolerance x this file")
+    ap.add_argument("--tolerance", type=float, default=2.0)
+    ap.add_argument("--save-baseline", help="write plan costs here")
+    args = ap.parse_args(argv)
+
+    if not (args.local or args.database_url):
+        ap.error("--database-url, PLANCHECK_DATABASE_URL or --local is required")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    with (local_cluster() if args.local else contextlib.nullcontext(args.database_url)) as url:
+        if args.local or args.generate or not has_data(url):
+            print("generating data set ...")
+            datagen.main(["--database-url", url, *DATA_ARGS])
+        results, failed = run(url, baseline, args.tolerance)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    counts = {s: sum(r["status"] == s for r in results.values()) for s in ("ok", "KNOWN", "FAIL")}
+    print(f"{counts['ok']} ok, {counts['KNOWN']} known, {counts['FAIL']} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""Concurrency test for point redemption (``polygreen.rewards``).
+
+Hammers ONE account from many threads straight against Postgres: redeemers
+spend points with fresh idempotency keys while earners credit drops through
+the counter slots and a folder moves slots into ``users``, as the app's
+background fold does. A monitor polls ``users_live`` throughout.
+
+    python -m bench.redeemrace --database-url postgresql://localhost/polygreen_bench \
+        --threads 32 --earners 4 --duration 10
+
+The run fails unless the balance never went negative, the final balance is
+exactly initial + earned - spent, and every successful redemption has one
+``redemptions`` row and one ledger row. A second phase fires the same
+idempotency key from every thread at once and fails unless the points were
+spent exactly once and every caller got the same coupon.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from bench.loadtest import bench_mobile, bench_name, bench_user_id, migrate, percentile
+from polygreen import counters, ledger, partitions, rewards
+
+USER_ID = bench_user_id(0)
+BRAND = "Race reward"
+
+
+def connect(database_url):
+    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+
+
+def setup(database_url, initial):
+    """Reset the race account to ``initial`` points; returns the brand id."""
+    migrate(database_url, reset=False)
+    conn = connect(database_url)
+    try:
+        partitions.ensure(conn)
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO users (user_id, name, mobile, password_hash)
+                VALUES (%s, %s, %s, 'x')
+                ON CONFLICT DO NOTHING;
+            """, (USER_ID, bench_name(0), bench_mobile(0)))
+            cur.execute("DELETE FROM user_counter_slots WHERE user_id = %s;", (USER_ID,))
+            cur.execute("UPDATE users SET points = %s WHERE user_id = %s;", (initial, USER_ID))
+            cur.execute("DELETE FROM redemptions WHERE user_id = %s;", (USER_ID,))
+            cur.execute("DELETE FROM transactions WHERE user_id = %s;", (USER_ID,))
+            cur.execute("SELECT id FROM reward_brand WHERE name = %s;", (BRAND,))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("INSERT INTO reward_brand (name, min_points) VALUES (%s, 1) "
+                            "RETURNING id;", (BRAND,))
+                row = cur.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    rewards.invalidate()
+    return row["id"]
+
+
+def attempt(conn, brand_id, cost, key):
+    """One ``POST /api/redeem/request``. Returns ``(result, replayed)`` or
+    ``(None, False)`` when refused."""
+    try:
+        with conn.cursor() as cur:
+            result, replayed = rewards.redeem(cur, USER_ID, brand_id, cost, key)
+        ledger.sync()
+        conn.commit()
+    except rewards.RedeemError:
+        conn.rollback()
+        return None, False
+    return result, replayed
+
+
+def race(database_url, brand_id, threads, earners, duration, cost, earn):
+    deadline = time.monotonic() + duration
+    spent = [0] * threads
+    refused = [0] * threads
+    errors = [0] * threads
+    earned = [0] * earners
+    latencies = [[] for _ in range(threads)]
+    lowest = [None]
+    start = threading.Barrier(threads + earners + 2)
+
+    def redeemer(i):
+        conn = connect(database_url)
+        start.wait()
+        try:
+            while time.monotonic() < deadline:
+                t = time.perf_counter()
+                try:
+                    result, _ = attempt(conn, brand_id, cost, uuid.uuid4().hex)
+                except psycopg2.Error:
+                    conn.rollback()
+                    errors[i] += 1
+                    continue
+                latencies[i].append(time.perf_counter() - t)
+                if result:
+                    spent[i] += result["points"]
+                else:
+                    refused[i] += 1
+        finally:
+            conn.close()
+
+    def earner(i):
+        conn = connect(database_url)
+        start.wait()
+        try:
+            while time.monotonic() < deadline:
+                with conn.cursor() as cur:
+                    counters.add_points(cur, USER_ID, earn, 1)
+                conn.commit()
+                earned[i] += earn
+                time.sleep(0.002)
+        finally:
+            conn.close()
+
+    def folder():
+        conn = connect(database_url)
+        start.wait()
+        try:
+            while time.monotonic() < deadline:
+                counters.fold(conn)
+                time.sleep(0.05)
+        finally:
+            conn.close()
+
+    def monitor():
+        conn = connect(database_url)
+        conn.autocommit = True
+        start.wait()
+        try:
+            while time.monotonic() < deadline:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT points FROM users_live WHERE user_id = %s;", (USER_ID,))
+                    points = cur.fetchone()["points"]
+                if lowest[0] is None or points < lowest[0]:
+                    lowest[0] = points
+        finally:
+            conn.close()
+
+    pool = ([threading.Thread(target=redeemer, args=(i,)) for i in range(threads)]
+            + [threading.Thread(target=earner, args=(i,)) for i in range(earners)]
+            + [threading.Thread(target=folder), threading.Thread(target=monitor)])
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return {
+        "spent": sum(spent),
+        "earned": sum(earned),
+        "redemptions": sum(spent) // cost,
+        "refused": sum(refused),
+        "errors": sum(errors),
+        "lowest_seen": lowest[0],
+        "latencies": sorted(x for lat in latencies for x in lat),
+    }
+
+
+def totals(database_url):
+    conn = connect(database_url)
+    try:
+        counters.fold(conn)
+        with conn.cursor() as cur:
+            cur.execute("SELECT points FROM users_live WHERE user_id = %s;", (USER_ID,))
+            balance = cur.fetchone()["points"]
+            cur.execute("SELECT COUNT(*) AS n, COALESCE(SUM(points), 0) AS points "
+                        "FROM redemptions WHERE user_id = %s;", (USER_ID,))
+            redemptions = cur.fetchone()
+            cur.execute("SELECT COUNT(*) AS n, COALESCE(SUM(points), 0) AS points "
+                        "FROM transactions WHERE user_id = %s AND type = 'redeem';", (USER_ID,))
+            ledger_rows = cur.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    return balance, redemptions, ledger_rows
+
+
+def same_key(database_url, brand_id, threads, cost):
+    """Every thread sends the same request with the same key at once."""
+    key = uuid.uuid4().hex
+    results = [None] * threads
+    start = threading.Barrier(threads)
+
+    def worker(i):
+        conn = connect(database_url)
+        start.wait()
+        try:
+            results[i] = attempt(conn, brand_id, cost, key)
+        finally:
+            conn.close()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--earners", type=int, default=4)
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--initial", type=int, default=100000)
+    ap.add_argument("--cost", type=int, default=500)
+    ap.add_argument("--earn", type=int, default=10)
+    ap.add_argument("--slots", type=int, default=counters.SLOTS,
+                    help="COUNTER_SLOTS for the earners (1 = unsharded)")
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    if not args.database_url:
+        ap.error("--database-url or BENCH_DATABASE_URL is required")
+
+    # rewards loads its catalog through the app's pool; ledger rows go
+    # straight into the redeeming transaction so they can be counted
+    os.environ["DATABASE_URL"] = args.database_url
+    ledger.ENABLED = False
+    counters.SLOTS = args.slots
+
+    brand_id = setup(args.database_url, args.initial)
+    r = race(args.database_url, brand_id, args.threads, args.earners, args.duration,
+             args.cost, args.earn)
+    balance, redemptions, ledger_rows = totals(args.database_url)
+    expected = args.initial + r["earned"] - r["spent"]
+    race_ok = (r["lowest_seen"] is not None and r["lowest_seen"] >= 0 and balance >= 0
+               and balance == expected
+               and redemptions["points"] == ledger_rows["points"] == r["spent"]
+               and redemptions["n"] == ledger_rows["n"] == r["redemptions"])
+    lat = r.pop("latencies")
+    print(f"race: {r['redemptions']} redemptions ({r['spent']} pts), {r['refused']} refused, "
+          f"{r['errors']} errors, earned {r['earned']} pts; lowest balance seen "
+          f"{r['lowest_seen']}, final {balance} (expected {expected}); "
+          f"p50 {percentile(lat, 50) * 1000:.2f}ms p99 {percentile(lat, 99) * 1000:.2f}ms  "
+          f"{'ok' if race_ok else 'FAILED'}")
+
+    before = balance
+    results = same_key(args.database_url, brand_id, args.threads, args.cost)
+    balance_after, _, _ = totals(args.database_url)
+    fresh = [res for res, replayed in results if res and not replayed]
+    coupons = {res["coupon"] for res, _ in results if res}
+    key_ok = (len(fresh) == 1 and len(coupons) == 1 and all(res for res, _ in results)
+              and before - balance_after == args.cost)
+    if before < args.cost:
+        key_ok = not fresh and before == balance_after
+    print(f"same key x{args.threads}: {len(fresh)} spent, {len(coupons)} distinct coupons, "
+          f"balance {before} -> {balance_after}  {'ok' if key_ok else 'FAILED'}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump({"race": dict(r, final=balance, expected=expected, ok=race_ok),
+                       "same_key": {"spent": len(fresh), "coupons": len(coupons),
+                                    "ok": key_ok}}, f, indent=2)
+    return 0 if race_ok and key_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Micro-benchmark for the collection route planner (``polygreen.collection``).
+
+Scatters ``--stops`` machines over a city-sized box around a depot and
+times planning them at several truck capacities, in-process with no
+database:
+
+    python -m bench.routebench --stops 500 2000 5000 --capacity 2000 20000
+
+For each run it prints the nearest-neighbour length, the length after
+2-opt / or-opt and the wall time.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+from polygreen import collection
+
+DEPOT = (37.5665, 126.9780)
+
+
+def synthetic_stops(n, seed=1, spread=0.2):
+    rnd = random.Random(seed)
+    return [{
+        "machine_id": f"M{i:06d}",
+        "lat": DEPOT[0] + rnd.uniform(-spread, spread),
+        "lng": DEPOT[1] + rnd.uniform(-spread, spread) * 1.25,
+        "current_bottles": rnd.randint(150, 300),
+        "max_capacity": 300,
+    } for i in range(n)]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--stops", type=int, nargs="+", default=[500, 2000, 5000])
+    ap.add_argument("--capacity", type=int, nargs="+", default=[collection.TRUCK_CAPACITY])
+    ap.add_argument("--time-limit", type=float, default=collection.TIME_LIMIT)
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    results = []
+    for n in args.stops:
+        stops = synthetic_stops(n)
+        for capacity in args.capacity:
+            plan = collection.plan(stops, DEPOT, capacity, args.time_limit)
+            row = {
+                "stops": n,
+                "capacity": capacity,
+                "routes": len(plan["routes"]),
+                "construction_km": plan["construction_km"],
+                "distance_km": plan["distance_km"],
+                "improvement_pct": round(100 * (1 - plan["distance_km"] / plan["construction_km"]), 1),
+                "compute_ms": plan["compute_ms"],
+                "timed_out": plan["timed_out"],
+            }
+            results.append(row)
+            print(f"{n:>6} stops  capacity {capacity:>6}: {row['routes']:>4} routes  "
+                  f"{row['construction_km']:>9} -> {row['distance_km']:>9} km "
+                  f"(-{row['improvement_pct']}%)  {row['compute_ms']}ms"
+                  f"{'  (time limit)' if row['timed_out'] else ''}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
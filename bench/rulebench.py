@@ -0,0 +1,125 @@
+"""Micro-benchmark for the compiled points rules (``polygreen.rules``).
+
+Builds a ``RuleSet`` from thousands of synthetic active rules (per-machine,
+per-city and global; campaign windows, weekday masks, time-of-day windows)
+and times compiling it and pricing drops against it, in-process with no
+database:
+
+    python -m bench.rulebench --rules 5000 --machines 2000 --calls 200000
+
+``--db`` loads the live ``points_rules`` table instead of synthetic rows.
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from polygreen import rules
+
+CITIES = ["Seoul", "Busan", "Incheon", "Daegu", "Daejeon", "Gwangju", "Ulsan", "Suwon"]
+
+
+def synthetic_rows(n, machines, seed=1):
+    rnd = random.Random(seed)
+    now = dt.datetime.now().replace(microsecond=0)
+    rows = []
+    for i in range(n, 0, -1):  # newest first, like LOAD_SQL
+        scope = rnd.random()
+        start_minute = end_minute = None
+        if rnd.random() < 0.3:
+            start_minute = rnd.randrange(0, 1440, 30)
+            end_minute = (start_minute + rnd.randrange(60, 600, 30)) % 1440
+        starts_at = ends_at = None
+        if rnd.random() < 0.5:
+            starts_at = now - dt.timedelta(days=rnd.randint(0, 30))
+            ends_at = now + dt.timedelta(days=rnd.randint(1, 30))
+        rows.append({
+            "id": i,
+            "machine_id": f"M{rnd.randrange(machines):06d}" if scope < 0.9 else None,
+            "city": rnd.choice(CITIES) if 0.9 <= scope < 0.99 else None,
+            "starts_at": starts_at,
+            "ends_at": ends_at,
+            "weekday_mask": rnd.choice([127, 31, 96, 1 << rnd.randrange(7)]),
+            "start_minute": start_minute,
+            "end_minute": end_minute,
+            "points_per_bottle": rnd.choice([None, 5, 10, 15, 20]),
+            "multiplier": rnd.choice([None, 1.5, 2.0]) if rnd.random() < 0.4 else None,
+        })
+    return rows
+
+
+def drops(n, machines, seed=2):
+    rnd = random.Random(seed)
+    now = dt.datetime.now()
+    return [(rnd.randint(1, 5), f"M{rnd.randrange(machines):06d}", rnd.choice(CITIES),
+             now + dt.timedelta(minutes=rnd.randrange(-7 * 1440, 7 * 1440)))
+            for _ in range(n)]
+
+
+def time_calls(ruleset, calls, batch=1000):
+    """Per-call latency in microseconds, measured over batches of ``batch``."""
+    samples = []
+    for i in range(0, len(calls), batch):
+        chunk = calls[i:i + batch]
+        t = time.perf_counter()
+        for bottles, machine_id, city, when in chunk:
+            ruleset.points(bottles, machine_id, city, when)
+        samples.append((time.perf_counter() - t) / len(chunk) * 1e6)
+    return samples
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--rules", type=int, default=5000)
+    ap.add_argument("--machines", type=int, default=2000)
+    ap.add_argument("--calls", type=int, default=200000)
+    ap.add_argument("--db", action="store_true", help="load points_rules from DATABASE_URL")
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    if args.db:
+        from polygreen import create_app
+
+        with create_app().app_context():
+            t = time.perf_counter()
+            ruleset = rules.load()
+            compile_ms = (time.perf_counter() - t) * 1000
+    else:
+        rows = synthetic_rows(args.rules, args.machines)
+        t = time.perf_counter()
+        ruleset = rules.RuleSet(rows)
+        compile_ms = (time.perf_counter() - t) * 1000
+
+    calls = drops(args.calls, args.machines)
+    time_calls(ruleset, calls[:1000])  # warm up
+    samples = sorted(time_calls(ruleset, calls))
+
+    result = {
+        "rules": ruleset.size,
+        "machine_buckets": len(ruleset.by_machine),
+        "city_buckets": len(ruleset.by_city),
+        "compile_ms": round(compile_ms, 2),
+        "calls": len(calls),
+        "mean_us": round(statistics.fmean(samples), 3),
+        "p50_us": round(samples[len(samples) // 2], 3),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+    }
+    print(f"{result['rules']} rules compiled in {result['compile_ms']}ms "
+          f"({result['machine_buckets']} machines, {result['city_buckets']} cities)")
+    print(f"points(): mean {result['mean_us']}us  p50 {result['p50_us']}us  "
+          f"p99 {result['p99_us']}us over {result['calls']:,} calls")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""Idle-connection benchmark for ``GET /api/machines/events``.
+
+Starts the app on gevent workers against a local Postgres, opens
+``--connections`` event streams from one thread (``selectors``), and
+measures worker memory before and after, then how long a bottle drop takes
+to reach every open stream:
+
+    python -m bench.ssebench --database-url postgresql://localhost/polygreen_bench \
+        --connections 5000 --inserts 20
+
+Each insert goes through ``POST /api/machine/insert``; delivery latency is
+from just before that request to the first byte of the matching event on
+each stream. Raise ``ulimit -n`` above ``--connections`` first.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import resource
+import selectors
+import socket
+import sys
+import time
+
+from bench.loadtest import (
+    PASSWORD, bench_machine_id, bench_mobile, bench_user_id, percentile, seed, start_app,
+)
+
+
+def worker_pids(master_pid):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def rss_kb(pids):
+    total = 0
+    for pid in pids:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])
+    return total
+
+
+def login(port):
+    c = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    c.request("POST", "/api/auth/login", body=json.dumps(
+        {"mobile": bench_mobile(0), "password": PASSWORD}),
+        headers={"Content-Type": "application/json"})
+    resp = c.getresponse()
+    body = json.loads(resp.read())
+    c.close()
+    if resp.status != 200:
+        raise RuntimeError(f"login failed: {resp.status} {body}")
+    return body["access_token"]
+
+
+def open_streams(port, token, n, sel):
+    request = (f"GET /api/machines/events?jwt={token} HTTP/1.1\r\n"
+               f"Host: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n").encode()
+    for i in range(n):
+        s = socket.create_connection(("127.0.0.1", port))
+        s.sendall(request)
+        s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ, {"n": i, "buf": b""})
+
+    # wait for every stream's response headers and retry: line
+    pending = n
+    deadline = time.monotonic() + 60
+    while pending and time.monotonic() < deadline:
+        for key, _ in sel.select(timeout=1):
+            state = key.data
+            chunk = key.fileobj.recv(65536)
+            if not chunk:
+                raise RuntimeError(f"stream {state['n']} closed during setup")
+            state["buf"] += chunk
+            if b"retry:" in state["buf"] and not state.get("ready"):
+                if not state["buf"].startswith(b"HTTP/1.1 200"):
+                    raise RuntimeError(state["buf"][:200].decode(errors="replace"))
+                state["ready"] = True
+                pending -= 1
+    if pending:
+        raise RuntimeError(f"{pending} streams never opened")
+    for key in sel.get_map().values():
+        key.data["buf"] = b""
+
+
+def insert(port, user_id, machine_id):
+    c = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    c.request("POST", "/api/machine/insert", body=json.dumps(
+        {"machine_id": machine_id, "user_id": user_id, "bottle_count": 1}),
+        headers={"Content-Type": "application/json"})
+    resp = c.getresponse()
+    body = json.loads(resp.read())
+    c.close()
+    if resp.status != 200:
+        raise RuntimeError(f"insert failed: {resp.status} {body}")
+    return body["machine_current_bottles"]
+
+
+def deliver(sel, marker, started, timeout):
+    """Seconds until each stream saw ``marker``; missing streams are left out."""
+    latencies = []
+    waiting = len(sel.get_map())
+    deadline = time.monotonic() + timeout
+    while waiting and time.monotonic() < deadline:
+        for key, _ in sel.select(timeout=0.5):
+            state = key.data
+            state["buf"] += key.fileobj.recv(65536)
+            if state.get("seen") != marker and marker in state["buf"]:
+                latencies.append(time.perf_counter() - started)
+                state["seen"] = marker
+                state["buf"] = b""
+                waiting -= 1
+            elif len(state["buf"]) > 65536:
+                state["buf"] = state["buf"][-4096:]
+    return latencies
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    ap.add_argument("--connections", type=int, default=2000)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--inserts", type=int, default=20)
+    ap.add_argument("--port", type=int, default=8097)
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    if not args.database_url:
+        ap.error("--database-url or BENCH_DATABASE_URL is required")
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.connections + 100:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.connections + 100), hard))
+
+    seed(args.database_url, users=1, machines=1)
+    proc = start_app(args.database_url, args.port, args.workers, extra_env={
+        "GUNICORN_WORKER_CLASS": "gevent",
+        "GUNICORN_WORKER_CONNECTIONS": str(args.connections + 100),
+    })
+    sel = selectors.DefaultSelector()
+    try:
+        workers = worker_pids(proc.pid)
+        token = login(args.port)
+        before = rss_kb(workers)
+
+        t = time.perf_counter()
+        open_streams(args.port, token, args.connections, sel)
+        opened_s = time.perf_counter() - t
+        time.sleep(1)
+        after = rss_kb(workers)
+
+        latencies = []
+        missed = 0
+        for _ in range(args.inserts):
+            started = time.perf_counter()
+            current = insert(args.port, bench_user_id(0), bench_machine_id(0))
+            marker = f'"current_bottles":{current},'.encode()
+            got = deliver(sel, marker, started, timeout=10)
+            missed += args.connections - len(got)
+            latencies.extend(got)
+        latencies.sort()
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        proc.terminate()
+        proc.wait()
+
+    per_conn = (after - before) / args.connections
+    result = {
+        "connections": args.connections,
+        "workers": args.workers,
+        "open_s": round(opened_s, 2),
+        "rss_before_mb": round(before / 1024, 1),
+        "rss_after_mb": round(after / 1024, 1),
+        "rss_per_connection_kb": round(per_conn, 1),
+        "deliveries": len(latencies),
+        "missed": missed,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+    }
+    print(f"{args.connections} streams on {args.workers} gevent workers opened in "
+          f"{result['open_s']}s; worker RSS {result['rss_before_mb']} -> "
+          f"{result['rss_after_mb']} MB ({result['rss_per_connection_kb']} KB/stream)")
+    print(f"{args.inserts} drops: {len(latencies)} deliveries, {missed} missed; "
+          f"p50 {result['p50_ms']}ms p99 {result['p99_ms']}ms max {result['max_ms']}ms")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0 if not missed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
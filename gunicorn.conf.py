@@ -0,0 +1,56 @@
+# Gunicorn picks this file up automatically from the working directory.
+
+import os
+import shutil
+import tempfile
+
+# Each worker writes its Prometheus samples to its own file in this
+# directory; /metrics merges them at scrape time.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "polygreen-metrics"),
+)
+
+# Sync workers by default. /api/machines/events and /ws/kiosk hold a
+# connection open per subscriber, so serve them from a second instance
+# started with GUNICORN_WORKER_CLASS=gevent and route those paths there; keep
+# the rest of the API (bcrypt, PDF reports) on sync workers.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "2000"))
+
+
+def on_starting(server):
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+    # Deploys can run `python -m polygreen.migrate upgrade` as a release
+    # step instead; this is for platforms without one.
+    if os.getenv("MIGRATE_ON_START") == "1":
+        import psycopg2
+        from polygreen.migrate import missing_indexes, upgrade
+        conn = psycopg2.connect(os.environ["DATABASE_URL"])
+        try:
+            upgrade(conn, log=server.log.info)
+            for table, columns, _ in missing_indexes(conn):
+                server.log.warning(f"missing index on {table} ({', '.join(columns)})")
+        finally:
+            conn.close()
+
+    # Likewise `python -m polygreen.assets build` belongs in the build step;
+    # this is for platforms without one (runs before the workers start).
+    if os.getenv("ASSETS_BUILD_ON_START") == "1":
+        from polygreen.assets import build
+        build(log=server.log.info)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # psycopg2 blocks in C; let it yield to other greenlets instead
+    if worker_class == "gevent":
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
@@ -0,0 +1,65 @@
+"""PolyGreen backend: app factory and blueprints.
+
+``create_app()`` wires configuration, extensions and the admin, auth, user,
+machine and kiosk-channel blueprints. Heavy subsystems (ReportLab for the admin reports,
+the Vonage SMS client) are imported on first use, not here, so worker boot
+and test processes stay cheap.
+"""
+
+import os
+import datetime as dt
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def create_app(config=None):
+    from flask import Flask
+    from flask_cors import CORS
+    from flask_jwt_extended import JWTManager
+    from werkzeug.middleware.proxy_fix import ProxyFix
+
+    from polygreen import (
+        admin, assets, auth, compression, kiosk, machines, metrics, site, users, warmup,
+    )
+
+    # ------------------ FLASK APP ------------------
+    app = Flask(__name__, root_path=ROOT_DIR, template_folder="templates")
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+    #----------------CONFIGURATIONS-------------------
+    app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev")
+    app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "devjwt")
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = dt.timedelta(hours=24)
+    app.config["JWT_ALGORITHM"] = "HS256"
+    app.config["SESSION_COOKIE_SECURE"] = True
+    app.config["SESSION_COOKIE_SAMESITE"] = "None"
+    app.config["SESSION_COOKIE_HTTPONLY"] = True
+    app.config["ADMIN_USERNAME"] = os.getenv("ADMIN_USERNAME")
+    app.config["ADMIN_PASSWORD"] = os.getenv("ADMIN_PASSWORD")
+    if config:
+        app.config.update(config)
+
+    # Enable CORS + JWT
+    CORS(app, supports_credentials=True)
+    JWTManager(app)
+
+    # Prometheus /metrics + request/DB instrumentation
+    metrics.init_app(app)
+
+    # Fingerprinted /assets (built by `python -m polygreen.assets build`)
+    assets.init_app(app)
+
+    # gzip/brotli for HTML, JSON and other text responses
+    compression.init_app(app)
+
+    for module in (site, admin, auth, users, machines, kiosk):
+        app.register_blueprint(module.bp)
+    kiosk.sock.init_app(app)
+    if not kiosk.configured():
+        app.logger.error("KIOSK_SECRET and SECRET_KEY are unset: /ws/kiosk refuses connections")
+
+    # Pre-open DB connections, fonts, templates and caches in the background
+    if app.config.get("WARMUP", os.getenv("WARMUP", "1") != "0"):
+        warmup.start(app)
+
+    return app
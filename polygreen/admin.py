@@ -0,0 +1,847 @@
+import io
+import os
+from functools import wraps
+
+from flask import (
+    Blueprint, current_app, render_template, request, redirect,
+    url_for, flash, session, abort, send_file, jsonify
+)
+
+from polygreen import counters, events, machine_cache, outbox, partitions, rules, slowlog
+from polygreen.db import TupleCursor, get_db, serialize_row
+from polygreen.serializers import map_rows
+
+bp = Blueprint("admin", __name__)
+
+# ---------------- ADMIN AUTH DECORATOR -------------
+# -
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not session.get("admin_logged_in"):
+            return redirect(url_for("admin.admin_login"))
+        return f(*args, **kwargs)
+    return decorated_function
+
+# ---------------------- ADMIN LOGIN ------------------------------
+
+@bp.route("/admin/login", methods=["GET", "POST"])
+def admin_login():
+    if request.method == "POST":
+        username = request.form.get("username")
+        password = request.form.get("password")
+
+        # Compare with env values
+        if (username == current_app.config["ADMIN_USERNAME"]
+                and password == current_app.config["ADMIN_PASSWORD"]):
+            session["admin_logged_in"] = True
+            return redirect(url_for(".admin_dashboard"))
+        else:
+            flash("Invalid credentials", "error")
+
+    return render_template("admin/login.html")
+
+
+# ---------------------- ADMIN DASHBOARD ------------------------------
+
+@bp.route("/admin/dashboard")
+@admin_required
+def admin_dashboard():
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) AS total_users FROM users;")
+                total_users = cur.fetchone()["total_users"]
+
+                cur.execute("SELECT COUNT(*) AS total_machines FROM machines;")
+                total_machines = cur.fetchone()["total_machines"]
+
+                cur.execute("SELECT COUNT(*) AS total_transactions FROM transactions;")
+                total_transactions = cur.fetchone()["total_transactions"]
+    except Exception as e:
+        current_app.logger.error(f"Dashboard DB error: {e}")
+        total_users = total_machines = total_transactions = 0
+
+    stats = {
+        "total_users": total_users,
+        "total_machines": total_machines,
+        "total_transactions": total_transactions,
+    }
+    return render_template("admin/dashboard.html", stats=stats)
+
+
+# ------------------------- ADMIN LIST OF USERS VIEW --------------------------------
+
+@bp.route("/admin/users")
+@admin_required
+def admin_users():
+    try:
+        with get_db() as conn:
+            with conn.cursor(cursor_factory=TupleCursor) as cur:
+                cur.execute("""
+                    SELECT user_id, name, mobile, points, bottles, created_at
+                    FROM users
+                    ORDER BY created_at DESC;
+                """)
+                users = map_rows(cur)
+    except Exception as e:
+        current_app.logger.error(f"/admin/users DB error: {e}")
+        users = []
+
+    return render_template("admin/users.html", users=users)
+
+
+@bp.route("/admin/users/report", methods=["POST"])
+@admin_required
+def export_filtered_users():
+    from polygreen import reports
+
+    payload = request.get_json()
+    if not payload or "data" not in payload:
+        return jsonify({"error": "No data"}), 400
+
+    try:
+        buffer = reports.users_report(payload["data"])
+    except Exception as e:
+        current_app.logger.error(f"PDF build error (users report): {e}")
+        return jsonify({"error": "Failed to generate PDF"}), 500
+
+    return send_file(
+        buffer,
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name="filtered_users.pdf"
+    )
+
+# -------------------------- ADMIN INDIVIDUAL USER VIEW ----------------------------------
+
+@bp.route("/admin/users/<string:user_id>")
+@admin_required
+def admin_user_detail(user_id):
+    include_archived = request.args.get("archived") == "1"
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                # Fetch user
+                cur.execute("""
+                    SELECT user_id, name, mobile, points, bottles, created_at
+                    FROM users_live
+                    WHERE user_id=%s;
+                """, (user_id,))
+                user = cur.fetchone()
+
+                if not user:
+                    abort(404)
+
+            # Fetch transactions
+            with conn.cursor(cursor_factory=TupleCursor) as cur:
+                cur.execute("""
+                    SELECT id, type, points, bottles, machine_id, brand_id, created_at
+                    FROM transactions
+                    WHERE user_id=%s
+                    ORDER BY created_at DESC;
+                """, (user_id,))
+                transactions = map_rows(cur)
+
+            # Months moved out of the database, on request
+            if include_archived:
+                transactions += list(partitions.archived_rows(conn, user_id=user_id))
+
+            # Convert datetime to ISO format
+            user = serialize_row(user)
+
+    except Exception as e:
+        current_app.logger.error(f"/admin/users/{user_id} error: {e}")
+        abort(500)
+
+    return render_template(
+        "admin/user_detail.html",
+        user=user,
+        transactions=transactions,
+        include_archived=include_archived
+    )
+
+@bp.route("/admin/users/<string:user_id>/report", methods=["POST"])
+@admin_required
+def export_individual_user_report(user_id):
+    from polygreen import reports
+
+    # Fetch user
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT * FROM users_live WHERE user_id=%s;", (user_id,))
+                user = cur.fetchone()
+                if not user:
+                    abort(404)
+                user = serialize_row(user)
+    except Exception as e:
+        current_app.logger.error(f"/admin/users/{user_id}/report DB error: {e}")
+        abort(500)
+
+    # JSON payload
+    payload = request.get_json() or {}
+    data = payload.get("data", [])
+
+    try:
+        buffer = reports.user_transactions_report(user, data)
+    except Exception as e:
+        current_app.logger.error(f"PDF build error (user {user_id} report): {e}")
+        return jsonify({"error": "Failed to generate PDF"}), 500
+
+    return send_file(
+        buffer,
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=f"{user_id}_filtered_report.pdf"
+    )
+
+# ------------------------- ADMIN LIST OF MACHINES VIEW --------------------------------
+
+@bp.route("/admin/machines")
+@admin_required
+def admin_machines():
+    try:
+        with get_db() as conn:
+            with conn.cursor(cursor_factory=TupleCursor) as cur:
+                cur.execute("""
+                    SELECT id, machine_id, name, city, lat, lng,
+                           current_bottles, max_capacity, total_bottles,
+                           is_full, last_emptied, created_at
+                    FROM machines
+                    ORDER BY id;
+                """)
+                machines = map_rows(cur)
+    except Exception as e:
+        current_app.logger.error(f"/admin/machines DB error: {e}")
+        machines = []
+
+    return render_template("admin/machines.html", machines=machines)
+
+@bp.route("/admin/machines/report", methods=["POST"])
+@admin_required
+def export_filtered_machines():
+    from polygreen import reports
+
+    # Validate JSON payload
+    payload = request.get_json()
+    if not payload or "data" not in payload:
+        return jsonify({"error": "No data provided"}), 400
+
+    try:
+        buffer = reports.machines_report(payload["data"])
+    except Exception as e:
+        current_app.logger.error(f"PDF building failed (machine report): {e}")
+        return jsonify({"error": "PDF generation failed"}), 500
+
+    return send_file(
+        buffer,
+        download_name="filtered_machines_report.pdf",
+        as_attachment=True,
+        mimetype="application/pdf"
+    )
+
+# ---------------------- ADMIN INDIVIDUAL MACHINE VIEW --------------------------------
+
+@bp.route("/admin/machines/<string:machine_id>")
+@admin_required
+def admin_machine_detail(machine_id):
+    include_archived = request.args.get("archived") == "1"
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+
+                # Fetch machine
+                cur.execute("""
+                    SELECT id, machine_id, name, city, lat, lng,
+                           current_bottles, max_capacity, total_bottles,
+                           is_full, last_emptied, created_at
+                    FROM machines_live
+                    WHERE machine_id=%s;
+                """, (machine_id,))
+                machine = cur.fetchone()
+
+                if not machine:
+                    abort(404)
+
+            # Fetch machine transactions
+            with conn.cursor(cursor_factory=TupleCursor) as cur:
+                cur.execute("""
+                    SELECT id, user_id, type, points, bottles,
+                           machine_id, brand_id, created_at
+                    FROM transactions
+                    WHERE machine_id=%s
+                    ORDER BY created_at DESC;
+                """, (machine["machine_id"],))
+                transactions = map_rows(cur)
+
+            if include_archived:
+                transactions += list(
+                    partitions.archived_rows(conn, machine_id=machine["machine_id"])
+                )
+
+            machine = serialize_row(machine)
+
+    except Exception as e:
+        current_app.logger.error(f"/admin/machines/{machine_id} error: {e}")
+        abort(500)
+
+    # The page still renders without a forecast
+    from polygreen import forecast
+    try:
+        machine_forecast = forecast.for_machine(machine_id)
+    except Exception as e:
+        current_app.logger.error(f"/admin/machines/{machine_id} forecast error: {e}")
+        machine_forecast = None
+
+    # Safe fill percentage
+    try:
+        current = machine.get("current_bottles") or 0
+        max_cap = machine.get("max_capacity") or 0
+        fill_percentage = (current / max_cap * 100) if max_cap else 0
+    except:
+        fill_percentage = 0
+
+    return render_template(
+        "admin/machine_detail.html",
+        machine=machine,
+        transactions=transactions,
+        fill_percentage=fill_percentage,
+        include_archived=include_archived,
+        forecast=machine_forecast,
+        forecast_days=forecast.HORIZON // 24
+    )
+
+@bp.route("/admin/machines/<string:machine_id>/report-filtered", methods=["POST"])
+@admin_required
+def admin_machine_filtered_pdf(machine_id):
+    from polygreen import reports
+
+    # Extract JSON payload
+    payload = request.get_json() or {}
+    machine = payload.get("machine", {})
+    transactions = payload.get("transactions", [])
+
+    try:
+        buffer = reports.machine_detail_report(machine, transactions)
+    except Exception as e:
+        current_app.logger.error(f"PDF build failed for machine {machine_id}: {e}")
+        return jsonify({"error": "PDF generation failed"}), 500
+
+    return send_file(
+        buffer,
+        as_attachment=True,
+        download_name=f"{machine_id}_filtered_report.pdf",
+        mimetype="application/pdf"
+    )
+
+# -------------------------- ADMIN EMPTYING MACHINE ----------------------------------
+
+@bp.route("/admin/machine/<string:machine_id>/empty", methods=["POST"])
+@admin_required
+def admin_empty_machine(machine_id):
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+
+                # Fetch machine details
+                cur.execute("""
+                    SELECT name
+                    FROM machines
+                    WHERE machine_id = %s;
+                """, (machine_id,))
+                machine = cur.fetchone()
+
+                if not machine:
+                    abort(404)
+
+                # Empty the machine (folds in drops still held in counter slots)
+                previous_count = counters.empty_machine(cur, machine_id) or 0
+
+                outbox.emit(cur, "machine.emptied", machine_id,
+                            {"machine_id": machine_id, "bottles": previous_count})
+
+                conn.commit()
+
+                # Live dashboards (committed by the with block)
+                events.publish(cur, machine_id)
+
+        machine_cache.invalidate()
+
+    except Exception as e:
+        current_app.logger.error(f"/admin/machine/{machine_id}/empty DB error: {e}")
+        flash("Failed to empty machine. Please try again.", "danger")
+        return redirect(url_for(".admin_machine_detail", machine_id=machine_id))
+
+    flash(
+        f"Machine '{machine.get('name')}' emptied successfully! "
+        f"Bottles collected: {previous_count}",
+        "success"
+    )
+    return redirect(url_for(".admin_machine_detail", machine_id=machine_id))
+
+
+# -------------------------- ADMIN COLLECTION ROUTES ----------------------------------
+
+def _route_options():
+    """Planner arguments from the query string (config defaults otherwise)."""
+    from polygreen import collection
+    args = request.args
+    lat, lng = args.get("depot_lat", type=float), args.get("depot_lng", type=float)
+    threshold = args.get("threshold", type=float)
+    return {
+        "threshold": threshold / 100 if threshold is not None else collection.FILL_THRESHOLD,
+        "within_hours": args.get("within_hours", type=float),
+        "city": args.get("city") or None,
+        "depot": (lat, lng) if lat is not None and lng is not None else None,
+        "capacity": args.get("capacity", type=int) or collection.TRUCK_CAPACITY,
+    }
+
+
+@bp.route("/admin/routes")
+@admin_required
+def admin_routes():
+    from polygreen import collection
+    options = _route_options()
+    try:
+        plan = collection.plan_from_db(**options)
+    except Exception as e:
+        current_app.logger.error(f"/admin/routes error: {e}")
+        abort(500)
+    return render_template("admin/routes.html", plan=plan, options=options)
+
+
+@bp.route("/admin/routes/plan")
+@admin_required
+def admin_routes_plan():
+    from polygreen import collection
+    try:
+        plan = collection.plan_from_db(**_route_options())
+    except Exception as e:
+        current_app.logger.error(f"/admin/routes/plan error: {e}")
+        return jsonify({"error": "Route planning failed"}), 500
+    return jsonify(plan)
+
+
+@bp.route("/admin/routes/empty", methods=["POST"])
+@admin_required
+def admin_empty_route():
+    machine_ids = request.form.getlist("machine_id")
+    if not machine_ids:
+        flash("No machines on this route.", "warning")
+        return redirect(request.referrer or url_for(".admin_routes"))
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                # Every machine on the route in one transaction
+                collected = counters.empty_machines(cur, machine_ids)
+
+                for machine_id, bottles in collected.items():
+                    outbox.emit(cur, "machine.emptied", machine_id,
+                                {"machine_id": machine_id, "bottles": bottles})
+
+                conn.commit()
+
+                for machine_id in collected:
+                    events.publish(cur, machine_id)
+
+        machine_cache.invalidate()
+
+    except Exception as e:
+        current_app.logger.error(f"/admin/routes/empty DB error: {e}")
+        flash("Failed to empty the route. Please try again.", "danger")
+        return redirect(request.referrer or url_for(".admin_routes"))
+
+    flash(
+        f"Route emptied: {len(collected)} machines, "
+        f"bottles collected: {sum(collected.values())}",
+        "success"
+    )
+    return redirect(request.referrer or url_for(".admin_routes"))
+
+
+# -------------------------- ADMIN ADD NEW MACHINE ----------------------------------
+
+@bp.route("/admin/machines/add", methods=["GET", "POST"])
+@admin_required
+def admin_add_machine():
+    if request.method == "POST":
+        machine_id = request.form.get("machine_id", "").strip()
+        name = request.form.get("name", "").strip()
+        city = request.form.get("city", "").strip()
+        lat = request.form.get("lat", type=float)
+        lng = request.form.get("lng", type=float)
+        max_capacity = request.form.get("max_capacity", type=int)
+
+        # Basic validation (optional)
+        if not machine_id or not name or not city:
+            flash("Missing required fields.", "danger")
+            return redirect(url_for(".admin_add_machine"))
+
+        try:
+            with get_db() as conn:
+                with conn.cursor() as cur:
+
+                    # Check if machine ID already exists
+                    cur.execute("SELECT 1 FROM machines WHERE machine_id = %s;", (machine_id,))
+                    if cur.fetchone():
+                        flash(f"Machine ID '{machine_id}' already exists.", "danger")
+                        return redirect(url_for(".admin_add_machine"))
+
+                    # Insert machine
+                    cur.execute("""
+                        INSERT INTO machines (
+                            machine_id, name, city, lat, lng, max_capacity,
+                            current_bottles, total_bottles, is_full, created_at
+                        ) VALUES (%s, %s, %s, %s, %s, %s, 0, 0, FALSE, NOW());
+                    """, (machine_id, name, city, lat, lng, max_capacity))
+
+                    conn.commit()
+
+            machine_cache.invalidate()
+
+        except Exception as e:
+            current_app.logger.error(f"/admin/machines/add error: {e}")
+            flash("Error adding machine. Please try again.", "danger")
+            return redirect(url_for(".admin_add_machine"))
+
+        flash(f"Machine '{name}' added successfully!", "success")
+        return redirect(url_for(".admin_machines"))
+
+    return render_template("admin/add_machine.html")
+
+
+@bp.route("/admin/machines/import", methods=["GET", "POST"])
+@admin_required
+def admin_import_machines():
+    from polygreen import machine_import
+
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            flash("Choose a CSV file to import.", "danger")
+            return redirect(url_for(".admin_import_machines"))
+        mode = "update" if request.form.get("update") else "skip"
+        dry_run = bool(request.form.get("dry_run"))
+
+        try:
+            stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+            with get_db() as conn:
+                report = machine_import.run(conn, stream, mode, dry_run)
+        except UnicodeDecodeError:
+            flash("The file is not UTF-8 encoded CSV.", "danger")
+            return redirect(url_for(".admin_import_machines"))
+        except Exception as e:
+            current_app.logger.error(f"/admin/machines/import error: {e}")
+            flash("Import failed. Nothing was changed.", "danger")
+            return redirect(url_for(".admin_import_machines"))
+
+        if not dry_run and (report["inserted"] or report["updated"]):
+            machine_cache.invalidate()
+        return render_template("admin/import_machines.html", report=report,
+                               columns=machine_import.COLUMNS, filename=upload.filename)
+
+    return render_template("admin/import_machines.html", report=None,
+                           columns=machine_import.COLUMNS)
+
+
+@bp.route("/admin/transactions")
+@admin_required
+def admin_transactions():
+    try:
+        with get_db() as conn:
+            with conn.cursor(cursor_factory=TupleCursor) as cur:
+                cur.execute("""
+                    SELECT id, user_id, type, points, bottles,
+                           machine_id, brand_id, created_at
+                    FROM transactions
+                    ORDER BY created_at DESC;
+                """)
+                transactions = map_rows(cur)
+
+    except Exception as e:
+        current_app.logger.error(f"/admin/transactions DB error: {e}")
+        transactions = []
+        flash("Failed to load transactions.", "danger")
+
+    return render_template("admin/transactions.html", transactions=transactions)
+
+
+@bp.route("/admin/transactions/report", methods=["POST"])
+@admin_required
+def export_filtered_transactions():
+    from polygreen import reports
+
+    payload = request.get_json()
+    if not payload or "data" not in payload:
+        return jsonify({"error": "No data provided"}), 400
+
+    try:
+        buffer = reports.transactions_report(payload["data"])
+    except Exception as e:
+        current_app.logger.error(f"PDF build error: {e}")
+        return jsonify({"error": "Failed to generate PDF"}), 500
+
+    return send_file(
+        buffer,
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name="filtered_transactions.pdf"
+    )
+
+# -------------------------- ADMIN SLOW QUERIES ----------------------------------
+
+@bp.route("/admin/slow-queries")
+@admin_required
+def admin_slow_queries():
+    # Stats are per worker process (each gunicorn worker keeps its own log)
+    return render_template(
+        "admin/slow_queries.html",
+        queries=slowlog.top(),
+        threshold_ms=slowlog.THRESHOLD * 1000,
+        pid=os.getpid()
+    )
+
+
+# -------------------------- ADMIN FORECAST ----------------------------------
+
+@bp.route("/admin/forecast")
+@admin_required
+def admin_forecast():
+    """Predicted time to full for every machine, soonest first."""
+    from polygreen import forecast
+    try:
+        result = forecast.fleet()
+    except Exception as e:
+        current_app.logger.error(f"/admin/forecast error: {e}")
+        return jsonify({"error": "Forecast failed"}), 500
+
+    items = result["items"]
+    city = request.args.get("city")
+    if city:
+        items = [it for it in items if it["city"] == city]
+    within = request.args.get("within_hours", type=float)
+    if within is not None:
+        items = [it for it in items
+                 if it["hours_to_full"] is not None and it["hours_to_full"] <= within]
+    limit = request.args.get("limit", type=int)
+    if limit:
+        items = items[:limit]
+    return jsonify(dict(result, items=items))
+
+
+# -------------------------- ADMIN DROP ANOMALIES ----------------------------------
+
+@bp.route("/admin/anomalies")
+@admin_required
+def admin_anomalies():
+    status = request.args.get("status") or None
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, machine_id, user_id, bottles, reasons, details,
+                           status, created_at, resolved_at
+                    FROM insert_anomalies
+                    WHERE %(status)s IS NULL OR status = %(status)s
+                    ORDER BY created_at DESC
+                    LIMIT 500;
+                """, {"status": status})
+                anomalies = [serialize_row(r) for r in cur.fetchall()]
+
+    except Exception as e:
+        current_app.logger.error(f"/admin/anomalies DB error: {e}")
+        anomalies = []
+        flash("Failed to load anomalies.", "danger")
+
+    return render_template("admin/anomalies.html", anomalies=anomalies, status=status)
+
+
+def _resolve_anomaly(anomaly_id, status):
+    """Move a held drop to ``status``; None if someone else got there first."""
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE insert_anomalies
+                SET status = %s, resolved_at = NOW()
+                WHERE id = %s AND status = 'held'
+                RETURNING machine_id, user_id, bottles;
+            """, (status, anomaly_id))
+            row = cur.fetchone()
+        conn.commit()
+    return row
+
+
+@bp.route("/admin/anomalies/<int:anomaly_id>/release", methods=["POST"])
+@admin_required
+def admin_release_anomaly(anomaly_id):
+    from polygreen.machines import insert_bottles
+
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT machine_id, user_id, bottles
+                    FROM insert_anomalies
+                    WHERE id = %s AND status = 'held';
+                """, (anomaly_id,))
+                held = cur.fetchone()
+        if not held:
+            flash("This drop was already handled.", "warning")
+            return redirect(url_for(".admin_anomalies", status="held"))
+
+        # Credited and marked released in one transaction: a failure leaves it held
+        body, status = insert_bottles(held["machine_id"], held["user_id"], held["bottles"],
+                                      check=False, release=anomaly_id)
+        if status == 409:
+            flash("This drop was already handled.", "warning")
+            return redirect(url_for(".admin_anomalies", status="held"))
+        if status != 200:
+            flash(f"Could not credit the drop: {body.get('message')}", "danger")
+            return redirect(url_for(".admin_anomalies", status="held"))
+
+    except Exception as e:
+        current_app.logger.error(f"/admin/anomalies/{anomaly_id}/release error: {e}")
+        flash("Failed to release the drop. Please try again.", "danger")
+        return redirect(url_for(".admin_anomalies", status="held"))
+
+    flash(f"Released: {held['bottles']} bottles credited to {held['user_id']}.", "success")
+    return redirect(url_for(".admin_anomalies", status="held"))
+
+
+@bp.route("/admin/anomalies/<int:anomaly_id>/reject", methods=["POST"])
+@admin_required
+def admin_reject_anomaly(anomaly_id):
+    try:
+        rejected = _resolve_anomaly(anomaly_id, "rejected")
+    except Exception as e:
+        current_app.logger.error(f"/admin/anomalies/{anomaly_id}/reject error: {e}")
+        flash("Failed to reject the drop. Please try again.", "danger")
+        return redirect(url_for(".admin_anomalies", status="held"))
+
+    if rejected:
+        flash("Drop rejected.", "success")
+    else:
+        flash("This drop was already handled.", "warning")
+    return redirect(url_for(".admin_anomalies", status="held"))
+
+
+# -------------------------- ADMIN POINTS RULES ----------------------------------
+
+def _rule_form():
+    """Validated column values from the add-rule form, or raise ValueError."""
+    form = request.form
+
+    def text(name):
+        return form.get(name, "").strip() or None
+
+    def minute(name):
+        value = text(name)
+        if value is None:
+            return None
+        hours, _, minutes = value.partition(":")
+        return int(hours) * 60 + int(minutes or 0)
+
+    values = {
+        "name": text("name"),
+        "campaign": text("campaign"),
+        "machine_id": text("machine_id"),
+        "city": text("city"),
+        "starts_at": text("starts_at"),
+        "ends_at": text("ends_at"),
+        "weekday_mask": sum(1 << int(d) for d in form.getlist("weekday")) or 127,
+        "start_minute": minute("start_time"),
+        "end_minute": minute("end_time"),
+        "points_per_bottle": form.get("points_per_bottle", type=int),
+        "multiplier": form.get("multiplier", type=float),
+    }
+    if not values["name"]:
+        raise ValueError("Name is required.")
+    if values["machine_id"] and values["city"]:
+        raise ValueError("Choose a machine or a city, not both.")
+    if values["points_per_bottle"] is None and values["multiplier"] is None:
+        raise ValueError("Set points per bottle, a multiplier, or both.")
+    return values
+
+
+@bp.route("/admin/points-rules", methods=["GET", "POST"])
+@admin_required
+def admin_points_rules():
+    if request.method == "POST":
+        try:
+            values = _rule_form()
+        except ValueError as e:
+            flash(str(e) or "Invalid rule.", "danger")
+            return redirect(url_for(".admin_points_rules"))
+
+        try:
+            with get_db() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        INSERT INTO points_rules ({", ".join(values)})
+                        VALUES ({", ".join(["%s"] * len(values))});
+                    """, tuple(values.values()))
+                    conn.commit()
+            rules.invalidate()
+        except Exception as e:
+            current_app.logger.error(f"/admin/points-rules add error: {e}")
+            flash("Error adding rule. Please try again.", "danger")
+            return redirect(url_for(".admin_points_rules"))
+
+        flash(f"Rule '{values['name']}' added.", "success")
+        return redirect(url_for(".admin_points_rules"))
+
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, name, campaign, machine_id, city, starts_at, ends_at,
+                           weekday_mask, start_minute, end_minute,
+                           points_per_bottle, multiplier, active, created_at
+                    FROM points_rules
+                    ORDER BY active DESC, id DESC;
+                """)
+                rows = cur.fetchall()
+    except Exception as e:
+        current_app.logger.error(f"/admin/points-rules DB error: {e}")
+        rows = []
+        flash("Failed to load points rules.", "danger")
+
+    return render_template(
+        "admin/points_rules.html",
+        rules=rows,
+        default_points=rules.DEFAULT_POINTS,
+        weekdays=["월", "화", "수", "목", "금", "토", "일"]
+    )
+
+
+@bp.route("/admin/points-rules/<int:rule_id>/toggle", methods=["POST"])
+@admin_required
+def admin_toggle_points_rule(rule_id):
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE points_rules SET active = NOT active WHERE id = %s RETURNING active;",
+                    (rule_id,)
+                )
+                row = cur.fetchone()
+                conn.commit()
+        rules.invalidate()
+    except Exception as e:
+        current_app.logger.error(f"/admin/points-rules toggle error: {e}")
+        flash("Error updating rule.", "danger")
+        return redirect(url_for(".admin_points_rules"))
+
+    if not row:
+        abort(404)
+    flash(f"Rule {rule_id} {'enabled' if row['active'] else 'disabled'}.", "success")
+    return redirect(url_for(".admin_points_rules"))
+
+
+# -------------------------- ADMIN LOGOUT ----------------------------------
+
+@bp.route("/admin/logout")
+def admin_logout():
+    session.pop("admin_logged_in", None)
+    return redirect(url_for(".admin_login"))
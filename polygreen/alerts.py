@@ -0,0 +1,466 @@
+"""Machine alerts, evaluated as machine events arrive.
+
+Every worker feeds the events it hears on ``polygreen_machine_events``
+(``polygreen.events``: one per bottle insert and per emptying) through an
+``Engine`` holding a little state per machine, so nothing polls the
+``machines`` table. The rules:
+
+* ``fill_<pct>`` - the machine reached ``pct``% of its capacity
+  (``ALERT_FILL_THRESHOLDS``, default 80,95,100). Once per fill cycle; when
+  one drop crosses several levels only the highest is reported.
+* ``idle`` - no drops for ``ALERT_IDLE_HOURS``. Each machine has one
+  deadline in a heap; a timer thread sleeps until the earliest.
+* ``spike`` - the drop rate over the last ``ALERT_SPIKE_WINDOW_MINUTES`` is
+  ``ALERT_SPIKE_FACTOR`` times the machine's rate over
+  ``ALERT_BASELINE_HOURS`` (both exponentially decayed, O(1) per event)
+  and at least ``ALERT_SPIKE_MIN_BOTTLES`` bottles.
+
+On start the engine seeds itself once from ``machines_live`` and the
+recent ledger (last drop, bottles in the baseline window).
+
+All workers evaluate the same events, so alerts are claimed in
+``machine_alerts`` (unique per machine, rule and episode) and only the
+claiming worker sends them; a restart re-evaluating old state claims
+nothing new. Each sink gets ``ALERT_RATE_PER_MIN`` messages a minute per
+worker; beyond that, waiting alerts go out together as one digest.
+
+Sinks (``ALERT_SINKS``, comma separated): ``log``, ``file:<path>`` (JSON
+lines), ``memory`` (kept on the sink, for tests), ``webhook:<url>``,
+``sms:<number>``. ``register_sink`` adds more.
+"""
+
+import collections
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+import urllib.request
+
+from polygreen import db, events
+from polygreen.metrics import ALERT_SENDS, ALERTS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("ALERTS_ENABLED", "1") == "1"
+FILL_THRESHOLDS = tuple(sorted(
+    int(x) for x in os.getenv("ALERT_FILL_THRESHOLDS", "80,95,100").split(",") if x.strip()
+))
+IDLE_SECONDS = float(os.getenv("ALERT_IDLE_HOURS", "12")) * 3600
+SPIKE_FACTOR = float(os.getenv("ALERT_SPIKE_FACTOR", "4"))
+SPIKE_WINDOW = float(os.getenv("ALERT_SPIKE_WINDOW_MINUTES", "15")) * 60
+SPIKE_MIN_BOTTLES = float(os.getenv("ALERT_SPIKE_MIN_BOTTLES", "30"))
+BASELINE = float(os.getenv("ALERT_BASELINE_HOURS", "24")) * 3600
+RATE_PER_MIN = float(os.getenv("ALERT_RATE_PER_MIN", "20"))
+SINKS = os.getenv("ALERT_SINKS", "log")
+QUEUE_MAX = 10000
+DIGEST_MAX = 50
+
+Alert = collections.namedtuple("Alert", "machine_id rule episode message data at")
+
+SEED_SQL = f"""
+    SELECT {events.STATE_JSON}::TEXT AS state, a.idle_seconds, COALESCE(a.bottles, 0) AS bottles
+    FROM machines_live
+    LEFT JOIN (
+        SELECT machine_id,
+               extract(epoch FROM LOCALTIMESTAMP - MAX(created_at))::FLOAT AS idle_seconds,
+               SUM(bottles) AS bottles
+        FROM transactions
+        WHERE type = 'earn' AND created_at >= LOCALTIMESTAMP - make_interval(secs => %s)
+        GROUP BY machine_id
+    ) a USING (machine_id);
+"""
+
+CLAIM_SQL = """
+    INSERT INTO machine_alerts (machine_id, rule, episode, message, data)
+    SELECT * FROM unnest(%s::TEXT[], %s::TEXT[], %s::TEXT[], %s::TEXT[], %s::JSONB[])
+    ON CONFLICT (machine_id, rule, episode) DO NOTHING
+    RETURNING machine_id, rule, episode;
+"""
+
+
+def _hour(now):
+    return time.strftime("%Y-%m-%dT%H", time.gmtime(now))
+
+
+# ---------------- ENGINE ----------------
+
+class MachineState:
+    __slots__ = ("total", "last_emptied", "activity", "fired", "fast", "slow",
+                 "rate_at", "observed_since", "scheduled", "spiked")
+
+    def __init__(self, total, last_emptied, activity, now):
+        self.total = total
+        self.last_emptied = last_emptied
+        self.activity = activity
+        self.fired = set()
+        self.fast = 0.0  # bottles/s, decayed over SPIKE_WINDOW
+        self.slow = 0.0  # bottles/s, decayed over BASELINE
+        self.rate_at = now
+        self.observed_since = now
+        self.scheduled = False
+        self.spiked = None  # hour of the last spike alert
+
+
+class Engine:
+    """Per-machine state and the rules. ``emit(alert)`` is called for every
+    alert (under the engine lock: it must not block)."""
+
+    def __init__(self, emit, thresholds=FILL_THRESHOLDS, idle=IDLE_SECONDS,
+                 spike_factor=SPIKE_FACTOR, spike_window=SPIKE_WINDOW,
+                 spike_min=SPIKE_MIN_BOTTLES, baseline=BASELINE):
+        self.emit = emit
+        self.thresholds = thresholds
+        self.idle = idle
+        self.spike_factor = spike_factor
+        self.spike_window = spike_window
+        self.spike_min = spike_min
+        self.baseline = baseline
+        self.lock = threading.Lock()
+        self.machines = {}
+        self.deadlines = []  # (when, machine_id); at most one per machine
+        self.wake = threading.Event()
+
+    def seed(self, event, idle_seconds, bottles, now=None):
+        """Initial state of a machine not heard from yet: its current state,
+        seconds since its last drop (None: none in the baseline window) and
+        bottles dropped in the baseline window."""
+        now = time.time() if now is None else now
+        with self.lock:
+            if event["machine_id"] in self.machines:
+                return
+            idle_seconds = self.baseline if idle_seconds is None else idle_seconds
+            m = MachineState(event["total_bottles"], event.get("last_emptied"),
+                             now - idle_seconds, now)
+            m.slow = bottles / self.baseline
+            m.observed_since = now - self.baseline
+            self.machines[event["machine_id"]] = m
+            self._schedule(event["machine_id"], m)
+            self._check_fill(event, m, now)
+
+    def on_event(self, event, now=None):
+        if event is None:
+            return  # missed events: the next one per machine carries full state
+        now = time.time() if now is None else now
+        with self.lock:
+            mid = event["machine_id"]
+            m = self.machines.get(mid)
+            if m is None:
+                m = self.machines[mid] = MachineState(
+                    event["total_bottles"], event.get("last_emptied"), now, now)
+                self._schedule(mid, m)
+                self.wake.set()  # may be the earliest deadline now
+            else:
+                if event.get("last_emptied") != m.last_emptied:
+                    m.last_emptied = event.get("last_emptied")
+                    m.fired.clear()
+                added = event["total_bottles"] - m.total
+                if added > 0:
+                    m.total = event["total_bottles"]
+                    m.activity = now
+                    self._schedule(mid, m)
+                    self._rate(m, added, now)
+                    self._check_spike(mid, m, now)
+            self._check_fill(event, m, now)
+
+    def _schedule(self, mid, m):
+        if not m.scheduled and self.idle > 0:
+            m.scheduled = True
+            heapq.heappush(self.deadlines, (m.activity + self.idle, mid))
+
+    def _rate(self, m, bottles, now):
+        dt = max(0.0, now - m.rate_at)
+        m.fast = m.fast * math.exp(-dt / self.spike_window) + bottles / self.spike_window
+        m.slow = m.slow * math.exp(-dt / self.baseline) + bottles / self.baseline
+        m.rate_at = now
+
+    def _check_fill(self, event, m, now):
+        capacity = event.get("max_capacity") or 0
+        if capacity <= 0:
+            return
+        pct = 100.0 * event["current_bottles"] / capacity
+        crossed = [t for t in self.thresholds if pct >= t and t not in m.fired]
+        if not crossed:
+            return
+        m.fired.update(crossed)
+        top = crossed[-1]
+        self.emit(Alert(event["machine_id"], f"fill_{top}", m.last_emptied or "never",
+                        f"Machine {event['machine_id']} is {pct:.0f}% full "
+                        f"({event['current_bottles']}/{capacity})",
+                        {"current_bottles": event["current_bottles"],
+                         "max_capacity": capacity, "percent": round(pct, 1)}, now))
+
+    def _check_spike(self, mid, m, now):
+        if now - m.observed_since < self.baseline / 4:
+            return  # not enough history for a baseline
+        if m.fast * self.spike_window < self.spike_min:
+            return
+        if m.fast <= self.spike_factor * m.slow or m.spiked == _hour(now):
+            return
+        m.spiked = _hour(now)
+        self.emit(Alert(mid, "spike", m.spiked,
+                        f"Machine {mid} drop rate is {m.fast / max(m.slow, 1e-9):.1f}x "
+                        f"its {self.baseline / 3600:.0f}h average",
+                        {"per_hour": round(m.fast * 3600, 1),
+                         "baseline_per_hour": round(m.slow * 3600, 1)}, now))
+
+    def due(self, now=None):
+        """Fire idle alerts whose deadline passed. Returns seconds until the
+        next deadline (None if there is none)."""
+        now = time.time() if now is None else now
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                _, mid = heapq.heappop(self.deadlines)
+                m = self.machines[mid]
+                m.scheduled = False
+                if m.activity + self.idle > now:
+                    self._schedule(mid, m)  # dropped since; re-arm
+                    continue
+                hours = (now - m.activity) / 3600
+                self.emit(Alert(mid, "idle", str(m.total),
+                                f"Machine {mid} has had no drops for {hours:.0f}h",
+                                {"idle_hours": round(hours, 1), "total_bottles": m.total}, now))
+            return self.deadlines[0][0] - now if self.deadlines else None
+
+    def run_timer(self):
+        while True:
+            try:
+                wait = self.due()
+            except Exception as e:
+                logger.warning(f"idle alert check failed: {e}")
+                wait = 60
+            self.wake.wait(60 if wait is None else min(max(wait, 0.05), 60))
+            self.wake.clear()
+
+
+# ---------------- SINKS ----------------
+
+def _as_dict(alert):
+    return {"machine_id": alert.machine_id, "rule": alert.rule, "episode": alert.episode,
+            "message": alert.message, "data": alert.data,
+            "at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(alert.at))}
+
+
+def _text(alerts):
+    if len(alerts) == 1:
+        return alerts[0].message
+    lines = [a.message for a in alerts[:DIGEST_MAX]]
+    if len(alerts) > DIGEST_MAX:
+        lines.append(f"... and {len(alerts) - DIGEST_MAX} more")
+    return f"{len(alerts)} machine alerts:\n" + "\n".join(lines)
+
+
+class LogSink:
+    def send(self, alerts):
+        logger.warning(_text(alerts))
+
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, alerts):
+        with open(self.path, "a") as f:
+            for alert in alerts:
+                f.write(json.dumps(dict(_as_dict(alert), digest=len(alerts) > 1)) + "\n")
+
+
+class MemorySink:
+    def __init__(self, arg=None):
+        self.sent = []
+
+    def send(self, alerts):
+        self.sent.append(list(alerts))
+
+
+class WebhookSink:
+    def __init__(self, url):
+        self.url = url
+
+    def send(self, alerts):
+        body = json.dumps({"text": _text(alerts), "alerts": [_as_dict(a) for a in alerts]})
+        req = urllib.request.Request(self.url, data=body.encode(), method="POST",
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            resp.read()
+
+
+class SmsSink:
+    def __init__(self, to):
+        self.to = to
+
+    def send(self, alerts):
+        from polygreen.sms import get_sms
+        sms = get_sms()
+        if not sms:
+            raise RuntimeError("SMS service unavailable")
+        response = sms.send_message({"from": "PolyGreen", "to": self.to,
+                                     "text": _text(alerts)[:600]})
+        if response["messages"][0]["status"] != "0":
+            raise RuntimeError(response["messages"][0].get("error-text", "Unknown error"))
+
+
+_sink_types = {
+    "log": lambda arg: LogSink(),
+    "file": FileSink,
+    "memory": MemorySink,
+    "webhook": WebhookSink,
+    "sms": SmsSink,
+}
+
+
+def register_sink(name, factory):
+    """Make ``name[:arg]`` usable in ``ALERT_SINKS``; ``factory(arg)`` returns
+    an object with ``send(alerts)``."""
+    _sink_types[name] = factory
+
+
+def build_sinks(spec=SINKS):
+    sinks = []
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, _, arg = item.partition(":")
+        if name not in _sink_types:
+            raise ValueError(f"unknown alert sink {name!r}")
+        sinks.append((item, _sink_types[name](arg or None)))
+    return sinks
+
+
+# ---------------- DISPATCH ----------------
+
+class Outlet:
+    """One sink behind a token bucket. Alerts that find no token wait and
+    go out together once one frees up."""
+
+    def __init__(self, name, sink, per_min=RATE_PER_MIN):
+        self.name = name
+        self.sink = sink
+        self.capacity = max(1.0, per_min)
+        self.per_second = per_min / 60
+        self.tokens = self.capacity
+        self.filled_at = time.monotonic()
+        self.held = []
+
+    def _take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.filled_at) * self.per_second)
+        self.filled_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def deliver(self, alerts):
+        self.held.extend(alerts)
+        while self.held and self._take():
+            # tokens left for every waiting alert on its own? else one digest
+            if self.tokens >= len(self.held) - 1:
+                batch, self.held = self.held[:1], self.held[1:]
+            else:
+                batch, self.held = self.held, []
+            self._send(batch)
+
+    def _send(self, batch):
+        try:
+            self.sink.send(batch)
+            ALERT_SENDS.labels(self.name.split(":", 1)[0], "digest" if len(batch) > 1 else "sent").inc()
+        except Exception as e:
+            ALERT_SENDS.labels(self.name.split(":", 1)[0], "error").inc()
+            logger.warning(f"alert sink {self.name} failed: {e}")
+
+
+class Dispatcher:
+    """Claims alerts in ``machine_alerts`` and hands the ones this worker
+    won to every outlet, off the LISTEN thread."""
+
+    def __init__(self, outlets, claim=None):
+        # claim(alerts) -> keys this worker won
+        self.outlets = outlets
+        self.claim = claim or _claim
+        self.queue = collections.deque(maxlen=QUEUE_MAX)
+        self.cond = threading.Condition()
+
+    def submit(self, alert):
+        with self.cond:
+            self.queue.append(alert)
+            self.cond.notify()
+
+    def step(self, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.queue, timeout=timeout)
+            batch = list(self.queue)
+            self.queue.clear()
+        if batch:
+            won = self.claim(batch)
+            for alert in batch:
+                ALERTS_TOTAL.labels(alert.rule.split("_")[0],
+                                    "claimed" if _key(alert) in won else "duplicate").inc()
+            batch = [a for a in batch if _key(a) in won]
+        for outlet in self.outlets:
+            if batch or outlet.held:
+                outlet.deliver(batch)
+
+    def run(self):
+        while True:
+            try:
+                held = any(o.held for o in self.outlets)
+                self.step(timeout=1 if held else None)
+            except Exception as e:
+                logger.warning(f"alert dispatch failed: {e}")
+                time.sleep(1)
+
+
+def _key(alert):
+    return alert.machine_id, alert.rule, alert.episode
+
+
+def _claim(alerts):
+    """Keys of the alerts no worker has claimed before."""
+    rows = [[a.machine_id for a in alerts], [a.rule for a in alerts],
+            [a.episode for a in alerts], [a.message for a in alerts],
+            [json.dumps(a.data) for a in alerts]]
+    with db.get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CLAIM_SQL, rows)
+            won = {(r["machine_id"], r["rule"], r["episode"]) for r in cur.fetchall()}
+        conn.commit()
+    return won
+
+
+# ---------------- WORKER ----------------
+
+_lock = threading.Lock()
+_state = {"pid": None, "engine": None, "dispatcher": None}
+
+
+def start():
+    """Start alerting in this process (once per pid). Returns the number of
+    machines seeded. If seeding fails nothing is left running and a later
+    call tries again."""
+    if not ENABLED:
+        return 0
+    with _lock:
+        if _state["pid"] == os.getpid():
+            return len(_state["engine"].machines)
+        outlets = [Outlet(name, sink) for name, sink in build_sinks()]
+        dispatcher = Dispatcher(outlets)
+        engine = Engine(dispatcher.submit)
+
+        # listen first: events racing the seed query win over its (older) rows
+        events.listen(engine.on_event)
+        try:
+            with db.get_db() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(SEED_SQL, (max(IDLE_SECONDS, BASELINE),))
+                    rows = cur.fetchall()
+            for row in rows:
+                engine.seed(json.loads(row["state"]), row["idle_seconds"], row["bottles"])
+        except Exception:
+            events.unlisten(engine.on_event)
+            raise
+
+        threading.Thread(target=engine.run_timer, name="alert-timer", daemon=True).start()
+        threading.Thread(target=dispatcher.run, name="alert-dispatch", daemon=True).start()
+        _state.update(pid=os.getpid(), engine=engine, dispatcher=dispatcher)
+    return len(rows)
@@ -0,0 +1,216 @@
+"""Inline checks on bottle drops, before they are credited.
+
+Each worker keeps a little state per machine and per user (``Track``): a
+ring of ``BUCKETS`` per-bucket bottle counts covering the last
+``ANOMALY_WINDOW_SECONDS``, an exponentially weighted mean and variance of
+the bottles per drop, and for users the last machine and time. A check is
+a few dictionary look-ups and sums over those rings (a few microseconds),
+and only suspicious drops touch the database. The rules:
+
+* ``per_insert`` - more than ``ANOMALY_MAX_PER_INSERT`` bottles in one drop.
+* ``machine_rate`` - the machine would take more than
+  ``ANOMALY_MACHINE_MAX_PER_MIN`` bottles a minute over the window (faster
+  than the hardware accepts them).
+* ``user_rate`` - the user would drop more than ``ANOMALY_USER_MAX_PER_MIN``
+  a minute over the window.
+* ``machine_hop`` - the user dropped at another machine less than
+  ``ANOMALY_HOP_SECONDS`` ago.
+* ``outlier`` - the drop is ``ANOMALY_Z`` standard deviations above the
+  machine's usual drop size (after ``ANOMALY_MIN_SAMPLES`` drops).
+
+The first three hold the drop, the others flag it. With
+``ANOMALY_MODE=hold`` held drops are not credited: they are written to
+``insert_anomalies`` and the kiosk gets a 202 until an admin releases or
+rejects them. ``flag`` (the default) credits them and only records them;
+``off`` skips the checks. Flagged drops are recorded too.
+
+Every worker only sees the drops it handles, so across ``W`` workers a
+machine or user has to exceed about ``W`` times a rate limit before one
+worker notices (a kiosk channel keeps a machine on one worker). Tracks
+are evicted least recently used past ``ANOMALY_MAX_TRACKS``.
+
+``bench/anomalyreplay.py`` runs the same ``Detector`` over past
+transactions.
+"""
+
+import collections
+import json
+import math
+import os
+import threading
+import time
+from array import array
+
+from polygreen.metrics import ANOMALY_CHECK_SECONDS, ANOMALY_VERDICTS
+
+MODE = os.getenv("ANOMALY_MODE", "flag")
+WINDOW = float(os.getenv("ANOMALY_WINDOW_SECONDS", "60"))
+MAX_PER_INSERT = int(os.getenv("ANOMALY_MAX_PER_INSERT", "50"))
+MACHINE_MAX_PER_MIN = float(os.getenv("ANOMALY_MACHINE_MAX_PER_MIN", "60"))
+USER_MAX_PER_MIN = float(os.getenv("ANOMALY_USER_MAX_PER_MIN", "60"))
+HOP_SECONDS = float(os.getenv("ANOMALY_HOP_SECONDS", "120"))
+Z = float(os.getenv("ANOMALY_Z", "4"))
+MIN_SAMPLES = int(os.getenv("ANOMALY_MIN_SAMPLES", "30"))
+MAX_TRACKS = int(os.getenv("ANOMALY_MAX_TRACKS", "200000"))
+BUCKETS = 12
+STATS_SPAN = 200  # drops; the weight of the running mean and variance
+MIN_SD = 1.0  # bottles; keeps a machine that always gets 1 from flagging 3
+
+HOLD_RULES = ("per_insert", "machine_rate", "user_rate")
+
+Verdict = collections.namedtuple("Verdict", "action reasons details")
+OK = Verdict("ok", (), {})
+
+
+class Track:
+    """Sliding-window bottle count and drop-size statistics for one key."""
+
+    __slots__ = ("counts", "stamps", "n", "mean", "var", "last_machine", "last_at")
+
+    def __init__(self):
+        self.counts = array("i", bytes(4 * BUCKETS))
+        self.stamps = array("q", bytes(8 * BUCKETS))
+        self.n = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.last_machine = None
+        self.last_at = 0.0
+
+    def total(self, bucket):
+        """Bottles in the buckets ``bucket - BUCKETS + 1 .. bucket``."""
+        oldest = bucket - BUCKETS
+        return sum(c for c, s in zip(self.counts, self.stamps) if s > oldest)
+
+    def add(self, bucket, bottles):
+        i = bucket % BUCKETS
+        if self.stamps[i] != bucket:
+            self.stamps[i] = bucket
+            self.counts[i] = 0
+        self.counts[i] += bottles
+        alpha = max(2.0 / (STATS_SPAN + 1), 1.0 / (self.n + 1))
+        delta = bottles - self.mean
+        self.mean += alpha * delta
+        self.var = (1 - alpha) * (self.var + alpha * delta * delta)
+        self.n += 1
+
+
+class Detector:
+    def __init__(self, mode=MODE, window=WINDOW, max_per_insert=MAX_PER_INSERT,
+                 machine_max_per_min=MACHINE_MAX_PER_MIN, user_max_per_min=USER_MAX_PER_MIN,
+                 hop_seconds=HOP_SECONDS, z=Z, min_samples=MIN_SAMPLES, max_tracks=MAX_TRACKS):
+        self.hold = mode == "hold"
+        self.width = window / BUCKETS
+        self.max_per_insert = max_per_insert
+        self.machine_limit = machine_max_per_min * window / 60
+        self.user_limit = user_max_per_min * window / 60
+        self.hop_seconds = hop_seconds
+        self.z = z
+        self.min_samples = min_samples
+        self.max_tracks = max_tracks
+        self.machines = collections.OrderedDict()
+        self.users = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _track(self, tracks, key):
+        track = tracks.get(key)
+        if track is None:
+            track = tracks[key] = Track()
+            if len(tracks) > self.max_tracks:
+                tracks.popitem(last=False)
+        else:
+            tracks.move_to_end(key)
+        return track
+
+    def check(self, machine_id, user_id, bottles, now=None):
+        """Judge a drop and, unless it is held, count it. Returns a
+        ``Verdict`` with action ``ok``, ``flag`` or ``hold``."""
+        now = time.time() if now is None else now
+        bucket = int(now // self.width)
+        reasons, details = [], {}
+        with self.lock:
+            m = self._track(self.machines, machine_id)
+            u = self._track(self.users, user_id)
+
+            if bottles > self.max_per_insert:
+                reasons.append("per_insert")
+            machine_total = m.total(bucket) + bottles
+            if machine_total > self.machine_limit:
+                reasons.append("machine_rate")
+                details["machine_window_bottles"] = machine_total
+            user_total = u.total(bucket) + bottles
+            if user_total > self.user_limit:
+                reasons.append("user_rate")
+                details["user_window_bottles"] = user_total
+            if u.last_machine not in (None, machine_id) and now - u.last_at < self.hop_seconds:
+                reasons.append("machine_hop")
+                details["previous_machine"] = u.last_machine
+                details["seconds_since"] = round(now - u.last_at, 1)
+            if m.n >= self.min_samples:
+                z = (bottles - m.mean) / max(math.sqrt(m.var), MIN_SD)
+                if z > self.z:
+                    reasons.append("outlier")
+                    details["z"] = round(z, 1)
+                    details["usual_bottles"] = round(m.mean, 1)
+
+            if not reasons:
+                action = "ok"
+            elif self.hold and any(r in HOLD_RULES for r in reasons):
+                action = "hold"
+            else:
+                action = "flag"
+            if action != "hold":
+                m.add(bucket, bottles)
+                u.add(bucket, bottles)
+                u.last_machine, u.last_at = machine_id, now
+        if action == "ok":
+            return OK
+        return Verdict(action, tuple(reasons), details)
+
+
+# ---------------- INSERT PATH ----------------
+
+_lock = threading.Lock()
+_detector = {"pid": None, "value": None}
+
+
+def detector():
+    # per process: a forked worker starts with empty tracks
+    if _detector["pid"] != os.getpid():
+        with _lock:
+            if _detector["pid"] != os.getpid():
+                _detector["value"], _detector["pid"] = Detector(), os.getpid()
+    return _detector["value"]
+
+
+def check(machine_id, user_id, bottles):
+    if MODE == "off":
+        return OK
+    start = time.perf_counter()
+    verdict = detector().check(machine_id, user_id, bottles)
+    ANOMALY_CHECK_SECONDS.observe(time.perf_counter() - start)
+    for reason in verdict.reasons:
+        ANOMALY_VERDICTS.labels(reason, verdict.action).inc()
+    return verdict
+
+
+def record(cur, machine_id, user_id, bottles, verdict):
+    """Store a flagged or held drop in the caller's transaction. Returns
+    its id."""
+    cur.execute("""
+        INSERT INTO insert_anomalies (machine_id, user_id, bottles, reasons, details, status)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        RETURNING id;
+    """, (machine_id, user_id, bottles, list(verdict.reasons), json.dumps(verdict.details),
+          "held" if verdict.action == "hold" else "flagged"))
+    return cur.fetchone()["id"]
+
+
+def release(cur, anomaly_id):
+    """Mark a held drop released in the caller's transaction (the one that
+    credits it). False if it is no longer held."""
+    cur.execute("""
+        UPDATE insert_anomalies
+        SET status = 'released', resolved_at = NOW()
+        WHERE id = %s AND status = 'held';
+    """, (anomaly_id,))
+    return cur.rowcount == 1
@@ -0,0 +1,262 @@
+"""Built static assets: resized, fingerprinted and precompressed.
+
+``python -m polygreen.assets build`` (a deploy step, or ``ASSETS_BUILD_ON_START=1``
+in gunicorn) reads ``static/`` and writes ``static/dist/``:
+
+* images larger than ``ASSET_MAX_PX`` on their longest side are scaled
+  down (pages show them at 500-600px, so this is still sharp at 2x);
+  PNGs are reduced to an ``ASSET_PNG_COLORS`` palette (the flat
+  illustrations and icons here lose nothing visible), and images get a
+  WebP copy when that is smaller;
+* CSS, JS and SVG get ``.gz`` and ``.br`` siblings (``.br`` needs the
+  ``Brotli`` package);
+* every output is named ``<name>.<content hash>.<ext>`` and listed in
+  ``manifest.json``.
+
+Templates call ``asset_url("admin.png")`` (or ``asset_url(name, "webp")``
+inside a ``<picture>``). With a manifest that is ``/assets/<hashed name>``,
+served with a year-long ``immutable`` cache header and the precompressed
+sibling the browser accepts, so repeat page loads fetch nothing. Without
+one (a fresh checkout) it falls back to the plain ``/static`` URL.
+Old hashed files are kept until ``build --prune``, so pages rendered by
+workers still on the previous build keep working during a deploy.
+"""
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import sys
+import threading
+
+from flask import abort, request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+from polygreen import ROOT_DIR
+
+try:
+    import brotli
+except ImportError:  # optional: without it only .gz siblings are built
+    brotli = None
+
+SOURCE_DIR = os.path.join(ROOT_DIR, "static")
+DIST_DIR = os.getenv("ASSETS_DIR", os.path.join(SOURCE_DIR, "dist"))
+MAX_PX = int(os.getenv("ASSET_MAX_PX", "1200"))
+WEBP_QUALITY = int(os.getenv("ASSET_WEBP_QUALITY", "80"))
+PNG_COLORS = int(os.getenv("ASSET_PNG_COLORS", "256"))  # 0 keeps full colour
+MAX_AGE = 365 * 24 * 3600
+
+IMAGE_TYPES = (".png", ".jpg", ".jpeg")
+TEXT_TYPES = (".css", ".js", ".svg", ".json", ".txt")
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+# ---------------- BUILD ----------------
+
+def _fingerprint(name, data, ext=None):
+    stem, original_ext = os.path.splitext(name)
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    return f"{stem}.{digest}{ext or original_ext}"
+
+
+def _write(out, name, data):
+    path = os.path.join(out, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):  # same name, same content
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+
+def _image(name, data, max_px, webp_quality, png_colors):
+    from PIL import Image
+
+    im = Image.open(io.BytesIO(data))
+    im.load()
+    original_size = im.size
+    if max(im.size) > max_px:
+        im.thumbnail((max_px, max_px), Image.LANCZOS)
+    fmt = "PNG" if name.lower().endswith(".png") else "JPEG"
+    buf = io.BytesIO()
+    if fmt == "PNG" and png_colors:
+        im = im.quantize(png_colors, method=Image.Quantize.FASTOCTREE)
+        im.save(buf, "PNG", optimize=True)
+        im = im.convert("RGBA")
+    elif fmt == "PNG":
+        im.save(buf, "PNG", optimize=True)
+    else:
+        im.convert("RGB").save(buf, "JPEG", quality=85, optimize=True, progressive=True)
+    resized = buf.getvalue()
+    if len(resized) >= len(data) and im.size == original_size:
+        resized = data  # nothing gained; keep the original bytes
+    # palette pictures compress best losslessly, photos lossy: keep the smaller
+    webps = []
+    for options in ({"lossless": True}, {"quality": webp_quality}):
+        buf = io.BytesIO()
+        im.save(buf, "WEBP", method=6, **options)
+        webps.append(buf.getvalue())
+    webp = min(webps, key=len)
+    return resized, webp if len(webp) < len(resized) else None, im.size
+
+
+def _compressed(data):
+    out = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        out[".br"] = brotli.compress(data, quality=11)
+    # a sibling that isn't smaller is just extra bytes on disk
+    return {ext: body for ext, body in out.items() if len(body) < len(data)}
+
+
+def build(source=SOURCE_DIR, out=DIST_DIR, max_px=MAX_PX, webp_quality=WEBP_QUALITY,
+          png_colors=PNG_COLORS, log=print):
+    """Build every file under ``source`` into ``out`` and write the
+    manifest last. Returns the manifest."""
+    files, before, after = {}, 0, 0
+    out_abs = os.path.abspath(out)
+    for root, dirs, names in os.walk(source):
+        dirs[:] = sorted(d for d in dirs
+                         if os.path.abspath(os.path.join(root, d)) != out_abs
+                         and d != "__pycache__")
+        for filename in sorted(names):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, source).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            entry = {}
+            ext = os.path.splitext(name)[1].lower()
+            if ext in IMAGE_TYPES:
+                data, webp, (entry["width"], entry["height"]) = _image(
+                    name, data, max_px, webp_quality, png_colors)
+                if webp is not None:
+                    entry["webp"] = _fingerprint(name, webp, ".webp")
+                    _write(out, entry["webp"], webp)
+            entry["path"] = _fingerprint(name, data)
+            _write(out, entry["path"], data)
+            if ext in TEXT_TYPES:
+                siblings = _compressed(data)
+                for suffix, body in siblings.items():
+                    _write(out, entry["path"] + suffix, body)
+                entry["encodings"] = sorted(siblings)
+            files[name] = entry
+            before += os.path.getsize(path)
+            after += len(data)
+            log(f"{name:32} {os.path.getsize(path):>9,} -> {len(data):>9,}"
+                + (f"  webp {os.path.getsize(os.path.join(out, entry['webp'])):>9,}"
+                   if "webp" in entry else ""))
+
+    manifest = {"files": files}
+    os.makedirs(out, exist_ok=True)
+    with open(os.path.join(out, "manifest.json.tmp"), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(os.path.join(out, "manifest.json.tmp"), os.path.join(out, "manifest.json"))
+    log(f"{len(files)} files, {before:,} -> {after:,} bytes")
+    return manifest
+
+
+def prune(out=DIST_DIR, log=print):
+    """Delete built files the current manifest doesn't list."""
+    keep = {"manifest.json"}
+    for entry in load_manifest(out)["files"].values():
+        keep.add(entry["path"])
+        keep.update(entry["path"] + suffix for suffix in entry.get("encodings", ()))
+        if "webp" in entry:
+            keep.add(entry["webp"])
+    removed = 0
+    for root, _, names in os.walk(out):
+        for filename in names:
+            name = os.path.relpath(os.path.join(root, filename), out).replace(os.sep, "/")
+            if name not in keep:
+                os.unlink(os.path.join(root, filename))
+                removed += 1
+    log(f"removed {removed} old file(s)")
+    return removed
+
+
+# ---------------- SERVING ----------------
+
+_lock = threading.Lock()
+_state = {"manifest": None}
+
+
+def load_manifest(out=DIST_DIR):
+    try:
+        with open(os.path.join(out, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"files": {}}
+
+
+def manifest():
+    """This process's manifest, read once (a deploy restarts workers)."""
+    if _state["manifest"] is None:
+        with _lock:
+            if _state["manifest"] is None:
+                _state["manifest"] = load_manifest()["files"]
+    return _state["manifest"]
+
+
+def asset_url(name, variant=None):
+    """URL of a static file: the built, fingerprinted copy if there is one.
+    ``variant="webp"`` gives the WebP copy of an image, or None when the
+    build made none (then the plain URL is all a ``<picture>`` needs)."""
+    entry = manifest().get(name)
+    if entry is None:
+        return None if variant else url_for("static", filename=name)
+    if variant:
+        return url_for("assets", filename=entry[variant]) if variant in entry else None
+    return url_for("assets", filename=entry["path"])
+
+
+def serve(filename):
+    # any build's files, not just the current manifest's: see the docstring
+    if filename == "manifest.json" or filename.endswith((".tmp", ".gz", ".br")):
+        abort(404)
+    compressible = os.path.splitext(filename)[1].lower() in TEXT_TYPES
+    accepted = request.headers.get("Accept-Encoding", "") if compressible else ""
+    for coding, suffix in ENCODINGS:
+        path = safe_join(DIST_DIR, filename + suffix)
+        if coding in accepted and path and os.path.isfile(path):
+            mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            response = send_from_directory(DIST_DIR, filename + suffix, mimetype=mimetype,
+                                           max_age=MAX_AGE, conditional=True)
+            response.headers["Content-Encoding"] = coding
+            break
+    else:
+        response = send_from_directory(DIST_DIR, filename, max_age=MAX_AGE, conditional=True)
+    if compressible:
+        response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = f"public, max-age={MAX_AGE}, immutable"
+    return response
+
+
+def init_app(app):
+    """Install the ``/assets`` route and the ``asset_url`` template helper."""
+    app.add_url_rule("/assets/<path:filename>", "assets", serve)
+    app.jinja_env.globals["asset_url"] = asset_url
+
+
+# ---------------- CLI ----------------
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="build fingerprinted static assets")
+    ap.add_argument("command", choices=["build", "prune"])
+    ap.add_argument("--source", default=SOURCE_DIR)
+    ap.add_argument("--out", default=DIST_DIR)
+    ap.add_argument("--max-px", type=int, default=MAX_PX)
+    ap.add_argument("--webp-quality", type=int, default=WEBP_QUALITY)
+    ap.add_argument("--png-colors", type=int, default=PNG_COLORS)
+    ap.add_argument("--prune", action="store_true", help="also delete old builds (build)")
+    args = ap.parse_args(argv)
+
+    if args.command == "build":
+        build(args.source, args.out, args.max_px, args.webp_quality, args.png_colors)
+    if args.command == "prune" or args.prune:
+        prune(args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+import random
+import time
+import datetime as dt
+
+from flask import Blueprint, current_app, request, jsonify
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from passlib.hash import bcrypt
+
+from polygreen import outbox
+from polygreen.db import get_db
+from polygreen.metrics import BCRYPT_SECONDS, SMS_SECONDS, SMS_TOTAL
+from polygreen.sms import get_sms
+
+bp = Blueprint("auth", __name__)
+
+#----------------------generate user id------------------------------------
+
+def generate_user_id(name, mobile):
+    # Take first 4 letters of name (lowercase)
+    prefix = name[:4].lower()
+    # Take last 4 digits of mobile
+    suffix = mobile[-4:]
+    return f"{prefix}_{suffix}"
+
+# ------------------- AUTHENTICATION ENDPOINTS-------------------------
+# ------------------ OTP STORE ------------------
+
+@bp.route("/api/auth/check-user", methods=["POST"])
+def check_user():
+    data = request.get_json() or {}
+    mobile = str(data.get("mobile", "")).strip()
+
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT user_id FROM users WHERE mobile=%s", (mobile,))
+            exists = cur.fetchone() is not None
+
+    return jsonify(ok=True, exists=exists)
+
+@bp.route("/api/auth/send-otp", methods=["POST"])
+def send_otp_db():
+    data = request.get_json() or {}
+    mobile = str(data.get("mobile", "")).strip()
+
+    if not (mobile.isdigit() and 8 <= len(mobile) <= 15):
+        return jsonify(ok=False, message="Invalid mobile number"), 400
+
+    otp = str(random.randint(1000, 9999))
+    expires_at = dt.datetime.utcnow() + dt.timedelta(minutes=5)
+
+    # ✅ Save OTP first (always succeed)
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO user_otps (mobile, otp, expires_at, verified, updated_at)
+                VALUES (%s, %s, %s, FALSE, NOW())
+                ON CONFLICT (mobile)
+                DO UPDATE SET
+                    otp = EXCLUDED.otp,
+                    expires_at = EXCLUDED.expires_at,
+                    verified = FALSE,
+                    updated_at = NOW()
+            """, (mobile, otp, expires_at))
+        conn.commit()
+
+    # ✅ Now try sending SMS safely
+    sms = get_sms()
+    if not sms:
+        return jsonify(ok=True, message="OTP generated (SMS service unavailable)")
+
+    sms_start = time.perf_counter()
+    try:
+        response = sms.send_message({
+            "from": "PolyGreen",
+            "to": mobile,
+            "text": f"Your OTP is {otp}",
+        })
+
+        status = response["messages"][0]["status"]
+        if status != "0":
+            SMS_SECONDS.labels("rejected").observe(time.perf_counter() - sms_start)
+            SMS_TOTAL.labels("rejected").inc()
+            error_text = response["messages"][0].get("error-text", "Unknown error")
+            current_app.logger.warning(f"Vonage SMS failed: {error_text}")
+            return jsonify(ok=True, message="OTP generated, SMS delivery pending")
+
+    except Exception as e:
+        SMS_SECONDS.labels("error").observe(time.perf_counter() - sms_start)
+        SMS_TOTAL.labels("error").inc()
+        current_app.logger.error(f"Vonage connection error: {e}")
+        return jsonify(ok=True, message="OTP generated, SMS delivery retryable")
+
+    SMS_SECONDS.labels("sent").observe(time.perf_counter() - sms_start)
+    SMS_TOTAL.labels("sent").inc()
+    return jsonify(ok=True, message="OTP sent successfully")
+
+
+@bp.route("/api/auth/verify-otp", methods=["POST"])
+def verify_otp_db():
+    data = request.get_json() or {}
+    mobile = str(data.get("mobile", "")).strip()
+    otp = str(data.get("otp", "")).strip()
+
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT otp, expires_at, verified
+                FROM user_otps
+                WHERE mobile=%s
+            """, (mobile,))
+            row = cur.fetchone()
+
+            if not row:
+                return jsonify(ok=False, message="OTP not found"), 400
+
+            if row["verified"]:
+                return jsonify(ok=False, message="OTP already used"), 400
+
+            if dt.datetime.utcnow() > row["expires_at"]:
+                return jsonify(ok=False, message="OTP expired"), 400
+
+            if row["otp"] != otp:
+                return jsonify(ok=False, message="Invalid OTP"), 400
+
+            cur.execute("""
+                UPDATE user_otps SET verified=TRUE WHERE mobile=%s
+            """, (mobile,))
+        conn.commit()
+
+    return jsonify(ok=True, message="OTP verified")
+
+@bp.route("/api/auth/set-new-password", methods=["POST"])
+def set_new_password():
+    data = request.get_json() or {}
+    mobile = str(data.get("mobile", "")).strip()
+    new_password = data.get("new_password", "").strip()
+
+    if not new_password:
+        return jsonify(ok=False, message="Password required"), 400
+
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT verified FROM user_otps
+                WHERE mobile=%s
+            """, (mobile,))
+            otp_row = cur.fetchone()
+
+            if not otp_row or not otp_row["verified"]:
+                return jsonify(ok=False, message="OTP not verified"), 400
+
+            with BCRYPT_SECONDS.labels("hash").time():
+                new_hash = bcrypt.hash(new_password)
+
+            cur.execute("""
+                UPDATE users SET password_hash=%s WHERE mobile=%s
+            """, (new_hash, mobile))
+
+            cur.execute("DELETE FROM user_otps WHERE mobile=%s", (mobile,))
+        conn.commit()
+
+    return jsonify(ok=True, message="Password reset successful")
+
+@bp.route("/api/auth/reset-password", methods=["POST"])
+@jwt_required()
+def reset_password_loggedin():
+    uid = get_jwt_identity()
+    data = request.get_json() or {}
+
+    old_password = data.get("old_password", "").strip()
+    new_password = data.get("new_password", "").strip()
+
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT password_hash FROM users WHERE user_id=%s", (uid,))
+            user = cur.fetchone()
+
+            if not user:
+                return jsonify(ok=False, message="Incorrect password"), 401
+            with BCRYPT_SECONDS.labels("verify").time():
+                valid = bcrypt.verify(old_password[:72], user["password_hash"])
+            if not valid:
+                return jsonify(ok=False, message="Incorrect password"), 401
+
+            with BCRYPT_SECONDS.labels("hash").time():
+                new_hash = bcrypt.hash(new_password)
+            cur.execute("""
+                UPDATE users SET password_hash=%s WHERE user_id=%s
+            """, (new_hash, uid))
+        conn.commit()
+
+    return jsonify(ok=True, message="Password updated")
+
+
+#--------------------------REGISTER API--------------------------------
+
+@bp.route("/api/auth/register", methods=["POST"])
+def register():
+    data = request.get_json() or {}
+    name = data.get("name")
+    mobile = str(data.get("mobile"))
+    password = data.get("password")
+
+    if not (name and mobile and password):
+        return jsonify(message="Missing fields"), 400
+
+    # Generate custom user_id
+    user_id = generate_user_id(name, mobile)
+
+    with get_db() as conn:
+        with conn.cursor() as cur:
+
+            # Check duplicates
+            cur.execute("SELECT id FROM users WHERE mobile=%s OR user_id=%s",
+                        (mobile, user_id))
+            if cur.fetchone():
+                return jsonify(message="mobile or user_id already used"), 400
+
+            # Hash password
+            with BCRYPT_SECONDS.labels("hash").time():
+                password_hash = bcrypt.hash(password)
+
+            # Insert user
+            cur.execute("""
+                INSERT INTO users (user_id, name, mobile, password_hash, points, bottles, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, NOW())
+                RETURNING user_id, name, mobile, points, bottles
+            """, (user_id, name, mobile, password_hash, 0, 0))
+
+            new_user = cur.fetchone()
+
+            outbox.emit(cur, "user.registered", user_id,
+                        {"user_id": user_id, "name": name})
+
+        conn.commit()
+
+    # Create JWT
+    token = create_access_token(
+        identity=new_user["user_id"],
+        additional_claims={
+            "mobile": new_user["mobile"],
+            "name": new_user["name"]
+        }
+    )
+
+    return jsonify(
+        message="Registered",
+        access_token=token,
+        user={
+            "user_id": new_user["user_id"],
+            "name": new_user["name"],
+            "mobile": new_user["mobile"],
+            "points": new_user["points"],
+            "bottles": new_user["bottles"]
+        }
+    ), 201
+
+
+#--------------------------LOGIN API-----------------------------------
+
+@bp.route("/api/auth/login", methods=["POST"])
+def login():
+    data = request.get_json() or {}
+    mobile = str(data.get("mobile", "")).strip()
+    password = data.get("password", "").strip()
+
+    # Validate inputs
+    if not (mobile and password):
+        return jsonify(message="Missing mobile or password"), 400
+
+    # Validate mobile format
+    if not (mobile.isdigit() and 8 <= len(mobile) <= 15):
+        return jsonify(message="Invalid mobile number format"), 400
+
+    # Fetch user
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM users_live WHERE mobile=%s", (mobile,))
+            u = cur.fetchone()
+
+    # bcrypt limitation fix
+    password_truncated = password[:72]
+
+    # Verify
+    if not u:
+        return jsonify(message="Invalid credentials"), 401
+    with BCRYPT_SECONDS.labels("verify").time():
+        valid = bcrypt.verify(password_truncated, u["password_hash"])
+    if not valid:
+        return jsonify(message="Invalid credentials"), 401
+
+    # Create JWT
+    token = create_access_token(
+        identity=str(u["user_id"]),
+        additional_claims={
+            "mobile": u["mobile"],
+            "name": u["name"]
+        }
+    )
+
+    # Return response
+    return jsonify(
+        access_token=token,
+        user={
+            "user_id": u["user_id"],
+            "name": u["name"],
+            "mobile": u["mobile"],
+            "points": u["points"],
+            "bottles": u["bottles"]
+        }
+    ), 200
@@ -0,0 +1,250 @@
+"""Collection route planning for emptying runs.
+
+``plan`` takes the machines that are near full (fill level at least
+``COLLECTION_FILL_THRESHOLD``, or predicted by ``polygreen.forecast`` to be
+full within ``within_hours``), a depot and a truck capacity in bottles, and
+returns routes that each start and end at the depot and collect at most a
+truckload:
+
+* distances: one great-circle distance matrix (km, float32) over the
+  depot and every stop, computed up front in NumPy.
+* construction: nearest neighbour. From the truck's position, drive to
+  the closest stop whose bottles still fit; when none fits, go back to
+  the depot and start the next route.
+* improvement, per route until nothing improves or ``COLLECTION_TIME_LIMIT``
+  seconds are spent: 2-opt (reverse a stretch of the route) and or-opt
+  (move a run of 1-3 stops elsewhere, either way round). For each move
+  NumPy scores every candidate position at once.
+
+Distances are straight lines, not roads, so they rank routes rather than
+predict driving time. A stop holding more than a truckload gets a route of
+its own. Past ``COLLECTION_MAX_STOPS`` stops only the fullest are planned.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from polygreen import db
+
+FILL_THRESHOLD = float(os.getenv("COLLECTION_FILL_THRESHOLD", "0.8"))
+TRUCK_CAPACITY = int(os.getenv("COLLECTION_TRUCK_CAPACITY", "2000"))
+TIME_LIMIT = float(os.getenv("COLLECTION_TIME_LIMIT", "5"))
+MAX_STOPS = int(os.getenv("COLLECTION_MAX_STOPS", "5000"))
+EARTH_KM = 6371.0
+EPS = 1e-3  # km; float32 distances are noisy below a metre
+
+CANDIDATES_SQL = """
+    SELECT machine_id, name, city, lat, lng, current_bottles, max_capacity
+    FROM machines_live
+    WHERE lat IS NOT NULL AND lng IS NOT NULL
+      AND (%(city)s IS NULL OR city = %(city)s)
+    ORDER BY machine_id;
+"""
+
+
+def depot_from_env():
+    """``(lat, lng)`` from ``COLLECTION_DEPOT="lat,lng"``, or None."""
+    value = os.getenv("COLLECTION_DEPOT")
+    if not value:
+        return None
+    lat, _, lng = value.partition(",")
+    return float(lat), float(lng)
+
+
+def candidates(conn, threshold=FILL_THRESHOLD, within_hours=None, city=None):
+    """Machines with coordinates that are at least ``threshold`` full, or
+    full within ``within_hours`` according to the forecast."""
+    with conn.cursor() as cur:
+        cur.execute(CANDIDATES_SQL, {"city": city})
+        machines = cur.fetchall()
+    conn.rollback()
+
+    predicted = {}
+    if within_hours is not None:
+        from polygreen import forecast
+        predicted = {it["machine_id"]: it["hours_to_full"] for it in forecast.fleet()["items"]}
+
+    stops = []
+    for m in machines:
+        level = m["current_bottles"] or 0
+        capacity = m["max_capacity"] or 0
+        hours = predicted.get(m["machine_id"])
+        if level <= 0:
+            continue
+        if (capacity and level >= threshold * capacity) or \
+                (hours is not None and hours <= within_hours):
+            stops.append(dict(m, hours_to_full=hours))
+    return stops
+
+
+# ---------------- DISTANCES ----------------
+
+def distance_matrix(lat, lng, chunk=1024):
+    """Great-circle distances in km between all points, as float32."""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lng = np.radians(np.asarray(lng, dtype=float))
+    n = len(lat)
+    d = np.empty((n, n), dtype=np.float32)
+    cos_lat = np.cos(lat)
+    for start in range(0, n, chunk):
+        rows = slice(start, start + chunk)
+        a = (np.sin((lat[None, :] - lat[rows, None]) / 2) ** 2
+             + cos_lat[rows, None] * cos_lat[None, :]
+             * np.sin((lng[None, :] - lng[rows, None]) / 2) ** 2)
+        d[rows] = 2 * EARTH_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    return d
+
+
+def route_length(d, tour):
+    tour = np.asarray(tour)
+    return float(d[tour[:-1], tour[1:]].sum())
+
+
+# ---------------- CONSTRUCTION ----------------
+
+def nearest_neighbour(d, demand, capacity):
+    """Point 0 is the depot. Returns tours (lists of point indices starting
+    and ending with 0) that each carry at most ``capacity``."""
+    n = len(demand)
+    open_ = np.ones(n, dtype=bool)
+    open_[0] = False
+    tours = []
+    while open_.any():
+        tour, here, left = [0], 0, capacity
+        while True:
+            fits = open_ & (demand <= left) if len(tour) > 1 else open_
+            if not fits.any():
+                break
+            nxt = int(np.argmin(np.where(fits, d[here], np.inf)))
+            tour.append(nxt)
+            open_[nxt] = False
+            left -= demand[nxt]
+            here = nxt
+        tour.append(0)
+        tours.append(tour)
+    return tours
+
+
+# ---------------- IMPROVEMENT ----------------
+
+def two_opt(d, tour, deadline):
+    """Reverse stretches of ``tour`` (ends fixed) while that shortens it.
+    Returns whether anything changed."""
+    t = np.array(tour)
+    n = len(t)
+    changed, improved = False, True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in range(n - 3):
+            # edges (t[i], t[i+1]) and (t[j], t[j+1]) for j > i + 1
+            a, b = t[i], t[i + 1]
+            c, e = t[i + 2:n - 1], t[i + 3:n]
+            gain = d[a, b] + d[c, e] - d[a, c] - d[b, e]
+            k = int(np.argmax(gain))
+            if gain[k] > EPS:
+                j = i + 2 + k
+                t[i + 1:j + 1] = t[i + 1:j + 1][::-1].copy()
+                improved = changed = True
+    tour[:] = t.tolist()
+    return changed
+
+
+def or_opt(d, tour, deadline, max_run=3):
+    """Move runs of 1..``max_run`` stops to a cheaper place in ``tour``,
+    possibly reversed. Returns whether anything changed."""
+    t = np.array(tour)
+    changed, improved = False, True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for run in range(1, max_run + 1):
+            edge = d[t[:-1], t[1:]]
+            i = 1
+            while i + run < len(t):
+                first, last = t[i], t[i + run - 1]
+                prev, nxt = t[i - 1], t[i + run]
+                removed = edge[i - 1] + edge[i + run - 1] - d[prev, nxt]
+                # insert between t[p] and t[p+1], for edges not touching the run
+                forward = d[first, t[:-1]] + d[last, t[1:]] - edge
+                backward = d[last, t[:-1]] + d[first, t[1:]] - edge
+                cost = np.minimum(forward, backward)
+                cost[i - 1:i + run] = np.inf
+                p = int(np.argmin(cost))
+                if removed - cost[p] > EPS:
+                    segment = t[i:i + run] if forward[p] <= backward[p] else t[i:i + run][::-1]
+                    if p < i:
+                        t = np.concatenate([t[:p + 1], segment, t[p + 1:i], t[i + run:]])
+                    else:
+                        t = np.concatenate([t[:i], t[i + run:p + 1], segment, t[p + 1:]])
+                    edge = d[t[:-1], t[1:]]
+                    improved = changed = True
+                else:
+                    i += 1
+    tour[:] = t.tolist()
+    return changed
+
+
+def improve(d, tour, deadline):
+    while time.monotonic() < deadline:
+        if not (two_opt(d, tour, deadline) | or_opt(d, tour, deadline)):
+            break
+
+
+# ---------------- PLANNING ----------------
+
+def plan(stops, depot=None, capacity=TRUCK_CAPACITY, time_limit=TIME_LIMIT):
+    """Routes over ``stops`` (dicts with ``lat``, ``lng`` and
+    ``current_bottles``). ``depot`` defaults to ``COLLECTION_DEPOT``, then
+    to the middle of the stops."""
+    started = time.perf_counter()
+    skipped = max(len(stops) - MAX_STOPS, 0)
+    if skipped:
+        stops = sorted(stops, key=lambda s: s["current_bottles"] or 0, reverse=True)[:MAX_STOPS]
+    if depot is None:
+        depot = depot_from_env()
+    if depot is None and stops:
+        depot = (sum(s["lat"] for s in stops) / len(stops),
+                 sum(s["lng"] for s in stops) / len(stops))
+    result = {"depot": depot, "truck_capacity": capacity, "stops": len(stops),
+              "skipped": skipped, "routes": []}
+    if not stops:
+        result.update(distance_km=0.0, compute_ms=0.0)
+        return result
+
+    d = distance_matrix([depot[0]] + [s["lat"] for s in stops],
+                        [depot[1]] + [s["lng"] for s in stops])
+    demand = np.array([0] + [s["current_bottles"] or 0 for s in stops])
+    tours = nearest_neighbour(d, demand, capacity)
+    constructed = sum(route_length(d, t) for t in tours)
+
+    deadline = time.monotonic() + time_limit
+    # longest routes first: they have the most to gain
+    for tour in sorted(tours, key=len, reverse=True):
+        improve(d, tour, deadline)
+
+    total = 0.0
+    for tour in tours:
+        length = route_length(d, tour)
+        total += length
+        route_stops = [stops[p - 1] for p in tour[1:-1]]
+        result["routes"].append({
+            "stops": route_stops,
+            "load": int(sum(s["current_bottles"] or 0 for s in route_stops)),
+            "distance_km": round(length, 2),
+        })
+    result.update(
+        distance_km=round(total, 2),
+        construction_km=round(constructed, 2),
+        timed_out=time.monotonic() >= deadline,
+        compute_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+    return result
+
+
+def plan_from_db(threshold=FILL_THRESHOLD, within_hours=None, city=None, depot=None,
+                 capacity=TRUCK_CAPACITY, time_limit=TIME_LIMIT):
+    with db.get_db() as conn:
+        stops = candidates(conn, threshold, within_hours, city)
+    return plan(stops, depot, capacity, time_limit)
+
@@ -0,0 +1,283 @@
+"""Response compression as WSGI middleware.
+
+``Compressor`` wraps the app and compresses responses for clients that
+send ``Accept-Encoding``: brotli when the ``Brotli`` package is installed
+and the client prefers or accepts it, otherwise gzip. Bodies are
+compressed chunk by chunk as the app yields them, never buffered whole,
+so the streamed ``/api/machines`` array and large admin tables start
+going out at once and hold only the compressor's window in memory. A
+response without a ``Content-Length`` (a real stream) is flushed once
+``COMPRESS_FLUSH_SIZE`` bytes have come in since the last flush, or when
+a chunk arrives ``COMPRESS_FLUSH_INTERVAL`` seconds after it: parts reach
+the client promptly without a flush (and its overhead) per tiny chunk.
+
+Only ``COMPRESS_TYPES`` are touched (HTML, JSON, CSS, JS, CSV, plain text,
+SVG); PDFs, images and anything already carrying ``Content-Encoding``
+(e.g. the precompressed ``/assets`` files) pass through, as do ``HEAD``
+requests, range responses (``206`` or ``Content-Range``), WebSocket
+upgrades, event streams and ``no-transform`` responses. A compressed
+response drops ``Accept-Ranges``: ranges are only served uncompressed.
+Bodies under ``COMPRESS_MIN_SIZE`` bytes are sent as they are:
+for streams, the first chunks are held until the threshold is reached or
+the stream ends.
+
+Levels are per content type: ``COMPRESS_GZIP_LEVELS`` and
+``COMPRESS_BR_QUALITY`` are ``type=level`` lists with an optional
+``default``, e.g. ``default=6,text/csv=1``. ``COMPRESS=0`` turns the
+middleware off. ``bench/compressbench.py`` measures bytes and CPU per
+response for each setting.
+"""
+
+import os
+import time
+import zlib
+
+from polygreen.metrics import COMPRESSION_BYTES, COMPRESSION_SECONDS
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+ENABLED = os.getenv("COMPRESS", "1") != "0"
+MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+FLUSH_SIZE = int(os.getenv("COMPRESS_FLUSH_SIZE", "16384"))
+FLUSH_INTERVAL = float(os.getenv("COMPRESS_FLUSH_INTERVAL", "0.2"))
+COMPRESS_TYPES = frozenset(filter(None, (t.strip() for t in os.getenv(
+    "COMPRESS_TYPES",
+    "text/html,text/css,text/plain,text/csv,text/javascript,application/javascript,"
+    "application/json,application/xml,image/svg+xml",
+).split(","))))
+
+
+def parse_levels(spec, default):
+    """``"default=6,text/csv=1"`` -> ``{"default": 6, "text/csv": 1}``."""
+    levels = {"default": default}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        mimetype, _, level = item.partition("=")
+        levels[mimetype.strip()] = int(level)
+    return levels
+
+
+GZIP_LEVELS = parse_levels(os.getenv("COMPRESS_GZIP_LEVELS", ""), 6)
+BR_QUALITY = parse_levels(os.getenv("COMPRESS_BR_QUALITY", ""), 4)
+
+
+def negotiate(accept_encoding, brotli_ok=True):
+    """The coding to use for an ``Accept-Encoding`` value: ``br``, ``gzip``
+    or None. Honours ``q=0``; between two acceptable codings prefers the
+    higher q, then brotli."""
+    best, best_q = None, 0.0
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding == "*":
+            candidates = ("br", "gzip") if brotli_ok else ("gzip",)
+        elif coding == "br" and brotli_ok:
+            candidates = ("br",)
+        elif coding in ("gzip", "x-gzip"):
+            candidates = ("gzip",)
+        else:
+            continue
+        for candidate in candidates:
+            if q > best_q or (q == best_q and q > 0 and candidate == "br"):
+                best, best_q = candidate, q
+    return best if best_q > 0 else None
+
+
+class _Gzip:
+    def __init__(self, level):
+        self.z = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, flush):
+        out = self.z.compress(data)
+        return out + self.z.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self):
+        return self.z.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self, quality, mimetype):
+        mode = brotli.MODE_TEXT if mimetype.startswith("text/") else brotli.MODE_GENERIC
+        self.c = brotli.Compressor(quality=quality, mode=mode)
+
+    def compress(self, data, flush):
+        out = self.c.process(data)
+        return out + self.c.flush() if flush else out
+
+    def finish(self):
+        return self.c.finish()
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class Compressor:
+    def __init__(self, app, min_size=MIN_SIZE, types=COMPRESS_TYPES,
+                 gzip_levels=GZIP_LEVELS, br_quality=BR_QUALITY):
+        self.app = app
+        self.min_size = min_size
+        self.types = types
+        self.gzip_levels = gzip_levels
+        self.br_quality = br_quality
+
+    def __call__(self, environ, start_response):
+        coding = None
+        if environ.get("REQUEST_METHOD") != "HEAD" and not environ.get("HTTP_UPGRADE"):
+            coding = negotiate(environ.get("HTTP_ACCEPT_ENCODING", ""), brotli is not None)
+        if coding is None:
+            return self.app(environ, start_response)
+
+        state = {}
+
+        def capture(status, headers, exc_info=None):
+            state["status"], state["headers"], state["exc_info"] = status, headers, exc_info
+            # the body goes out through the real start_response below
+            return lambda data: state.setdefault("written", []).append(data)
+
+        body = self.app(environ, capture)
+        return self._respond(body, state, coding, start_response)
+
+    def _choose(self, status, headers):
+        """Mimetype to compress as, or None to pass the response through."""
+        if status[:3] in ("204", "206", "304") or status[0] == "1":
+            return None
+        if _header(headers, "Content-Range"):
+            return None  # its byte offsets are of the uncompressed body
+        if _header(headers, "Content-Encoding"):
+            return None
+        if "no-transform" in (_header(headers, "Cache-Control") or ""):
+            return None
+        mimetype = (_header(headers, "Content-Type") or "").split(";")[0].strip().lower()
+        if mimetype not in self.types:
+            return None
+        length = _header(headers, "Content-Length")
+        if length is not None and int(length) < self.min_size:
+            return None
+        return mimetype
+
+    def _respond(self, body, state, coding, start_response):
+        chunks = iter(body)
+        try:
+            # the app calls start_response by its first chunk at the latest
+            held, size, done = list(state.pop("written", [])), 0, False
+            if "status" not in state:
+                try:
+                    held.append(next(chunks))
+                except StopIteration:
+                    done = True
+            status, headers = state["status"], state["headers"]
+            mimetype = self._choose(status, headers)
+            streamed = _header(headers, "Content-Length") is None
+
+            if mimetype is not None and streamed:
+                # hold short streams back until they prove big enough
+                size = sum(len(c) for c in held)
+                while not done and size < self.min_size:
+                    try:
+                        chunk = next(chunks)
+                    except StopIteration:
+                        done = True
+                        break
+                    held.append(chunk)
+                    size += len(chunk)
+                if done and size < self.min_size:
+                    mimetype = None
+                    headers = headers + [("Content-Length", str(size))]
+        except BaseException:
+            _close(body)
+            raise
+
+        if mimetype is None:
+            start_response(status, headers, state.get("exc_info"))
+            return _passthrough(held, chunks, body)
+
+        if coding == "br":
+            compressor = _Brotli(self.br_quality.get(mimetype, self.br_quality["default"]),
+                                 mimetype)
+        else:
+            compressor = _Gzip(self.gzip_levels.get(mimetype, self.gzip_levels["default"]))
+        headers = [(k, v) for k, v in headers
+                   if k.lower() not in ("content-length", "accept-ranges")]
+        headers.append(("Content-Encoding", coding))
+        vary = _header(headers, "Vary")
+        if vary is None:
+            headers.append(("Vary", "Accept-Encoding"))
+        elif "accept-encoding" not in vary.lower():
+            headers = [(k, f"{v}, Accept-Encoding" if k.lower() == "vary" else v)
+                       for k, v in headers]
+        etag = _header(headers, "ETag")
+        if etag and not etag.startswith("W/"):
+            # same resource, different bytes: only weakly equal
+            headers = [(k, "W/" + v if k.lower() == "etag" else v) for k, v in headers]
+        start_response(status, headers, state.get("exc_info"))
+        return _compressed(held, chunks, body, compressor, coding, streamed)
+
+
+def _close(body):
+    if hasattr(body, "close"):
+        body.close()
+
+
+def _passthrough(held, chunks, body):
+    try:
+        yield from held
+        yield from chunks
+    finally:
+        _close(body)
+
+
+def _compressed(held, chunks, body, compressor, coding, streamed):
+    size_in = size_out = pending = 0
+    cpu = 0.0
+    flushed_at = time.perf_counter()
+    try:
+        for chunk in _chain(held, chunks):
+            if not chunk:
+                continue
+            start = time.perf_counter()
+            pending += len(chunk)
+            flush = streamed and (pending >= FLUSH_SIZE or start - flushed_at >= FLUSH_INTERVAL)
+            out = compressor.compress(chunk, flush)
+            if flush:
+                pending, flushed_at = 0, time.perf_counter()
+            cpu += time.perf_counter() - start
+            size_in += len(chunk)
+            size_out += len(out)
+            if out:
+                yield out
+        start = time.perf_counter()
+        out = compressor.finish()
+        cpu += time.perf_counter() - start
+        size_out += len(out)
+        yield out
+    finally:
+        _close(body)
+        COMPRESSION_BYTES.labels(coding, "in").inc(size_in)
+        COMPRESSION_BYTES.labels(coding, "out").inc(size_out)
+        COMPRESSION_SECONDS.labels(coding).observe(cpu)
+
+
+def _chain(held, chunks):
+    yield from held
+    yield from chunks
+
+
+def init_app(app):
+    """Compress ``app``'s responses (unless ``COMPRESS=0``)."""
+    if ENABLED:
+        app.wsgi_app = Compressor(app.wsgi_app)
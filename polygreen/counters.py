@@ -0,0 +1,308 @@
+"""Sharded machine fill and user balance counters.
+
+A busy kiosk used to serialize on its ``machines`` row: every drop ran
+``UPDATE machines SET current_bottles = current_bottles + n`` and waited for
+the previous drop's commit. Drops now go to one of ``COUNTER_SLOTS`` slot
+rows per machine (and per user) instead, so concurrent drops only queue
+when they pick the same slot.
+
+Machine capacity stays exact: each slot holds a *quota*, its share of the
+capacity that was left at the last fold, and a drop can only land in a
+slot with room for it (``FOR UPDATE SKIP LOCKED`` picks a free one). When
+no slot has room the machine row is locked, every slot folded back into
+it, and the request is decided against the exact total. User slots carry
+plain deltas (earning has no upper bound).
+
+A background thread folds slots into ``machines`` / ``users`` every
+``COUNTER_FOLD_INTERVAL`` seconds. The ``machines_live`` and ``users_live``
+views add pending slot values and are what user-facing reads use; admin
+lists read the base tables and may lag by one interval.
+
+``COUNTER_SLOTS=1`` turns the slots off: drops update the canonical rows
+directly, as before.
+"""
+
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from polygreen import db
+
+logger = logging.getLogger(__name__)
+
+SLOTS = int(os.getenv("COUNTER_SLOTS", "8"))
+FOLD_INTERVAL = float(os.getenv("COUNTER_FOLD_INTERVAL", "2"))
+FOLD_BATCH = 5000
+
+
+def sharded():
+    return SLOTS > 1
+
+
+# ---------------- MACHINES ----------------
+
+def reserve_bottles(cur, machine_id, n):
+    """Take ``n`` bottles of ``machine_id``'s capacity in the caller's
+    transaction. Returns ``(ok, available_space)``; when ``ok`` is False
+    nothing was taken and ``available_space`` is exact."""
+    if not sharded():
+        return _reserve_direct(cur, machine_id, n)
+
+    cur.execute("""
+        UPDATE machine_counter_slots SET used = used + %(n)s
+        WHERE (machine_id, slot) = (
+            SELECT machine_id, slot FROM machine_counter_slots
+            WHERE machine_id = %(machine_id)s AND used + %(n)s <= quota
+            ORDER BY (slot + %(start)s) %% %(slots)s
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING slot;
+    """, {"machine_id": machine_id, "n": n, "start": random.randrange(SLOTS), "slots": SLOTS})
+    if cur.fetchone():
+        return True, None
+    # every slot is full or busy: decide against the exact total
+    return _rebalance(cur, machine_id, take=n)[:2]
+
+
+def _reserve_direct(cur, machine_id, n):
+    # capacity promised to slots (by sharded processes) is not available here
+    cur.execute("""
+        UPDATE machines
+        SET current_bottles = current_bottles + %(n)s,
+            total_bottles = total_bottles + %(n)s,
+            is_full = current_bottles + %(n)s >= max_capacity
+        WHERE machine_id = %(machine_id)s
+          AND current_bottles + %(n)s + (
+              SELECT COALESCE(SUM(quota), 0) FROM machine_counter_slots
+              WHERE machine_id = %(machine_id)s
+          ) <= max_capacity
+        RETURNING 1;
+    """, {"machine_id": machine_id, "n": n})
+    if cur.fetchone():
+        return True, None
+    return _rebalance(cur, machine_id, take=n)[:2]
+
+
+def _rebalance(cur, machine_id, take=0, empty=False, wait=True):
+    """Fold the machine's slots into its row, optionally take ``take``
+    bottles or empty it, and split the remaining capacity across fresh
+    slots. Returns ``(ok, available_space, level)`` where ``level`` is the
+    fill level before this call."""
+    cur.execute(f"""
+        SELECT current_bottles, max_capacity FROM machines
+        WHERE machine_id = %s
+        FOR UPDATE{'' if wait else ' SKIP LOCKED'};
+    """, (machine_id,))
+    machine = cur.fetchone()
+    if not machine:
+        return False, 0, None
+    cur.execute("""
+        SELECT COALESCE(SUM(used), 0) AS used FROM (
+            SELECT used FROM machine_counter_slots
+            WHERE machine_id = %s
+            FOR UPDATE
+        ) s;
+    """, (machine_id,))
+    used = cur.fetchone()["used"]
+
+    max_cap = machine["max_capacity"] or 0
+    level = (machine["current_bottles"] or 0) + used
+    current = 0 if empty else level
+    ok = take <= max_cap - current
+    if ok:
+        current += take
+    added = used + (take if ok else 0)
+
+    cur.execute(f"""
+        UPDATE machines
+        SET current_bottles = %s,
+            total_bottles = total_bottles + %s,
+            is_full = %s{', last_emptied = NOW()' if empty else ''}
+        WHERE machine_id = %s;
+    """, (current, added, current >= max_cap, machine_id))
+
+    available = max(max_cap - current, 0)
+    if sharded():
+        quotas = [available // SLOTS + (1 if i < available % SLOTS else 0) for i in range(SLOTS)]
+        cur.execute("""
+            INSERT INTO machine_counter_slots (machine_id, slot, quota, used)
+            SELECT %s, q.slot - 1, q.quota, 0
+            FROM unnest(%s::INTEGER[]) WITH ORDINALITY AS q(quota, slot)
+            ON CONFLICT (machine_id, slot) DO UPDATE SET quota = EXCLUDED.quota, used = 0;
+        """, (machine_id, quotas))
+    else:
+        cur.execute("DELETE FROM machine_counter_slots WHERE machine_id = %s;", (machine_id,))
+    return ok, available, level
+
+
+def empty_machine(cur, machine_id):
+    """Reset the fill level to 0 (pending drops still count towards
+    ``total_bottles``). Returns the level it had, or None if there is no
+    such machine."""
+    return _rebalance(cur, machine_id, empty=True)[2]
+
+
+def empty_machines(cur, machine_ids):
+    """``empty_machine`` for many machines at once, in set-based statements
+    (rows are locked in ``machine_id`` order). Returns ``{machine_id: level
+    it had}`` for the machines that exist."""
+    if not machine_ids:
+        return {}
+    cur.execute("""
+        SELECT machine_id, current_bottles FROM machines
+        WHERE machine_id = ANY(%s)
+        ORDER BY machine_id
+        FOR UPDATE;
+    """, (sorted(set(machine_ids)),))
+    levels = {r["machine_id"]: r["current_bottles"] or 0 for r in cur.fetchall()}
+    ids = list(levels)
+    if not ids:
+        return {}
+    cur.execute("""
+        SELECT machine_id, SUM(used) AS used FROM (
+            SELECT machine_id, used FROM machine_counter_slots
+            WHERE machine_id = ANY(%s)
+            ORDER BY machine_id, slot
+            FOR UPDATE
+        ) s
+        GROUP BY machine_id;
+    """, (ids,))
+    used = {r["machine_id"]: int(r["used"]) for r in cur.fetchall()}
+
+    cur.execute("""
+        UPDATE machines m
+        SET current_bottles = 0,
+            total_bottles = m.total_bottles + u.used,
+            is_full = m.max_capacity <= 0,
+            last_emptied = NOW()
+        FROM unnest(%s::TEXT[], %s::INTEGER[]) AS u(machine_id, used)
+        WHERE m.machine_id = u.machine_id;
+    """, (ids, [used.get(i, 0) for i in ids]))
+
+    if sharded():
+        cur.execute("""
+            INSERT INTO machine_counter_slots (machine_id, slot, quota, used)
+            SELECT m.machine_id, s.slot,
+                   GREATEST(m.max_capacity, 0) / %(slots)s
+                   + (s.slot < GREATEST(m.max_capacity, 0) %% %(slots)s)::INT,
+                   0
+            FROM machines m CROSS JOIN generate_series(0, %(slots)s - 1) AS s(slot)
+            WHERE m.machine_id = ANY(%(ids)s)
+            ON CONFLICT (machine_id, slot) DO UPDATE SET quota = EXCLUDED.quota, used = 0;
+        """, {"ids": ids, "slots": SLOTS})
+    else:
+        cur.execute("DELETE FROM machine_counter_slots WHERE machine_id = ANY(%s);", (ids,))
+    return {i: levels[i] + used.get(i, 0) for i in ids}
+
+
+# ---------------- USERS ----------------
+
+def add_points(cur, user_id, points, bottles):
+    if not sharded():
+        cur.execute("""
+            UPDATE users
+            SET points = points + %s,
+                bottles = bottles + %s
+            WHERE user_id=%s
+        """, (points, bottles, user_id))
+        return
+    cur.execute("""
+        INSERT INTO user_counter_slots (user_id, slot, points, bottles)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (user_id, slot) DO UPDATE
+        SET points = user_counter_slots.points + EXCLUDED.points,
+            bottles = user_counter_slots.bottles + EXCLUDED.bottles;
+    """, (user_id, random.randrange(SLOTS), points, bottles))
+
+
+# ---------------- FOLDING ----------------
+
+def fold(conn):
+    """Move pending slot values into ``machines`` and ``users``. Machines
+    that are being rebalanced and user slots that are being written are
+    skipped until the next round. Returns how many machines and user slots
+    were folded."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT machine_id FROM machine_counter_slots WHERE used > 0;")
+        machine_ids = [r["machine_id"] for r in cur.fetchall()]
+    conn.commit()
+
+    machines = 0
+    for machine_id in machine_ids:
+        with conn.cursor() as cur:
+            ok, _, _ = _rebalance(cur, machine_id, wait=False)
+        conn.commit()
+        machines += ok
+
+    users = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("""
+                WITH moved AS (
+                    DELETE FROM user_counter_slots
+                    WHERE (user_id, slot) IN (
+                        SELECT user_id, slot FROM user_counter_slots
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING user_id, points, bottles
+                ), per_user AS (
+                    SELECT user_id, SUM(points) AS points, SUM(bottles) AS bottles
+                    FROM moved GROUP BY user_id
+                ), folded AS (
+                    UPDATE users u
+                    SET points = u.points + p.points,
+                        bottles = u.bottles + p.bottles
+                    FROM per_user p
+                    WHERE u.user_id = p.user_id
+                )
+                SELECT COUNT(*) AS slots FROM moved;
+            """, (FOLD_BATCH,))
+            moved = cur.fetchone()["slots"]
+        conn.commit()
+        users += moved
+        if moved < FOLD_BATCH:
+            break
+    return {"machines": machines, "user_slots": users}
+
+
+_fold_state = {"pid": None}
+
+
+def _fold_loop():
+    while True:
+        time.sleep(FOLD_INTERVAL * random.uniform(0.8, 1.2))
+        try:
+            with db.get_db() as conn:
+                fold(conn)
+        except Exception as e:
+            logger.warning(f"counter fold failed: {e}")
+
+
+def start_folding():
+    """Run ``fold`` in the background of this process (once per pid)."""
+    if not sharded() or FOLD_INTERVAL <= 0 or _fold_state["pid"] == os.getpid():
+        return
+    _fold_state["pid"] = os.getpid()
+    threading.Thread(target=_fold_loop, name="counter-fold", daemon=True).start()
+
+
+def main():
+    """One fold, e.g. from cron when workers run with WARMUP=0."""
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    conn = psycopg2.connect(os.environ["DATABASE_URL"], cursor_factory=RealDictCursor)
+    try:
+        print(fold(conn))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Database access: timed connections and a per-worker connection pool.
+
+``connect()`` is a drop-in for ``psycopg2.connect`` that returns a
+connection whose cursors (whatever ``cursor_factory`` is in use) report
+each statement to the registered listeners. Metrics and the slow query log
+hook in here instead of every handler timing its own SQL.
+
+``get_db()`` hands out connections from a pool owned by the current process
+(so it is safe under gunicorn's pre-fork model). Leaving the ``with get_db()
+as conn:`` block commits or rolls back as before and then returns the
+connection to the pool, so don't keep using ``conn`` after it or nest a
+second ``with conn:``. Code that does not use ``with`` calls ``release()``.
+When all ``DB_POOL_MAX`` connections are out, ``get_db()`` waits up to
+``DB_POOL_TIMEOUT`` seconds for one to come back before raising
+``PoolError``.
+"""
+
+import datetime as dt
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extensions import cursor as TupleCursor  # noqa: F401 (used by handlers)
+from psycopg2.extras import RealDictCursor
+
+_statement_listeners = []
+_connect_listeners = []
+_acquire_listeners = []
+
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "300"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+
+def add_statement_listener(fn):
+    """Call ``fn(sql, params, seconds, cursor)`` after every statement."""
+    _statement_listeners.append(fn)
+    return fn
+
+
+def add_connect_listener(fn):
+    """Call ``fn(seconds)`` after every new connection is opened."""
+    _connect_listeners.append(fn)
+    return fn
+
+
+def add_acquire_listener(fn):
+    """Call ``fn(seconds)`` every time ``get_db()`` hands out a connection
+    (``seconds`` includes any wait for a free one)."""
+    _acquire_listeners.append(fn)
+    return fn
+
+
+def _notify(sql, params, seconds, cursor):
+    for fn in _statement_listeners:
+        try:
+            fn(sql, params, seconds, cursor)
+        except Exception:
+            # instrumentation must never break a request
+            pass
+
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _notify(query, vars, time.perf_counter() - start, self)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _notify(query, None, time.perf_counter() - start, self)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            _notify(sql, None, time.perf_counter() - start, self)
+
+
+_timed_classes = {}
+
+
+def timed_cursor_class(base):
+    cls = _timed_classes.get(base)
+    if cls is None:
+        cls = _timed_classes[base] = type("Timed" + base.__name__, (_TimedCursorMixin, base), {})
+    return cls
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = timed_cursor_class(factory)
+        return super().cursor(*args, **kwargs)
+
+
+def connect(dsn, **kwargs):
+    start = time.perf_counter()
+    kwargs.setdefault("connection_factory", TimedConnection)
+    conn = psycopg2.connect(dsn, **kwargs)
+    elapsed = time.perf_counter() - start
+    for fn in _connect_listeners:
+        try:
+            fn(elapsed)
+        except Exception:
+            pass
+    return conn
+
+
+# ----------------- CONNECTION POOL ------------------
+
+class PooledConnection(TimedConnection):
+    """Timed connection that goes back to the pool when its ``with`` block
+    ends (after the usual commit/rollback)."""
+
+    _owner_pool = None
+    _opened_at = 0.0
+    _holds_slot = False
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return super().__exit__(exc_type, exc, tb)
+        finally:
+            release(self)
+
+
+class _Pool(psycopg2.pool.ThreadedConnectionPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # getconn() raises at once when all maxconn are out; get_db() waits
+        # for one of these slots first instead (a greenlet wait under gevent)
+        self.slots = threading.BoundedSemaphore(self.maxconn)
+
+    def _connect(self, key=None):
+        conn = connect(*self._args, **self._kwargs)
+        conn._owner_pool = self
+        conn._opened_at = time.monotonic()
+        if key is not None:
+            self._used[key] = conn
+            self._rused[id(conn)] = key
+        else:
+            self._pool.append(conn)
+        return conn
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _database_url():
+    uri = os.getenv("DATABASE_URL")
+    if not uri:
+        raise ValueError("DATABASE_URL is not set")
+    return uri
+
+
+def get_pool():
+    """The pool for this process, created on first use (and again after a
+    fork, since sockets must not be shared between workers)."""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = _Pool(0, POOL_MAX, _database_url(),
+                              connection_factory=PooledConnection,
+                              cursor_factory=RealDictCursor)
+                # psycopg2 only keeps ``minconn`` idle connections around;
+                # open lazily but keep up to POOL_MAX once they exist
+                _pool.minconn = POOL_MAX
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def prefill(n):
+    """Open up to ``n`` connections ahead of traffic."""
+    conns = [get_db() for _ in range(min(n, POOL_MAX))]
+    for conn in conns:
+        release(conn)
+    return len(conns)
+
+
+def release(conn):
+    pool = getattr(conn, "_owner_pool", None)
+    holds_slot, conn._holds_slot = getattr(conn, "_holds_slot", False), False
+    try:
+        if pool is None or pool is not _pool or pool.closed:
+            conn.close()
+            return
+        stale = time.monotonic() - conn._opened_at > POOL_RECYCLE
+        try:
+            pool.putconn(conn, close=stale or bool(conn.closed))
+        except psycopg2.pool.PoolError:
+            # already returned (e.g. release() after the with block)
+            pass
+    finally:
+        # only after putconn, so the next waiter finds the connection free
+        if holds_slot:
+            pool.slots.release()
+
+
+# ----------------- DB CONNECTION------------------
+
+def get_db():
+    if POOL_MAX <= 0:
+        # pooling disabled: one fresh connection per call, as before
+        return connect(_database_url(), cursor_factory=RealDictCursor)
+
+    start = time.perf_counter()
+    pool = get_pool()
+    if not pool.slots.acquire(timeout=POOL_TIMEOUT):
+        raise psycopg2.pool.PoolError(
+            f"no pooled connection free after {POOL_TIMEOUT}s (DB_POOL_MAX={POOL_MAX})")
+    try:
+        conn = pool.getconn()
+    except BaseException:
+        pool.slots.release()
+        raise
+    conn._holds_slot = True
+    elapsed = time.perf_counter() - start
+    for fn in _acquire_listeners:
+        try:
+            fn(elapsed)
+        except Exception:
+            pass
+    return conn
+
+
+def serialize_row(row):
+    if not row:
+        return row
+    for k, v in list(row.items()):
+        if isinstance(v, (dt.datetime, dt.date)):
+            row[k] = v.isoformat()
+    return row
@@ -0,0 +1,262 @@
+"""Live machine status over Server-Sent Events.
+
+After ``machine_insert`` and ``admin_empty_machine`` commit, they read the
+machine's state back (fill level, capacity, ``is_full``, ``last_emptied``)
+and ``pg_notify`` it in the same statement (``publish``), so every worker
+hears about every change. Each worker keeps the last
+``EVENTS_BUFFER`` events in a ring buffer and feeds ``GET
+/api/machines/events`` subscribers from it.
+
+Events carry absolute state, so only the newest one per machine matters.
+``(last_emptied, total_bottles)`` never goes backwards; a worker drops an
+event older than the one it already has for that machine (NOTIFYs from
+concurrent requests can arrive out of order).
+
+Event ids are the database clock in microseconds. A client reconnecting
+with ``Last-Event-ID`` (EventSource sends it; or ``?last_event_id=``) gets
+the buffered events after that id, less ``EVENTS_REORDER_MARGIN`` seconds
+for late commits. If the buffer doesn't reach back that far, or the
+worker's LISTEN connection dropped meanwhile, it gets the current state of
+every machine instead.
+
+An idle subscriber costs a blocked generator waiting on one shared
+condition. With sync gunicorn workers every open stream would pin a whole
+worker, so the stream is only served by cooperative (gevent) workers, or
+when ``EVENTS_ALLOW_THREADS=1`` says the worker has threads to spare. Run
+a separate ``GUNICORN_WORKER_CLASS=gevent`` instance for this route: on a
+gevent worker, bcrypt and PDF builds would stall every other request.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+from polygreen import db, notify
+from polygreen.metrics import EVENTS_SUBSCRIBERS
+
+CHANNEL = "polygreen_machine_events"
+BUFFER = int(os.getenv("EVENTS_BUFFER", "10000"))
+HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+REORDER_MARGIN = float(os.getenv("EVENTS_REORDER_MARGIN", "5"))
+ALLOW_THREADS = os.getenv("EVENTS_ALLOW_THREADS", "0") == "1"
+SNAPSHOT_TTL = 1.0
+RETRY_MS = 3000
+
+# Built in SQL for events and reads alike, so timestamps compare as strings
+STATE_JSON = """
+    json_build_object(
+        'id', (extract(epoch FROM clock_timestamp()) * 1000000)::BIGINT,
+        'machine_id', machine_id,
+        'current_bottles', current_bottles,
+        'max_capacity', max_capacity,
+        'is_full', is_full,
+        'total_bottles', total_bottles,
+        'last_emptied', last_emptied
+    )
+"""
+
+PUBLISH_SQL = f"""
+    SELECT machine_id, current_bottles, max_capacity, is_full, total_bottles, last_emptied,
+           pg_notify(%(channel)s, {STATE_JSON}::TEXT) AS published
+    FROM machines_live
+    WHERE machine_id = %(machine_id)s;
+"""
+
+SNAPSHOT_SQL = f"""
+    SELECT {STATE_JSON}::TEXT AS state
+    FROM machines_live
+    ORDER BY machine_id;
+"""
+
+CURRENT_SQL = f"""
+    SELECT {STATE_JSON}::TEXT AS state
+    FROM machines_live
+    WHERE machine_id = %s;
+"""
+
+
+def publish(cur, machine_id):
+    """Read ``machine_id``'s live state and announce it to every worker (the
+    NOTIFY goes out when ``cur``'s transaction commits). Call it after the
+    change itself has committed: drops reserved in other counter slots are
+    only visible then. Returns the state row, or None."""
+    cur.execute(PUBLISH_SQL, {"channel": CHANNEL, "machine_id": machine_id})
+    return cur.fetchone()
+
+
+def current(machine_id):
+    """``machine_id``'s state now, shaped like an event (or None)."""
+    with db.get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CURRENT_SQL, (machine_id,))
+            row = cur.fetchone()
+    return json.loads(row["state"]) if row else None
+
+
+def streaming_supported():
+    if ALLOW_THREADS:
+        return True
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+# ---------------- HUB ----------------
+
+def version(event):
+    """Order of two states of the same machine."""
+    return (event.get("last_emptied") or "", event.get("total_bottles") or 0)
+
+
+def _format(event_id, data):
+    return f"id: {event_id}\nevent: machine\ndata: {data}\n\n"
+
+
+class Hub:
+    """This worker's recent events and the condition subscribers wait on."""
+
+    def __init__(self, size=BUFFER):
+        self.cond = threading.Condition()
+        self.events = collections.deque(maxlen=size)  # (seq, id, machine_id, data)
+        self.seq = 0
+        self.epoch = 0  # bumped when notifications may have been missed
+        self.versions = {}
+        self.listeners = []  # called with each new event (None: resync)
+        self.snapshot_rows = None
+        self.snapshot_at = 0.0
+
+    def on_notify(self, payload):
+        if payload is None:
+            with self.cond:
+                self.epoch += 1
+                self.versions.clear()
+                self.cond.notify_all()
+            for fn in self.listeners:
+                fn(None)
+            return
+        self.add(json.loads(payload))
+
+    def add(self, event):
+        v = version(event)
+        with self.cond:
+            if v <= self.versions.get(event["machine_id"], ("", -1)):
+                return False
+            self.versions[event["machine_id"]] = v
+            self.seq += 1
+            self.events.append((self.seq, event["id"], event["machine_id"],
+                                json.dumps(event, separators=(",", ":"))))
+            self.cond.notify_all()
+        for fn in self.listeners:
+            fn(event)
+        return True
+
+    def after_id(self, last_id):
+        """Buffered events that may be newer than ``last_id``, or None if
+        the buffer doesn't go back far enough (call with ``cond`` held)."""
+        since = last_id - int(REORDER_MARGIN * 1000000)
+        if not self.events or self.events[0][1] > since:
+            return None
+        return [e for e in self.events if e[1] > since]
+
+    def after_seq(self, seq):
+        """Events after position ``seq``, or None if some were already
+        pushed out of the buffer (call with ``cond`` held)."""
+        count = self.seq - seq
+        if count > len(self.events):
+            return None
+        return [self.events[i] for i in range(len(self.events) - count, len(self.events))]
+
+    def snapshot(self):
+        """Current state of every machine, shared by reconnecting clients
+        for ``SNAPSHOT_TTL`` seconds."""
+        if self.snapshot_rows is None or time.monotonic() - self.snapshot_at > SNAPSHOT_TTL:
+            with db.get_db() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(SNAPSHOT_SQL)
+                    rows = cur.fetchall()
+            self.snapshot_rows = []
+            for r in rows:
+                event = json.loads(r["state"])
+                self.snapshot_rows.append((event["id"], event["machine_id"],
+                                           json.dumps(event, separators=(",", ":"))))
+            self.snapshot_at = time.monotonic()
+        return self.snapshot_rows
+
+
+_lock = threading.Lock()
+_state = {"pid": None, "hub": None}
+
+
+def hub():
+    if _state["pid"] != os.getpid():
+        with _lock:
+            if _state["pid"] != os.getpid():
+                _state["hub"] = Hub()
+                _state["pid"] = os.getpid()
+                notify.subscribe(CHANNEL, _state["hub"].on_notify)
+    return _state["hub"]
+
+
+def listen(fn):
+    """Call ``fn(event)`` for every new machine state this worker hears
+    about, and ``fn(None)`` when some may have been missed. Runs on the
+    LISTEN thread, so keep it short."""
+    hub().listeners.append(fn)
+    return fn
+
+
+def unlisten(fn):
+    """Stop calling ``fn`` (a no-op if it isn't listening)."""
+    try:
+        hub().listeners.remove(fn)
+    except ValueError:
+        pass
+
+
+def stream(machine_id=None, last_id=None):
+    """SSE body: optionally a replay from ``last_id``, then live events for
+    one machine (or all), with a comment line every ``HEARTBEAT`` seconds
+    to keep proxies from closing the connection."""
+    h = hub()
+    notify.wait_listening(CHANNEL, timeout=5)
+    EVENTS_SUBSCRIBERS.inc()
+    try:
+        with h.cond:
+            seq, epoch = h.seq, h.epoch
+            replay = h.after_id(last_id) if last_id is not None else []
+        yield f"retry: {RETRY_MS}\n\n"
+        if replay is None:
+            yield from _snapshot(h, machine_id)
+        else:
+            for _, event_id, mid, data in replay:
+                if machine_id is None or mid == machine_id:
+                    yield _format(event_id, data)
+
+        while True:
+            with h.cond:
+                h.cond.wait_for(lambda: h.seq != seq or h.epoch != epoch, timeout=HEARTBEAT)
+                missed = h.epoch != epoch
+                new = None if missed else h.after_seq(seq)
+                seq, epoch = h.seq, h.epoch
+            if new is None:
+                yield from _snapshot(h, machine_id)
+                continue
+            sent = False
+            for _, event_id, mid, data in new:
+                if machine_id is None or mid == machine_id:
+                    yield _format(event_id, data)
+                    sent = True
+            if not sent:
+                yield ": keepalive\n\n"
+    finally:
+        EVENTS_SUBSCRIBERS.dec()
+
+
+def _snapshot(h, machine_id):
+    for event_id, mid, data in h.snapshot():
+        if machine_id is None or mid == machine_id:
+            yield _format(event_id, data)
@@ -0,0 +1,193 @@
+"""Fill-rate forecasts for the whole fleet, in one NumPy pass.
+
+History is the last ``FORECAST_DAYS`` of earn rows in ``transactions``,
+summed per machine and clock hour in SQL and copied out as integer triples
+into a ``machines x hours`` matrix. Every machine gets the same model,
+fitted for all machines at once with matrix products:
+
+* level and trend: weighted least squares over the hourly counts, with
+  weights halving every ``FORECAST_HALF_LIFE_HOURS`` (the last few days
+  count most). The trend is only extrapolated ``TREND_HOURS`` ahead.
+* hour-of-day profile: each machine's weighted share of drops per hour of
+  the day, shrunk towards flat for machines with little history.
+
+The forecast rate for the coming hours is ``(level + trend) x profile``;
+its running sum against the space left gives the time to full (``None``
+if not within ``FORECAST_HORIZON_HOURS``). Machines younger than the
+history window look quieter than they are.
+
+The fleet forecast is cached per worker for ``FORECAST_TTL`` seconds.
+"""
+
+import io
+import os
+import threading
+import time
+
+import numpy as np
+
+from polygreen import db
+
+DAYS = int(os.getenv("FORECAST_DAYS", "14"))
+HALF_LIFE = float(os.getenv("FORECAST_HALF_LIFE_HOURS", "72"))
+HORIZON = int(os.getenv("FORECAST_HORIZON_HOURS", "336"))
+TTL = float(os.getenv("FORECAST_TTL", "300"))
+TREND_HOURS = 72
+PROFILE_PRIOR = 50.0  # weighted bottles before a machine's own profile counts fully
+
+MACHINES_SQL = """
+    SELECT id, machine_id, name, city, current_bottles, max_capacity,
+           date_trunc('hour', LOCALTIMESTAMP) AS ref
+    FROM machines_live
+    ORDER BY id;
+"""
+
+# h = 0 is the last complete hour
+HISTORY_SQL = """
+    COPY (
+        SELECT m.id,
+               floor(extract(epoch FROM %(ref)s - t.created_at) / 3600)::INT AS h,
+               SUM(t.bottles)
+        FROM transactions t
+        JOIN machines m ON m.machine_id = t.machine_id
+        WHERE t.type = 'earn'
+          AND t.created_at >= %(ref)s - make_interval(hours => %(hours)s)
+          AND t.created_at < %(ref)s
+        GROUP BY 1, 2
+    ) TO STDOUT
+"""
+
+
+def load(conn, days=DAYS):
+    """``(machines, counts, ref)``: machine rows, a ``len(machines) x
+    days*24`` float matrix of bottles per hour (column 0 = the last
+    complete hour) and the start of the current hour."""
+    hours = days * 24
+    with conn.cursor() as cur:
+        cur.execute(MACHINES_SQL)
+        machines = cur.fetchall()
+        if not machines:
+            return machines, np.zeros((0, hours)), None
+        ref = machines[0]["ref"]
+        buf = io.StringIO()
+        cur.copy_expert(cur.mogrify(HISTORY_SQL, {"ref": ref, "hours": hours}).decode(), buf)
+    conn.rollback()
+
+    counts = np.zeros((len(machines), hours))
+    data = buf.getvalue()
+    if data:
+        triples = np.array(data.split(), dtype=np.int64).reshape(-1, 3)
+        ids = np.array([m["id"] for m in machines], dtype=np.int64)
+        rows = np.minimum(np.searchsorted(ids, triples[:, 0]), len(ids) - 1)
+        known = ids[rows] == triples[:, 0]  # not machines added since the first query
+        # a row exactly at the window's start lands in column ``hours``
+        h = np.minimum(triples[:, 1], hours - 1)
+        np.add.at(counts, (rows[known], h[known]), triples[known, 2])
+    return machines, counts, ref
+
+
+def fit(counts, last_hour_of_day, half_life=HALF_LIFE):
+    """Per machine ``(level, trend, profile)``: bottles/hour now, change per
+    hour, and a ``24``-column multiplier by hour of day (mean 1)."""
+    n, hours = counts.shape
+    age = np.arange(hours, dtype=float)
+    w = 0.5 ** (age / half_life)
+    x = -age  # time relative to the last complete hour
+
+    sw, sx, sxx = w.sum(), (w * x).sum(), (w * x * x).sum()
+    sy = counts @ w
+    sxy = counts @ (w * x)
+    trend = (sw * sxy - sx * sy) / (sw * sxx - sx * sx)
+    level = (sy - trend * sx) / sw
+
+    hod = (last_hour_of_day - np.arange(hours)) % 24
+    by_hour = np.zeros((hours, 24))
+    by_hour[np.arange(hours), hod] = w
+    per_hod = counts @ by_hour                       # weighted bottles per hour of day
+    weight_hod = by_hour.sum(axis=0)                 # weight each hour of day got
+    total = per_hod.sum(axis=1, keepdims=True)
+    raw = np.divide(per_hod / weight_hod, total / weight_hod.sum(),
+                    out=np.ones_like(per_hod), where=total > 0)
+    trust = total / (total + PROFILE_PRIOR)
+    profile = trust * raw + (1 - trust)
+    return level, trend, profile
+
+
+def predict(level, trend, profile, remaining, next_hour_of_day, horizon=HORIZON):
+    """``(hours_to_full, next_24h)``: fractional hours until ``remaining``
+    more bottles have arrived (NaN beyond ``horizon``) and bottles expected
+    in the next 24 hours."""
+    ahead = np.arange(1, horizon + 1, dtype=float)
+    base = level[:, None] + trend[:, None] * np.minimum(ahead, TREND_HOURS)[None, :]
+    hod = (next_hour_of_day + np.arange(horizon)) % 24
+    rate = np.maximum(base, 0) * profile[:, hod]
+    cum = np.cumsum(rate, axis=1)
+
+    reached = cum >= remaining[:, None]
+    hit = reached.any(axis=1)
+    k = np.argmax(reached, axis=1)
+    rows = np.arange(len(k))
+    before = np.where(k > 0, cum[rows, np.maximum(k - 1, 0)], 0.0)
+    step = np.where(rate[rows, k] > 0, rate[rows, k], 1.0)
+    hours = np.where(hit, k + np.clip((remaining - before) / step, 0, 1), np.nan)
+    hours = np.where(remaining <= 0, 0.0, hours)
+    return hours, cum[:, min(24, horizon) - 1]
+
+
+def compute(conn, days=DAYS, horizon=HORIZON):
+    machines, counts, ref = load(conn, days)
+    if not machines:
+        return {"generated_at": None, "horizon_hours": horizon, "items": []}
+
+    start = time.perf_counter()
+    level, trend, profile = fit(counts, (ref.hour - 1) % 24)
+    remaining = np.array([max((m["max_capacity"] or 0) - (m["current_bottles"] or 0), 0)
+                          for m in machines], dtype=float)
+    hours, next_24h = predict(level, trend, profile, remaining, ref.hour, horizon)
+    fit_ms = (time.perf_counter() - start) * 1000
+
+    now = time.time()
+    items = []
+    for i, m in enumerate(machines):
+        h = None if np.isnan(hours[i]) else round(float(hours[i]), 1)
+        items.append({
+            "machine_id": m["machine_id"],
+            "name": m["name"],
+            "city": m["city"],
+            "current_bottles": m["current_bottles"],
+            "max_capacity": m["max_capacity"],
+            "rate_per_hour": round(float(next_24h[i]) / 24, 2),
+            "expected_next_24h": round(float(next_24h[i]), 1),
+            "hours_to_full": h,
+            "full_at": None if h is None else
+            time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now + h * 3600)),
+        })
+    items.sort(key=lambda it: (it["hours_to_full"] is None, it["hours_to_full"] or 0))
+    return {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)),
+        "horizon_hours": horizon,
+        "history_days": days,
+        "fit_ms": round(fit_ms, 1),
+        "items": items,
+    }
+
+
+_lock = threading.Lock()
+_cache = {"at": 0.0, "value": None, "index": None}
+
+
+def fleet():
+    """The cached fleet forecast (recomputed once it is ``TTL`` old)."""
+    if _cache["value"] is None or time.monotonic() - _cache["at"] > TTL:
+        with _lock:
+            if _cache["value"] is None or time.monotonic() - _cache["at"] > TTL:
+                with db.get_db() as conn:
+                    value = compute(conn)
+                _cache["index"] = {it["machine_id"]: it for it in value["items"]}
+                _cache["value"], _cache["at"] = value, time.monotonic()
+    return _cache["value"]
+
+
+def for_machine(machine_id):
+    fleet()
+    return _cache["index"].get(machine_id)
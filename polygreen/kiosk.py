@@ -0,0 +1,361 @@
+"""Persistent kiosk channel: ``/ws/kiosk`` (WebSocket, JSON text frames).
+
+A kiosk keeps one connection open instead of a TLS handshake per
+``/api/user/fetch`` and ``/api/machine/insert``. The first frame
+authenticates it::
+
+    -> {"type": "hello", "machine_id": "M001", "token": "...", "since": 1718000000000000}
+    <- {"type": "welcome", "machine_id": "M001", "heartbeat": 15, "resumed": true}
+
+``token`` is ``token_for(machine_id)`` (``python -m polygreen.kiosk token
+M001``), an HMAC with ``KIOSK_SECRET`` (or ``SECRET_KEY``). The machine id
+in the hello is the only one the channel acts for. With neither set (or
+``SECRET_KEY`` left at the public ``dev`` default) the channel refuses
+every connection and no tokens are issued.
+
+Requests carry an ``id`` the reply echoes; the bodies and statuses are the
+HTTP endpoints' own::
+
+    -> {"type": "lookup", "id": 7, "mobile": "01012345678"}
+    -> {"type": "insert", "id": 8, "user_id": "abcd_5678", "bottle_count": 2}
+    -> {"type": "ping", "id": 9}
+    <- {"type": "result", "id": 7, "status": 200, "body": {...}}
+    <- {"type": "pong", "id": 9}
+
+Requests are handled one at a time, in order. A kiosk with more than
+``KIOSK_MAX_IN_FLIGHT`` unanswered requests is disconnected (1008), and one
+silent for ``KIOSK_IDLE_TIMEOUT`` seconds is dropped. A request still in
+flight when the connection breaks may or may not have happened: look the
+user up again before repeating an insert.
+
+The server pushes commands, numbered ``n`` per connection, which the kiosk
+acknowledges with ``{"type": "ack", "n": ...}``::
+
+    <- {"type": "command", "n": 1, "name": "status", "seq": ..., "data": {...}}
+    <- {"type": "command", "n": 2, "name": "emptied", "seq": ..., "data": {...}}
+    <- {"type": "command", "n": 3, "name": "config", "data": {"points_per_bottle": 12}}
+
+``status`` and ``emptied`` carry the machine's state from
+``polygreen.events`` (``emptied`` when ``last_emptied`` moved); ``config``
+the points rate the kiosk should display, sent on connect and whenever
+the rules change it. Commands are state, not deltas: while
+``KIOSK_WINDOW`` commands are unacknowledged nothing more is sent, and
+only the newest state goes out once the kiosk catches up. To resume, a
+kiosk sends the ``seq`` of the last state it applied as ``since`` in its
+hello; it gets the states it may have missed (some possibly twice), or the
+current state if this worker can't tell.
+
+Like the SSE stream this needs the gevent workers (``events.streaming_supported``).
+"""
+
+import argparse
+import collections
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+
+from flask import Blueprint, current_app, jsonify
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
+
+from polygreen import events, rules
+from polygreen.db import get_db
+from polygreen.machines import insert_bottles, lookup_user
+from polygreen.metrics import KIOSK_CONNECTIONS, KIOSK_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = float(os.getenv("KIOSK_HEARTBEAT", "15"))
+IDLE_TIMEOUT = float(os.getenv("KIOSK_IDLE_TIMEOUT", str(HEARTBEAT * 3)))
+HELLO_TIMEOUT = 10.0
+MAX_IN_FLIGHT = int(os.getenv("KIOSK_MAX_IN_FLIGHT", "16"))
+WINDOW = int(os.getenv("KIOSK_WINDOW", "8"))
+CONFIG_INTERVAL = 5.0  # time-of-day rules change the rate without a NOTIFY
+MESSAGE_TYPES = ("lookup", "insert", "ping", "ack")
+
+bp = Blueprint("kiosk", __name__)
+sock = Sock()
+
+
+def _secret():
+    # the app's SECRET_KEY default is public: anyone could mint tokens with it
+    secret = os.getenv("KIOSK_SECRET") or os.getenv("SECRET_KEY")
+    return secret.encode() if secret and secret != "dev" else None
+
+
+def configured():
+    return _secret() is not None
+
+
+def token_for(machine_id):
+    secret = _secret()
+    if secret is None:
+        raise RuntimeError("set KIOSK_SECRET (or SECRET_KEY) to use kiosk tokens")
+    return hmac.new(secret, f"kiosk:{machine_id}".encode(), hashlib.sha256).hexdigest()
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), default=str)
+
+
+# ---------------- SERVER -> KIOSK COMMANDS ----------------
+
+_lock = threading.Lock()
+_channels = collections.defaultdict(set)
+_listening = {"pid": None}
+
+
+def _on_event(event):
+    # LISTEN thread: hand the newest state to that machine's channels
+    with _lock:
+        if event is None:
+            targets = [c for chans in _channels.values() for c in chans]
+        else:
+            targets = list(_channels.get(event["machine_id"], ()))
+    for channel in targets:
+        channel.offer(event)
+
+
+class Channel:
+    """One connected kiosk: the socket, what it still has to be sent and
+    how far it has acknowledged."""
+
+    def __init__(self, ws, machine_id, city):
+        self.ws = ws
+        self.machine_id = machine_id
+        self.city = city
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.open = True
+        self.pending = None  # newest state not yet sent
+        self.resync = False
+        self.version = None
+        self.last_emptied = None
+        self.rate = None
+        self.sent = 0
+        self.acked = 0
+
+    def send(self, message):
+        with self.send_lock:
+            self.ws.send(_dumps(message))
+
+    def offer(self, event):
+        with self.lock:
+            if event is None:
+                self.resync = True
+            elif self.version is None or events.version(event) > self.version:
+                self.pending = event
+        self.wake.set()
+
+    def ack(self, n):
+        with self.lock:
+            if isinstance(n, int) and self.acked < n <= self.sent:
+                self.acked = n
+        self.wake.set()
+
+    def close(self):
+        self.open = False
+        self.wake.set()
+
+    def _command(self, name, data, seq=None):
+        with self.lock:
+            self.sent += 1
+            message = {"type": "command", "n": self.sent, "name": name, "data": data}
+        if seq is not None:
+            message["seq"] = seq
+        self.send(message)
+
+    def send_state(self, event):
+        v = events.version(event)
+        if self.version is not None and v <= self.version:
+            return
+        emptied = self.version is not None and event.get("last_emptied") != self.last_emptied
+        self.version, self.last_emptied = v, event.get("last_emptied")
+        self._command("emptied" if emptied else "status", event, seq=event["id"])
+
+    def missed(self, since):
+        """States after ``since`` for a resuming kiosk, and whether this
+        worker's buffer covered them; otherwise just the current state."""
+        if since is not None:
+            h = events.hub()
+            with h.cond:
+                replay = h.after_id(since)
+            if replay is not None:
+                return [json.loads(data) for _, _, mid, data in replay
+                        if mid == self.machine_id], True
+        event = events.current(self.machine_id)
+        return [event] if event else [], False
+
+    def send_config(self):
+        rate = rules.points_for(1, self.machine_id, self.city)
+        if rate != self.rate:
+            self.rate = rate
+            self._command("config", {"points_per_bottle": rate})
+
+    def push(self):
+        """Sender thread: pushes state changes and rate changes while the
+        kiosk keeps up with its acks."""
+        try:
+            while self.open:
+                self.wake.wait(CONFIG_INTERVAL)
+                self.wake.clear()
+                if not self.open:
+                    break
+                with self.lock:
+                    if self.sent - self.acked >= WINDOW:
+                        continue
+                    event, self.pending = self.pending, None
+                    resync, self.resync = self.resync, False
+                if resync:
+                    event = events.current(self.machine_id) or event
+                if event is not None:
+                    self.send_state(event)
+                self.send_config()
+        except ConnectionClosed:
+            self.open = False
+        except Exception as e:
+            logger.warning(f"kiosk {self.machine_id} push stopped: {e}")
+            self.open = False
+
+
+# ---------------- CHANNEL ----------------
+
+def _hello(ws):
+    """Authenticate the first frame. Returns ``(machine_id, city, since)``
+    or None after closing the socket."""
+    if not configured():
+        logger.error("refusing /ws/kiosk: neither KIOSK_SECRET nor SECRET_KEY is set")
+        ws.close(1011, "kiosk channel is not configured")
+        return None
+    raw = ws.receive(timeout=HELLO_TIMEOUT)
+    try:
+        msg = json.loads(raw) if raw else {}
+    except ValueError:
+        msg = {}
+    machine_id = msg.get("machine_id") if msg.get("type") == "hello" else None
+    if not (isinstance(machine_id, str) and machine_id and isinstance(msg.get("token"), str)
+            and hmac.compare_digest(msg["token"], token_for(machine_id))):
+        ws.close(1008, "hello with machine_id and token expected")
+        return None
+
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT city FROM machines WHERE machine_id=%s", (machine_id,))
+            machine = cur.fetchone()
+    if not machine:
+        ws.close(1008, "unknown machine")
+        return None
+
+    since = msg.get("since")
+    return machine_id, machine["city"], since if isinstance(since, int) else None
+
+
+def _handle(channel, msg):
+    kind = msg.get("type")
+    if kind == "ping":
+        return {"type": "pong", "id": msg.get("id")}
+    if kind == "ack":
+        channel.ack(msg.get("n"))
+        return None
+    if kind == "lookup":
+        body, status = lookup_user(str(msg.get("mobile", "")).strip())
+    elif kind == "insert":
+        try:
+            bottle_count = int(msg.get("bottle_count", 1))
+        except (TypeError, ValueError):
+            body, status = {"message": "bottle_count must be at least 1"}, 400
+        else:
+            body, status = insert_bottles(channel.machine_id, msg.get("user_id"), bottle_count)
+    else:
+        body, status = {"message": f"unknown message type {kind!r}"}, 400
+    return {"type": "result", "id": msg.get("id"), "status": status, "body": body}
+
+
+@bp.before_request
+def require_cooperative_worker():
+    if not events.streaming_supported():
+        return jsonify(message="Kiosk channels are served by the gevent workers"), 503
+
+
+@sock.route("/ws/kiosk", bp=bp)
+def kiosk_channel(ws):
+    hello = _hello(ws)
+    if hello is None:
+        return
+    machine_id, city, since = hello
+
+    with _lock:
+        if _listening["pid"] != os.getpid():
+            _listening["pid"] = os.getpid()
+            events.listen(_on_event)
+
+    channel = Channel(ws, machine_id, city)
+    with _lock:
+        _channels[machine_id].add(channel)
+    KIOSK_CONNECTIONS.inc()
+    try:
+        states, resumed = channel.missed(since)
+        channel.send({"type": "welcome", "machine_id": machine_id,
+                      "heartbeat": HEARTBEAT, "resumed": resumed})
+        for event in states:
+            channel.send_state(event)
+        channel.send_config()
+        threading.Thread(target=channel.push, name=f"kiosk-{machine_id}", daemon=True).start()
+
+        while channel.open:
+            raw = ws.receive(timeout=IDLE_TIMEOUT)
+            if raw is None:
+                ws.close(1001, "idle")
+                break
+            if len(ws.input_buffer) > MAX_IN_FLIGHT:
+                ws.close(1008, f"more than {MAX_IN_FLIGHT} requests in flight")
+                break
+            try:
+                msg = json.loads(raw)
+            except ValueError:
+                msg = None
+            if not isinstance(msg, dict):
+                channel.send({"type": "result", "id": None, "status": 400,
+                              "body": {"message": "JSON object expected"}})
+                continue
+            kind = msg.get("type")
+            KIOSK_MESSAGES.labels(kind if kind in MESSAGE_TYPES else "other").inc()
+            try:
+                reply = _handle(channel, msg)
+            except Exception as e:
+                current_app.logger.error(f"/ws/kiosk {machine_id} {msg.get('type')} error: {e}")
+                reply = {"type": "result", "id": msg.get("id"), "status": 500,
+                         "body": {"message": "Server error"}}
+            if reply is not None:
+                channel.send(reply)
+    finally:
+        channel.close()
+        with _lock:
+            _channels[machine_id].discard(channel)
+            if not _channels[machine_id]:
+                del _channels[machine_id]
+        KIOSK_CONNECTIONS.dec()
+
+
+# ---------------- CLI ----------------
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="kiosk channel tokens")
+    ap.add_argument("command", choices=["token"])
+    ap.add_argument("machine_id", nargs="+")
+    args = ap.parse_args(argv)
+
+    if not configured():
+        ap.error("KIOSK_SECRET (or SECRET_KEY) is required")
+    for machine_id in args.machine_id:
+        print(f"{machine_id}\t{token_for(machine_id)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
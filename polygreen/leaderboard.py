@@ -0,0 +1,450 @@
+"""Points leaderboards: global, per city, per machine and per week.
+
+Scores are points *earned* (redeeming doesn't cost you your place) and
+live in ``leaderboard_scores`` (migration 0008), one row per board, scope
+and user. The ledger flush adds each batch's earn rows to them in the same
+transaction as the insert (``record``), using only the rows that insert
+actually wrote, so a replayed spool file is not counted twice.
+
+Top-N is a range scan of the ``(board, scope, points DESC)`` index. "My
+rank" is 1 + the number of users with more points, which an index can't
+count without visiting them all, so every worker also keeps a ``Histogram``
+of scores per board scope (counts per score, not users, so it stays small)
+answering that in O(log n). The histograms are loaded with one aggregate
+query and then follow the changes ``record`` NOTIFYs on
+``polygreen_leaderboard``; each change carries its transaction id, so
+changes already in the loaded snapshot are not applied twice.
+
+``rebuild`` recomputes every board from the ledger (plus the totals of
+archived months, see ``fold_archived``) and prunes old weekly boards:
+
+    python -m polygreen.leaderboard rebuild
+    python -m polygreen.leaderboard prune --weeks 4
+
+Months archived before migration 0008 are not counted by a rebuild.
+"""
+
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import sys
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+from polygreen import db, notify
+
+logger = logging.getLogger(__name__)
+
+BOARDS = ("global", "city", "machine", "week")
+WEEKS = int(os.getenv("LEADERBOARD_WEEKS", "4"))
+CHANNEL = "polygreen_leaderboard"
+BUCKET = 32
+NOTIFY_BYTES = 7000  # pg_notify payloads must stay under 8000 bytes
+
+RECORD_SQL = """
+    WITH d AS (
+        SELECT d.user_id, d.machine_id, m.city, d.points,
+               to_char(date_trunc('week', d.created_at), 'YYYY-MM-DD') AS week
+        FROM unnest(%s::TEXT[], %s::TEXT[], %s::INTEGER[], %s::TIMESTAMP[])
+             AS d(user_id, machine_id, points, created_at)
+        LEFT JOIN machines m ON m.machine_id = d.machine_id
+    ), deltas AS (
+        SELECT 'global' AS board, ''::TEXT AS scope, user_id, SUM(points) AS points
+        FROM d GROUP BY user_id
+        UNION ALL
+        SELECT 'city', city, user_id, SUM(points)
+        FROM d WHERE city IS NOT NULL GROUP BY city, user_id
+        UNION ALL
+        SELECT 'machine', machine_id, user_id, SUM(points)
+        FROM d WHERE machine_id IS NOT NULL GROUP BY machine_id, user_id
+        UNION ALL
+        SELECT 'week', week, user_id, SUM(points)
+        FROM d GROUP BY week, user_id
+    ), upserted AS (
+        INSERT INTO leaderboard_scores AS s (board, scope, user_id, points)
+        SELECT board, scope, user_id, points FROM deltas
+        ORDER BY board, scope, user_id  -- same lock order in every flush
+        ON CONFLICT (board, scope, user_id) DO UPDATE SET points = s.points + EXCLUDED.points
+        RETURNING s.board, s.scope, s.user_id, s.points
+    )
+    SELECT u.board, u.scope, u.points - d.points AS old, u.points AS new,
+           txid_current() AS txid
+    FROM upserted u
+    JOIN deltas d USING (board, scope, user_id);
+"""
+
+REBUILD_SQL = """
+    INSERT INTO leaderboard_scores (board, scope, user_id, points)
+    WITH earned AS (
+        SELECT t.user_id, t.machine_id, m.city, t.points, t.created_at
+        FROM transactions t
+        LEFT JOIN machines m ON m.machine_id = t.machine_id
+        WHERE t.type = 'earn' AND t.points > 0
+    ), totals AS (
+        SELECT 'global' AS board, ''::TEXT AS scope, user_id, SUM(points) AS points
+        FROM earned GROUP BY user_id
+        UNION ALL
+        SELECT 'city', city, user_id, SUM(points)
+        FROM earned WHERE city IS NOT NULL GROUP BY city, user_id
+        UNION ALL
+        SELECT 'machine', machine_id, user_id, SUM(points)
+        FROM earned WHERE machine_id IS NOT NULL GROUP BY machine_id, user_id
+        UNION ALL
+        SELECT 'week', to_char(date_trunc('week', created_at), 'YYYY-MM-DD'), user_id, SUM(points)
+        FROM earned WHERE created_at >= %(weeks_from)s GROUP BY 2, user_id
+        UNION ALL
+        SELECT board, scope, user_id, points FROM leaderboard_archived
+    )
+    SELECT board, scope, user_id, SUM(points) FROM totals GROUP BY board, scope, user_id;
+"""
+
+FOLD_ARCHIVED_SQL = """
+    INSERT INTO leaderboard_archived AS a (board, scope, user_id, points)
+    WITH earned AS (
+        SELECT t.user_id, t.machine_id, m.city, t.points
+        FROM "{partition}" t
+        LEFT JOIN machines m ON m.machine_id = t.machine_id
+        WHERE t.type = 'earn' AND t.points > 0
+    )
+    SELECT 'global', '', user_id, SUM(points) FROM earned GROUP BY user_id
+    UNION ALL
+    SELECT 'city', city, user_id, SUM(points) FROM earned
+    WHERE city IS NOT NULL GROUP BY city, user_id
+    UNION ALL
+    SELECT 'machine', machine_id, user_id, SUM(points) FROM earned
+    WHERE machine_id IS NOT NULL GROUP BY machine_id, user_id
+    ON CONFLICT (board, scope, user_id) DO UPDATE SET points = a.points + EXCLUDED.points;
+"""
+
+
+def week_scope(day=None):
+    day = day or dt.date.today()
+    return (day - dt.timedelta(days=day.weekday())).isoformat()
+
+
+# ---------------- WRITES ----------------
+
+def record(cur, rows):
+    """Add ledger rows just inserted in ``cur``'s transaction to the boards
+    and queue the NOTIFYs. A failure here is logged and leaves the ledger
+    write alone (``rebuild`` repairs the boards)."""
+    earned = [r for r in rows if r["type"] == "earn" and r["points"] > 0]
+    if not earned:
+        return
+    cur.execute("SAVEPOINT leaderboard;")
+    try:
+        cur.execute(RECORD_SQL, (
+            [r["user_id"] for r in earned],
+            [r["machine_id"] for r in earned],
+            [r["points"] for r in earned],
+            [r["created_at"] for r in earned],
+        ))
+        changes = cur.fetchall()
+        for payload in _payloads(changes):
+            cur.execute("SELECT pg_notify(%s, %s);", (CHANNEL, payload))
+        cur.execute("RELEASE SAVEPOINT leaderboard;")
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT leaderboard;")
+        logger.error(f"leaderboard update failed ({e}); run `python -m polygreen.leaderboard "
+                     "rebuild` to repair")
+
+
+def _payloads(changes):
+    """Compact JSON payloads under the NOTIFY size limit."""
+    if not changes:
+        return
+    txid = changes[0]["txid"]
+    batch, size = [], 0
+    for c in changes:
+        item = [c["board"], c["scope"], c["old"], c["new"]]
+        length = len(json.dumps(item)) + 1
+        if batch and size + length > NOTIFY_BYTES:
+            yield json.dumps({"x": txid, "d": batch}, separators=(",", ":"))
+            batch, size = [], 0
+        batch.append(item)
+        size += length
+    yield json.dumps({"x": txid, "d": batch}, separators=(",", ":"))
+
+
+def fold_archived(cur, partition):
+    """Keep the all-time totals of a ``transactions`` partition that is
+    about to be dropped (call in the same transaction)."""
+    cur.execute(FOLD_ARCHIVED_SQL.format(partition=partition))
+
+
+def rebuild(conn, weeks=WEEKS, today=None):
+    """Recompute every board from the ledger in one transaction (writers
+    wait) and tell the workers to reload. Returns the number of rows."""
+    monday = dt.date.fromisoformat(week_scope(today))
+    with conn.cursor() as cur:
+        cur.execute("LOCK TABLE leaderboard_scores IN EXCLUSIVE MODE;")
+        cur.execute("DELETE FROM leaderboard_scores;")
+        cur.execute(REBUILD_SQL, {"weeks_from": monday - dt.timedelta(weeks=weeks - 1)})
+        count = cur.rowcount
+        cur.execute("SELECT pg_notify(%s, 'reload');", (CHANNEL,))
+    conn.commit()
+    return count
+
+
+def prune(conn, weeks=WEEKS, today=None):
+    """Drop weekly boards older than the last ``weeks`` weeks."""
+    monday = dt.date.fromisoformat(week_scope(today))
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM leaderboard_scores WHERE board = 'week' AND scope < %s;",
+                    ((monday - dt.timedelta(weeks=weeks - 1)).isoformat(),))
+        count = cur.rowcount
+        if count:
+            cur.execute("SELECT pg_notify(%s, 'reload');", (CHANNEL,))
+    conn.commit()
+    return count
+
+
+# ---------------- RANKS ----------------
+
+class Histogram:
+    """How many users of one board scope have each score.
+
+    A Fenwick tree over score buckets of ``BUCKET`` points gives the count
+    above a bucket in O(log(max score)); the scores inside a bucket are
+    counted directly."""
+
+    def __init__(self):
+        self.tree = [0] * 65  # 1-based Fenwick array over buckets
+        self.buckets = {}     # bucket -> {points: users}
+        self.total = 0
+
+    def add(self, points, n=1):
+        b = points // BUCKET
+        if b + 1 >= len(self.tree):
+            self._grow(b + 1)
+        i = b + 1
+        while i < len(self.tree):
+            self.tree[i] += n
+            i += i & -i
+        counts = self.buckets.setdefault(b, {})
+        counts[points] = counts.get(points, 0) + n
+        if not counts[points]:
+            del counts[points]
+            if not counts:
+                del self.buckets[b]
+        self.total += n
+
+    def _grow(self, size):
+        length = len(self.tree) - 1
+        while length < size:
+            length *= 2
+        self.tree = [0] * (length + 1)
+        for b, counts in self.buckets.items():
+            i = b + 1
+            n = sum(counts.values())
+            while i <= length:
+                self.tree[i] += n
+                i += i & -i
+
+    def _prefix(self, i):
+        total = 0
+        i = min(i, len(self.tree) - 1)
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def above(self, points):
+        """Number of users with more than ``points``."""
+        b = points // BUCKET
+        inside = self.buckets.get(b, {})
+        return (self.total - self._prefix(b + 1)
+                + sum(n for p, n in inside.items() if p > points))
+
+
+def _visible(txid, snapshot):
+    """Whether ``txid`` had committed in ``snapshot`` (``xmin:xmax:xip``)."""
+    xmin, xmax, xip = snapshot.split(":")
+    if txid < int(xmin):
+        return True
+    if txid >= int(xmax):
+        return False
+    return str(txid) not in xip.split(",")
+
+
+class Boards:
+    def __init__(self, rows, snapshot):
+        self.snapshot = snapshot
+        self.histograms = {}
+        for row in rows:
+            self.histogram(row["board"], row["scope"]).add(row["points"], row["users"])
+
+    def histogram(self, board, scope):
+        h = self.histograms.get((board, scope))
+        if h is None:
+            h = self.histograms[(board, scope)] = Histogram()
+        return h
+
+    def apply(self, txid, changes):
+        if _visible(txid, self.snapshot):
+            return  # already counted by the load
+        for board, scope, old, new in changes:
+            h = self.histogram(board, scope)
+            if old > 0:
+                h.add(old, -1)
+            h.add(new, 1)
+
+
+_lock = threading.Lock()
+_load_lock = threading.Lock()
+_state = {"pid": None, "boards": None, "stale": True, "pending": None}
+
+
+def _on_notify(payload):
+    if payload is None or payload == "reload":
+        _state["stale"] = True
+        return
+    message = json.loads(payload)
+    with _lock:
+        if _state["pending"] is not None:
+            _state["pending"].append((message["x"], message["d"]))
+        elif _state["boards"] is not None:
+            _state["boards"].apply(message["x"], message["d"])
+
+
+def load():
+    """Aggregate ``leaderboard_scores`` into histograms, with the snapshot
+    the aggregate was read in."""
+    with db.get_db() as conn:
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT txid_current_snapshot()::TEXT AS snapshot;")
+                snapshot = cur.fetchone()["snapshot"]
+                cur.execute("""
+                    SELECT board, scope, points, COUNT(*) AS users
+                    FROM leaderboard_scores
+                    GROUP BY board, scope, points;
+                """)
+                rows = cur.fetchall()
+            conn.rollback()
+        finally:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_DEFAULT)
+    return Boards(rows, snapshot)
+
+
+def boards():
+    """This worker's histograms, (re)loaded when missing or stale."""
+    if _state["pid"] != os.getpid():
+        with _lock:
+            if _state["pid"] != os.getpid():
+                _state.update(pid=os.getpid(), boards=None, stale=True, pending=None)
+                notify.subscribe(CHANNEL, _on_notify)
+    if _state["stale"] or _state["boards"] is None:
+        with _load_lock:
+            if _state["stale"] or _state["boards"] is None:
+                _reload()
+    return _state["boards"]
+
+
+def _reload():
+    listening = notify.wait_listening(CHANNEL, timeout=5)
+    with _lock:
+        _state["pending"] = []
+        _state["stale"] = False
+    try:
+        loaded = load()
+    except Exception:
+        with _lock:
+            _state["pending"] = None
+            _state["stale"] = True
+        raise
+    with _lock:
+        for txid, changes in _state["pending"]:
+            loaded.apply(txid, changes)
+        _state.update(boards=loaded, pending=None)
+        if not listening:
+            _state["stale"] = True  # may have missed changes: load again next time
+
+
+def top(board, scope, limit=10):
+    """The first ``limit`` users of a board with their rank (ties share)."""
+    with db.get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT s.user_id, u.name, s.points
+                FROM leaderboard_scores s
+                JOIN users u ON u.user_id = s.user_id
+                WHERE s.board = %s AND s.scope = %s
+                ORDER BY s.points DESC, s.user_id
+                LIMIT %s;
+            """, (board, scope, limit))
+            rows = cur.fetchall()
+    items, rank = [], 0
+    for i, row in enumerate(rows):
+        if i == 0 or row["points"] < rows[i - 1]["points"]:
+            rank = i + 1
+        items.append({"rank": rank, "user_id": row["user_id"],
+                      "name": mask_name(row["name"]), "points": row["points"]})
+    return items
+
+
+def rank(board, scope, user_id):
+    """``{"rank", "points", "total"}`` for ``user_id`` (rank None if the
+    user has no points on this board yet)."""
+    with db.get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT points FROM leaderboard_scores
+                WHERE board = %s AND scope = %s AND user_id = %s;
+            """, (board, scope, user_id))
+            row = cur.fetchone()
+    current = boards()
+    with _lock:
+        h = current.histograms.get((board, scope))
+        total = h.total if h else 0
+        if row is None:
+            return {"rank": None, "points": 0, "total": total}
+        return {"rank": (h.above(row["points"]) if h else 0) + 1,
+                "points": row["points"], "total": total}
+
+
+def mask_name(name):
+    """Other users' names are shown as e.g. 김*수."""
+    if not name or len(name) < 2:
+        return name
+    if len(name) == 2:
+        return name[0] + "*"
+    return name[0] + "*" * (len(name) - 2) + name[-1]
+
+
+def prime():
+    return len(boards().histograms)
+
+
+def main(argv=None):
+    from psycopg2.extras import RealDictCursor
+
+    ap = argparse.ArgumentParser(description="leaderboard maintenance")
+    ap.add_argument("command", choices=["rebuild", "prune"])
+    ap.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    ap.add_argument("--weeks", type=int, default=WEEKS, help="weekly boards to keep")
+    args = ap.parse_args(argv)
+
+    if not args.database_url:
+        ap.error("--database-url or DATABASE_URL is required")
+
+    conn = psycopg2.connect(args.database_url, cursor_factory=RealDictCursor)
+    try:
+        if args.command == "rebuild":
+            print(f"rebuilt leaderboards: {rebuild(conn, args.weeks):,} rows")
+        else:
+            print(f"pruned {prune(conn, args.weeks):,} weekly rows")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
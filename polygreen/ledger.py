@@ -0,0 +1,393 @@
+"""Write-behind buffer for ``transactions`` ledger rows.
+
+``machine_insert`` decides capacity and credits points synchronously (see
+``counters``) but no longer waits for its ledger row to be inserted: the
+row is appended to a local spool file and a background thread writes
+buffered rows in one multi-row ``INSERT`` when ``WRITE_BEHIND_BATCH`` rows
+are waiting or ``WRITE_BEHIND_INTERVAL`` seconds have passed, whichever
+comes first. Many drops then share one commit (and one WAL flush).
+
+Spooling: ``stage`` appends each row to
+``WRITE_BEHIND_DIR/ledger-<pid>-*.jsonl`` and the caller calls ``sync``
+just before committing, so a credited balance (and its outbox event)
+never outlives its ledger row in a crash. Syncs are grouped: one
+``fdatasync`` covers every row appended since the last one, and all the
+requests waiting on it go on together. The row carries the
+request's ``txid_current()``: the flusher inserts only rows whose
+transaction committed (``txid_status``), drops those that rolled back and
+keeps those still open for the next flush. A worker claims and replays
+spool files left behind by dead processes (they are ``flock``-ed while
+their owner lives). Every row carries an ``event_id`` and inserts are
+``ON CONFLICT DO NOTHING``, so a replay never duplicates a row.
+
+Rows the database rejects outright, and rows whose transaction is too old
+for ``txid_status`` to tell, are moved to ``ledger-dead-*.jsonl`` and
+counted in ``polygreen_ledger_dead_rows_total``; connection errors just
+leave the batch for the next attempt.
+
+Readers see a new row up to one interval late. ``WRITE_BEHIND=0`` inserts
+it in the request's own transaction instead. Either way the leaderboards
+are updated in the transaction that inserts the row (see ``leaderboard``),
+and the row's ``ledger.<type>`` outbox event is written in the request's
+transaction (see ``outbox``).
+"""
+
+import atexit
+import collections
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from polygreen import ROOT_DIR, db, leaderboard, outbox
+from polygreen.metrics import (
+    LEDGER_BUFFERED, LEDGER_DEAD_ROWS, LEDGER_FLUSH_ROWS, LEDGER_FLUSH_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("WRITE_BEHIND", "1") != "0"
+BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH", "200"))
+FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.2"))
+SPOOL_DIR = os.getenv("WRITE_BEHIND_DIR", os.path.join(ROOT_DIR, "spool"))
+
+COLUMNS = ("event_id", "user_id", "type", "points", "bottles", "machine_id", "brand_id",
+           "created_at")
+
+XID_STATUS_SQL = """
+    SELECT xid, txid_status(xid) AS status FROM unnest(%s::BIGINT[]) AS xid;
+"""
+
+INSERT_SQL = f"""
+    INSERT INTO transactions ({", ".join(COLUMNS)})
+    VALUES %s
+    ON CONFLICT (event_id, created_at) DO NOTHING
+    RETURNING user_id, type, points, machine_id, created_at
+"""
+
+
+_local = threading.local()
+
+
+def enabled():
+    return ENABLED
+
+
+def stage(cur, user_id, type, points, bottles, machine_id=None, brand_id=None):
+    """Record a ledger row inside the caller's transaction.
+
+    With write-behind off the row is inserted right away. Otherwise it is
+    appended to the spool now, tagged with the transaction's id (call
+    ``sync`` before committing), and written by the flusher once that
+    transaction has committed."""
+    # the time NOW() would have recorded, and who to ask whether we committed
+    cur.execute("SELECT LOCALTIMESTAMP AS now, txid_current() AS xid;")
+    now = cur.fetchone()
+    row = {
+        "event_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "type": type,
+        "points": points,
+        "bottles": bottles,
+        "machine_id": machine_id,
+        "brand_id": brand_id,
+        "created_at": now["now"].isoformat(),
+    }
+    outbox.emit(cur, f"ledger.{type}", user_id, row)
+    if not ENABLED:
+        _insert(cur, [row])
+        return
+    _local.ticket = _writer().append(dict(row, xid=now["xid"]))
+
+
+def sync():
+    """Wait until the rows this thread staged are on disk. Call right
+    before committing the transaction that staged them."""
+    ticket = getattr(_local, "ticket", None)
+    if ticket is not None:
+        _writer().sync(ticket)
+        _local.ticket = None
+
+
+def _values(row):
+    return tuple(row[c] for c in COLUMNS)
+
+
+def _insert(cur, rows):
+    """Insert ledger rows and update the leaderboards with the ones that
+    were new (a replayed row is neither inserted nor counted again)."""
+    inserted = execute_values(cur, INSERT_SQL, [_values(r) for r in rows],
+                              page_size=len(rows) or 1, fetch=True)
+    leaderboard.record(cur, inserted)
+
+
+# ---------------- SPOOL ----------------
+
+class _Segment:
+    """One spool file, exclusively locked for as long as we hold it."""
+
+    def __init__(self, path, create=True):
+        flags = os.O_RDWR | os.O_APPEND | (os.O_CREAT if create else 0)
+        self.path = path
+        self.fd = os.open(path, flags, 0o600)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.rows = []
+        self.last = 0  # ticket of the newest row written here
+
+    def append(self, row):
+        os.write(self.fd, (json.dumps(row) + "\n").encode())
+        self.rows.append(row)
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    self.rows.append(json.loads(line))
+                except ValueError:
+                    # a line torn by the crash: the request never got a reply
+                    logger.warning(f"skipping torn line in {self.path}")
+
+    def discard(self):
+        try:
+            os.unlink(self.path)
+        finally:
+            os.close(self.fd)
+
+
+class _Writer:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = f"ledger-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.seq = 0
+        lock = threading.Lock()
+        self.cond = threading.Condition(lock)  # wakes the flusher
+        self.sync_done = threading.Condition(lock)
+        self.flushing = threading.Lock()
+        self.active = None
+        self.sealed = collections.deque()
+        # group sync: rows get increasing tickets; ``synced`` is the newest
+        # one known to be on disk, ``dirty`` the segments holding newer ones
+        self.written = 0
+        self.synced = 0
+        self.syncing = False
+        self.dirty = []
+        self.claim_orphans()
+        threading.Thread(target=self._run, name="ledger-flush", daemon=True).start()
+
+    # -- producer side --
+
+    def append(self, row):
+        """Write a row to the active segment (not synced yet). Returns its
+        ticket for ``sync``."""
+        with self.cond:
+            if self.active is None:
+                self.seq += 1
+                path = os.path.join(self.directory, f"{self.prefix}-{self.seq}.jsonl")
+                self.active = _Segment(path)
+            self.active.append(row)
+            self.written += 1
+            if self.active.last <= self.synced:
+                self.dirty.append(self.active)
+            self.active.last = self.written
+            LEDGER_BUFFERED.inc()
+            if len(self.active.rows) >= BATCH_SIZE:
+                self.cond.notify()
+            return self.written
+
+    def sync(self, ticket):
+        """Return once the row with ``ticket`` is on disk. One caller at a
+        time syncs every dirty segment, outside the lock; the others wait
+        for it and usually find their row covered."""
+        while True:
+            with self.cond:
+                while self.syncing and self.synced < ticket:
+                    self.sync_done.wait()
+                if self.synced >= ticket:
+                    return
+                self.syncing = True
+                target, segments = self.written, list(self.dirty)
+            synced = False
+            try:
+                for segment in segments:
+                    os.fdatasync(segment.fd)
+                synced = True
+            finally:
+                with self.cond:
+                    self.syncing = False
+                    if synced:
+                        self.synced = max(self.synced, target)
+                        self.dirty = [s for s in self.dirty if s.last > self.synced]
+                    self.sync_done.notify_all()
+
+    # -- recovery --
+
+    def claim_orphans(self):
+        """Queue spool files whose owner process is gone."""
+        for path in sorted(glob.glob(os.path.join(self.directory, "ledger-[0-9]*.jsonl"))):
+            try:
+                segment = _Segment(path, create=False)
+            except OSError:
+                continue  # alive (locked) or already replayed and removed
+            segment.load()
+            if segment.rows:
+                logger.info(f"replaying {len(segment.rows)} spooled ledger rows from {path}")
+                LEDGER_BUFFERED.inc(len(segment.rows))
+                self.sealed.append(segment)
+            else:
+                segment.discard()
+
+    # -- flusher --
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"ledger flush failed, will retry: {e}")
+                time.sleep(min(FLUSH_INTERVAL * 10, 5))
+
+    def flush(self):
+        with self.flushing:
+            with self.cond:
+                if self.active is not None:
+                    self.sealed.append(self.active)
+                    self.active = None
+                target = self.written
+            # a segment is only discarded once nobody can be syncing it
+            self.sync(target)
+            while self.sealed:
+                segment = self.sealed[0]
+                pending = self._write(segment.rows)
+                if pending:  # their transaction is still open
+                    self.sync(max(self.append(row) for row in pending))
+                segment.discard()
+                self.sealed.popleft()
+                LEDGER_BUFFERED.dec(len(segment.rows))
+
+    def _write(self, rows):
+        """Insert the rows whose transaction committed. Returns the rows
+        whose transaction is still in progress."""
+        start = time.perf_counter()
+        rows, pending, unknown = self._settle(rows)
+        try:
+            if rows:
+                with db.get_db() as conn:
+                    with conn.cursor() as cur:
+                        _insert(cur, rows)
+                    conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            raise
+        except psycopg2.Error as e:
+            logger.error(f"ledger batch rejected ({e}); retrying row by row")
+            self._write_each(rows)
+        if unknown:
+            logger.error(f"{len(unknown)} ledger rows from transactions too old to check; "
+                         "moved to the dead-letter file")
+            self._dead(unknown)
+        LEDGER_FLUSH_SECONDS.observe(time.perf_counter() - start)
+        LEDGER_FLUSH_ROWS.observe(len(rows))
+        return pending
+
+    def _settle(self, rows):
+        """Split rows by their transaction's fate: ``(committed, in
+        progress, unknown)``. Rolled-back rows are dropped."""
+        xids = sorted({r["xid"] for r in rows if r.get("xid") is not None})
+        status = {}
+        if xids:
+            with db.get_db() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(XID_STATUS_SQL, (xids,))
+                    status = {r["xid"]: r["status"] for r in cur.fetchall()}
+                conn.rollback()
+        committed, pending, unknown, aborted = [], [], [], 0
+        for row in rows:
+            # rows spooled before xids were recorded were spooled after commit
+            state = status.get(row.get("xid"), "committed")
+            if state == "committed":
+                committed.append(row)
+            elif state == "in progress":
+                pending.append(row)
+            elif state == "aborted":
+                aborted += 1
+            else:
+                unknown.append(row)
+        if aborted:
+            logger.info(f"dropped {aborted} spooled ledger rows whose request rolled back")
+        return committed, pending, unknown
+
+    def _write_each(self, rows):
+        dead = []
+        with db.get_db() as conn:
+            for row in rows:
+                try:
+                    with conn.cursor() as cur:
+                        _insert(cur, [row])
+                    conn.commit()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    raise
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    logger.error(f"ledger row {row['event_id']} rejected: {e}")
+                    dead.append(row)
+        if dead:
+            self._dead(dead)
+
+    def _dead(self, rows):
+        path = os.path.join(self.directory, f"ledger-dead-{os.getpid()}.jsonl")
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(r) + "\n" for r in rows)
+            f.flush()
+            os.fsync(f.fileno())
+        LEDGER_DEAD_ROWS.inc(len(rows))
+
+
+_lock = threading.Lock()
+_state = {"pid": None, "writer": None}
+
+
+def _writer():
+    """This process's writer (a forked worker gets its own)."""
+    if _state["pid"] != os.getpid():
+        with _lock:
+            if _state["pid"] != os.getpid():
+                _state["writer"] = _Writer(SPOOL_DIR)
+                _state["pid"] = os.getpid()
+    return _state["writer"]
+
+
+def start():
+    """Start the flusher now (and replay orphaned spool files) rather than
+    on the first row. Returns the number of rows waiting to be written."""
+    if not ENABLED:
+        return 0
+    writer = _writer()
+    with writer.cond:
+        return sum(len(s.rows) for s in writer.sealed)
+
+
+def flush():
+    """Write everything buffered in this process now."""
+    if ENABLED and _state["pid"] == os.getpid():
+        _state["writer"].flush()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception as e:
+        logger.warning(f"ledger rows left in spool at exit ({e}); they will be replayed")
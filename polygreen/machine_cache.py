@@ -0,0 +1,63 @@
+"""Short-lived cache of the ``/api/machines`` payload.
+
+Every app session fetches the full machine list, but it only changes when
+bottles go in or a machine is emptied/added. The encoded JSON body is kept
+per worker for ``MACHINE_CACHE_TTL`` seconds (0 disables the cache) and is
+dropped immediately when this worker changes a machine; other workers pick
+the change up once their copy expires.
+"""
+
+import os
+import threading
+import time
+
+from polygreen.db import TupleCursor, get_db
+from polygreen.serializers import encode_rows
+
+TTL = float(os.getenv("MACHINE_CACHE_TTL", "5"))
+
+LIST_SQL = """
+    SELECT id, machine_id, name, city, lat, lng,
+           COALESCE(current_bottles, 0) AS current_bottles,
+           COALESCE(max_capacity, 0) AS max_capacity,
+           COALESCE(max_capacity, 0) - COALESCE(current_bottles, 0) AS available_space,
+           COALESCE(is_full, FALSE) AS is_full,
+           last_emptied
+    FROM machines_live
+"""
+
+_lock = threading.Lock()
+_body = None
+_expires = 0.0
+
+
+def enabled():
+    return TTL > 0
+
+
+def list_body():
+    """Encoded ``{"items": [...]}`` body, rebuilt at most once per TTL."""
+    global _body, _expires
+    body = _body
+    if body is not None and time.monotonic() < _expires:
+        return body
+    with _lock:
+        if _body is not None and time.monotonic() < _expires:
+            return _body
+        with get_db() as conn:
+            with conn.cursor(cursor_factory=TupleCursor) as cur:
+                cur.execute(LIST_SQL)
+                items = encode_rows(cur)
+        _body = b'{"items":' + items + b"}"
+        _expires = time.monotonic() + TTL
+        return _body
+
+
+def invalidate():
+    global _expires
+    _expires = 0.0
+
+
+def prime():
+    if enabled():
+        list_body()
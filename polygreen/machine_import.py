@@ -0,0 +1,245 @@
+"""Bulk machine provisioning from CSV.
+
+The file needs a header with ``machine_id, name, city, lat, lng,
+max_capacity`` (any order, extra columns ignored). One pass over it
+validates every row and drops repeats of a ``machine_id`` already seen
+earlier in the file; each rejected row is reported with its line number.
+The valid rows go to a temporary staging table through ``COPY`` and are
+merged into ``machines`` with one ``INSERT ... ON CONFLICT`` per import:
+
+* ``skip`` (default): machines that already exist are left alone and
+  reported as conflicts.
+* ``update``: their name, city, position and capacity are overwritten
+  (fill levels and totals are kept; counter slots re-split on the next
+  drop).
+
+Conflicts come from the ``INSERT``'s own ``RETURNING``, so a machine added
+by someone else mid-import is reported, not lost. With ``dry_run`` the
+merge runs and is rolled back. Either everything valid is imported or,
+on a database error, nothing is.
+
+    python -m polygreen.machine_import machines.csv [--update] [--dry-run]
+"""
+
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sys
+import time
+
+COLUMNS = ("machine_id", "name", "city", "lat", "lng", "max_capacity")
+MODES = ("skip", "update")
+
+STAGE_SQL = """
+    CREATE TEMP TABLE machine_import (
+        line         INTEGER NOT NULL,
+        machine_id   TEXT NOT NULL,
+        name         TEXT NOT NULL,
+        city         TEXT NOT NULL,
+        lat          DOUBLE PRECISION NOT NULL,
+        lng          DOUBLE PRECISION NOT NULL,
+        max_capacity INTEGER NOT NULL
+    ) ON COMMIT DROP;
+"""
+
+COPY_SQL = f"COPY machine_import (line, {', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+
+MERGE_SQL = {
+    "skip": """
+        WITH merged AS (
+            INSERT INTO machines (machine_id, name, city, lat, lng, max_capacity,
+                                  current_bottles, total_bottles, is_full, created_at)
+            SELECT machine_id, name, city, lat, lng, max_capacity, 0, 0, FALSE, NOW()
+            FROM machine_import
+            ORDER BY line
+            ON CONFLICT (machine_id) DO NOTHING
+            RETURNING machine_id, TRUE AS inserted
+        )
+        SELECT s.line, s.machine_id, COALESCE(m.inserted, FALSE) AS inserted,
+               m.machine_id IS NOT NULL AS merged
+        FROM machine_import s
+        LEFT JOIN merged m USING (machine_id)
+        ORDER BY s.line;
+    """,
+    "update": """
+        WITH merged AS (
+            INSERT INTO machines (machine_id, name, city, lat, lng, max_capacity,
+                                  current_bottles, total_bottles, is_full, created_at)
+            SELECT machine_id, name, city, lat, lng, max_capacity, 0, 0, FALSE, NOW()
+            FROM machine_import
+            ORDER BY line
+            ON CONFLICT (machine_id) DO UPDATE
+            SET name = EXCLUDED.name,
+                city = EXCLUDED.city,
+                lat = EXCLUDED.lat,
+                lng = EXCLUDED.lng,
+                max_capacity = EXCLUDED.max_capacity,
+                -- the live fill level: unfolded counter slots count too
+                is_full = machines.current_bottles + (
+                    SELECT COALESCE(SUM(c.used), 0) FROM machine_counter_slots c
+                    WHERE c.machine_id = machines.machine_id
+                ) >= EXCLUDED.max_capacity
+            RETURNING machine_id, xmax = 0 AS inserted
+        )
+        SELECT s.line, s.machine_id, COALESCE(m.inserted, FALSE) AS inserted,
+               m.machine_id IS NOT NULL AS merged
+        FROM machine_import s
+        LEFT JOIN merged m USING (machine_id)
+        ORDER BY s.line;
+    """,
+}
+
+
+# ---------------- VALIDATION ----------------
+
+def _number(value, kind, low, high):
+    n = kind(value)
+    if isinstance(n, float) and not math.isfinite(n):
+        raise ValueError
+    if not low <= n <= high:
+        raise ValueError
+    return n
+
+
+def parse(stream):
+    """Validate and dedupe a CSV text stream. Returns ``(rows, errors)``:
+    rows as ``(line, machine_id, name, city, lat, lng, max_capacity)``,
+    errors as ``{"line", "machine_id", "error"}``."""
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return [], [{"line": 1, "machine_id": None, "error": "empty file"}]
+    names = [h.strip().lstrip("\ufeff").lower() for h in header]
+    missing = [c for c in COLUMNS if c not in names]
+    if missing:
+        return [], [{"line": 1, "machine_id": None,
+                     "error": f"missing columns: {', '.join(missing)}"}]
+    index = [names.index(c) for c in COLUMNS]
+    width = max(index) + 1
+
+    rows, errors, seen = [], [], {}
+    for record in reader:
+        line = reader.line_num
+        if not any(field.strip() for field in record):
+            continue
+        if len(record) < width:
+            record = record + [""] * (width - len(record))
+        machine_id, name, city, lat, lng, capacity = (record[i].strip() for i in index)
+
+        problem = None
+        if not machine_id or not name or not city:
+            problem = "machine_id, name and city are required"
+        elif machine_id in seen:
+            problem = f"duplicate of line {seen[machine_id]}"
+        else:
+            try:
+                lat = _number(lat, float, -90, 90)
+                lng = _number(lng, float, -180, 180)
+            except ValueError:
+                problem = "lat/lng must be coordinates"
+            else:
+                try:
+                    capacity = _number(capacity, int, 1, 2 ** 31 - 1)
+                except ValueError:
+                    problem = "max_capacity must be a positive whole number"
+        if problem:
+            errors.append({"line": line, "machine_id": machine_id or None, "error": problem})
+            continue
+        seen[machine_id] = line
+        rows.append((line, machine_id, name, city, lat, lng, capacity))
+    return rows, errors
+
+
+# ---------------- LOADING ----------------
+
+def load(conn, rows, mode="skip", dry_run=False):
+    """Stage ``rows`` with COPY and merge them into ``machines``. Returns
+    ``(inserted, updated, conflicts)``; conflicts as error dicts."""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    with conn.cursor() as cur:
+        cur.execute(STAGE_SQL)
+        cur.copy_expert(COPY_SQL, buf)
+        cur.execute(MERGE_SQL[mode])
+        results = cur.fetchall()
+        if mode == "update":
+            # slot quotas were cut from the old capacity: make the next drop
+            # rebalance against the new one
+            cur.execute("""
+                UPDATE machine_counter_slots c SET quota = c.used
+                FROM machine_import s
+                WHERE c.machine_id = s.machine_id AND c.quota <> c.used;
+            """)
+    if dry_run:
+        conn.rollback()
+    else:
+        conn.commit()
+
+    inserted = updated = 0
+    conflicts = []
+    for r in results:
+        if r["inserted"]:
+            inserted += 1
+        elif r["merged"]:
+            updated += 1
+        else:
+            conflicts.append({"line": r["line"], "machine_id": r["machine_id"],
+                              "error": "machine already exists"})
+    return inserted, updated, conflicts
+
+
+def run(conn, stream, mode="skip", dry_run=False):
+    """Parse, stage and merge one CSV. Returns the report."""
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    start = time.perf_counter()
+    rows, errors = parse(stream)
+    parsed = time.perf_counter()
+    total = len(rows) + sum(1 for e in errors if e["line"] > 1)
+    inserted = updated = 0
+    if rows:
+        inserted, updated, conflicts = load(conn, rows, mode, dry_run)
+        errors = sorted(errors + conflicts, key=lambda e: e["line"])
+    return {
+        "mode": mode,
+        "dry_run": dry_run,
+        "rows": total,
+        "valid": len(rows),
+        "inserted": inserted,
+        "updated": updated,
+        "errors": errors,
+        "parse_ms": round((parsed - start) * 1000, 1),
+        "total_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+# ---------------- CLI ----------------
+
+def main(argv=None):
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    ap = argparse.ArgumentParser(description="import machines from CSV")
+    ap.add_argument("path")
+    ap.add_argument("--update", action="store_true", help="overwrite machines that exist")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args(argv)
+
+    conn = psycopg2.connect(os.environ["DATABASE_URL"], cursor_factory=RealDictCursor)
+    try:
+        with open(args.path, newline="", encoding="utf-8-sig") as f:
+            report = run(conn, f, "update" if args.update else "skip", args.dry_run)
+    finally:
+        conn.close()
+    for e in report["errors"]:
+        print(f"line {e['line']}: {e['machine_id'] or '-'}: {e['error']}", file=sys.stderr)
+    print(json.dumps({k: v for k, v in report.items() if k != "errors"}))
+    return 0 if not report["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
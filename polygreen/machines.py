@@ -0,0 +1,206 @@
+from flask import Blueprint, current_app, request, jsonify, session, stream_with_context
+from flask_jwt_extended import jwt_required, verify_jwt_in_request
+
+from polygreen import anomaly, counters, events, ledger, machine_cache, rules
+from polygreen.db import TupleCursor, get_db, release
+from polygreen.serializers import stream_json_array
+
+bp = Blueprint("machines", __name__)
+
+# ----------------------LIST ALL MACHINES API ------------------------------------------------
+
+@bp.route("/api/machines", methods=["GET"])
+@jwt_required()
+def list_machines():
+    if machine_cache.enabled():
+        return current_app.response_class(
+            machine_cache.list_body(),
+            mimetype="application/json"
+        )
+
+    conn = get_db()
+    try:
+        # Server-side cursor: rows are pulled in batches while streaming
+        cur = conn.cursor("list_machines", cursor_factory=TupleCursor)
+        cur.itersize = 500
+        cur.execute(machine_cache.LIST_SQL)
+    except Exception:
+        conn.rollback()
+        release(conn)
+        raise
+
+    def close():
+        cur.close()
+        conn.rollback()
+        release(conn)
+
+    response = current_app.response_class(
+        stream_json_array(cur, key="items"),
+        mimetype="application/json"
+    )
+    response.call_on_close(close)
+    return response
+
+
+# ----------------------LIVE MACHINE STATUS (SSE) ------------------------------------------
+
+@bp.route("/api/machines/events", methods=["GET"])
+def machine_events():
+    # Admin dashboards use their session; apps pass a JWT (EventSource
+    # can't set headers, so ?jwt= is accepted too)
+    if not session.get("admin_logged_in"):
+        verify_jwt_in_request(locations=["headers", "query_string"])
+
+    if not events.streaming_supported():
+        return jsonify(message="Live events are served by the gevent workers"), 503
+
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+
+    response = current_app.response_class(
+        stream_with_context(events.stream(request.args.get("machine_id") or None, last_id)),
+        mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+# --------------------- MACHINE ENDPOINTS --------------------------------------------------
+
+#--------------------MACHINE FECTH USER API----------------------------------------------------
+
+def lookup_user(mobile):
+    """Kiosk user lookup, shared with the kiosk channel. Returns ``(body, status)``."""
+    # Validate mobile format
+    if not mobile or not mobile.isdigit() or not (8 <= len(mobile) <= 15):
+        return {"message": "Invalid mobile number"}, 400
+
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT user_id, name, mobile, bottles, points FROM users_live WHERE mobile=%s",
+                (mobile,)
+            )
+            u = cur.fetchone()
+
+    if not u:
+        return {"message": "User not found. Please register in the mobile application."}, 404
+
+    return {
+        "user_id": u["user_id"],
+        "name": u["name"],
+        "mobile": u["mobile"],
+        "points": u["points"],
+        "bottles": u["bottles"]
+    }, 200
+
+
+@bp.route("/api/user/fetch", methods=["POST"])
+def fetchuser():
+    data = request.get_json() or {}
+    body, status = lookup_user(str(data.get("mobile", "")).strip())
+    return jsonify(body), status
+
+
+#------------------BOTTLE INSERT API----------------------------------------------------------
+
+def insert_bottles(machine_id, user_id, bottle_count, check=True, release=None):
+    """Credit a bottle drop, shared with the kiosk channel. Returns ``(body, status)``.
+    ``check=False`` skips the anomaly detector; ``release`` is the id of a
+    held drop being credited, marked released in the same transaction
+    (409 if it is no longer held)."""
+    # Validation
+    if not (machine_id and user_id):
+        return {"message": "machine_id and user_id required"}, 400
+
+    if bottle_count <= 0:
+        return {"message": "bottle_count must be at least 1"}, 400
+
+    with get_db() as conn:
+        with conn.cursor() as cur:
+
+            # Check user
+            cur.execute("SELECT 1 FROM users WHERE user_id=%s", (user_id,))
+            if not cur.fetchone():
+                return {"message": "User not found"}, 404
+
+            # Check machine
+            cur.execute("SELECT city FROM machines WHERE machine_id=%s", (machine_id,))
+            machine = cur.fetchone()
+            if not machine:
+                return {"message": "Machine not found"}, 404
+
+            # Rates and outliers (in memory; only suspicious drops are written)
+            verdict = anomaly.check(machine_id, user_id, bottle_count) if check else anomaly.OK
+            if verdict.action == "hold":
+                anomaly.record(cur, machine_id, user_id, bottle_count, verdict)
+                conn.commit()
+                return {
+                    "message": "Drop held for review",
+                    "held": True,
+                    "reasons": list(verdict.reasons)
+                }, 202
+
+            # Take capacity (exact, without queueing on the machine row)
+            ok, available_space = counters.reserve_bottles(cur, machine_id, bottle_count)
+
+            # Machine full check
+            if not ok:
+                return {
+                    "message": f"Machine is full! Only {available_space} bottles can be accepted",
+                    "available_space": available_space,
+                    "requested": bottle_count
+                }, 400
+
+            earned_points = rules.points_for(bottle_count, machine_id, machine["city"])
+
+            # Update user
+            counters.add_points(cur, user_id, earned_points, bottle_count)
+
+            # Transaction row (spooled now, written behind once this commits)
+            ledger.stage(cur, user_id, "earn", earned_points, bottle_count, machine_id)
+
+            if verdict.action == "flag":
+                anomaly.record(cur, machine_id, user_id, bottle_count, verdict)
+
+            if release is not None and not anomaly.release(cur, release):
+                conn.rollback()
+                return {"message": "Drop was already handled"}, 409
+
+        ledger.sync()  # the spooled row is on disk before the credit commits
+        conn.commit()
+
+    machine_cache.invalidate()
+
+    # Fetch updated values (including drops not yet folded)
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT user_id, points, bottles FROM users_live WHERE user_id=%s", (user_id,))
+            new_user = cur.fetchone()
+            # Also pushes the new fill level to /api/machines/events subscribers
+            new_machine = events.publish(cur, machine_id)
+
+    return {
+        "message": "Points and bottles added successfully",
+        "earned_points": earned_points,
+        "bottles_added": bottle_count,
+        "user_total_points": new_user["points"],
+        "user_total_bottles": new_user["bottles"],
+        "machine_current_bottles": new_machine["current_bottles"],
+        "machine_available_space": new_machine["max_capacity"] - new_machine["current_bottles"],
+        "machine_is_full": bool(new_machine["is_full"])
+    }, 200
+
+
+@bp.route("/api/machine/insert", methods=["POST"])
+def machine_insert():
+    data = request.get_json() or {}
+    # points_per_bottle from the kiosk is ignored: rates come from points_rules
+    body, status = insert_bottles(
+        data.get("machine_id"), data.get("user_id"), int(data.get("bottle_count", 1))
+    )
+    return jsonify(body), status
@@ -0,0 +1,231 @@
+"""Prometheus metrics exposed on ``/metrics``.
+
+Request latency, per-request DB time and query count, connection
+acquisition, bcrypt, PDF builds, SMS sends, the transaction write-behind
+buffer, open live-event streams, kiosk channels, machine alerts and the
+drop anomaly detector are recorded with
+``prometheus_client``. Each process only touches its own samples; under
+gunicorn set ``PROMETHEUS_MULTIPROC_DIR`` (``gunicorn.conf.py`` does this)
+and every worker writes to its own mmap file, which ``/metrics`` merges on
+scrape.
+"""
+
+import hmac
+import os
+import time
+
+from flask import Response, abort, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client import multiprocess
+
+from polygreen import db
+
+_FAST = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+_SLOW = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+REQUEST_SECONDS = Histogram(
+    "polygreen_http_request_duration_seconds",
+    "Time spent handling a request (to first byte for streamed bodies)",
+    ["method", "endpoint", "status"], buckets=_SLOW,
+)
+REQUEST_DB_SECONDS = Histogram(
+    "polygreen_http_request_db_seconds",
+    "Total time spent in SQL statements per request",
+    ["endpoint"], buckets=_SLOW,
+)
+REQUEST_DB_QUERIES = Histogram(
+    "polygreen_http_request_db_queries",
+    "Number of SQL statements executed per request",
+    ["endpoint"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+QUERY_SECONDS = Histogram(
+    "polygreen_db_statement_duration_seconds",
+    "Duration of individual SQL statements",
+    ["endpoint"], buckets=_FAST,
+)
+DB_CONNECT_SECONDS = Histogram(
+    "polygreen_db_connect_seconds",
+    "Time to open a new database connection",
+    buckets=_FAST,
+)
+DB_ACQUIRE_SECONDS = Histogram(
+    "polygreen_db_pool_acquire_seconds",
+    "Time for get_db() to hand out a pooled connection, waiting for a free one included",
+    buckets=_FAST + (5, 10),
+)
+BCRYPT_SECONDS = Histogram(
+    "polygreen_bcrypt_seconds",
+    "Time spent hashing or verifying passwords",
+    ["op"], buckets=_SLOW,
+)
+PDF_BUILD_SECONDS = Histogram(
+    "polygreen_pdf_build_seconds",
+    "Time to build a PDF report",
+    ["report"], buckets=_SLOW,
+)
+SMS_SECONDS = Histogram(
+    "polygreen_sms_send_seconds",
+    "Latency of Vonage SMS sends",
+    ["result"], buckets=_SLOW,
+)
+SMS_TOTAL = Counter(
+    "polygreen_sms_total",
+    "SMS send attempts by result",
+    ["result"],
+)
+LEDGER_FLUSH_SECONDS = Histogram(
+    "polygreen_ledger_flush_seconds",
+    "Time to write one batch of buffered transaction rows",
+    buckets=_FAST,
+)
+LEDGER_FLUSH_ROWS = Histogram(
+    "polygreen_ledger_flush_rows",
+    "Transaction rows written per flush",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+LEDGER_BUFFERED = Gauge(
+    "polygreen_ledger_buffered_rows",
+    "Transaction rows spooled but not yet in the database",
+    multiprocess_mode="livesum",
+)
+EVENTS_SUBSCRIBERS = Gauge(
+    "polygreen_events_subscribers",
+    "Open /api/machines/events streams",
+    multiprocess_mode="livesum",
+)
+KIOSK_CONNECTIONS = Gauge(
+    "polygreen_kiosk_connections",
+    "Open /ws/kiosk channels",
+    multiprocess_mode="livesum",
+)
+KIOSK_MESSAGES = Counter(
+    "polygreen_kiosk_messages_total",
+    "Messages received on kiosk channels by type",
+    ["type"],
+)
+ALERTS_TOTAL = Counter(
+    "polygreen_alerts_total",
+    "Machine alerts raised by this worker, by rule and whether it won the claim",
+    ["rule", "result"],
+)
+ALERT_SENDS = Counter(
+    "polygreen_alert_sends_total",
+    "Alert notifications by sink and result (sent, digest, error)",
+    ["sink", "result"],
+)
+ANOMALY_CHECK_SECONDS = Histogram(
+    "polygreen_anomaly_check_seconds",
+    "Time the inline anomaly detector adds to a bottle drop",
+    buckets=(.000005, .00001, .000025, .00005, .0001, .00025, .0005, .001),
+)
+ANOMALY_VERDICTS = Counter(
+    "polygreen_anomaly_verdicts_total",
+    "Suspicious bottle drops by rule and action (flag, hold)",
+    ["rule", "action"],
+)
+OUTBOX_RELAYED = Counter(
+    "polygreen_outbox_relayed_total",
+    "Outbox events handed to each relay sink (redeliveries included)",
+    ["sink"],
+)
+OUTBOX_RELAY_ERRORS = Counter(
+    "polygreen_outbox_relay_errors_total",
+    "Failed outbox deliveries by sink (the batch is retried)",
+    ["sink"],
+)
+OUTBOX_LAG = Gauge(
+    "polygreen_outbox_lag_events",
+    "Sequenced outbox events a relay sink has not delivered yet",
+    ["sink"],
+    multiprocess_mode="livemax",
+)
+COMPRESSION_BYTES = Counter(
+    "polygreen_compression_bytes_total",
+    "Response bytes through the compression middleware by coding, before (in) and after (out)",
+    ["coding", "direction"],
+)
+COMPRESSION_SECONDS = Histogram(
+    "polygreen_compression_seconds",
+    "CPU time spent compressing one response body",
+    ["coding"],
+    buckets=(.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1),
+)
+LEDGER_DEAD_ROWS = Counter(
+    "polygreen_ledger_dead_rows_total",
+    "Buffered transaction rows the database rejected (moved to a dead-letter file)",
+)
+
+
+def _endpoint():
+    return request.endpoint or "<unmatched>"
+
+
+# ---------------- DB LISTENERS ----------------
+
+@db.add_statement_listener
+def _on_statement(sql, params, seconds, cursor):
+    if not has_request_context():
+        QUERY_SECONDS.labels("<background>").observe(seconds)
+        return
+    QUERY_SECONDS.labels(_endpoint()).observe(seconds)
+    stats = g.get("_db_stats")
+    if stats is not None:
+        stats[0] += seconds
+        stats[1] += 1
+
+
+@db.add_connect_listener
+def _on_connect(seconds):
+    DB_CONNECT_SECONDS.observe(seconds)
+
+
+@db.add_acquire_listener
+def _on_acquire(seconds):
+    DB_ACQUIRE_SECONDS.observe(seconds)
+
+
+# ---------------- FLASK HOOKS ----------------
+
+def _before_request():
+    g._metrics_start = time.perf_counter()
+    g._db_stats = [0.0, 0]
+
+
+def _after_request(response):
+    start = g.pop("_metrics_start", None)
+    if start is None:
+        return response
+    endpoint = _endpoint()
+    REQUEST_SECONDS.labels(request.method, endpoint, str(response.status_code)).observe(
+        time.perf_counter() - start
+    )
+    db_seconds, db_queries = g.pop("_db_stats", (0.0, 0))
+    REQUEST_DB_SECONDS.labels(endpoint).observe(db_seconds)
+    REQUEST_DB_QUERIES.labels(endpoint).observe(db_queries)
+    return response
+
+
+def _registry():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_view():
+    token = os.getenv("METRICS_TOKEN")
+    if token:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied, token):
+            abort(401)
+    return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Install request hooks and the ``/metrics`` route on ``app``."""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
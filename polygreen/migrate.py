@@ -0,0 +1,218 @@
+"""Forward-only, versioned schema migrations.
+
+Migrations are the ``NNNN_description.sql`` files in ``polygreen/migrations``
+and are applied in order, each recorded in ``schema_migrations`` with a
+checksum so an already-applied file that was edited afterwards is caught.
+A file whose first line is ``-- polygreen: no-transaction`` runs statement
+by statement in autocommit (needed for ``CREATE INDEX CONCURRENTLY``);
+every other file runs in a single transaction.
+
+Run at deploy time (before workers start):
+
+    python -m polygreen.migrate upgrade     # apply pending migrations
+    python -m polygreen.migrate status      # list applied / pending
+    python -m polygreen.migrate check       # exit 1 if an expected index is missing
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+
+import psycopg2
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+NO_TRANSACTION = "-- polygreen: no-transaction"
+LOCK_ID = 0x706F6C79  # "poly": serializes concurrent deploys
+
+# (table, columns, unique) - every index a handler relies on. Matching is
+# by column list, so a primary key or an index under another name counts.
+EXPECTED_INDEXES = [
+    ("users", ("mobile",), True),
+    ("users", ("user_id",), True),
+    ("users", ("created_at",), False),
+    ("machines", ("machine_id",), True),
+    ("transactions", ("user_id", "created_at"), False),
+    ("transactions", ("machine_id", "created_at"), False),
+    ("transactions", ("created_at",), False),
+    ("user_otps", ("mobile",), True),
+]
+
+_FILENAME = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration:
+    def __init__(self, path):
+        m = _FILENAME.match(os.path.basename(path))
+        self.version = int(m.group(1))
+        self.name = m.group(2)
+        self.path = path
+        with open(path, encoding="utf-8") as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION)
+
+    def statements(self):
+        """Split on ``;`` at line ends (no-transaction files keep to simple DDL)."""
+        body = "\n".join(l for l in self.sql.splitlines() if not l.strip().startswith("--"))
+        return [s.strip() for s in re.split(r";\s*$", body, flags=re.MULTILINE) if s.strip()]
+
+    def __repr__(self):
+        return f"{self.version:04d}_{self.name}"
+
+
+def discover(directory=MIGRATIONS_DIR):
+    migrations = [Migration(os.path.join(directory, f))
+                  for f in sorted(os.listdir(directory)) if _FILENAME.match(f)]
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise MigrationError("duplicate migration version numbers")
+    return migrations
+
+
+def _ensure_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version    INTEGER PRIMARY KEY,
+                name       TEXT NOT NULL,
+                checksum   TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+        """)
+    conn.commit()
+
+
+def applied(conn):
+    _ensure_table(conn)
+    with conn.cursor() as cur:
+        cur.execute("SELECT version, checksum FROM schema_migrations ORDER BY version;")
+        rows = cur.fetchall()
+    conn.commit()
+    return {r[0]: r[1] for r in rows}
+
+
+def _apply(conn, migration):
+    if migration.transactional:
+        with conn.cursor() as cur:
+            cur.execute(migration.sql)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+                (migration.version, migration.name, migration.checksum),
+            )
+        conn.commit()
+        return
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for statement in migration.statements():
+                cur.execute(statement)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+                (migration.version, migration.name, migration.checksum),
+            )
+    finally:
+        conn.autocommit = False
+
+
+def upgrade(conn, target=None, log=print):
+    """Apply every pending migration up to ``target`` (inclusive)."""
+    migrations = discover()
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s);", (LOCK_ID,))
+    conn.commit()
+    try:
+        done = applied(conn)
+        for m in migrations:
+            if m.version in done:
+                if done[m.version] != m.checksum:
+                    raise MigrationError(f"{m} was modified after it was applied")
+                continue
+            if target is not None and m.version > target:
+                break
+            log(f"applying {m} ...")
+            _apply(conn, m)
+        return sorted(set(applied(conn)))
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (LOCK_ID,))
+        conn.commit()
+
+
+def missing_indexes(conn):
+    """Expected indexes that do not exist (or exist but are INVALID, e.g.
+    after a failed CREATE INDEX CONCURRENTLY)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT t.relname,
+                   i.indisunique,
+                   ARRAY(
+                       SELECT a.attname
+                       FROM unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+                       JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+                       ORDER BY k.ord
+                   )
+            FROM pg_index i
+            JOIN pg_class t ON t.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            WHERE n.nspname = current_schema() AND i.indisvalid;
+        """)
+        existing = [(table, tuple(cols), unique) for table, unique, cols in cur.fetchall()]
+    conn.commit()
+
+    missing = []
+    for table, columns, unique in EXPECTED_INDEXES:
+        found = any(
+            t == table and cols[:len(columns)] == columns
+            and (not unique or (u and cols == columns))
+            for t, cols, u in existing
+        )
+        if not found:
+            missing.append((table, columns, unique))
+    return missing
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="PolyGreen schema migrations")
+    ap.add_argument("command", choices=["upgrade", "status", "check"])
+    ap.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    ap.add_argument("--target", type=int, help="stop after this version (upgrade)")
+    args = ap.parse_args(argv)
+
+    if not args.database_url:
+        ap.error("--database-url or DATABASE_URL is required")
+
+    conn = psycopg2.connect(args.database_url)
+    try:
+        if args.command == "upgrade":
+            upgrade(conn, target=args.target)
+            args.command = "check" if args.target is None else "status"
+
+        if args.command == "status":
+            done = applied(conn)
+            for m in discover():
+                state = "applied" if m.version in done else "pending"
+                if m.version in done and done[m.version] != m.checksum:
+                    state = "MODIFIED"
+                print(f"{state:8} {m}")
+            return 0
+
+        missing = missing_indexes(conn)
+        for table, columns, unique in missing:
+            kind = "unique index" if unique else "index"
+            print(f"missing {kind} on {table} ({', '.join(columns)})")
+        if not missing:
+            print("all expected indexes present")
+        return 1 if missing else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
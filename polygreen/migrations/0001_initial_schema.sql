@@ -0,0 +1,54 @@
+-- Baseline schema. Everything is IF NOT EXISTS so this also applies
+-- cleanly to databases created before migrations existed.
+
+CREATE TABLE IF NOT EXISTS users (
+    id            SERIAL PRIMARY KEY,
+    user_id       TEXT NOT NULL UNIQUE,
+    name          TEXT NOT NULL,
+    mobile        TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    points        INTEGER NOT NULL DEFAULT 0,
+    bottles       INTEGER NOT NULL DEFAULT 0,
+    created_at    TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS machines (
+    id              SERIAL PRIMARY KEY,
+    machine_id      TEXT NOT NULL UNIQUE,
+    name            TEXT NOT NULL,
+    city            TEXT NOT NULL,
+    lat             DOUBLE PRECISION,
+    lng             DOUBLE PRECISION,
+    current_bottles INTEGER NOT NULL DEFAULT 0,
+    max_capacity    INTEGER NOT NULL DEFAULT 0,
+    total_bottles   INTEGER NOT NULL DEFAULT 0,
+    is_full         BOOLEAN NOT NULL DEFAULT FALSE,
+    last_emptied    TIMESTAMP,
+    created_at      TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS reward_brand (
+    id         SERIAL PRIMARY KEY,
+    name       TEXT NOT NULL,
+    min_points INTEGER NOT NULL DEFAULT 0,
+    active     BOOLEAN NOT NULL DEFAULT TRUE
+);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    id         BIGSERIAL PRIMARY KEY,
+    user_id    TEXT NOT NULL,
+    type       TEXT NOT NULL,
+    points     INTEGER NOT NULL DEFAULT 0,
+    bottles    INTEGER NOT NULL DEFAULT 0,
+    machine_id TEXT,
+    brand_id   INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS user_otps (
+    mobile     TEXT PRIMARY KEY,
+    otp        TEXT NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    verified   BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
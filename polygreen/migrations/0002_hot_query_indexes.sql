@@ -0,0 +1,23 @@
+-- polygreen: no-transaction
+-- Indexes behind every hot lookup. Built CONCURRENTLY so they can be
+-- applied to a live database without blocking writes.
+
+-- login, fetchuser, check-user, register duplicate check
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_mobile_key ON users (mobile);
+-- every user_id lookup (me, points summary, machine insert)
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_user_id_key ON users (user_id);
+-- /admin/users ORDER BY created_at DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_created_at_idx ON users (created_at DESC);
+
+-- machine insert / detail / empty by machine_id
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS machines_machine_id_key ON machines (machine_id);
+
+-- points summary + admin user detail: WHERE user_id ORDER BY created_at DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_user_id_created_at_idx
+    ON transactions (user_id, created_at DESC);
+-- admin machine detail: WHERE machine_id ORDER BY created_at DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_machine_id_created_at_idx
+    ON transactions (machine_id, created_at DESC);
+-- /admin/transactions ORDER BY created_at DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_created_at_idx
+    ON transactions (created_at DESC);
@@ -0,0 +1,79 @@
+-- Range-partition transactions by month on created_at, so recent-history
+-- queries only touch recent partitions and old months can be detached and
+-- archived (see polygreen/partitions.py). Existing rows are copied into the
+-- new table; on a large table, run this in a maintenance window.
+
+-- The old table and its indexes go away below; free up their names.
+DROP INDEX IF EXISTS transactions_user_id_created_at_idx;
+DROP INDEX IF EXISTS transactions_machine_id_created_at_idx;
+DROP INDEX IF EXISTS transactions_created_at_idx;
+ALTER TABLE transactions RENAME TO transactions_unpartitioned;
+ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_pkey
+    TO transactions_unpartitioned_pkey;
+ALTER SEQUENCE transactions_id_seq OWNED BY NONE;
+
+-- No DEFAULT partition: it would stop the planner from reading partitions
+-- in created_at order (which is what lets "latest N" stop early).
+CREATE TABLE transactions (
+    id         BIGINT NOT NULL DEFAULT nextval('transactions_id_seq'),
+    user_id    TEXT NOT NULL,
+    type       TEXT NOT NULL,
+    points     INTEGER NOT NULL DEFAULT 0,
+    bottles    INTEGER NOT NULL DEFAULT 0,
+    machine_id TEXT,
+    brand_id   INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX transactions_user_id_created_at_idx ON transactions (user_id, created_at DESC);
+CREATE INDEX transactions_machine_id_created_at_idx ON transactions (machine_id, created_at DESC);
+CREATE INDEX transactions_created_at_idx ON transactions (created_at DESC);
+
+-- One row per month that was detached and exported to a compressed file.
+CREATE TABLE IF NOT EXISTS transaction_archives (
+    partition   TEXT PRIMARY KEY,
+    range_start TIMESTAMP NOT NULL,
+    range_end   TIMESTAMP NOT NULL,
+    path        TEXT NOT NULL,
+    row_count   BIGINT NOT NULL,
+    sha256      TEXT NOT NULL,
+    archived_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Create the monthly partitions covering [first_month, last_month].
+-- Idempotent and safe to call concurrently; returns how many it created.
+CREATE OR REPLACE FUNCTION polygreen_ensure_transaction_partitions(first_month DATE, last_month DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    m DATE := date_trunc('month', first_month);
+    name TEXT;
+    created INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('polygreen_transaction_partitions'));
+    WHILE m <= last_month LOOP
+        name := 'transactions_' || to_char(m, 'YYYY_MM');
+        IF to_regclass(name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+                name, m, (m + INTERVAL '1 month')::DATE
+            );
+            created := created + 1;
+        END IF;
+        m := (m + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT polygreen_ensure_transaction_partitions(
+    COALESCE((SELECT MIN(created_at) FROM transactions_unpartitioned), NOW())::DATE,
+    GREATEST((SELECT MAX(created_at) FROM transactions_unpartitioned), NOW() + INTERVAL '3 months')::DATE
+);
+
+INSERT INTO transactions (id, user_id, type, points, bottles, machine_id, brand_id, created_at)
+SELECT id, user_id, type, points, bottles, machine_id, brand_id, created_at
+FROM transactions_unpartitioned;
+
+DROP TABLE transactions_unpartitioned;
+ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id;
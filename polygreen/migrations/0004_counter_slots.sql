@@ -0,0 +1,52 @@
+-- Sharded counters for machine fill levels and user balances (see
+-- polygreen/counters.py). Bottle drops update one of several slot rows
+-- instead of the single machines / users row, and a background fold moves
+-- the slot totals back into the canonical rows.
+
+-- Each slot owns a share (quota) of the machine's remaining capacity, so
+-- slots never admit more than the machine can hold:
+--     machines.current_bottles + SUM(quota) <= machines.max_capacity
+CREATE TABLE IF NOT EXISTS machine_counter_slots (
+    machine_id TEXT NOT NULL,
+    slot       SMALLINT NOT NULL,
+    quota      INTEGER NOT NULL DEFAULT 0,
+    used       INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (machine_id, slot)
+);
+
+-- Pending (not yet folded) points and bottles per user.
+CREATE TABLE IF NOT EXISTS user_counter_slots (
+    user_id TEXT NOT NULL,
+    slot    SMALLINT NOT NULL,
+    points  INTEGER NOT NULL DEFAULT 0,
+    bottles INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, slot)
+);
+
+-- Drop-in replacements for the base tables with exact, up-to-date counters.
+CREATE OR REPLACE VIEW machines_live AS
+SELECT m.id, m.machine_id, m.name, m.city, m.lat, m.lng,
+       m.current_bottles + s.used AS current_bottles,
+       m.max_capacity,
+       m.total_bottles + s.used AS total_bottles,
+       m.current_bottles + s.used >= m.max_capacity AS is_full,
+       m.last_emptied, m.created_at
+FROM machines m
+CROSS JOIN LATERAL (
+    SELECT COALESCE(SUM(used), 0)::INTEGER AS used
+    FROM machine_counter_slots c
+    WHERE c.machine_id = m.machine_id
+) s;
+
+CREATE OR REPLACE VIEW users_live AS
+SELECT u.id, u.user_id, u.name, u.mobile, u.password_hash,
+       u.points + s.points AS points,
+       u.bottles + s.bottles AS bottles,
+       u.created_at
+FROM users u
+CROSS JOIN LATERAL (
+    SELECT COALESCE(SUM(points), 0)::INTEGER AS points,
+           COALESCE(SUM(bottles), 0)::INTEGER AS bottles
+    FROM user_counter_slots c
+    WHERE c.user_id = u.user_id
+) s;
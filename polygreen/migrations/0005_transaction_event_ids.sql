@@ -0,0 +1,6 @@
+-- Idempotency key for transaction rows, so the write-behind ledger
+-- (polygreen/ledger.py) can replay spooled rows after a crash without
+-- duplicating any. Unique indexes on a partitioned table must include the
+-- partition key, hence (event_id, created_at); older rows keep NULL.
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS event_id UUID;
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_event_id_key ON transactions (event_id, created_at);
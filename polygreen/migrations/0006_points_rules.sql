@@ -0,0 +1,44 @@
+-- Server-side points rules (polygreen/rules.py). A rule applies to one
+-- machine, one city or everywhere (machine_id and city both NULL), within
+-- an optional campaign window [starts_at, ends_at), on the weekdays in
+-- weekday_mask (bit 0 = Monday) and between start_minute and end_minute of
+-- the day (may wrap past midnight).
+--
+-- points_per_bottle sets the base rate (the most specific matching rule
+-- wins); multiplier scales it (every matching multiplier applies).
+CREATE TABLE IF NOT EXISTS points_rules (
+    id                SERIAL PRIMARY KEY,
+    name              TEXT NOT NULL,
+    campaign          TEXT,
+    machine_id        TEXT,
+    city              TEXT,
+    starts_at         TIMESTAMP,
+    ends_at           TIMESTAMP,
+    weekday_mask      SMALLINT NOT NULL DEFAULT 127,
+    start_minute      SMALLINT,
+    end_minute        SMALLINT,
+    points_per_bottle INTEGER CHECK (points_per_bottle >= 0),
+    multiplier        NUMERIC(6, 3) CHECK (multiplier >= 0),
+    active            BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at        TIMESTAMP NOT NULL DEFAULT NOW(),
+    CHECK (points_per_bottle IS NOT NULL OR multiplier IS NOT NULL),
+    CHECK (machine_id IS NULL OR city IS NULL)
+);
+
+-- Workers keep the rules compiled in memory and reload on this signal.
+CREATE OR REPLACE FUNCTION polygreen_points_rules_changed() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('polygreen_points_rules', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS points_rules_changed ON points_rules;
+CREATE TRIGGER points_rules_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON points_rules
+    FOR EACH STATEMENT EXECUTE FUNCTION polygreen_points_rules_changed();
+
+-- Keep today's behaviour: 10 points per bottle everywhere.
+INSERT INTO points_rules (name, points_per_bottle)
+SELECT 'Default rate', 10
+WHERE NOT EXISTS (SELECT 1 FROM points_rules);
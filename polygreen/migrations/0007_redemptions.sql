@@ -0,0 +1,27 @@
+-- Point redemptions (polygreen/rewards.py). One row per successful
+-- redemption; (user_id, idempotency_key) makes a retried request return the
+-- original coupon instead of spending the points twice.
+CREATE TABLE IF NOT EXISTS redemptions (
+    id              BIGSERIAL PRIMARY KEY,
+    user_id         TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    brand_id        INTEGER NOT NULL,
+    points          INTEGER NOT NULL CHECK (points > 0),
+    balance         INTEGER NOT NULL,
+    coupon          TEXT,
+    created_at      TIMESTAMP NOT NULL DEFAULT NOW(),
+    UNIQUE (user_id, idempotency_key)
+);
+
+-- Workers cache the brand catalog and reload it on this signal.
+CREATE OR REPLACE FUNCTION polygreen_reward_brand_changed() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('polygreen_reward_brand', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS reward_brand_changed ON reward_brand;
+CREATE TRIGGER reward_brand_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON reward_brand
+    FOR EACH STATEMENT EXECUTE FUNCTION polygreen_reward_brand_changed();
@@ -0,0 +1,46 @@
+-- Leaderboards (polygreen/leaderboard.py): points earned per user on the
+-- global board (scope ''), per city, per machine and per week (scope = the
+-- week's Monday, YYYY-MM-DD). Kept up to date by the ledger flush.
+CREATE TABLE IF NOT EXISTS leaderboard_scores (
+    board   TEXT NOT NULL CHECK (board IN ('global', 'city', 'machine', 'week')),
+    scope   TEXT NOT NULL DEFAULT '',
+    user_id TEXT NOT NULL,
+    points  BIGINT NOT NULL,
+    PRIMARY KEY (board, scope, user_id)
+);
+
+-- Top-N is a range scan of this index.
+CREATE INDEX IF NOT EXISTS leaderboard_scores_top_idx
+    ON leaderboard_scores (board, scope, points DESC, user_id);
+
+-- Totals from transaction months that have been archived (and dropped), so
+-- a rebuild from the ledger still counts them. Weekly boards don't need it.
+CREATE TABLE IF NOT EXISTS leaderboard_archived (
+    board   TEXT NOT NULL,
+    scope   TEXT NOT NULL DEFAULT '',
+    user_id TEXT NOT NULL,
+    points  BIGINT NOT NULL,
+    PRIMARY KEY (board, scope, user_id)
+);
+
+-- Backfill from the ledger: all time, plus the last four weeks.
+INSERT INTO leaderboard_scores (board, scope, user_id, points)
+WITH earned AS (
+    SELECT t.user_id, t.machine_id, m.city, t.points, t.created_at
+    FROM transactions t
+    LEFT JOIN machines m ON m.machine_id = t.machine_id
+    WHERE t.type = 'earn' AND t.points > 0
+)
+SELECT 'global', '', user_id, SUM(points) FROM earned GROUP BY user_id
+UNION ALL
+SELECT 'city', city, user_id, SUM(points) FROM earned
+WHERE city IS NOT NULL GROUP BY city, user_id
+UNION ALL
+SELECT 'machine', machine_id, user_id, SUM(points) FROM earned
+WHERE machine_id IS NOT NULL GROUP BY machine_id, user_id
+UNION ALL
+SELECT 'week', to_char(date_trunc('week', created_at), 'YYYY-MM-DD'), user_id, SUM(points)
+FROM earned
+WHERE created_at >= date_trunc('week', LOCALTIMESTAMP) - INTERVAL '3 weeks'
+GROUP BY 2, user_id
+ON CONFLICT DO NOTHING;
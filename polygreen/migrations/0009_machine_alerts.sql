@@ -0,0 +1,16 @@
+-- Machine alerts (polygreen/alerts.py). Every worker evaluates the rules;
+-- the one whose INSERT wins sends the notification, so each alert goes out
+-- once. episode scopes the dedup: the fill cycle (last_emptied) for fill
+-- levels, total_bottles for idleness, the hour for rate spikes.
+CREATE TABLE IF NOT EXISTS machine_alerts (
+    id         BIGSERIAL PRIMARY KEY,
+    machine_id TEXT NOT NULL,
+    rule       TEXT NOT NULL,
+    episode    TEXT NOT NULL,
+    message    TEXT NOT NULL,
+    data       JSONB,
+    fired_at   TIMESTAMP NOT NULL DEFAULT NOW(),
+    UNIQUE (machine_id, rule, episode)
+);
+
+CREATE INDEX IF NOT EXISTS machine_alerts_fired_at_idx ON machine_alerts (fired_at DESC);
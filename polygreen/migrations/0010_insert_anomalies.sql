@@ -0,0 +1,18 @@
+-- Suspicious bottle drops (polygreen/anomaly.py). 'flagged' drops were
+-- credited and are kept for review; 'held' ones were not credited until an
+-- admin releases them ('released') or throws them out ('rejected').
+CREATE TABLE IF NOT EXISTS insert_anomalies (
+    id          BIGSERIAL PRIMARY KEY,
+    machine_id  TEXT NOT NULL,
+    user_id     TEXT NOT NULL,
+    bottles     INTEGER NOT NULL,
+    reasons     TEXT[] NOT NULL,
+    details     JSONB,
+    status      TEXT NOT NULL CHECK (status IN ('flagged', 'held', 'released', 'rejected')),
+    created_at  TIMESTAMP NOT NULL DEFAULT NOW(),
+    resolved_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS insert_anomalies_created_at_idx ON insert_anomalies (created_at DESC);
+CREATE INDEX IF NOT EXISTS insert_anomalies_held_idx ON insert_anomalies (created_at)
+    WHERE status = 'held';
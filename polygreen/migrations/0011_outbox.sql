@@ -0,0 +1,22 @@
+-- Transactional outbox (polygreen/outbox.py). Producers insert events in
+-- their own transaction with no position; the relay numbers committed
+-- events 1, 2, 3, ... in the order it sees them, so readers page through
+-- ``position > offset`` and never skip one that committed late.
+CREATE TABLE IF NOT EXISTS outbox_events (
+    id         BIGSERIAL PRIMARY KEY,
+    position   BIGINT UNIQUE,
+    topic      TEXT NOT NULL,
+    key        TEXT,
+    payload    JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS outbox_events_unsequenced_idx ON outbox_events (id)
+    WHERE position IS NULL;
+
+-- Last position each consumer (relay sinks included) has processed.
+CREATE TABLE IF NOT EXISTS outbox_offsets (
+    consumer   TEXT PRIMARY KEY,
+    position   BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
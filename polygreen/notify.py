@@ -0,0 +1,161 @@
+"""Postgres LISTEN/NOTIFY fan-out inside a worker.
+
+One background thread per process holds a dedicated autocommit connection,
+LISTENs on every channel someone subscribed to and calls the subscribers
+with each payload. Callbacks run on that thread, so keep them short.
+
+If the connection drops, notifications sent meanwhile are lost: after
+reconnecting every callback is called with ``None`` so it can resync from
+the database.
+
+``Cached`` builds on this for small tables every worker keeps in memory
+(points rules, the reward catalog): the value is rebuilt when the table's
+trigger NOTIFYs its channel, and at least every ``max_age`` seconds.
+"""
+
+import collections
+import logging
+import os
+import select
+import threading
+import time
+
+import psycopg2.extensions
+
+from polygreen import db
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_callbacks = collections.defaultdict(list)
+_listening = {}
+_state = {"pid": None}
+
+
+def subscribe(channel, fn):
+    """Call ``fn(payload)`` for every NOTIFY on ``channel`` (and ``fn(None)``
+    after a reconnect)."""
+    with _lock:
+        _callbacks[channel].append(fn)
+        if _state["pid"] != os.getpid():
+            _state["pid"] = os.getpid()
+            _listening.clear()
+            threading.Thread(target=_run, name="pg-listen", daemon=True).start()
+    return fn
+
+
+def wait_listening(channel, timeout=None):
+    """Block until this process is LISTENing on ``channel`` (or ``timeout``
+    seconds pass). Returns whether it is."""
+    with _lock:
+        event = _listening.setdefault(channel, threading.Event())
+    return event.wait(timeout)
+
+
+def _run():
+    backoff = 1.0
+    resync = False
+    while True:
+        try:
+            conn = db.connect(db._database_url())
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        except Exception as e:
+            logger.warning(f"LISTEN connection failed: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        try:
+            listening = set()
+            while True:
+                with _lock:
+                    channels = set(_callbacks) - listening
+                for channel in channels:
+                    with conn.cursor() as cur:
+                        cur.execute(f'LISTEN "{channel}";')
+                    listening.add(channel)
+                    with _lock:
+                        _listening.setdefault(channel, threading.Event()).set()
+                if resync:
+                    # only once we are listening again, so a resync can't
+                    # miss what happens while it runs
+                    resync = False
+                    _dispatch_all(None)
+                backoff = 1.0
+                if select.select([conn], [], [], 1.0)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        n = conn.notifies.pop(0)
+                        _dispatch(n.channel, n.payload)
+        except Exception as e:
+            logger.warning(f"LISTEN connection lost: {e}")
+            resync = True
+            with _lock:
+                for event in _listening.values():
+                    event.clear()
+            time.sleep(backoff)
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def _dispatch(channel, payload):
+    with _lock:
+        fns = list(_callbacks.get(channel, ()))
+    for fn in fns:
+        try:
+            fn(payload)
+        except Exception as e:
+            logger.warning(f"NOTIFY {channel} callback failed: {e}")
+
+
+def _dispatch_all(payload):
+    with _lock:
+        channels = list(_callbacks)
+    for channel in channels:
+        _dispatch(channel, payload)
+
+
+class Cached:
+    """A value built by ``load()`` and kept per process. It is rebuilt on
+    the next ``get()`` after a NOTIFY on ``channel``, after ``invalidate()``
+    or once it is ``max_age`` seconds old. If a rebuild fails the previous
+    value keeps being served (the first load raises)."""
+
+    def __init__(self, channel, load, max_age):
+        self.channel = channel
+        self.load = load
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.value = None
+        self.loaded_at = 0.0
+        self.stale = True
+        self.pid = None
+
+    def _fresh(self):
+        return not self.stale and time.monotonic() - self.loaded_at <= self.max_age
+
+    def get(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.pid, self.value, self.stale = os.getpid(), None, True
+                    subscribe(self.channel, self.invalidate)
+        if not self._fresh():
+            with self.lock:
+                if not self._fresh():
+                    self.stale = False  # a NOTIFY from here on marks it stale again
+                    try:
+                        value = self.load()
+                    except Exception as e:
+                        self.stale = True
+                        if self.value is None:
+                            raise
+                        logger.warning(f"reload of {self.channel} failed: {e}")
+                    else:
+                        self.value, self.loaded_at = value, time.monotonic()
+        return self.value
+
+    def invalidate(self, payload=None):
+        self.stale = True
@@ -0,0 +1,535 @@
+"""Change-data feed: a transactional outbox of ledger and account events.
+
+Producers call ``emit`` with the cursor of the transaction that makes the
+change, so an event exists exactly when its change committed:
+
+* ``ledger.earn`` / ``ledger.redeem`` - every ledger row from
+  ``ledger.stage`` (bottle drops, redemptions), carrying its ``event_id``.
+  With write-behind on, the event commits before the ``transactions`` row
+  is flushed.
+* ``redemption.created`` - a reward redemption (without the coupon code).
+* ``user.registered`` - a new account (id and name only).
+* ``machine.emptied`` - an admin emptied a machine, with the bottles
+  collected.
+
+Events are inserted without a position. The relay (``sequence``) numbers
+committed ones 1, 2, 3, ... under an advisory lock, in the order it sees
+them, so positions are gapless and only ever appear in order: a reader
+that has processed up to ``position`` just asks for ``position > p`` and
+can't miss an event whose transaction committed late. Within one run,
+committed events are numbered in insert order, so a transaction's own
+events stay in the order it emitted them.
+
+The relay then hands each batch to every sink in ``OUTBOX_SINKS`` and only
+afterwards stores the sink's offset in ``outbox_offsets``: delivery is
+at-least-once, and consumers dedupe by ``position``. Sinks (comma
+separated): ``file:<dir>`` (JSON-lines segments, fsynced before the offset
+moves; ``read_files`` reads them back), ``queue:<name>`` (in-process, see
+``queue``) and ``webhook:<url>``. ``register_sink`` adds more. One relay
+runs at a time (a session advisory lock); others stand by.
+
+Consumers that read the table directly use ``Consumer``: keyset pages of
+``OUTBOX_CONSUMER_BATCH`` events along the ``position`` index, each event
+arriving as one JSON column, with the offset stored under the consumer's
+name. Events every consumer has passed are deleted after
+``OUTBOX_RETENTION_DAYS``, so a consumer that stops for good should be
+removed from ``outbox_offsets``.
+
+Every worker runs a relay thread unless ``OUTBOX_RELAY=0`` (one of them
+is active); it can also run on its own:
+
+    python -m polygreen.outbox relay --sinks file:/var/lib/polygreen/outbox
+    python -m polygreen.outbox tail --consumer warehouse --follow
+    python -m polygreen.outbox status
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import queue as queue_module
+import sys
+import threading
+import time
+import urllib.request
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from polygreen import db
+from polygreen.metrics import OUTBOX_LAG, OUTBOX_RELAY_ERRORS, OUTBOX_RELAYED
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("OUTBOX", "1") != "0"  # 0: emit() writes nothing
+RELAY = os.getenv("OUTBOX_RELAY", "1") == "1"
+SINKS = os.getenv("OUTBOX_SINKS", "")
+BATCH = int(os.getenv("OUTBOX_BATCH", "1000"))
+CONSUMER_BATCH = int(os.getenv("OUTBOX_CONSUMER_BATCH", "10000"))
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.5"))
+RETENTION_DAYS = float(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+SEGMENT_EVENTS = int(os.getenv("OUTBOX_SEGMENT_EVENTS", "100000"))
+QUEUE_MAX = int(os.getenv("OUTBOX_QUEUE_MAX", "1000"))
+PURGE_INTERVAL = 300
+PURGE_BATCH = 10000
+
+SEQUENCE_LOCK = 0x0b0c5e01  # held for one sequencing transaction
+RELAY_LOCK = 0x0b0c5e02  # held by the active relay for its whole session
+
+EMIT_SQL = """
+    INSERT INTO outbox_events (topic, key, payload)
+    VALUES (%s, %s, %s);
+"""
+
+SEQUENCE_SQL = """
+    UPDATE outbox_events e
+    SET position = %(top)s + next.n
+    FROM (
+        SELECT id, row_number() OVER (ORDER BY id) AS n
+        FROM (
+            SELECT id FROM outbox_events
+            WHERE position IS NULL
+            ORDER BY id
+            LIMIT %(batch)s
+        ) pending
+    ) next
+    WHERE e.id = next.id;
+"""
+
+# one JSON text per event: cheap to fetch, and json.loads does the rest
+READ_SQL = """
+    SELECT json_build_object(
+        'position', position, 'topic', topic, 'key', key,
+        'payload', payload, 'created_at', created_at
+    )::TEXT
+    FROM outbox_events
+    WHERE position > %(after)s
+      AND (%(topics)s::TEXT[] IS NULL OR topic = ANY(%(topics)s::TEXT[]))
+    ORDER BY position
+    LIMIT %(limit)s;
+"""
+
+SAVE_OFFSET_SQL = """
+    INSERT INTO outbox_offsets (consumer, position, updated_at)
+    VALUES (%s, %s, NOW())
+    ON CONFLICT (consumer) DO UPDATE
+    SET position = EXCLUDED.position, updated_at = EXCLUDED.updated_at;
+"""
+
+PURGE_SQL = """
+    DELETE FROM outbox_events
+    WHERE id IN (
+        SELECT id FROM outbox_events
+        WHERE position < COALESCE((SELECT MIN(position) FROM outbox_offsets),
+                                  (SELECT MAX(position) FROM outbox_events))
+          AND created_at < LOCALTIMESTAMP - make_interval(secs => %s)
+        ORDER BY position
+        LIMIT %s
+    );
+"""
+
+
+def emit(cur, topic, key, payload):
+    """Add an event to the caller's transaction."""
+    if ENABLED:
+        cur.execute(EMIT_SQL, (topic, None if key is None else str(key),
+                               json.dumps(payload, default=str)))
+
+
+# ---------------- READING ----------------
+
+def sequence(conn, batch=BATCH):
+    """Give the next ``batch`` committed events their positions. Returns
+    how many were numbered."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (SEQUENCE_LOCK,))
+        # read after taking the lock: the previous run has committed
+        cur.execute("SELECT COALESCE(MAX(position), 0) AS top FROM outbox_events;")
+        top = _first(cur.fetchone())
+        cur.execute(SEQUENCE_SQL, {"top": top, "batch": batch})
+        numbered = cur.rowcount
+    conn.commit()
+    return numbered
+
+
+def read(conn, after, limit=CONSUMER_BATCH, topics=None):
+    """Up to ``limit`` events after position ``after``, oldest first."""
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute(READ_SQL, {"after": after, "limit": limit,
+                               "topics": list(topics) if topics else None})
+        return [json.loads(line) for line, in cur.fetchall()]
+
+
+def head(conn):
+    """The newest sequenced position (0 if none)."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MAX(position), 0) AS top FROM outbox_events;")
+        return _first(cur.fetchone())
+
+
+def load_offset(conn, consumer):
+    with conn.cursor() as cur:
+        cur.execute("SELECT position FROM outbox_offsets WHERE consumer = %s;", (consumer,))
+        row = cur.fetchone()
+    return _first(row) if row else 0
+
+
+def save_offset(conn, consumer, position):
+    with conn.cursor() as cur:
+        cur.execute(SAVE_OFFSET_SQL, (consumer, position))
+
+
+def _first(row):
+    # RealDictCursor rows (the app's connections) or plain tuples
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+class Consumer:
+    """Reads the feed in position order and remembers how far it got.
+
+    ``for batch in consumer.batches(): ...; consumer.commit()`` processes
+    every event at least once: the offset only moves on ``commit``, so a
+    crash replays the last uncommitted batches. ``start`` overrides the
+    stored offset (e.g. ``0`` to replay everything still retained)."""
+
+    def __init__(self, conn, name, topics=None, batch=CONSUMER_BATCH, start=None):
+        self.conn = conn
+        self.name = name
+        self.topics = topics
+        self.batch = batch
+        self.position = load_offset(conn, name) if start is None else start
+        self.committed = self.position
+        conn.commit()
+
+    def poll(self):
+        """The next batch (possibly empty); doesn't move the offset."""
+        events = read(self.conn, self.position, self.batch, self.topics)
+        self.conn.commit()  # don't sit idle in a transaction between pages
+        if events:
+            self.position = events[-1]["position"]
+        return events
+
+    def batches(self, follow=False, poll_interval=POLL_INTERVAL):
+        """Yield batches until caught up (or forever with ``follow``)."""
+        while True:
+            events = self.poll()
+            if events:
+                yield events
+            elif follow:
+                time.sleep(poll_interval)
+            else:
+                return
+
+    def __iter__(self):
+        for events in self.batches():
+            yield from events
+
+    def commit(self):
+        """Store the position of the last event handed out."""
+        if self.position != self.committed:
+            save_offset(self.conn, self.name, self.position)
+            self.conn.commit()
+            self.committed = self.position
+
+
+# ---------------- SINKS ----------------
+
+class FileSink:
+    """JSON lines in ``<dir>/outbox-<first position>.jsonl``, a new segment
+    every ``OUTBOX_SEGMENT_EVENTS`` events. Each batch is fsynced before the
+    relay stores the offset, so a crash can only repeat events."""
+
+    def __init__(self, directory, segment_events=SEGMENT_EVENTS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_events = segment_events
+        self.path, self.count = None, 0
+        segments = _segments(directory)
+        if segments:
+            self.path = segments[-1]
+            self.count = self._repair(self.path)
+
+    @staticmethod
+    def _repair(path):
+        """Cut a line torn by a crash off the end; returns the line count."""
+        with open(path, "rb+") as f:
+            data = f.read()
+            keep = data.rfind(b"\n") + 1
+            if keep < len(data):
+                logger.warning(f"dropping torn outbox line at the end of {path}")
+                f.truncate(keep)
+        return data.count(b"\n", 0, keep)
+
+    def send(self, events):
+        if self.path is None or self.count >= self.segment_events:
+            self.path = os.path.join(self.directory,
+                                     f"outbox-{events[0]['position']:020d}.jsonl")
+            self.count = 0
+        data = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in events)
+        with open(self.path, "ab") as f:
+            f.write(data.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        self.count += len(events)
+
+
+class QueueSink:
+    """Puts each batch (a list of events) on ``queue(name)``. A full queue
+    fails the delivery, and the relay retries it."""
+
+    def __init__(self, name):
+        self.queue = queue(name or "default")
+
+    def send(self, events):
+        self.queue.put(list(events), timeout=5)
+
+
+class WebhookSink:
+    def __init__(self, url):
+        self.url = url
+
+    def send(self, events):
+        body = json.dumps({"events": events}, separators=(",", ":"))
+        req = urllib.request.Request(self.url, data=body.encode(), method="POST",
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            resp.read()
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def queue(name="default"):
+    """The in-process queue a ``queue:<name>`` sink feeds."""
+    with _queues_lock:
+        if name not in _queues:
+            _queues[name] = queue_module.Queue(maxsize=QUEUE_MAX)
+        return _queues[name]
+
+
+_sink_types = {
+    "file": FileSink,
+    "queue": QueueSink,
+    "webhook": WebhookSink,
+}
+
+
+def register_sink(name, factory):
+    """Make ``name[:arg]`` usable in ``OUTBOX_SINKS``; ``factory(arg)``
+    returns an object with ``send(events)``."""
+    _sink_types[name] = factory
+
+
+def build_sinks(spec=SINKS):
+    sinks = []
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, _, arg = item.partition(":")
+        if name not in _sink_types:
+            raise ValueError(f"unknown outbox sink {name!r}")
+        sinks.append((item, _sink_types[name](arg or None)))
+    return sinks
+
+
+def _segments(directory):
+    return sorted(glob.glob(os.path.join(directory, "outbox-*.jsonl")))
+
+
+def read_files(directory, after=0):
+    """Events from a ``file`` sink's segments after position ``after``,
+    once each (repeats from redelivery are skipped)."""
+    segments = _segments(directory)
+    # start from the last segment that begins at or before after + 1
+    firsts = [int(os.path.basename(p)[7:-6]) for p in segments]
+    start = max([i for i, first in enumerate(firsts) if first <= after + 1] or [0])
+    last = after
+    for path in segments[start:]:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # torn by a crash; the relay wrote it again
+                if event["position"] > last:
+                    last = event["position"]
+                    yield event
+
+
+# ---------------- RELAY ----------------
+
+class Relay:
+    """Sequences new events and feeds every sink from its own offset."""
+
+    def __init__(self, sinks, batch=BATCH, retention_days=RETENTION_DAYS):
+        self.sinks = sinks
+        self.batch = batch
+        self.retention = retention_days * 86400
+        self.retry_at = {}
+        self.purged_at = 0.0
+
+    def step(self, conn):
+        """One round; returns the number of events sequenced or delivered
+        (0 when there was nothing to do)."""
+        done = sequence(conn, self.batch)
+        top = head(conn)
+        conn.commit()
+        for name, sink in self.sinks:
+            if self.retry_at.get(name, 0) <= time.monotonic():
+                done += self._deliver(conn, name, sink, top)
+        if time.monotonic() - self.purged_at > PURGE_INTERVAL:
+            self.purge(conn)
+        return done
+
+    def _deliver(self, conn, name, sink, top):
+        consumer = f"relay:{name}"
+        offset = load_offset(conn, consumer)
+        events = read(conn, offset, self.batch)
+        conn.commit()
+        if not events:
+            OUTBOX_LAG.labels(name).set(0)
+            return 0
+        try:
+            sink.send(events)
+        except Exception as e:
+            OUTBOX_RELAY_ERRORS.labels(name).inc()
+            logger.warning(f"outbox sink {name} failed at position {offset + 1}: {e}")
+            self.retry_at[name] = time.monotonic() + 5
+            return 0
+        save_offset(conn, consumer, events[-1]["position"])
+        conn.commit()
+        OUTBOX_RELAYED.labels(name).inc(len(events))
+        OUTBOX_LAG.labels(name).set(top - events[-1]["position"])
+        return len(events)
+
+    def purge(self, conn):
+        """Delete retained events every consumer has passed."""
+        with conn.cursor() as cur:
+            cur.execute(PURGE_SQL, (self.retention, PURGE_BATCH))
+            deleted = cur.rowcount
+        conn.commit()
+        if deleted < PURGE_BATCH:
+            self.purged_at = time.monotonic()
+        return deleted
+
+    def run(self, connect, stop=None):
+        """Relay until ``stop`` is set: take the relay lock on a connection
+        from ``connect()`` (standing by while another relay holds it), then
+        loop, sleeping ``OUTBOX_POLL_INTERVAL`` when idle."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                conn = connect()
+            except psycopg2.Error as e:
+                logger.warning(f"outbox relay can't connect: {e}")
+                stop.wait(5)
+                continue
+            try:
+                while not stop.is_set() and not self._lead(conn):
+                    stop.wait(5)  # another relay is active
+                if not stop.is_set():
+                    logger.info(f"outbox relay active, sinks: "
+                                f"{', '.join(n for n, _ in self.sinks) or 'none'}")
+                while not stop.is_set():
+                    if not self.step(conn):
+                        stop.wait(POLL_INTERVAL)
+            except psycopg2.Error as e:
+                logger.warning(f"outbox relay failed, reconnecting: {e}")
+                stop.wait(1)
+            finally:
+                conn.close()  # also releases the relay lock
+
+    @staticmethod
+    def _lead(conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s) AS ok;", (RELAY_LOCK,))
+            leader = _first(cur.fetchone())
+        conn.commit()
+        return leader
+
+
+# ---------------- WORKER ----------------
+
+_lock = threading.Lock()
+_state = {"pid": None, "relay": None}
+
+
+def start():
+    """Start this process's relay thread (once per pid; only one relay
+    across the fleet is active at a time). Returns the sink names."""
+    if not (ENABLED and RELAY):
+        return []
+    with _lock:
+        if _state["pid"] != os.getpid():
+            relay = Relay(build_sinks())
+            _state.update(pid=os.getpid(), relay=relay)
+            threading.Thread(
+                target=relay.run,
+                args=(lambda: db.connect(db._database_url(), cursor_factory=RealDictCursor),),
+                name="outbox-relay", daemon=True,
+            ).start()
+    return [name for name, _ in _state["relay"].sinks]
+
+
+# ---------------- CLI ----------------
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="outbox relay and feed tools")
+    ap.add_argument("command", choices=["relay", "tail", "status"])
+    ap.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    ap.add_argument("--sinks", default=SINKS, help="sink list (relay)")
+    ap.add_argument("--consumer", help="store the offset under this name (tail)")
+    ap.add_argument("--from", dest="start", type=int,
+                    help="start after this position instead of the stored offset (tail)")
+    ap.add_argument("--topic", action="append", help="only these topics (tail)")
+    ap.add_argument("--follow", action="store_true", help="keep waiting for events (tail)")
+    args = ap.parse_args(argv)
+
+    if not args.database_url:
+        ap.error("--database-url or DATABASE_URL is required")
+
+    def connect():
+        return psycopg2.connect(args.database_url, cursor_factory=RealDictCursor)
+
+    if args.command == "relay":
+        logging.basicConfig(level=logging.INFO)
+        try:
+            Relay(build_sinks(args.sinks)).run(connect)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    conn = connect()
+    try:
+        if args.command == "status":
+            top = head(conn)
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) AS n FROM outbox_events WHERE position IS NULL;")
+                pending = cur.fetchone()["n"]
+                cur.execute("SELECT consumer, position, updated_at FROM outbox_offsets "
+                            "ORDER BY consumer;")
+                offsets = cur.fetchall()
+            print(f"head {top:,}  not yet sequenced {pending:,}")
+            for o in offsets:
+                print(f"{o['consumer']:40} {o['position']:>14,}  behind {top - o['position']:>12,}"
+                      f"  {o['updated_at']:%Y-%m-%d %H:%M:%S}")
+        else:
+            start = args.start
+            if start is None and not args.consumer:
+                start = 0
+            consumer = Consumer(conn, args.consumer, topics=args.topic, start=start)
+            try:
+                for events in consumer.batches(follow=args.follow):
+                    sys.stdout.write("".join(json.dumps(e) + "\n" for e in events))
+                    sys.stdout.flush()
+                    if args.consumer:
+                        consumer.commit()
+            except KeyboardInterrupt:
+                pass
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""Monthly partitions of ``transactions`` and their archives.
+
+``transactions`` is range-partitioned by month on ``created_at`` (migration
+0003). This module keeps partitions created ahead of time and moves whole
+old months out of the database:
+
+    python -m polygreen.partitions list
+    python -m polygreen.partitions ensure              # current month + PARTITION_MONTHS_AHEAD
+    python -m polygreen.partitions archive --keep-months 24
+
+Every worker runs ``ensure`` at warm-up and then every
+``PARTITION_ENSURE_INTERVAL`` seconds (``start``), so a long-lived worker
+never reaches a month without a partition (there is no DEFAULT partition
+to catch its rows, see migration 0003). Schedule ``archive`` from cron.
+Archiving exports a
+month to ``TRANSACTION_ARCHIVE_DIR/<partition>.csv.gz``, detaches and drops
+the partition and records the file in ``transaction_archives`` (the
+month's earned points are kept in ``leaderboard_archived`` first).
+``archived_rows`` reads those files back for the admin pages' "include
+archived" view.
+"""
+
+import argparse
+import csv
+import datetime as dt
+import gzip
+import hashlib
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from polygreen import ROOT_DIR, db, leaderboard
+
+logger = logging.getLogger(__name__)
+
+MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+ENSURE_INTERVAL = float(os.getenv("PARTITION_ENSURE_INTERVAL", "3600"))
+ENSURE_RETRY = 60.0
+ARCHIVE_DIR = os.getenv("TRANSACTION_ARCHIVE_DIR", os.path.join(ROOT_DIR, "archive"))
+
+COLUMNS = ("id", "user_id", "type", "points", "bottles", "machine_id", "brand_id", "created_at",
+           "event_id")
+_INT_COLUMNS = ("id", "points", "bottles", "brand_id")
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return dt.date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def ensure(conn, ahead=MONTHS_AHEAD, today=None):
+    """Create any missing partitions from this month to ``ahead`` months out."""
+    first = (today or dt.date.today()).replace(day=1)
+    with conn.cursor() as cur:
+        cur.execute("SELECT polygreen_ensure_transaction_partitions(%s, %s) AS created;",
+                    (first, _add_months(first, ahead)))
+        (created,) = _values(cur.fetchone(), ("created",))
+    conn.commit()
+    return created
+
+
+def _ensure_pooled():
+    with db.get_db() as conn:
+        return ensure(conn)
+
+
+def _ensure_loop(delay):
+    while True:
+        time.sleep(delay * random.uniform(0.9, 1.1))
+        try:
+            created = _ensure_pooled()
+            if created:
+                logger.info(f"created {created} transactions partition(s)")
+            delay = ENSURE_INTERVAL
+        except Exception as e:
+            logger.warning(f"ensuring transactions partitions failed, will retry: {e}")
+            delay = min(ENSURE_INTERVAL, ENSURE_RETRY)
+
+
+_lock = threading.Lock()
+_state = {"pid": None}
+
+
+def start():
+    """Run ``ensure`` now and then every ``ENSURE_INTERVAL`` seconds in the
+    background of this process (once per pid). Returns the number of
+    partitions created now; if that fails the loop retries every
+    ``ENSURE_RETRY`` seconds until it succeeds."""
+    with _lock:
+        if _state["pid"] == os.getpid():
+            return 0
+        _state["pid"] = os.getpid()
+    delay = min(ENSURE_INTERVAL, ENSURE_RETRY)
+    try:
+        created = _ensure_pooled()
+        delay = ENSURE_INTERVAL
+        return created
+    finally:
+        if ENSURE_INTERVAL > 0:
+            threading.Thread(target=_ensure_loop, args=(delay,), name="partition-ensure",
+                             daemon=True).start()
+
+
+def partitions(conn):
+    """``[(name, range_start, range_end, rows_estimate)]`` oldest first."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname AS name,
+                   pg_get_expr(c.relpartbound, c.oid) AS bound,
+                   GREATEST(c.reltuples, 0)::BIGINT AS rows
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'transactions'::regclass;
+        """)
+        rows = cur.fetchall()
+    conn.commit()
+
+    result = []
+    for row in rows:
+        name, bound, estimate = _values(row, ("name", "bound", "rows"))
+        # FOR VALUES FROM ('2025-01-01 00:00:00') TO ('2025-02-01 00:00:00')
+        start, end = bound.split("'")[1], bound.split("'")[3]
+        result.append((name, dt.datetime.fromisoformat(start),
+                       dt.datetime.fromisoformat(end), estimate))
+    return sorted(result, key=lambda p: p[1])
+
+
+def _values(row, keys):
+    # works with both the app's RealDictCursor and plain tuple cursors
+    return tuple(row[k] for k in keys) if isinstance(row, dict) else tuple(row)
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def archive(conn, before, directory=ARCHIVE_DIR, log=print):
+    """Export, detach and drop every partition that ends on or before
+    ``before``. Each month is its own transaction; the file is fsynced
+    before the partition is dropped."""
+    os.makedirs(directory, exist_ok=True)
+    archived = []
+    for name, start, end, _ in partitions(conn):
+        if end > before:
+            break
+        path = os.path.join(directory, f"{name}.csv.gz")
+        tmp = path + ".tmp"
+        with conn.cursor() as cur:
+            # old months take no writes, but make sure nothing slips in
+            # between the export and the drop
+            cur.execute(f'LOCK TABLE "{name}" IN SHARE MODE;')
+            cur.execute(f'SELECT COUNT(*) AS n FROM "{name}";')
+            (count,) = _values(cur.fetchone(), ("n",))
+            with open(tmp, "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                    cur.copy_expert(
+                        f'COPY (SELECT {", ".join(COLUMNS)} FROM "{name}" ORDER BY created_at, id) '
+                        f"TO STDOUT WITH (FORMAT csv, HEADER)", f)
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(tmp, path)
+            digest = _sha256(path)
+
+            leaderboard.fold_archived(cur, name)
+            cur.execute(f'ALTER TABLE transactions DETACH PARTITION "{name}";')
+            cur.execute("""
+                INSERT INTO transaction_archives
+                    (partition, range_start, range_end, path, row_count, sha256)
+                VALUES (%s, %s, %s, %s, %s, %s);
+            """, (name, start, end, os.path.basename(path), count, digest))
+            cur.execute(f'DROP TABLE "{name}";')
+        conn.commit()
+        log(f"archived {name}: {count:,} rows -> {path}")
+        archived.append(name)
+    return archived
+
+
+def archived_rows(conn, user_id=None, machine_id=None, start=None, end=None,
+                  directory=ARCHIVE_DIR):
+    """Rows from archived months matching the filters, newest first, shaped
+    like ``serializers.map_rows`` output (ISO timestamps). Reads the files,
+    so it is only meant for occasional look-ups."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT path FROM transaction_archives
+            WHERE (%(start)s IS NULL OR range_end > %(start)s)
+              AND (%(end)s IS NULL OR range_start < %(end)s)
+            ORDER BY range_start DESC;
+        """, {"start": start, "end": end})
+        paths = [_values(r, ("path",))[0] for r in cur.fetchall()]
+    conn.commit()
+
+    for path in paths:
+        full = os.path.join(directory, path)
+        if not os.path.exists(full):
+            raise FileNotFoundError(f"transaction archive {full} is missing")
+        with gzip.open(full, "rt", newline="") as f:
+            rows = []
+            for row in csv.DictReader(f):
+                if user_id is not None and row["user_id"] != user_id:
+                    continue
+                if machine_id is not None and row["machine_id"] != machine_id:
+                    continue
+                created = dt.datetime.fromisoformat(row["created_at"])
+                if (start and created < start) or (end and created >= end):
+                    continue
+                for key in _INT_COLUMNS:
+                    row[key] = int(row[key]) if row[key] else None
+                row["machine_id"] = row["machine_id"] or None
+                row["event_id"] = row.get("event_id") or None
+                row["created_at"] = created.isoformat()
+                rows.append(row)
+        yield from reversed(rows)
+
+
+def main(argv=None):
+    import psycopg2
+
+    ap = argparse.ArgumentParser(description="transactions partition maintenance")
+    ap.add_argument("command", choices=["list", "ensure", "archive"])
+    ap.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    ap.add_argument("--ahead", type=int, default=MONTHS_AHEAD, help="months (ensure)")
+    ap.add_argument("--keep-months", type=int, default=24,
+                    help="archive months older than this many (archive)")
+    ap.add_argument("--dir", default=ARCHIVE_DIR, help="archive directory")
+    args = ap.parse_args(argv)
+
+    if not args.database_url:
+        ap.error("--database-url or DATABASE_URL is required")
+
+    conn = psycopg2.connect(args.database_url)
+    try:
+        if args.command == "ensure":
+            print(f"created {ensure(conn, args.ahead)} partition(s)")
+        elif args.command == "archive":
+            cutoff = _add_months(dt.date.today().replace(day=1), -args.keep_months)
+            done = archive(conn, dt.datetime.combine(cutoff, dt.time()), args.dir)
+            print(f"archived {len(done)} partition(s) older than {cutoff}")
+        else:
+            for name, start, end, estimate in partitions(conn):
+                print(f"{name:24} {start:%Y-%m-%d} .. {end:%Y-%m-%d}  ~{estimate:,} rows")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""PDF reports for the admin pages.
+
+ReportLab (and the Korean CID fonts) are only needed by the report routes,
+so this module is imported lazily from them instead of at app start.
+"""
+
+import logging
+from io import BytesIO
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter, A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.platypus import (
+    SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+)
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+
+from polygreen.metrics import PDF_BUILD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# ---------------- FONTS ----------------
+
+_fonts_registered = None
+
+
+def register_fonts():
+    """Register the Korean CID fonts once per process (unavailable on some
+    hosts, e.g. AWS Beanstalk) and report whether that worked."""
+    global _fonts_registered
+    if _fonts_registered is None:
+        try:
+            pdfmetrics.registerFont(UnicodeCIDFont("HYSMyeongJo-Medium"))
+            pdfmetrics.registerFont(UnicodeCIDFont("HYGothic-Medium"))
+            _fonts_registered = True
+        except Exception as e:
+            logger.warning(f"Korean fonts unavailable: {e}")
+            _fonts_registered = False
+    return _fonts_registered
+
+
+def _body_font():
+    return "HYSMyeongJo-Medium" if register_fonts() else "Helvetica"
+
+
+def _styles():
+    styles = getSampleStyleSheet()
+    if register_fonts():
+        styles["Normal"].fontName = "HYSMyeongJo-Medium"
+        styles["Heading1"].fontName = "HYSMyeongJo-Medium"
+    else:
+        styles["Normal"].fontName = "Helvetica"
+        styles["Heading1"].fontName = "Helvetica-Bold"
+    return styles
+
+
+def _table_style(grid=0.7, align="CENTER", extra=()):
+    return TableStyle([
+        ("FONTNAME", (0, 0), (-1, -1), _body_font()),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#006d71")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("ALIGN", (0, 0), (-1, -1), align),
+        ("GRID", (0, 0), (-1, -1), grid, colors.black),
+        *extra,
+    ])
+
+
+def _build(report, doc, elements, buffer):
+    with PDF_BUILD_SECONDS.labels(report).time():
+        doc.build(elements)
+    buffer.seek(0)
+    return buffer
+
+
+# ---------------- SIMPLE TEXT PDF ----------------
+
+def generate_pdf(title, lines):
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer, pagesize=letter)
+    title_font, body_font = (
+        ("HYGothic-Medium", "HYGothic-Medium") if register_fonts()
+        else ("Helvetica-Bold", "Helvetica")
+    )
+
+    # --- Title font ---
+    p.setFont(title_font, 16)
+
+    y = 750
+    p.drawString(50, y, str(title))
+
+    # --- Body font ---
+    p.setFont(body_font, 12)
+
+    y -= 40
+
+    # --- Content Lines ---
+    for line in lines:
+        p.drawString(50, y, str(line))
+        y -= 20
+
+        # New page if space ends
+        if y < 50:
+            p.showPage()
+            p.setFont(body_font, 12)
+            y = 750
+
+    # Finalize PDF
+    p.save()
+    buffer.seek(0)
+    return buffer
+
+
+# ---------------- ADMIN REPORTS ----------------
+
+def users_report(data):
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = _styles()
+
+    elements = []
+    elements.append(Paragraph("사용자 보고서", styles["Heading1"]))
+    elements.append(Spacer(1, 12))
+
+    # Table header
+    table_data = [["ID", "이름", "전화번호", "포인트", "병"]]
+
+    # Rows
+    for u in data:
+        table_data.append([
+            u.get("user_id", ""),
+            u.get("name", ""),
+            u.get("mobile", ""),
+            u.get("points", ""),
+            u.get("bottles", "")
+        ])
+
+    table = Table(table_data, repeatRows=1)
+    table.setStyle(_table_style())
+    elements.append(table)
+
+    return _build("users", doc, elements, buffer)
+
+
+def user_transactions_report(user, data):
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = _styles()
+
+    elements = []
+    elements.append(Paragraph("사용자 거래 보고서", styles["Heading1"]))
+    elements.append(Spacer(1, 12))
+
+    # User info block
+    user_info = f"""
+    사용자 ID: {user.get('user_id')}<br/>
+    이름: {user.get('name')}<br/>
+    전화번호: {user.get('mobile')}<br/>
+    포인트: {user.get('points')}<br/>
+    병 수: {user.get('bottles')}<br/>
+    생성 날짜: {user.get('created_at')}
+    """
+
+    elements.append(Paragraph(user_info, styles["Normal"]))
+    elements.append(Spacer(1, 15))
+
+    # Table header
+    table_data = [["ID", "유형", "포인트", "병", "머신 ID", "날짜"]]
+
+    # Table rows
+    for t in data:
+        table_data.append([
+            t.get("id", ""),
+            t.get("type", ""),
+            t.get("points", ""),
+            t.get("bottles", ""),
+            t.get("machine_id", ""),
+            t.get("created_at", "")
+        ])
+
+    table = Table(table_data, repeatRows=1)
+    table.setStyle(_table_style())
+    elements.append(table)
+
+    return _build("user_detail", doc, elements, buffer)
+
+
+def machines_report(data):
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        leftMargin=20,
+        rightMargin=20
+    )
+    styles = _styles()
+
+    # Heading formatting (Korean-safe)
+    styles["Heading1"].bold = False
+    styles["Heading1"].italic = False
+    styles["Heading1"].fontSize = 16
+    styles["Heading1"].leading = 20
+
+    elements = []
+    elements.append(Paragraph("기계 보고서 (필터링됨)", styles["Heading1"]))
+    elements.append(Spacer(1, 12))
+
+    # Table headers
+    header = [
+        "Machine ID", "Name", "City", "Current",
+        "Max", "Total", "Full?", "Last Emptied"
+    ]
+
+    table_data = [header]
+
+    # Table rows
+    for m in data:
+        table_data.append([
+            m.get("machine_id", ""),
+            m.get("name", ""),
+            m.get("city", ""),
+            m.get("current_bottles", ""),
+            m.get("max_capacity", ""),
+            m.get("total_bottles", ""),
+            m.get("is_full", ""),
+            m.get("last_emptied", ""),
+        ])
+
+    # Column widths
+    col_widths = [60, 70, 60, 45, 45, 45, 40, 135]
+
+    table = Table(table_data, colWidths=col_widths, repeatRows=1)
+    table.setStyle(_table_style(grid=0.4, extra=[("FONTSIZE", (0, 0), (-1, -1), 8)]))
+    elements.append(table)
+
+    return _build("machines", doc, elements, buffer)
+
+
+def machine_detail_report(machine, transactions):
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = _styles()
+
+    elements = []
+
+    # Report Title
+    elements.append(Paragraph("기계 상세 보고서 (Machine Detail Report)", styles["Heading1"]))
+    elements.append(Spacer(1, 12))
+
+    # Machine info table
+    info_data = [
+        ["Machine ID", machine.get("machine_id", "")],
+        ["Name", machine.get("name", "")],
+        ["City", machine.get("city", "")],
+        ["Latitude", machine.get("lat", "")],
+        ["Longitude", machine.get("lng", "")],
+        ["Total Bottles", machine.get("total", "")],
+        ["Current Capacity", f"{machine.get('current', '')} / {machine.get('max', '')}"],
+        ["Is Full", machine.get("full", "")],
+        ["Created At", machine.get("created_at", "")],
+        ["Last Emptied", machine.get("last_emptied", "")]
+    ]
+
+    info_table = Table(info_data, colWidths=[120, 300])
+    info_table.setStyle(_table_style(
+        grid=0.5, align="LEFT", extra=[("VALIGN", (0, 0), (-1, -1), "MIDDLE")]
+    ))
+
+    elements.append(info_table)
+    elements.append(Spacer(1, 20))
+
+    # Transactions table
+    table_data = [["ID", "User ID", "Type", "Points", "Bottles", "Date"]]
+
+    for t in transactions:
+        table_data.append([
+            t.get("id", ""),
+            t.get("user_id", ""),
+            t.get("type", ""),
+            t.get("points", ""),
+            t.get("bottles", ""),
+            t.get("created_at", "")
+        ])
+
+    trx_table = Table(table_data, repeatRows=1)
+    trx_table.setStyle(_table_style(grid=0.5))
+    elements.append(trx_table)
+
+    return _build("machine_detail", doc, elements, buffer)
+
+
+def transactions_report(data):
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = _styles()
+
+    elements = []
+    elements.append(Paragraph("필터링된 거래 보고서", styles["Heading1"]))
+    elements.append(Spacer(1, 12))
+
+    # Table header
+    table_data = [["ID", "사용자 ID", "유형", "포인트", "병", "머신 ID", "날짜"]]
+
+    # Rows
+    for t in data:
+        table_data.append([
+            t.get("id", ""),
+            t.get("user_id", ""),
+            t.get("type", ""),
+            t.get("points", ""),
+            t.get("bottles", ""),
+            t.get("machine_id", ""),
+            t.get("created_at", ""),
+        ])
+
+    table = Table(table_data, repeatRows=1)
+    table.setStyle(_table_style())
+    elements.append(table)
+
+    return _build("transactions", doc, elements, buffer)
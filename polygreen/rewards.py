@@ -0,0 +1,161 @@
+"""Reward brand catalog and point redemption.
+
+The active ``reward_brand`` rows are cached per worker (with the encoded
+``/api/redeem/brands`` body) and rebuilt when the table changes: a trigger
+NOTIFYs ``polygreen_reward_brand`` (migration 0007, see ``notify``), with a
+``REWARD_CATALOG_MAX_AGE`` second safety net.
+
+``redeem`` spends points with a single conditional ``UPDATE users ... WHERE
+points >= n RETURNING``. Concurrent redemptions against one account queue
+on that row and each re-checks the balance the previous one left, so the
+balance can't go negative. Points still sitting in ``user_counter_slots``
+(see ``counters``) are folded into the row by the same statement, so the
+check is against the live balance.
+
+Every request carries an idempotency key. The first request with a key
+claims a ``redemptions`` row before spending; a retry (or a concurrent
+duplicate, which waits for the first to commit) gets the stored result
+back instead of spending again.
+"""
+
+import json
+import os
+
+from polygreen import db, ledger, notify, outbox
+
+MAX_AGE = float(os.getenv("REWARD_CATALOG_MAX_AGE", "300"))
+CHANNEL = "polygreen_reward_brand"
+
+CATALOG_SQL = """
+    SELECT id, name, min_points
+    FROM reward_brand
+    WHERE active
+    ORDER BY min_points, id;
+"""
+
+CLAIM_SQL = """
+    INSERT INTO redemptions (user_id, idempotency_key, brand_id, points, balance)
+    VALUES (%s, %s, %s, %s, 0)
+    ON CONFLICT (user_id, idempotency_key) DO NOTHING
+    RETURNING id;
+"""
+
+# Fold pending slot points into the row and spend in one statement. The
+# DELETE takes the slot rows it folds, so a concurrent fold (or redemption)
+# can't count them a second time.
+SPEND_SQL = """
+    WITH moved AS (
+        DELETE FROM user_counter_slots
+        WHERE user_id = %(user_id)s
+        RETURNING points, bottles
+    ), pending AS (
+        SELECT COALESCE(SUM(points), 0) AS points, COALESCE(SUM(bottles), 0) AS bottles
+        FROM moved
+    )
+    UPDATE users u
+    SET points = u.points + p.points - %(points)s,
+        bottles = u.bottles + p.bottles
+    FROM pending p
+    WHERE u.user_id = %(user_id)s
+      AND u.points + p.points >= %(points)s
+    RETURNING u.points AS balance;
+"""
+
+
+class RedeemError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# ---------------- CATALOG ----------------
+
+class Catalog:
+    def __init__(self, rows):
+        self.items = [{"id": r["id"], "name": r["name"], "min_points": r["min_points"]}
+                      for r in rows]
+        self.by_id = {item["id"]: item for item in self.items}
+        self.body = json.dumps({"items": self.items}, ensure_ascii=False,
+                               separators=(",", ":")).encode()
+
+
+def load():
+    with db.get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CATALOG_SQL)
+            rows = cur.fetchall()
+    return Catalog(rows)
+
+
+_cache = notify.Cached(CHANNEL, load, MAX_AGE)
+
+
+def catalog():
+    return _cache.get()
+
+
+def invalidate():
+    _cache.invalidate()
+
+
+def prime():
+    return len(catalog().items)
+
+
+# ---------------- REDEMPTION ----------------
+
+def redeem(cur, user_id, brand_id, points, key):
+    """Spend ``points`` on ``brand_id`` in the caller's transaction.
+
+    Returns ``(result, replayed)``: the redemption as a dict and whether
+    this is a stored earlier result. Call ``ledger.sync`` before
+    committing. Raises
+    ``RedeemError``; the caller must then roll back."""
+    brand = catalog().by_id.get(brand_id)
+    if brand is None:
+        raise RedeemError("Invalid brand")
+    if points < brand["min_points"]:
+        raise RedeemError(f"Minimum required for this brand is {brand['min_points']}")
+
+    cur.execute(CLAIM_SQL, (user_id, key, brand_id, points))
+    claim = cur.fetchone()
+    if claim is None:
+        cur.execute("""
+            SELECT id, brand_id, points, balance, coupon
+            FROM redemptions
+            WHERE user_id = %s AND idempotency_key = %s;
+        """, (user_id, key))
+        done = cur.fetchone()
+        if done["brand_id"] != brand_id or done["points"] != points:
+            raise RedeemError("Idempotency key was already used for a different request", 422)
+        return _result(done), True
+
+    cur.execute(SPEND_SQL, {"user_id": user_id, "points": points})
+    spent = cur.fetchone()
+    if spent is None:
+        cur.execute("SELECT 1 FROM users WHERE user_id = %s;", (user_id,))
+        if cur.fetchone() is None:
+            raise RedeemError("User not found", 404)
+        raise RedeemError("Not enough points")
+
+    coupon = f"{brand['name'][:3].upper()}-{user_id}-{str(claim['id']).zfill(4)}"
+    cur.execute("UPDATE redemptions SET balance = %s, coupon = %s WHERE id = %s;",
+                (spent["balance"], coupon, claim["id"]))
+    ledger.stage(cur, user_id, "redeem", points, 0, brand_id=brand_id)
+    done = {"id": claim["id"], "brand_id": brand_id, "points": points,
+            "balance": spent["balance"], "coupon": coupon}
+    outbox.emit(cur, "redemption.created", user_id, {
+        "redemption_id": claim["id"], "user_id": user_id, "brand_id": brand_id,
+        "points": points, "balance": spent["balance"],
+    })
+    return _result(done), False
+
+
+def _result(row):
+    return {
+        "redemption_id": row["id"],
+        "brand_id": row["brand_id"],
+        "points": row["points"],
+        "balance": row["balance"],
+        "coupon": row["coupon"],
+    }
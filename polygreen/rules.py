@@ -0,0 +1,168 @@
+"""Server-side points rules, compiled into an in-memory lookup.
+
+The ``points_rules`` table (migration 0006) holds base rates and
+multipliers scoped to a machine, a city or everything, optionally limited
+to a campaign window, weekdays and a time of day. Each worker compiles the
+active rules into per-machine / per-city / global lists, so pricing a drop
+is a couple of dict lookups and a short scan, with no query.
+
+The compiled set is rebuilt when the table changes (a trigger NOTIFYs
+``polygreen_points_rules``; see ``notify``) and at least every
+``POINTS_RULES_MAX_AGE`` seconds as a safety net. Times are the server's
+local time.
+
+Resolution: the base rate comes from the most specific matching rule
+(machine, then city, then global; newest first within a level), falling
+back to ``POINTS_PER_BOTTLE``. Every matching multiplier applies on top.
+"""
+
+import datetime as dt
+import os
+
+from polygreen import db, notify
+
+DEFAULT_POINTS = int(os.getenv("POINTS_PER_BOTTLE", "10"))
+MAX_AGE = float(os.getenv("POINTS_RULES_MAX_AGE", "300"))
+CHANNEL = "polygreen_points_rules"
+
+LOAD_SQL = """
+    SELECT id, machine_id, city, starts_at, ends_at, weekday_mask,
+           start_minute, end_minute, points_per_bottle, multiplier
+    FROM points_rules
+    WHERE active AND (ends_at IS NULL OR ends_at > LOCALTIMESTAMP)
+    ORDER BY id DESC;
+"""
+
+
+class Rule:
+    __slots__ = ("id", "starts", "ends", "weekdays", "start_minute", "end_minute",
+                 "base", "multiplier")
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.starts = row["starts_at"]
+        self.ends = row["ends_at"]
+        mask = row["weekday_mask"]
+        self.weekdays = None if mask is None or mask & 127 == 127 else mask
+        self.start_minute = row["start_minute"]
+        self.end_minute = row["end_minute"]
+        self.base = row["points_per_bottle"]
+        self.multiplier = None if row["multiplier"] is None else float(row["multiplier"])
+
+    def applies(self, when, weekday_bit, minute):
+        if self.starts is not None and when < self.starts:
+            return False
+        if self.ends is not None and when >= self.ends:
+            return False
+        if self.weekdays is not None and not self.weekdays & weekday_bit:
+            return False
+        if self.start_minute is not None:
+            start, end = self.start_minute, self.end_minute if self.end_minute is not None else 1440
+            if start <= end:
+                return start <= minute < end
+            return minute >= start or minute < end  # wraps past midnight
+        return True
+
+
+    def hours(self):
+        """The hours of the day (0-23) this rule can apply in."""
+        if self.start_minute is None:
+            return range(24)
+        start = self.start_minute
+        end = self.end_minute if self.end_minute is not None else 1440
+        if start <= end:
+            return range(start // 60, (end + 59) // 60)
+        return [h for h in range(24) if h >= start // 60 or h < (end + 59) // 60]
+
+
+# Buckets with more rules than this are indexed by (weekday, hour)
+INDEX_THRESHOLD = 16
+_NONE = []
+
+
+def _compile(bucket):
+    """A list of rules, or for a big bucket a 168-slot (weekday, hour) tuple
+    of the rules that can apply in that hour, in the same order."""
+    if len(bucket) <= INDEX_THRESHOLD:
+        return bucket
+    slots = [[] for _ in range(7 * 24)]
+    for rule in bucket:
+        for day in range(7):
+            if rule.weekdays is None or rule.weekdays & (1 << day):
+                for hour in rule.hours():
+                    slots[day * 24 + hour].append(rule)
+    return tuple(slots)
+
+
+class RuleSet:
+    """Active rules bucketed by scope, most specific bucket first."""
+
+    def __init__(self, rows, default=DEFAULT_POINTS):
+        self.default = default
+        by_machine, by_city, everywhere = {}, {}, []
+        for row in rows:  # newest first
+            rule = Rule(row)
+            if row["machine_id"] is not None:
+                by_machine.setdefault(row["machine_id"], []).append(rule)
+            elif row["city"] is not None:
+                by_city.setdefault(row["city"], []).append(rule)
+            else:
+                everywhere.append(rule)
+        self.by_machine = {k: _compile(v) for k, v in by_machine.items()}
+        self.by_city = {k: _compile(v) for k, v in by_city.items()}
+        self.everywhere = _compile(everywhere)
+        self.size = len(rows)
+
+    def rate(self, machine_id, city, when):
+        """``(points_per_bottle, multiplier)`` for a drop at ``when``."""
+        weekday = when.weekday()
+        weekday_bit = 1 << weekday
+        minute = when.hour * 60 + when.minute
+        slot = weekday * 24 + when.hour
+        base, multiplier = None, 1.0
+        for bucket in (self.by_machine.get(machine_id, _NONE), self.by_city.get(city, _NONE),
+                       self.everywhere):
+            if isinstance(bucket, tuple):
+                bucket = bucket[slot]
+            for rule in bucket:
+                if base is not None and rule.multiplier is None:
+                    continue
+                if not rule.applies(when, weekday_bit, minute):
+                    continue
+                if base is None and rule.base is not None:
+                    base = rule.base
+                if rule.multiplier is not None:
+                    multiplier *= rule.multiplier
+        return (self.default if base is None else base), multiplier
+
+    def points(self, bottles, machine_id, city, when):
+        base, multiplier = self.rate(machine_id, city, when)
+        return int(round(bottles * base * multiplier))
+
+
+def load():
+    with db.get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute(LOAD_SQL)
+            rows = cur.fetchall()
+    return RuleSet(rows)
+
+
+_cache = notify.Cached(CHANNEL, load, MAX_AGE)
+
+
+def current():
+    """This worker's compiled rules (loads them on first use)."""
+    return _cache.get()
+
+
+def invalidate():
+    _cache.invalidate()
+
+
+def points_for(bottles, machine_id, city, when=None):
+    return current().points(bottles, machine_id, city, when or dt.datetime.now())
+
+
+def prime():
+    return current().size
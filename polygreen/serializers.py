@@ -0,0 +1,158 @@
+"""Compiled row serializers.
+
+Handlers used to fetch RealDictCursor rows, run ``serialize_row`` over every
+dict to patch datetimes and then copy the result into yet another dict for
+``jsonify``. The helpers here look at ``cursor.description`` once per query
+shape, generate a small specialised function for it and turn plain cursor
+tuples straight into JSON (or into template-ready dicts) in a single pass.
+"""
+
+import json
+import math
+import threading
+
+# ---------------- POSTGRES TYPE OIDS ----------------
+
+_INT_OIDS = {20, 21, 23, 26}            # int8, int2, int4, oid
+_FLOAT_OIDS = {700, 701}                # float4, float8
+_NUMERIC_OIDS = {1700}                  # numeric -> Decimal
+_BOOL_OIDS = {16}
+_TEMPORAL_OIDS = {1082, 1083, 1114, 1184, 1266}  # date, time, timestamp(tz), timetz
+_TEXT_OIDS = {18, 19, 25, 1042, 1043}   # char, name, text, bpchar, varchar
+
+_dumps = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def _any_json(v):
+    return json.dumps(v, ensure_ascii=False, default=str)
+
+
+def _float_json(v):
+    # JSON has no NaN or Infinity
+    return repr(v) if math.isfinite(v) else "null"
+
+
+def _value_expr(var, oid):
+    """Source expression converting column variable ``var`` to JSON text."""
+    if oid in _INT_OIDS:
+        return f"('null' if {var} is None else str(int({var})))"
+    if oid in _FLOAT_OIDS:
+        return f"('null' if {var} is None else _float_json(float({var})))"
+    if oid in _NUMERIC_OIDS:
+        # str(Decimal) is already a valid JSON number ("12.50", "1E+3"),
+        # except for NaN and Infinity
+        return f"('null' if {var} is None or not {var}.is_finite() else str({var}))"
+    if oid in _BOOL_OIDS:
+        return f"('null' if {var} is None else ('true' if {var} else 'false'))"
+    if oid in _TEMPORAL_OIDS:
+        return f"('null' if {var} is None else '\"' + {var}.isoformat() + '\"')"
+    if oid in _TEXT_OIDS:
+        return f"('null' if {var} is None else _dumps({var}))"
+    return f"_any_json({var})"
+
+
+def _shape(description):
+    return tuple((col.name, col.type_code) for col in description)
+
+
+# ---------------- CODE GENERATION ----------------
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _compile(kind, shape):
+    names = [name for name, _ in shape]
+    vars_ = [f"v{i}" for i in range(len(shape))]
+    unpack = ", ".join(vars_) + ("," if len(vars_) == 1 else "")
+
+    if kind == "json":
+        parts = []
+        for i, (name, oid) in enumerate(shape):
+            prefix = ("{" if i == 0 else ",") + _dumps(name) + ":"
+            parts.append(f"{prefix!r} + {_value_expr(vars_[i], oid)}")
+        body = " + ".join(parts) + " + '}'" if parts else "'{}'"
+    else:
+        items = []
+        for i, (name, oid) in enumerate(shape):
+            var = vars_[i]
+            if oid in _TEMPORAL_OIDS:
+                val = f"(None if {var} is None else {var}.isoformat())"
+            else:
+                val = var
+            items.append(f"{name!r}: {val}")
+        body = "{" + ", ".join(items) + "}"
+
+    src = f"def _row(row):\n    {unpack} = row\n    return {body}\n"
+    if not names:
+        src = f"def _row(row):\n    return {body}\n"
+    ns = {"_dumps": _dumps, "_any_json": _any_json, "_float_json": _float_json}
+    exec(compile(src, f"<{kind}-serializer {','.join(names)}>", "exec"), ns)
+    return ns["_row"]
+
+
+def _get(kind, description):
+    key = (kind, _shape(description))
+    fn = _cache.get(key)
+    if fn is None:
+        with _cache_lock:
+            fn = _cache.get(key)
+            if fn is None:
+                fn = _cache[key] = _compile(kind, key[1])
+    return fn
+
+
+def row_encoder(description):
+    """Return a function turning one cursor tuple into a JSON object string.
+
+    Serializers are compiled once per distinct query shape (column names and
+    Postgres types) and reused for every later call.
+    """
+    return _get("json", description)
+
+
+def row_mapper(description):
+    """Return a function turning one cursor tuple into a template-ready dict
+    with datetimes already converted to ISO strings."""
+    return _get("dict", description)
+
+
+# ---------------- HIGH LEVEL HELPERS ----------------
+
+def map_rows(cur):
+    """Fetch every remaining row of ``cur`` as serialized dicts."""
+    if cur.description is None:
+        return []
+    mapper = row_mapper(cur.description)
+    return [mapper(r) for r in cur.fetchall()]
+
+
+def encode_rows(cur):
+    """Fetch every remaining row of ``cur`` as one JSON array (bytes)."""
+    if cur.description is None:
+        return b"[]"
+    encode = row_encoder(cur.description)
+    return ("[" + ",".join([encode(r) for r in cur.fetchall()]) + "]").encode("utf-8")
+
+
+def stream_json_array(cur, key="items", batch_size=500):
+    """Yield ``{"<key>": [...]}`` as UTF-8 chunks, pulling ``batch_size``
+    rows at a time so large lists never sit fully in memory as dicts.
+    """
+    yield ("{" + _dumps(key) + ":[").encode("utf-8")
+    encode = None
+    first = True
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        # named (server-side) cursors only know their description
+        # after the first fetch
+        if encode is None:
+            encode = row_encoder(cur.description)
+        chunk = ",".join([encode(r) for r in rows])
+        if not first:
+            chunk = "," + chunk
+        first = False
+        yield chunk.encode("utf-8")
+    yield b"]}"
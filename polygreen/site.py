@@ -0,0 +1,48 @@
+from flask import Blueprint, current_app, render_template, jsonify
+
+from polygreen import warmup
+
+bp = Blueprint("site", __name__)
+
+
+# Liveness: the process answers. Never touches the DB.
+@bp.route("/health")
+@bp.route("/health/live")
+def health():
+    return jsonify(status="ok"), 200
+
+
+# Readiness: warm-up finished and the (cached) DB check passed.
+@bp.route("/health/ready")
+def health_ready():
+    ready, details = warmup.readiness(current_app._get_current_object())
+    return jsonify(details), 200 if ready else 503
+
+#------------------------FORCE HTTPS---------------------
+
+# @bp.before_app_request
+# def redirect_https():
+#     # Skip for AWS health check & internal service requests
+#     if request.path in ('/health', '/api', '/api/', '/api/'):
+#         return
+    
+#     # AWS forwards a header instead of request.is_secure()
+#     if request.headers.get('X-Forwarded-Proto', 'http') != 'https':
+#         return redirect(request.url.replace("http://", "https://"), code=301)
+
+        
+#-------------------------DOMAIN INDEX----------------------------
+
+@bp.route('/')
+def home():
+    return render_template("admin/index.html")
+
+@bp.route('/policy')
+def policy():
+    return render_template("admin/policy.html")
+
+# ------------------------- BASE ROUTE ---------------------------------
+
+@bp.route("/api", methods=["GET"])
+def api():
+    return jsonify(message="WELCOME TO POLYGREEN"), 201
@@ -0,0 +1,185 @@
+"""Slow query log with sampled EXPLAIN plans.
+
+Every statement that runs through ``polygreen.db`` is checked against
+``SLOW_QUERY_MS`` (default 200). Slow ones are logged with their normalized
+text, a fingerprint of that text and a hash of the bound parameters (raw
+values are never logged - they are mobile numbers and the like). Per
+fingerprint totals are kept in memory for the ``/admin/slow-queries`` page.
+
+For slow read-only statements a plain ``EXPLAIN`` of the same query is
+captured on the same connection, inside a savepoint, at most once per
+fingerprint every ``SLOW_QUERY_EXPLAIN_INTERVAL`` seconds, into a bounded
+ring buffer. The statement is planned, not run again: a slow request does
+not pay for it twice. Statements calling anything but a short list of
+side-effect-free built-in functions are never explained (``pg_notify``,
+``txid_current()`` and the partition helpers are SELECTs too).
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from flask import has_request_context, request
+
+from polygreen import db
+
+logger = logging.getLogger("polygreen.slowlog")
+
+THRESHOLD = float(os.getenv("SLOW_QUERY_MS", "200")) / 1000.0
+EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "900"))
+EXPLAIN_ENABLED = os.getenv("SLOW_QUERY_EXPLAIN", "1") != "0"
+MAX_FINGERPRINTS = 500
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))+\s*\)")
+_SPACE = re.compile(r"\s+")
+_READ_ONLY = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b|\bFOR\s+UPDATE\b", re.IGNORECASE)
+_CALL = re.compile(r"\b([A-Za-z_][\w.]*)\s*\(")
+# words that may precede "(" in a plain SELECT: keywords, then built-ins
+# without side effects; any other call keeps the statement from being explained
+_PURE_CALLS = frozenset("""
+    select with as from join on using where and or not in exists any all values
+    lateral over filter group by partition order then else when case is between
+    array row cast interval
+    count sum min max avg bool_and bool_or every array_agg string_agg json_agg
+    jsonb_agg json_object_agg jsonb_object_agg json_build_object jsonb_build_object
+    json_build_array jsonb_build_array to_json to_jsonb row_to_json
+    row_number rank dense_rank percent_rank cume_dist ntile lag lead first_value
+    last_value percentile_cont percentile_disc width_bucket
+    coalesce nullif greatest least abs round ceil floor trunc sqrt power ln exp
+    lower upper length char_length trim ltrim rtrim substr substring replace
+    concat concat_ws split_part left right position lpad rpad md5 format
+    now date_trunc date_part extract age to_char to_date to_timestamp make_interval
+    generate_series unnest
+""".split())
+
+_lock = threading.Lock()
+_stats = {}
+explains = deque(maxlen=int(os.getenv("SLOW_QUERY_EXPLAIN_BUFFER", "50")))
+_local = threading.local()
+
+
+def normalize(sql):
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    sql = str(sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _SPACE.sub(" ", sql).strip().rstrip(";")
+    return _IN_LIST.sub("(...)", sql)
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+
+def _explainable(normalized):
+    """A plain read: SELECT/WITH, no writes or row locks, and no calls to
+    functions that might do something."""
+    return (_READ_ONLY.match(normalized) is not None
+            and _WRITES.search(normalized) is None
+            and all(name.lower() in _PURE_CALLS for name in _CALL.findall(normalized)))
+
+
+def params_fingerprint(params):
+    if params is None:
+        return None
+    return hashlib.sha1(repr(params).encode("utf-8")).hexdigest()[:12]
+
+
+def _explain(cursor, sql, params):
+    """EXPLAIN the statement on the caller's connection without disturbing
+    its transaction (or its result set)."""
+    conn = cursor.connection
+    _local.busy = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SAVEPOINT polygreen_slowlog")
+            try:
+                cur.execute("EXPLAIN " + sql, params)
+                rows = cur.fetchall()
+            except Exception:
+                cur.execute("ROLLBACK TO SAVEPOINT polygreen_slowlog")
+                raise
+            cur.execute("RELEASE SAVEPOINT polygreen_slowlog")
+    finally:
+        _local.busy = False
+    # RealDictCursor rows are dicts, plain cursor rows are tuples
+    return "\n".join(next(iter(r.values())) if isinstance(r, dict) else r[0] for r in rows)
+
+
+@db.add_statement_listener
+def _on_statement(sql, params, seconds, cursor):
+    if seconds < THRESHOLD or getattr(_local, "busy", False):
+        return
+
+    text = normalize(sql)
+    fp = fingerprint(text)
+    endpoint = request.endpoint if has_request_context() else None
+    now = time.time()
+
+    with _lock:
+        entry = _stats.get(fp)
+        if entry is None:
+            if len(_stats) >= MAX_FINGERPRINTS:
+                # forget the least expensive fingerprint to stay bounded
+                del _stats[min(_stats, key=lambda k: _stats[k]["total"])]
+            entry = _stats[fp] = {
+                "fingerprint": fp, "query": text, "endpoint": endpoint,
+                "count": 0, "total": 0.0, "max": 0.0,
+                "last_seen": now, "last_explained": 0.0,
+            }
+        entry["count"] += 1
+        entry["total"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+        entry["last_seen"] = now
+        entry["endpoint"] = endpoint or entry["endpoint"]
+        want_explain = (
+            EXPLAIN_ENABLED
+            and now - entry["last_explained"] >= EXPLAIN_INTERVAL
+            and _explainable(text)
+            and getattr(cursor, "name", None) is None
+        )
+        if want_explain:
+            entry["last_explained"] = now
+
+    logger.warning(
+        "slow query %.1fms fp=%s params=%s endpoint=%s: %s",
+        seconds * 1000, fp, params_fingerprint(params), endpoint, text,
+    )
+
+    if want_explain:
+        try:
+            plan = _explain(cursor, sql, params)
+        except Exception as e:
+            logger.warning(f"EXPLAIN failed for slow query {fp}: {e}")
+            return
+        explains.append({
+            "fingerprint": fp, "seconds": seconds, "captured_at": now, "plan": plan,
+        })
+
+
+def top(limit=50):
+    """Slowest fingerprints by total time, with their latest plan sample."""
+    with _lock:
+        entries = sorted((dict(e) for e in _stats.values()),
+                         key=lambda e: e["total"], reverse=True)[:limit]
+    plans = {}
+    for sample in list(explains):
+        plans[sample["fingerprint"]] = sample
+    for e in entries:
+        e["mean"] = e["total"] / e["count"] if e["count"] else 0.0
+        e["plan"] = plans.get(e["fingerprint"])
+    return entries
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+    explains.clear()
@@ -0,0 +1,33 @@
+"""Lazily constructed Vonage SMS client.
+
+Importing ``vonage`` is comparatively slow and only the OTP route needs it,
+so the client is built on first use and cached for the life of the worker.
+"""
+
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_sms = None
+_initialized = False
+
+
+def get_sms():
+    """Return the ``vonage.Sms`` client, or ``None`` if not configured."""
+    global _sms, _initialized
+    if _initialized:
+        return _sms
+    with _lock:
+        if not _initialized:
+            key = os.getenv("VONAGE_API_KEY")
+            secret = os.getenv("VONAGE_API_SECRET")
+            if key and secret:
+                import vonage
+                _sms = vonage.Sms(vonage.Client(key=key, secret=secret))
+            else:
+                logger.warning("Vonage API key/secret missing — OTP will NOT work.")
+            _initialized = True
+    return _sms
@@ -0,0 +1,172 @@
+import datetime as dt
+
+from flask import Blueprint, abort, current_app, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from polygreen import leaderboard, ledger, rewards
+from polygreen.db import TupleCursor, get_db, serialize_row
+from polygreen.serializers import map_rows
+
+bp = Blueprint("users", __name__)
+
+# -------------------------- HELPERS ----------------------------------
+
+def get_user_or_404(user_id):
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM users_live WHERE user_id=%s", (user_id,))
+            user = cur.fetchone()
+
+    if not user:
+        abort(404, description="User not found")
+
+    return user
+
+
+# ------------------------------USER ENDPOINTS----------------------------
+
+#------------------------------USER DETAILS API-----------------------------
+@bp.route("/api/users/me", methods=["GET"])
+@jwt_required()
+def me():
+    uid_str = get_jwt_identity()   # this is the user_id string
+    u = get_user_or_404(uid_str)   # fetch by user_id
+    u = serialize_row(u)
+
+    return jsonify(
+        user_id=u["user_id"],
+        name=u["name"],
+        mobile=u["mobile"],
+        points=u["points"],
+        bottles=u["bottles"],
+        created_at=u.get("created_at")
+    )
+
+# ---------------------TRANSACTION & POINTS ENDPOINTS-----------------------------
+
+#---------------------PAST 5 TRANSACTIONS SUMMARY API----------------------------------
+
+@bp.route("/api/points/summary", methods=["GET"])
+@jwt_required()
+def points_summary():
+    user_id = get_jwt_identity()  # this is the string user_id
+    u = get_user_or_404(user_id)  # fetch user by user_id
+
+    with get_db() as conn:
+        with conn.cursor(cursor_factory=TupleCursor) as cur:
+            cur.execute("""
+                SELECT id, points, type, created_at
+                FROM transactions
+                WHERE user_id=%s
+                ORDER BY created_at DESC
+                LIMIT 5
+            """, (u["user_id"],))
+            # datetimes come out as isoformat strings
+            recent = map_rows(cur)
+
+    return jsonify(
+        total_points=u["points"],
+        recent=recent
+    )
+
+
+#----------------------------LEADERBOARD API-----------------------------------------------
+
+@bp.route("/api/leaderboard", methods=["GET"])
+@jwt_required()
+def get_leaderboard():
+    user_id = get_jwt_identity()
+    board = request.args.get("board", "global")
+    scope = request.args.get("scope", "").strip()
+    limit = max(1, min(request.args.get("limit", 10, type=int), 100))
+
+    if board not in leaderboard.BOARDS:
+        return jsonify(message=f"board must be one of {', '.join(leaderboard.BOARDS)}"), 400
+
+    if board == "global":
+        scope = ""
+    elif board == "week":
+        try:
+            scope = leaderboard.week_scope(dt.date.fromisoformat(scope) if scope else None)
+        except ValueError:
+            return jsonify(message="scope must be a date (YYYY-MM-DD)"), 400
+    elif not scope:
+        return jsonify(message=f"scope ({'city' if board == 'city' else 'machine_id'}) required"), 400
+
+    return jsonify(
+        board=board,
+        scope=scope,
+        items=leaderboard.top(board, scope, limit),
+        me=leaderboard.rank(board, scope, user_id)
+    )
+
+
+#----------------------------SHOW ALL TRANSACTIONS API-----------------------------------------------
+
+# @bp.route("/api/transactions", methods=["GET"])
+# @jwt_required()
+# def transactions():
+#     uid_str = get_jwt_identity()
+#     uid = int(uid_str)
+#     with get_db() as conn:
+#         with conn.cursor() as cur:
+#             cur.execute("""
+#                 SELECT id, type, points, brand_id, machine_id, created_at
+#                 FROM transactions
+#                 WHERE user_id=%s
+#                 ORDER BY created_at DESC
+#             """, (uid,))
+#             rows = cur.fetchall()
+#     rows = [serialize_row(r) for r in rows]
+#     return jsonify(
+#         items=[{"id": r["id"], "type": r["type"], "points": r["points"], "brand_id": r.get("brand_id"), "machine_id": r.get("machine_id"), "created_at": r["created_at"]} for r in rows]
+#     )
+
+# ----------------------------REDEEM ENDPOINTS--------------------------------------------------------
+
+#----------------------------LIST ALL REDEEM BRANDS API---------------------------------------------------
+
+@bp.route("/api/redeem/brands", methods=["GET"])
+@jwt_required()
+def redeem_brands():
+    # cached per worker, reloaded when reward_brand changes
+    return current_app.response_class(
+        rewards.catalog().body,
+        mimetype="application/json"
+    )
+
+#--------------------------REDEEM REQUEST API----------------------------------------------------------
+
+@bp.route("/api/redeem/request", methods=["POST"])
+@jwt_required()
+def redeem_request():
+    user_id = get_jwt_identity()
+    data = request.get_json() or {}
+
+    # Retries must reuse the key so the points are only spent once
+    key = str(request.headers.get("Idempotency-Key") or data.get("idempotency_key") or "").strip()
+    if not key or len(key) > 128:
+        return jsonify(message="Idempotency-Key header (1-128 characters) required"), 400
+
+    try:
+        brand_id = int(data.get("brand_id"))
+        pts = int(data.get("points", 0))
+    except (TypeError, ValueError):
+        return jsonify(message="brand_id and points must be integers"), 400
+
+    if pts <= 0:
+        return jsonify(message="points must be at least 1"), 400
+
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                result, replayed = rewards.redeem(cur, user_id, brand_id, pts, key)
+            ledger.sync()
+            conn.commit()
+    except rewards.RedeemError as e:
+        return jsonify(message=str(e)), e.status
+
+    response = jsonify(message="Redeem successful", **result)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
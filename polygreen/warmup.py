@@ -0,0 +1,182 @@
+"""Worker warm-up and readiness.
+
+When a worker starts, a background thread pre-opens pooled DB connections,
+registers the report fonts, compiles every Jinja template, primes the
+machine list cache, compiles the points rules and loads the reward
+catalog and leaderboard histograms, so the first real requests don't pay
+for any of it. It also makes sure the coming months' ``transactions``
+partitions exist (and keeps checking hourly), starts the ledger flusher
+(replaying rows spooled by dead workers), the counter fold loop, machine
+alerting and the outbox relay.
+``/health/ready`` reports not-ready until that has finished. Background
+services whose start fails (say, the database is briefly down at boot)
+are retried with backoff, and the worker stays not-ready until they all
+run.
+
+Once warm, readiness also reflects a DB ping, but the result is cached for
+``READY_CHECK_INTERVAL`` seconds and refreshed in the background: probes
+themselves never wait on (or hammer) the database.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from polygreen import (
+    alerts, counters, db, leaderboard, ledger, machine_cache, outbox, partitions, rewards, rules,
+)
+
+logger = logging.getLogger(__name__)
+
+POOL_WARM = int(os.getenv("DB_POOL_WARM", "2"))
+READY_CHECK_INTERVAL = float(os.getenv("READY_CHECK_INTERVAL", "10"))
+SERVICE_RETRY_MAX = 30.0
+
+_lock = threading.Lock()
+_state = {"pid": None}
+
+
+def _new_state():
+    return {
+        "pid": os.getpid(),
+        "started_at": time.time(),
+        "finished_at": None,
+        "steps": {},
+        "db_ok": False,
+        "db_error": None,
+        "db_checked_at": 0.0,
+        "db_checking": False,
+        "services_ok": False,
+    }
+
+
+def _step(state, name, fn, required=True):
+    start = time.perf_counter()
+    try:
+        detail = fn()
+        ok = True
+    except Exception as e:
+        detail = str(e)
+        ok = not required
+        logger.warning(f"warm-up step {name} failed: {e}")
+    state["steps"][name] = {
+        "ok": ok,
+        "ms": round((time.perf_counter() - start) * 1000, 1),
+        "detail": detail,
+    }
+    return ok
+
+
+def _compile_templates(app):
+    env = app.jinja_env
+    names = env.list_templates(filter_func=lambda n: n.endswith(".html"))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def _register_fonts():
+    from polygreen import reports
+    return reports.register_fonts()
+
+
+_SERVICES = (
+    ("partitions", partitions.start),
+    ("ledger", ledger.start),
+    ("counter_fold", counters.start_folding),
+    ("alerts", alerts.start),
+    ("outbox", outbox.start),
+)
+
+
+def _start_services(state):
+    """Start the background services not running yet. True once all are."""
+    ok = True
+    for name, fn in _SERVICES:
+        if not state["steps"].get(name, {}).get("ok"):
+            ok = _step(state, name, fn) and ok
+    return ok
+
+
+def _run(app, state):
+    db_ok = _step(state, "db_pool", lambda: db.prefill(POOL_WARM))
+    _step(state, "fonts", _register_fonts, required=False)
+    _step(state, "templates", lambda: _compile_templates(app), required=False)
+    if db_ok:
+        def prime():
+            with app.app_context():
+                machine_cache.prime()
+        _step(state, "machine_cache", prime, required=False)
+        _step(state, "points_rules", rules.prime, required=False)
+        _step(state, "reward_catalog", rewards.prime, required=False)
+        _step(state, "leaderboard", leaderboard.prime, required=False)
+    services_ok = _start_services(state)
+
+    state["db_ok"] = db_ok
+    state["db_error"] = None if db_ok else state["steps"]["db_pool"]["detail"]
+    state["db_checked_at"] = time.monotonic()
+    state["services_ok"] = services_ok
+    state["finished_at"] = time.time()
+    if db_ok and services_ok:
+        logger.info(f"worker {state['pid']} warm in "
+                    f"{state['finished_at'] - state['started_at']:.2f}s")
+
+    # the caches fill on demand; the services must run, so keep trying
+    delay = 1.0
+    while not services_ok:
+        time.sleep(delay)
+        delay = min(delay * 2, SERVICE_RETRY_MAX)
+        services_ok = _start_services(state)
+    if not state["services_ok"]:
+        state["services_ok"] = True
+        logger.info(f"worker {state['pid']} background services started")
+
+
+def start(app):
+    """Start warm-up for this process (no-op if already started). Safe to
+    call again after a fork: the child gets its own warm-up."""
+    with _lock:
+        if _state.get("pid") == os.getpid():
+            return
+        state = _new_state()
+        _state.clear()
+        _state.update(state)
+    thread = threading.Thread(target=_run, args=(app, _state), name="warmup", daemon=True)
+    thread.start()
+
+
+def _check_db(state):
+    try:
+        with db.get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+        state["db_ok"], state["db_error"] = True, None
+    except Exception as e:
+        state["db_ok"], state["db_error"] = False, str(e)
+        logger.warning(f"readiness DB check failed: {e}")
+    finally:
+        state["db_checked_at"] = time.monotonic()
+        state["db_checking"] = False
+
+
+def readiness(app):
+    """Return ``(ready, details)`` without blocking on the database."""
+    start(app)
+    state = _state
+    finished = state["finished_at"] is not None
+    if finished and time.monotonic() - state["db_checked_at"] > READY_CHECK_INTERVAL:
+        with _lock:
+            refresh = not state["db_checking"]
+            state["db_checking"] = True
+        if refresh:
+            threading.Thread(target=_check_db, args=(state,), daemon=True).start()
+
+    ready = finished and state["db_ok"] and state["services_ok"]
+    details = {
+        "status": "ready" if ready else ("unavailable" if finished else "warming"),
+        "pid": state["pid"],
+        # error text stays in the logs; probes only see what failed
+        "steps": {name: {"ok": s["ok"], "ms": s["ms"]} for name, s in state["steps"].items()},
+    }
+    return ready, details